@@ -0,0 +1,234 @@
+"""Moteur d'analyse en mémoire des rapports
+
+Les documents d'une période (exercices archivés compris) sont chargés en une
+seule requête dans des tableaux NumPy colonne par colonne : date, client,
+type, état, mode de paiement, total, montant réglé. Les rapports se calculent ensuite par
+opérations vectorisées (masques, bincount, cumsum, percentile) au lieu de
+boucles Python sur des objets ORM.
+
+Les colonnes texte (état, paiement) sont codées en entiers ; `modalites`
+garde la table des codes.
+"""
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import String, case, func, null, select, type_coerce
+
+import archives
+from models import db
+
+FACTURE = 0
+AVOIR = 1
+
+# Le client absent (facture sans client) est codé 0
+SANS_CLIENT = 0
+
+PERCENTILES = (25, 50, 75, 90)
+
+
+class Periode:
+    """Colonnes des documents d'une période"""
+
+    def __init__(self, date_debut, date_fin, lignes):
+        self.date_debut = date_debut
+        self.date_fin = date_fin
+        ids, numeros, dates, clients, types, etats, paiements, totaux, payes = (
+            zip(*lignes) if lignes else ((),) * 9
+        )
+        self.id = np.array(ids, dtype=np.int64)
+        self.numero = np.array(numeros, dtype=object)
+        # Dates lues en texte SQLite ('AAAA-MM-JJ HH:MM:SS.ffffff') : NumPy les convertit d'un bloc
+        self.date = np.array(dates, dtype='datetime64[us]')
+        self.client_id = np.array(clients, dtype=np.int64)
+        self.type = np.array(types, dtype=np.int8)
+        self.etat_modalites, self.etat = _coder(etats)
+        self.paiement_modalites, self.paiement = _coder(paiements)
+        # Montants entiers en francs : sommes exactes
+        self.total = np.array(totaux, dtype=np.int64)
+        self.paye = np.array(payes, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.id)
+
+    @property
+    def factures(self):
+        return self.type == FACTURE
+
+    @property
+    def avoirs(self):
+        return self.type == AVOIR
+
+    def masque_etat(self, etat):
+        return _masque_modalite(self.etat_modalites, self.etat, etat)
+
+    def documents(self, masque):
+        """Documents sélectionnés, dans l'ordre chronologique (dicts pour les templates)"""
+        indices = np.flatnonzero(masque)
+        indices = indices[np.argsort(self.date[indices], kind='stable')]
+        dates = self.date[indices].astype(object)
+        return [{
+            'id': int(self.id[i]),
+            'numero': self.numero[i],
+            'date_creation': dates[n],
+            'type_document': 'avoir' if self.type[i] == AVOIR else 'facture',
+            'total': float(self.total[i]),
+            'montant_paye': float(self.paye[i]),
+            'etat': self.etat_modalites[self.etat[i]],
+            'paiement': self.paiement_modalites[self.paiement[i]],
+        } for n, i in enumerate(indices)]
+
+
+def _coder(valeurs):
+    """(modalités, codes) d'une colonne texte ; None reste une modalité"""
+    modalites = sorted(set(valeurs), key=lambda v: (v is None, v or ''))
+    index = {m: code for code, m in enumerate(modalites)}
+    return modalites, np.fromiter(map(index.__getitem__, valeurs), dtype=np.int16, count=len(valeurs))
+
+
+def _masque_modalite(modalites, codes, valeur):
+    if valeur not in modalites:
+        return np.zeros(len(codes), dtype=bool)
+    return codes == modalites.index(valeur)
+
+
+def charger(date_debut, date_fin, client_id=None, numeros=False):
+    """Charger les documents de la période en une requête
+
+    Les conversions se font dans SQLite (type, valeurs nulles) et dans NumPy
+    (dates) plutôt que ligne par ligne dans les processeurs de résultat.
+    `numeros=True` charge aussi les numéros, utiles seulement pour lister
+    les documents (`Periode.documents`).
+    """
+    F = archives.factures(date_debut, date_fin)
+    requete = select(
+        F.id,
+        F.numero if numeros else null(),
+        type_coerce(F.date_creation, String),
+        func.coalesce(F.client_id, SANS_CLIENT),
+        case((F.type_document == 'avoir', AVOIR), else_=FACTURE),
+        F.etat,
+        F.paiement,
+        func.coalesce(F.total, 0),
+        F.montant_paye,
+    ).where(
+        F.date_creation >= date_debut,
+        F.date_creation <= date_fin
+    )
+    if client_id is not None:
+        requete = requete.where(F.client_id == client_id)
+    # Exécution Core et tuples bruts du curseur : ni chargement ORM ni objets Row
+    resultat = db.session.connection().execute(requete)
+    try:
+        lignes = resultat.cursor.fetchall()
+    finally:
+        resultat.close()
+    return Periode(date_debut, date_fin, lignes)
+
+
+# ===== AGRÉGATS =====
+
+def grouper(codes, valeurs, masque=None, taille=None):
+    """(sommes, nombres) de `valeurs` par code entier"""
+    if masque is not None:
+        codes, valeurs = codes[masque], valeurs[masque]
+    taille = taille if taille is not None else (int(codes.max()) + 1 if len(codes) else 0)
+    sommes = np.bincount(codes, weights=valeurs, minlength=taille)
+    nombres = np.bincount(codes, minlength=taille)
+    return sommes, nombres
+
+
+def par_client(periode):
+    """Factures et avoirs par client : {client_id: dict}"""
+    clients, codes = np.unique(periode.client_id, return_inverse=True)
+    taille = len(clients)
+    ventes, nb_ventes = grouper(codes, periode.total, periode.factures, taille)
+    avoirs, nb_avoirs = grouper(codes, periode.total, periode.avoirs, taille)
+    return {
+        int(client): {
+            'nb_factures': int(nb_ventes[i]),
+            'nb_avoirs': int(nb_avoirs[i]),
+            'total_factures': float(ventes[i]),
+            'total_avoirs': float(avoirs[i]),
+            'net': float(ventes[i] - avoirs[i]),
+        }
+        for i, client in enumerate(clients) if client != SANS_CLIENT
+    }
+
+
+def par_paiement(periode, masque):
+    """{mode: {'count', 'total'}} des documents sélectionnés"""
+    sommes, nombres = grouper(periode.paiement, periode.total, masque, len(periode.paiement_modalites))
+    return {
+        (mode or 'Non spécifié'): {'count': int(nombres[code]), 'total': float(sommes[code])}
+        for code, mode in enumerate(periode.paiement_modalites) if nombres[code]
+    }
+
+
+def par_etat(periode, masque):
+    """{état: {'count', 'total'}} des documents sélectionnés"""
+    sommes, nombres = grouper(periode.etat, periode.total, masque, len(periode.etat_modalites))
+    return {
+        (etat or 'Non spécifié'): {'count': int(nombres[code]), 'total': float(sommes[code])}
+        for code, etat in enumerate(periode.etat_modalites) if nombres[code]
+    }
+
+
+def par_mois(periode):
+    """Ventes, avoirs, net, cumul et variation d'un mois sur l'autre"""
+    premier = np.datetime64(periode.date_debut, 'M')
+    dernier = np.datetime64(periode.date_fin, 'M')
+    taille = int((dernier - premier).astype(int)) + 1
+    mois = (periode.date.astype('datetime64[M]') - premier).astype(np.int64)
+
+    ventes, nb_ventes = grouper(mois, periode.total, periode.factures, taille)
+    avoirs, nb_avoirs = grouper(mois, periode.total, periode.avoirs, taille)
+    net = ventes - avoirs
+    cumul = np.cumsum(net)
+    precedent = np.concatenate(([np.nan], net[:-1]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variation = np.where(precedent != 0, (net - precedent) / np.abs(precedent) * 100, np.nan)
+
+    libelles = (premier + np.arange(taille)).astype(object)
+    return [{
+        'mois': libelles[i],
+        'nb_factures': int(nb_ventes[i]),
+        'nb_avoirs': int(nb_avoirs[i]),
+        'ventes': float(ventes[i]),
+        'avoirs': float(avoirs[i]),
+        'net': float(net[i]),
+        'cumul': float(cumul[i]),
+        'variation': None if np.isnan(variation[i]) else float(variation[i]),
+    } for i in range(taille)]
+
+
+def distribution(valeurs):
+    """Percentiles, moyenne et extrêmes d'une série de montants"""
+    if not len(valeurs):
+        return None
+    quantiles = np.percentile(valeurs, PERCENTILES)
+    resultat = {f'p{p}': float(q) for p, q in zip(PERCENTILES, quantiles)}
+    resultat.update(moyenne=float(valeurs.mean()), min=float(valeurs.min()), max=float(valeurs.max()))
+    return resultat
+
+
+def tendances(periode, top=10):
+    """Contexte du rapport des tendances"""
+    factures = periode.factures
+    mois = par_mois(periode)
+    clients = par_client(periode)
+    meilleurs = sorted(clients.items(), key=lambda kv: kv[1]['net'], reverse=True)[:top]
+    ventes = float(periode.total[factures].sum())
+    avoirs = float(periode.total[periode.avoirs].sum())
+    return dict(
+        mois=mois,
+        total_ventes=ventes,
+        total_avoirs=avoirs,
+        total_net=ventes - avoirs,
+        nb_factures=int(factures.sum()),
+        nb_avoirs=int(periode.avoirs.sum()),
+        distribution=distribution(periode.total[factures]),
+        paiements=par_paiement(periode, factures),
+        etats=par_etat(periode, factures),
+        meilleurs_clients=meilleurs,
+        maintenant=datetime.now(),
+    )
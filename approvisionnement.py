@@ -0,0 +1,137 @@
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from models import db, Produit, MouvementStock, Approvisionnement, LigneApprovisionnement
+from horodatages import get_conditionnel
+from ecritures import ecrire
+from journal_stock import journal
+
+bp = Blueprint('approvisionnements', __name__)
+
+@bp.route('/approvisionnements')
+def approvisionnements_list():
+    appros = Approvisionnement.query.order_by(Approvisionnement.date_approvisionnement.desc()).all()
+    return render_template('approvisionnements_list.html', appros=appros)
+
+@bp.route('/approvisionnement/<int:id>')
+@get_conditionnel('approvisionnement')
+def approvisionnement_detail(id):
+    appro = Approvisionnement.query.get_or_404(id)
+    return render_template('approvisionnement.html', appro=appro)
+
+@bp.route('/approvisionnement/new', methods=['GET', 'POST'])
+def approvisionnement_new():
+    if request.method == 'POST':
+        entete = {
+            'fournisseur': request.form.get('fournisseur', ''),
+            'reference_fournisseur': request.form.get('reference_fournisseur', ''),
+            'notes': request.form.get('notes', '')
+        }
+
+        # Traiter les lignes
+        produits_ids = request.form.getlist('produit_id[]')
+        quantites = request.form.getlist('quantite[]')
+        prix_ht = request.form.getlist('prix_ht[]')
+        tva_list = request.form.getlist('tva[]')
+
+        lignes = []
+        for i in range(len(produits_ids)):
+            if produits_ids[i] and quantites[i] and prix_ht[i]:
+                lignes.append({
+                    'produit_id': int(produits_ids[i]),
+                    'quantite': int(quantites[i]),
+                    'prix_unitaire_ht': float(prix_ht[i]),
+                    # Sans TVA saisie : celle du produit
+                    'tva': float(tva_list[i]) if i < len(tva_list) else None
+                })
+
+        appro_id = ecrire(creer_approvisionnement, entete, lignes)
+        
+        flash('Approvisionnement créé avec succès', 'success')
+        return redirect(url_for('approvisionnements.approvisionnement_detail', id=appro_id))
+
+    produits = Produit.query.filter_by(article_stockable="OUI").all()
+    produits_serialized = [{'id': p.id, 'nom': p.nom, 'tva': p.tva} for p in produits]
+    return render_template('approvisionnement_form.html', produits=produits_serialized)
+
+def creer_approvisionnement(entete, lignes):
+    """Créer un approvisionnement en attente et ses lignes (exécuté par le thread d'écriture)"""
+    # Générer numéro
+    last_appro = Approvisionnement.query.order_by(Approvisionnement.id.desc()).first()
+    if last_appro:
+        new_num = f'APP{last_appro.id + 1:04d}'
+    else:
+        new_num = 'APP0001'
+
+    appro = Approvisionnement(numero=new_num, statut=Approvisionnement.STATUT_EN_ATTENTE, **entete)
+    db.session.add(appro)
+    db.session.flush()
+
+    total_ht = 0
+    total_ttc = 0
+
+    for donnees in lignes:
+        tva = donnees['tva']
+        if tva is None:
+            tva = db.session.get(Produit, donnees['produit_id']).tva
+        prix_unitaire_ht = donnees['prix_unitaire_ht']
+
+        ligne = LigneApprovisionnement(
+            approvisionnement_id=appro.id,
+            produit_id=donnees['produit_id'],
+            quantite=donnees['quantite'],
+            prix_unitaire_ht=prix_unitaire_ht,
+            prix_unitaire_ttc=prix_unitaire_ht * (1 + tva/100),
+            tva=tva
+        )
+        db.session.add(ligne)
+        
+        total_ht += ligne.total_ht
+        total_ttc += ligne.total_ttc
+
+    appro.total_ht = total_ht
+    appro.total_ttc = total_ttc
+    return appro.id
+
+@bp.route('/approvisionnement/<int:id>/recevoir', methods=['POST'])
+def approvisionnement_recevoir(id):
+    appro = Approvisionnement.query.get_or_404(id)
+    
+    if appro.statut == Approvisionnement.STATUT_EN_ATTENTE:
+        if ecrire(recevoir_approvisionnement, appro.id):
+            flash('Approvisionnement reçu et stock mis à jour', 'success')
+    
+    return redirect(url_for('approvisionnements.approvisionnement_detail', id=appro.id))
+
+def recevoir_approvisionnement(appro_id):
+    """Entrer en stock les lignes d'un approvisionnement (thread d'écriture)"""
+    appro = db.session.get(Approvisionnement, appro_id)
+
+    # Deux clics rapprochés : le second ne doit pas entrer le stock une seconde fois
+    if appro.statut != Approvisionnement.STATUT_EN_ATTENTE:
+        return False
+
+    # Les mouvements partent en un seul INSERT à la fin du travail
+    mouvements = journal(db.session)
+    for ligne in appro.lignes:
+        mouvements.ajouter(
+            ligne.produit,
+            MouvementStock.TYPE_ENTREE,
+            ligne.quantite,
+            reference_type='approvisionnement',
+            reference_id=appro.id,
+            commentaire=f"Réception approvisionnement {appro.numero}",
+            utilisateur='admin'
+        )
+    
+    appro.statut = Approvisionnement.STATUT_RECU
+    return True
+
+@bp.route('/approvisionnement/<int:id>/annuler', methods=['POST'])
+def approvisionnement_annuler(id):
+    appro = Approvisionnement.query.get_or_404(id)
+    ecrire(annuler_approvisionnement, appro.id)
+    flash('Approvisionnement annulé', 'success')
+    return redirect(url_for('approvisionnements.approvisionnement_detail', id=appro.id))  
+
+def annuler_approvisionnement(appro_id):
+    """Passer un approvisionnement à l'état annulé (exécuté par le thread d'écriture)"""
+    db.session.get(Approvisionnement, appro_id).statut = Approvisionnement.STATUT_ANNULE
@@ -0,0 +1,361 @@
+"""Archives annuelles des exercices clos
+
+La base vivante ne garde que les exercices ouverts : `flask archiver 2024`
+déplace les factures, leurs lignes et les mouvements de stock de l'année dans
+`archives/facturier_2024.db` et l'inscrit dans la table `archives_exercices`
+(le manifeste).
+
+Les lectures qui en ont besoin attachent ces bases à leur connexion
+(ATTACH DATABASE ... AS archive_2024) et interrogent l'union de la table
+vivante et des tables archivées :
+- listes et rapports : les exercices que recoupe la période demandée ;
+- détail d'une facture : l'archive dont l'intervalle d'identifiants la contient.
+
+Les identifiants ne sont jamais réutilisés (voir `_verifier_identifiants`) :
+une facture garde le même id, vivante ou archivée.
+
+Une facture archivée est en lecture seule : elle ne reçoit plus de paiement
+et les avoirs ne peuvent plus désigner ses lignes. L'archivage est refusé
+tant que l'exercice a des factures non soldées ou des lignes encore
+créditables (voir `_verifier_soldes`), sauf `--forcer`.
+"""
+import os
+import re
+from datetime import datetime
+from functools import lru_cache
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import Column, MetaData, Table, select, union_all
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import db, ArchiveExercice, Facture, LigneFacture, MouvementStock
+
+# SQLITE_MAX_ATTACHED par défaut
+LIMITE_ATTACHEES = 10
+
+
+class PeriodeTropLongue(ValueError):
+    """Plus d'exercices archivés que de bases attachables à la fois (-> 400)"""
+
+
+def _alias(annee):
+    return f'archive_{int(annee)}'
+
+
+def _chemin(fichier):
+    return os.path.join(current_app.config['ARCHIVES_DOSSIER'], fichier)
+
+
+# Tables des archives, hors des métadonnées de l'application (pas de create_all)
+_metadata_archives = MetaData()
+
+
+@lru_cache(maxsize=None)
+def _table_archivee(modele, annee):
+    """Copie de la table du modèle dans le schéma archive_AAAA, sans clés étrangères"""
+    t = modele.__table__
+    return Table(t.name, _metadata_archives,
+                 *[Column(c.name, c.type, primary_key=c.primary_key) for c in t.c],
+                 schema=_alias(annee))
+
+
+def annees(date_debut=None, date_fin=None):
+    """Exercices archivés qui recoupent la période (None : non bornée)"""
+    query = db.session.query(ArchiveExercice.annee)
+    if date_debut is not None:
+        query = query.filter(ArchiveExercice.annee >= date_debut.year)
+    if date_fin is not None:
+        query = query.filter(ArchiveExercice.annee <= date_fin.year)
+    return [annee for (annee,) in query.order_by(ArchiveExercice.annee)]
+
+
+def attacher(annees_demandees):
+    """Attacher les archives à la connexion de la session (une fois par connexion du pool)"""
+    if not annees_demandees:
+        return
+    if len(annees_demandees) > LIMITE_ATTACHEES:
+        raise PeriodeTropLongue(f'Période trop longue : au plus {LIMITE_ATTACHEES} exercices archivés à la fois')
+
+    connexion = db.session.connection()
+    attachees = connexion.connection.info.setdefault('archives_attachees', [])
+    manquantes = [a for a in annees_demandees if a not in attachees]
+    if not manquantes:
+        return
+
+    fichiers = dict(db.session.query(ArchiveExercice.annee, ArchiveExercice.fichier)
+                    .filter(ArchiveExercice.annee.in_(manquantes)))
+    for annee in manquantes:
+        # Faire de la place en détachant les plus anciennes non demandées
+        while len(attachees) >= LIMITE_ATTACHEES:
+            ancienne = next(a for a in attachees if a not in annees_demandees)
+            connexion.exec_driver_sql(f'DETACH DATABASE {_alias(ancienne)}')
+            attachees.remove(ancienne)
+        connexion.exec_driver_sql(f'ATTACH DATABASE ? AS {_alias(annee)}', (_chemin(fichiers[annee]),))
+        attachees.append(annee)
+
+
+def par_lots(annees_archivees):
+    """Années archivées par lots attachables ensemble (lectures seulement)
+
+    Une archive lue dans la transaction en cours ne peut pas être détachée :
+    la transaction de lecture est terminée entre deux lots.
+    """
+    for i in range(0, len(annees_archivees), LIMITE_ATTACHEES):
+        if i:
+            db.session.rollback()
+        lot = annees_archivees[i:i + LIMITE_ATTACHEES]
+        attacher(lot)
+        yield lot
+
+
+def archivee(modele, annee):
+    """Entité ORM sur la table du modèle dans l'archive d'une année (attachée)"""
+    attacher([annee])
+    return aliased(modele, _table_archivee(modele, annee), adapt_on_names=True)
+
+
+def source(modele, annees_archivees):
+    """Entité ORM sur la table vivante et sur les archives des années données"""
+    if not annees_archivees:
+        return modele
+    attacher(annees_archivees)
+    vivante = modele.__table__
+    union = union_all(select(vivante), *[select(_table_archivee(modele, a)) for a in annees_archivees])
+    return aliased(modele, union.subquery(f'{vivante.name}_archives'))
+
+
+def tables(modele, annees_archivees):
+    """Table vivante puis tables archivées du modèle (archives attachées)
+
+    Pour les agrégats : une requête groupée par table, chacune avec ses
+    index, plutôt qu'une jointure sur l'union (que SQLite matérialise).
+    """
+    attacher(annees_archivees)
+    return [modele.__table__] + [_table_archivee(modele, a) for a in annees_archivees]
+
+
+def factures(date_debut=None, date_fin=None):
+    """Entité Facture couvrant la période, exercices archivés compris"""
+    return source(Facture, annees(date_debut, date_fin))
+
+
+def _facture_archivee(facture_id):
+    """(facture, annee) depuis l'archive dont l'intervalle d'ids contient l'id"""
+    candidates = db.session.query(ArchiveExercice.annee).filter(
+        ArchiveExercice.facture_id_min <= facture_id,
+        ArchiveExercice.facture_id_max >= facture_id
+    ).order_by(ArchiveExercice.annee).all()
+    for (annee,) in candidates:
+        F = archivee(Facture, annee)
+        facture = db.session.query(F).filter(F.id == facture_id).first()
+        if facture is not None:
+            return facture, annee
+    return None, None
+
+
+def charger_facture(facture_id):
+    """Facture vivante ou archivée, ou None
+
+    Pour une facture archivée, les lignes, les avoirs et la facture d'origine
+    sont lus dans les archives et posés sur l'objet : le template s'en sert
+    comme des relations habituelles. Lecture seule.
+    """
+    facture = db.session.get(Facture, facture_id)
+    if facture is None:
+        facture, annee = _facture_archivee(facture_id)
+        if facture is None:
+            return None
+        lignes = aliased(LigneFacture, _table_archivee(LigneFacture, annee), adapt_on_names=True)
+        set_committed_value(facture, 'lignes', db.session.query(lignes)
+                            .filter(lignes.facture_id == facture_id).order_by(lignes.id).all())
+        # Avoirs : identifiants postérieurs, émis avant l'archivage de l'exercice
+        # (refusé tant que des lignes restent créditables) : les exercices suivants
+        # les plus proches suffisent (une place reste pour la facture d'origine)
+        annees_avoirs = [a for (a,) in db.session.query(ArchiveExercice.annee)
+                         .filter(ArchiveExercice.annee >= annee, ArchiveExercice.facture_id_max >= facture_id)
+                         .order_by(ArchiveExercice.annee).limit(LIMITE_ATTACHEES - 1)]
+        suivantes = source(Facture, annees_avoirs)
+        set_committed_value(facture, 'avoirs', db.session.query(suivantes)
+                            .filter(suivantes.facture_originale_id == facture_id).order_by(suivantes.id).all())
+
+    originale_id = facture.facture_originale_id
+    if originale_id is not None and db.session.get(Facture, originale_id) is None:
+        originale, _ = _facture_archivee(originale_id)
+        set_committed_value(facture, 'facture_originale', originale)
+    return facture
+
+
+def mouvements(annee):
+    """Entité MouvementStock de l'archive d'une année"""
+    return archivee(MouvementStock, annee)
+
+
+# ===== ARCHIVAGE =====
+
+def _schema(cursor, nom_table, alias):
+    """Ordres CREATE de la table vivante (et de ses index) réécrits pour l'archive"""
+    ordres = []
+    for type_objet, sql in cursor.execute(
+            "SELECT type, sql FROM main.sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL "
+            "ORDER BY type DESC", (nom_table,)):
+        if type_objet == 'table':
+            ordres.append(re.sub(r'^CREATE TABLE\s+"?(\w+)"?', rf'CREATE TABLE {alias}.\1', sql))
+        else:
+            ordres.append(re.sub(r'^CREATE (UNIQUE )?INDEX\s+"?(\w+)"?', rf'CREATE \1INDEX {alias}.\2', sql))
+    return ordres
+
+
+def _verifier_identifiants(cursor, nom_table, id_max):
+    """SQLite réattribue max(id) + 1 : il doit rester une ligne vivante au-delà"""
+    if id_max is None:
+        return
+    (reste,) = cursor.execute(f'SELECT max(id) FROM main.{nom_table} WHERE id > ?', (id_max,)).fetchone()
+    if reste is None:
+        raise click.ClickException(
+            f'{nom_table} : aucune ligne postérieure à l\'exercice. Archiver après la première '
+            f'écriture de l\'exercice suivant, pour que les identifiants ne soient pas réutilisés.')
+
+
+def _verifier_soldes(cursor, debut, fin):
+    """Factures de l'exercice qui ne pourraient plus être réglées ou créditées une fois archivées"""
+    factures = ("FROM main.factures f WHERE f.date_creation >= ? AND f.date_creation < ? "
+                "AND f.type_document = 'facture' AND f.etat != 'Annulée'")
+    nb_impayees, restant = cursor.execute(
+        f'SELECT count(*), coalesce(sum(f.total - f.montant_paye), 0) {factures} '
+        f'AND coalesce(f.total, 0) > f.montant_paye', (debut, fin)).fetchone()
+    (nb_creditables,) = cursor.execute(
+        f'SELECT count(*) {factures} AND EXISTS (SELECT 1 FROM main.lignes_facture l '
+        f'WHERE l.facture_id = f.id AND l.quantite > l.quantite_creditee)', (debut, fin)).fetchone()
+    problemes = []
+    if nb_impayees:
+        problemes.append(f'{nb_impayees} facture(s) non soldée(s) ({restant:,.0f} FBU restant dû)'.replace(',', ' '))
+    if nb_creditables:
+        problemes.append(f'{nb_creditables} facture(s) encore créditable(s) par un avoir')
+    if problemes:
+        raise click.ClickException(
+            f'{" et ".join(problemes)}. Archivées, elles ne pourraient plus être réglées ni créditées ; '
+            f'--forcer pour archiver quand même.')
+
+
+def archiver_exercice(annee, forcer=False):
+    """Déplacer l'exercice dans sa base d'archive ; renvoie l'entrée du manifeste
+
+    Refusé si l'exercice a des factures non soldées ou encore créditables
+    (voir `_verifier_soldes`), sauf `forcer`.
+
+    Deux transactions : copie dans l'archive, puis suppression dans la base
+    vivante avec l'inscription au manifeste. En WAL, SQLite ne rend pas un
+    commit atomique sur deux bases ; si l'on s'arrête entre les deux, la
+    base vivante est intacte et relancer la commande refait l'archive.
+    """
+    if annee >= datetime.now().year:
+        raise click.ClickException(f'L\'exercice {annee} n\'est pas clos')
+    if db.session.get(ArchiveExercice, annee) is not None:
+        raise click.ClickException(f'L\'exercice {annee} est déjà archivé')
+    db.session.rollback()
+
+    dossier = current_app.config['ARCHIVES_DOSSIER']
+    os.makedirs(dossier, exist_ok=True)
+    fichier = f'facturier_{annee}.db'
+    chemin = _chemin(fichier)
+    if os.path.exists(chemin):
+        # Archive d'un essai interrompu, absente du manifeste : on la refait
+        os.chmod(chemin, 0o644)
+        os.remove(chemin)
+
+    debut, fin = str(datetime(annee, 1, 1)), str(datetime(annee + 1, 1, 1))
+    alias = _alias(annee)
+    connexion = db.engine.raw_connection()
+    try:
+        cursor = connexion.cursor()
+        cursor.execute(f'ATTACH DATABASE ? AS {alias}', (chemin,))
+        cursor.execute(f'PRAGMA {alias}.journal_mode=DELETE')
+
+        # 1. Copie (soldes vérifiés sous le verrou d'écriture : pas de paiement entre-temps)
+        cursor.execute('BEGIN IMMEDIATE')
+        if not forcer:
+            _verifier_soldes(cursor, debut, fin)
+        for modele in (Facture, LigneFacture, MouvementStock):
+            for ordre in _schema(cursor, modele.__tablename__, alias):
+                cursor.execute(ordre)
+        cursor.execute(f'INSERT INTO {alias}.factures SELECT * FROM main.factures '
+                       f'WHERE date_creation >= ? AND date_creation < ?', (debut, fin))
+        cursor.execute(f'INSERT INTO {alias}.lignes_facture SELECT * FROM main.lignes_facture '
+                       f'WHERE facture_id IN (SELECT id FROM {alias}.factures)')
+        cursor.execute(f'INSERT INTO {alias}.mouvements_stock SELECT * FROM main.mouvements_stock '
+                       f'WHERE date_mouvement >= ? AND date_mouvement < ?', (debut, fin))
+        nb_factures, facture_id_min, facture_id_max = cursor.execute(
+            f'SELECT count(*), min(id), max(id) FROM {alias}.factures').fetchone()
+        nb_lignes, ligne_id_max = cursor.execute(
+            f'SELECT count(*), max(id) FROM {alias}.lignes_facture').fetchone()
+        nb_mouvements, mouvement_id_max = cursor.execute(
+            f'SELECT count(*), max(id) FROM {alias}.mouvements_stock').fetchone()
+        _verifier_identifiants(cursor, 'factures', facture_id_max)
+        _verifier_identifiants(cursor, 'lignes_facture', ligne_id_max)
+        _verifier_identifiants(cursor, 'mouvements_stock', mouvement_id_max)
+        cursor.execute('COMMIT')
+
+        # 2. Suppression dans la base vivante et manifeste
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute(f'DELETE FROM main.lignes_facture WHERE id IN (SELECT id FROM {alias}.lignes_facture)')
+        cursor.execute(f'DELETE FROM main.factures WHERE id IN (SELECT id FROM {alias}.factures)')
+        cursor.execute(f'DELETE FROM main.mouvements_stock WHERE id IN (SELECT id FROM {alias}.mouvements_stock)')
+        # Flux des changements : les consommateurs retirent ces factures de la base vivante
+        cursor.execute(f"INSERT INTO main.changements (entite, entite_id, operation, date_changement) "
+                       f"SELECT 'facture', id, 'archivage', ? FROM {alias}.factures ORDER BY id",
+                       (str(datetime.utcnow()),))
+        cursor.execute(
+            'INSERT INTO main.archives_exercices (annee, fichier, date_archivage, nb_factures, nb_lignes, '
+            'nb_mouvements, facture_id_min, facture_id_max) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (annee, fichier, str(datetime.utcnow()), nb_factures, nb_lignes, nb_mouvements,
+             facture_id_min, facture_id_max))
+        cursor.execute('COMMIT')
+        cursor.execute(f'DETACH DATABASE {alias}')
+    except Exception:
+        brute = connexion.dbapi_connection
+        if brute.in_transaction:
+            brute.execute('ROLLBACK')
+        # La connexion retourne au pool : ne pas y laisser l'archive attachée.
+        # Absente du manifeste, l'archive est supprimée (relancer la refait)
+        if any(base[1] == alias for base in brute.execute('PRAGMA database_list')):
+            brute.execute(f'DETACH DATABASE {alias}')
+        if os.path.exists(chemin):
+            os.remove(chemin)
+        raise
+    finally:
+        connexion.close()
+
+    # Les lectures l'ouvrent en lecture seule
+    os.chmod(chemin, 0o444)
+    return db.session.get(ArchiveExercice, annee)
+
+
+@click.command('archiver')
+@click.argument('annee', type=int)
+@click.option('--vacuum', is_flag=True, help='Réduire ensuite le fichier de la base vivante')
+@click.option('--forcer', is_flag=True,
+              help='Archiver même avec des factures non soldées ou encore créditables')
+@with_appcontext
+def archiver_commande(annee, vacuum, forcer):
+    """Déplacer un exercice clos dans sa base d'archive"""
+    archive = archiver_exercice(annee, forcer)
+    click.echo(f'Exercice {annee} archivé dans {archive.fichier} : {archive.nb_factures} documents, '
+               f'{archive.nb_lignes} lignes, {archive.nb_mouvements} mouvements')
+    if vacuum:
+        db.session.remove()
+        with db.engine.connect() as connexion:
+            connexion.connection.dbapi_connection.execute('VACUUM')
+        click.echo('Base vivante compactée')
+
+
+def init_app(app):
+    if not app.config.get('ARCHIVES_DOSSIER'):
+        app.config['ARCHIVES_DOSSIER'] = os.path.join(os.path.dirname(app.config['DATABASE_PATH']), 'archives')
+    app.cli.add_command(archiver_commande)
+
+    @app.errorhandler(PeriodeTropLongue)
+    def _periode_trop_longue(e):
+        return str(e), 400
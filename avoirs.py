@@ -0,0 +1,173 @@
+"""Quantités déjà créditées des lignes de facture
+
+`quantite_creditee` d'une ligne de facture est la somme des quantités (en
+valeur absolue) des lignes d'avoir qui la désignent par
+`ligne_originale_id`, hors avoirs annulés. Les écritures d'avoirs la
+tiennent à jour dans leur transaction ; `creditable` en lit le reste en une
+requête. Une ligne d'avoir sans ligne d'origine est rattachée à la première
+ligne du même produit encore créditable. `flask recalculer-avoirs`
+reconstruit les quantités.
+"""
+from collections import defaultdict
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, func, select, update
+
+from models import db, Facture, LigneFacture, Produit
+
+# Écart toléré sur les quantités (colonnes flottantes)
+TOLERANCE = 1e-6
+
+ANNULEE = 'Annulée'
+
+
+def creditable(facture_id):
+    """(facture, lignes) du reste créditable d'une facture, en une requête ; None si introuvable"""
+    L = LigneFacture
+    rows = db.session.query(
+        Facture.id, Facture.numero, Facture.type_document, Facture.client_id,
+        L.id.label('ligne_id'), L.produit_id, Produit.nom, Produit.code,
+        L.quantite, L.quantite_creditee, L.prix_unitaire, L.tva
+    ).outerjoin(L, L.facture_id == Facture.id)\
+     .outerjoin(Produit, Produit.id == L.produit_id)\
+     .filter(Facture.id == facture_id).order_by(L.id).all()
+    if not rows:
+        return None
+    facture = {'id': rows[0].id, 'numero': rows[0].numero,
+               'type_document': rows[0].type_document, 'client_id': rows[0].client_id}
+    lignes = [{
+        'ligne_id': r.ligne_id,
+        'produit_id': r.produit_id,
+        'produit': r.nom,
+        'code': r.code,
+        'quantite': r.quantite,
+        'quantite_creditee': r.quantite_creditee,
+        'restante': max(r.quantite - r.quantite_creditee, 0),
+        'prix_unitaire': float(r.prix_unitaire),
+        'tva': r.tva or 0,
+    } for r in rows if r.ligne_id is not None]
+    return facture, lignes
+
+
+def credits(lignes):
+    """{ligne_originale_id: quantité} des lignes d'un avoir (dicts ou lignes ORM)"""
+    quantites = defaultdict(float)
+    for ligne in lignes:
+        ligne_originale_id = ligne['ligne_originale_id'] if isinstance(ligne, dict) else ligne.ligne_originale_id
+        quantite = ligne['quantite'] if isinstance(ligne, dict) else ligne.quantite
+        if ligne_originale_id is not None:
+            quantites[ligne_originale_id] += abs(quantite)
+    return quantites
+
+
+def affecter(facture_originale_id, lignes):
+    """Rattacher les lignes d'un avoir aux lignes de sa facture d'origine (thread d'écriture)
+
+    `lignes` : dicts (produit_id, quantite, ligne_originale_id éventuel),
+    complétés en place. Lève ValueError si un produit n'est pas sur la
+    facture d'origine ou si une quantité dépasse le reste créditable.
+    """
+    for ligne in lignes:
+        ligne.setdefault('ligne_originale_id', None)
+    if not facture_originale_id:
+        return lignes
+    originales = db.session.query(
+        LigneFacture.id, LigneFacture.produit_id, LigneFacture.quantite, LigneFacture.quantite_creditee,
+        Produit.nom, Facture.numero
+    ).join(Produit, Produit.id == LigneFacture.produit_id)\
+     .join(Facture, Facture.id == LigneFacture.facture_id)\
+     .filter(LigneFacture.facture_id == facture_originale_id).order_by(LigneFacture.id).all()
+    if not originales:
+        # Facture archivée (ou vide) : pas de suivi
+        return lignes
+
+    par_id = {o.id: o for o in originales}
+    restantes = {o.id: o.quantite - o.quantite_creditee for o in originales}
+    numero = originales[0].numero
+    for ligne in lignes:
+        quantite = abs(ligne['quantite'])
+        ligne_originale_id = ligne['ligne_originale_id']
+        if ligne_originale_id is not None:
+            originale = par_id.get(ligne_originale_id)
+            if originale is None or originale.produit_id != ligne['produit_id']:
+                raise ValueError(f'La ligne {ligne_originale_id} ne correspond pas à ce produit '
+                                 f'sur la facture {numero}')
+        else:
+            candidates = [o for o in originales if o.produit_id == ligne['produit_id']]
+            if not candidates:
+                nom = db.session.get(Produit, ligne['produit_id'])
+                raise ValueError(f'{nom.nom if nom else ligne["produit_id"]} ne figure pas '
+                                 f'sur la facture {numero}')
+            # Première ligne qui suffit, sinon celle qui a le plus grand reste
+            originale = next((o for o in candidates if restantes[o.id] + TOLERANCE >= quantite),
+                             max(candidates, key=lambda o: restantes[o.id]))
+            ligne['ligne_originale_id'] = originale.id
+        if quantite > restantes[originale.id] + TOLERANCE:
+            raise ValueError(f'{originale.nom} : {quantite:g} à créditer, il reste '
+                             f'{max(restantes[originale.id], 0):g} sur {originale.quantite:g} '
+                             f'de la facture {numero}')
+        restantes[originale.id] -= quantite
+    return lignes
+
+
+def crediter(quantites, signe=1):
+    """Ajouter (signe 1) ou retirer (signe -1) des quantités créditées, en un UPDATE"""
+    if not quantites:
+        return
+    table = LigneFacture.__table__
+    db.session.execute(
+        update(table).where(table.c.id == bindparam('b_id'))
+        .values(quantite_creditee=table.c.quantite_creditee + bindparam('b_quantite')),
+        [{'b_id': ligne_id, 'b_quantite': signe * quantite} for ligne_id, quantite in quantites.items()]
+    )
+
+
+def reporter(anciennes, nouvelles):
+    """Lignes d'une facture recréées (modification) : y reporter ses crédits
+
+    `anciennes` : (id, produit_id, quantite_creditee) des lignes supprimées,
+    `nouvelles` : lignes ORM insérées (avec id). Les lignes d'avoir sont
+    rattachées à la nouvelle ligne du même produit ; ValueError si elle ne
+    couvre plus ce qui a déjà été crédité.
+    """
+    table = LigneFacture.__table__
+    restantes = {ligne.id: ligne.quantite for ligne in nouvelles}
+    for ancienne in anciennes:
+        if not ancienne.quantite_creditee:
+            continue
+        nouvelle = next((n for n in nouvelles if n.produit_id == ancienne.produit_id), None)
+        if nouvelle is None or restantes[nouvelle.id] + TOLERANCE < ancienne.quantite_creditee:
+            nom = db.session.get(Produit, ancienne.produit_id)
+            raise ValueError(f'{nom.nom if nom else ancienne.produit_id} : {ancienne.quantite_creditee:g} '
+                             f'déjà crédité(s) par des avoirs, la facture doit les garder')
+        restantes[nouvelle.id] -= ancienne.quantite_creditee
+        db.session.execute(update(table).where(table.c.ligne_originale_id == ancienne.id)
+                           .values(ligne_originale_id=nouvelle.id))
+        nouvelle.quantite_creditee = (nouvelle.quantite_creditee or 0) + ancienne.quantite_creditee
+
+
+def recalculer():
+    """Reconstruire les quantités créditées depuis les lignes d'avoir ; nombre de lignes modifiées"""
+    lignes = LigneFacture.__table__
+    avoir = LigneFacture.__table__.alias('avoir')
+    factures = Facture.__table__
+    credite = select(func.coalesce(func.sum(func.abs(avoir.c.quantite)), 0))\
+        .select_from(avoir.join(factures, factures.c.id == avoir.c.facture_id))\
+        .where(avoir.c.ligne_originale_id == lignes.c.id, factures.c.etat != ANNULEE)\
+        .scalar_subquery()
+    resultat = db.session.execute(update(lignes).where(lignes.c.quantite_creditee != credite)
+                                  .values(quantite_creditee=credite))
+    db.session.commit()
+    return resultat.rowcount
+
+
+@click.command('recalculer-avoirs')
+@with_appcontext
+def recalculer_commande():
+    """Reconstruire les quantités créditées des lignes de facture"""
+    click.echo(f'{recalculer()} ligne(s) corrigée(s)')
+
+
+def init_app(app):
+    app.cli.add_command(recalculer_commande)
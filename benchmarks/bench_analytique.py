@@ -0,0 +1,109 @@
+"""Rapports sur plusieurs années : boucles ORM ou colonnes NumPy
+
+Génère, sur une copie de la base, N documents répartis sur plusieurs années
+et chronomètre le calcul des rapports :
+- orm : objets Facture chargés par client puis sommés en Python (avant) ;
+- analytique : une requête, colonnes NumPy, agrégats vectorisés.
+
+    python benchmarks/bench_analytique.py --documents 200000 --annees 5 --clients 200
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+
+from app import create_app  # noqa: E402
+from models import db, Client, Facture  # noqa: E402
+import rapport  # noqa: E402
+
+
+def rapport_tous_clients_orm(date_debut, date_fin):
+    """Ancien calcul : deux requêtes ORM par client, sommes en Python"""
+    stats = []
+    for client in Client.query.order_by(Client.nom).all():
+        factures = Facture.query.filter(Facture.client_id == client.id, Facture.date_creation >= date_debut,
+                                        Facture.date_creation <= date_fin,
+                                        Facture.type_document == 'facture').all()
+        avoirs = Facture.query.filter(Facture.client_id == client.id, Facture.date_creation >= date_debut,
+                                      Facture.date_creation <= date_fin,
+                                      Facture.type_document == 'avoir').all()
+        total_factures = sum(f.total for f in factures)
+        total_avoirs = sum(a.total for a in avoirs)
+        if total_factures > 0 or total_avoirs > 0:
+            stats.append((client.id, total_factures - total_avoirs))
+    toutes = Facture.query.filter(Facture.date_creation >= date_debut, Facture.date_creation <= date_fin,
+                                  Facture.type_document == 'facture').all()
+    paiements = {}
+    for f in toutes:
+        mode = f.paiement or 'Non spécifié'
+        paiements.setdefault(mode, {'count': 0, 'total': 0})
+        paiements[mode]['count'] += 1
+        paiements[mode]['total'] += f.total
+    return stats, paiements
+
+
+def generer(nb_documents, nb_annees, nb_clients):
+    random.seed(42)
+    db.session.execute(Client.__table__.insert(), [
+        {'type_client': 'person', 'nom': f'Bench {i:04d}'} for i in range(nb_clients)
+    ])
+    clients = [c for (c,) in db.session.query(Client.id)]
+    debut = datetime(datetime.now().year - nb_annees, 1, 1)
+    minutes = nb_annees * 365 * 24 * 60
+    premier = (db.session.query(db.func.max(Facture.id)).scalar() or 0) + 1
+    db.session.execute(Facture.__table__.insert(), [{
+        'numero': f'B{premier + i:07d}',
+        'client_id': random.choice(clients),
+        'date_creation': debut + timedelta(minutes=random.randrange(minutes)),
+        'type_document': 'avoir' if random.random() < 0.1 else 'facture',
+        'etat': random.choice(('Payée', 'En attente')),
+        'paiement': random.choice(('Espèces', 'Virement', 'Mobile')),
+        'total': round(random.uniform(1000, 500000)),
+    } for i in range(nb_documents)])
+    db.session.commit()
+    return debut, datetime.now()
+
+
+def chrono(fonction, *args):
+    debut = time.perf_counter()
+    fonction(*args)
+    db.session.remove()
+    return (time.perf_counter() - debut) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=200000)
+    parser.add_argument('--annees', type=int, default=5)
+    parser.add_argument('--clients', type=int, default=200)
+    args = parser.parse_args()
+
+    dossier = tempfile.mkdtemp()
+    try:
+        base = os.path.join(dossier, 'bench.db')
+        shutil.copy(os.path.join(RACINE, 'database', 'facturier.db'), base)
+        app = create_app({'DATABASE_PATH': base, 'JINJA_CACHE_DOSSIER': os.path.join(dossier, 'jinja')})
+        with app.app_context():
+            db.create_all()
+            date_debut, date_fin = generer(args.documents, args.annees, args.clients)
+            print(f'{args.documents} documents, {args.annees} ans, {args.clients} clients')
+            mesures = [
+                ('tous clients  orm', rapport_tous_clients_orm),
+                ('tous clients  analytique', rapport.calculer_rapport_tous_clients),
+                ('tendances     analytique', rapport.calculer_rapport_tendances),
+            ]
+            for nom, fonction in mesures:
+                print(f'  {nom:<26} {chrono(fonction, date_debut, date_fin):9.1f} ms')
+    finally:
+        shutil.rmtree(dossier, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Temps de démarrage : import de l'application -> première requête servie
+
+Chaque mesure tourne dans un processus neuf (comme un worker gunicorn).
+Fonctionne aussi sur l'ancien app.py (application construite à l'import)
+pour comparer avant/après :
+
+    python benchmarks/bench_demarrage.py --runs 10
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = r'''
+import json, time
+t0 = time.perf_counter()
+import app as module
+t1 = time.perf_counter()
+if hasattr(module, 'create_app'):
+    application = module.create_app()
+else:
+    application = module.app
+t2 = time.perf_counter()
+reponse = application.test_client().get('/')
+t3 = time.perf_counter()
+assert reponse.status_code == 200, reponse.status_code
+print(json.dumps({'import': t1 - t0, 'creation': t2 - t1, 'premiere_requete': t3 - t2, 'total': t3 - t0}))
+'''
+
+
+def mesurer(runs):
+    dossier = tempfile.mkdtemp()
+    try:
+        base = os.path.join(dossier, 'facturier.db')
+        shutil.copy(os.path.join(RACINE, 'database', 'facturier.db'), base)
+        env = dict(os.environ, FACTURIER_DB=base, JINJA_CACHE_DOSSIER=os.path.join(dossier, 'jinja'))
+        resultats = []
+        for _ in range(runs):
+            sortie = subprocess.run([sys.executable, '-c', SCRIPT], cwd=RACINE, env=env,
+                                    capture_output=True, text=True, check=True)
+            resultats.append(json.loads(sortie.stdout.strip().splitlines()[-1]))
+        return resultats
+    finally:
+        shutil.rmtree(dossier, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    resultats = mesurer(args.runs)
+    print(f'{args.runs} démarrages (médiane, ms)')
+    for etape in ('import', 'creation', 'premiere_requete', 'total'):
+        valeurs = [r[etape] * 1000 for r in resultats]
+        print(f'  {etape:<18} {statistics.median(valeurs):8.1f}   (min {min(valeurs):.1f}, max {max(valeurs):.1f})')
+
+
+if __name__ == '__main__':
+    main()
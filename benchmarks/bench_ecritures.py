@@ -0,0 +1,94 @@
+"""Débit d'écriture avec beaucoup d'écrivains concurrents
+
+Compare, sur une copie de la base, la création de factures depuis N threads :
+- direct : chaque thread écrit et committe lui-même (comportement d'avant) ;
+- coordinateur : les écritures passent par le thread écrivain unique.
+
+    python benchmarks/bench_ecritures.py --threads 16 --factures 50
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+
+from flask_migrate import upgrade  # noqa: E402
+
+from app import create_app  # noqa: E402
+from ecritures import ecrire  # noqa: E402
+from facture import creer_facture  # noqa: E402
+from models import db, Client, Produit  # noqa: E402
+
+
+def scenario(directes, nb_threads, nb_factures, dossier):
+    base = os.path.join(dossier, f'bench_{"direct" if directes else "coord"}.db')
+    shutil.copy(os.path.join(RACINE, 'database', 'facturier.db'), base)
+    app = create_app({'DATABASE_PATH': base, 'ECRITURES_DIRECTES': directes,
+                      'JINJA_CACHE_DOSSIER': os.path.join(dossier, 'jinja')})
+    with app.app_context():
+        upgrade(directory=os.path.join(RACINE, 'migrations'))
+        db.create_all()
+        client_id = db.session.query(Client.id).limit(1).scalar()
+        produit_id = db.session.query(Produit.id).limit(1).scalar()
+
+    erreurs = []
+    latences = []
+
+    def ecrivain():
+        with app.app_context():
+            for _ in range(nb_factures):
+                debut = time.perf_counter()
+                try:
+                    ecrire(creer_facture, 'facture', {'client_id': client_id},
+                           [{'produit_id': produit_id, 'quantite': 1, 'prix_unitaire': 1000, 'tva': 18}])
+                    latences.append(time.perf_counter() - debut)
+                except Exception as e:
+                    erreurs.append(type(e).__name__)
+                finally:
+                    db.session.remove()
+
+    threads = [threading.Thread(target=ecrivain) for _ in range(nb_threads)]
+    debut = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duree = time.perf_counter() - debut
+
+    latences.sort()
+    stats = app.extensions['ecritures'].stats()
+    return {
+        'reussies': len(latences),
+        'erreurs': len(erreurs),
+        'debit': len(latences) / duree,
+        'p50_ms': latences[len(latences) // 2] * 1000 if latences else 0,
+        'p99_ms': latences[int(len(latences) * 0.99)] * 1000 if latences else 0,
+        'par_commit': stats.get('transactions_par_commit', 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--factures', type=int, default=50, help='factures par thread')
+    args = parser.parse_args()
+
+    dossier = tempfile.mkdtemp()
+    try:
+        print(f'{args.threads} threads x {args.factures} factures')
+        for nom, directes in (('direct', True), ('coordinateur', False)):
+            r = scenario(directes, args.threads, args.factures, dossier)
+            print(f"  {nom:<13} {r['reussies']:5d} ok  {r['erreurs']:5d} erreurs  "
+                  f"{r['debit']:8.1f} factures/s  p50 {r['p50_ms']:.1f} ms  p99 {r['p99_ms']:.1f} ms  "
+                  f"{r['par_commit']} tx/commit")
+    finally:
+        shutil.rmtree(dossier, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Réception d'un gros approvisionnement : un INSERT par mouvement ou un seul
+
+Compare, sur une copie de la base, la réception d'un approvisionnement de N
+lignes :
+- orm : un objet MouvementStock par ligne (comportement d'avant) ;
+- journal : mouvements chaînés en mémoire puis un seul INSERT multi-lignes.
+
+    python benchmarks/bench_journal_stock.py --lignes 300 --repetitions 10
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+
+from app import create_app  # noqa: E402
+from approvisionnement import recevoir_approvisionnement  # noqa: E402
+from ecritures import ecrire  # noqa: E402
+from models import db, Approvisionnement, LigneApprovisionnement, MouvementStock, Produit  # noqa: E402
+
+
+def recevoir_orm(appro_id):
+    """Ancienne réception : un MouvementStock ajouté à la session par ligne"""
+    appro = db.session.get(Approvisionnement, appro_id)
+    for ligne in appro.lignes:
+        produit = ligne.produit
+        ancien_stock = produit.stock_actuel
+        db.session.add(MouvementStock(
+            produit_id=produit.id,
+            type_mouvement=MouvementStock.TYPE_ENTREE,
+            quantite=ligne.quantite,
+            stock_avant=ancien_stock,
+            stock_apres=ancien_stock + ligne.quantite,
+            reference_type='approvisionnement',
+            reference_id=appro.id,
+            commentaire=f"Réception approvisionnement {appro.numero}",
+            utilisateur='admin'
+        ))
+        produit.stock_actuel += ligne.quantite
+    appro.statut = Approvisionnement.STATUT_RECU
+    return True
+
+
+def creer_approvisionnement(nb_lignes, produits_ids, numero):
+    appro = Approvisionnement(numero=numero, fournisseur='Bench')
+    db.session.add(appro)
+    db.session.flush()
+    db.session.add_all([
+        LigneApprovisionnement(approvisionnement_id=appro.id,
+                               produit_id=produits_ids[i % len(produits_ids)],
+                               quantite=1, prix_unitaire_ht=100, prix_unitaire_ttc=100, tva=0)
+        for i in range(nb_lignes)
+    ])
+    db.session.commit()
+    return appro.id
+
+
+def scenario(nom, fonction, nb_lignes, repetitions, dossier):
+    base = os.path.join(dossier, f'bench_{nom}.db')
+    shutil.copy(os.path.join(RACINE, 'database', 'facturier.db'), base)
+    app = create_app({'DATABASE_PATH': base, 'ECRITURES_DIRECTES': True,
+                      'JINJA_CACHE_DOSSIER': os.path.join(dossier, 'jinja')})
+    durees = []
+    with app.app_context():
+        db.create_all()
+        produits_ids = [p for (p,) in db.session.query(Produit.id).all()]
+        for i in range(repetitions):
+            appro_id = creer_approvisionnement(nb_lignes, produits_ids, f'BENCH-{nom}-{i}')
+            db.session.remove()
+            debut = time.perf_counter()
+            ecrire(fonction, appro_id)
+            durees.append(time.perf_counter() - debut)
+            db.session.remove()
+    durees.sort()
+    return {'p50_ms': durees[len(durees) // 2] * 1000, 'min_ms': durees[0] * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lignes', type=int, default=300)
+    parser.add_argument('--repetitions', type=int, default=10)
+    args = parser.parse_args()
+
+    dossier = tempfile.mkdtemp()
+    try:
+        print(f'réception de {args.lignes} lignes x {args.repetitions}')
+        for nom, fonction in (('orm', recevoir_orm), ('journal', recevoir_approvisionnement)):
+            r = scenario(nom, fonction, args.lignes, args.repetitions, dossier)
+            print(f"  {nom:<8} p50 {r['p50_ms']:7.1f} ms  min {r['min_ms']:7.1f} ms")
+    finally:
+        shutil.rmtree(dossier, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
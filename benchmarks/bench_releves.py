@@ -0,0 +1,112 @@
+"""Rapprochement d'un relevé : requête par ligne ou index en mémoire
+
+Génère, sur une copie de la base, N factures en attente et un relevé de L
+crédits (un tiers avec le numéro de facture, un tiers avec le téléphone du
+client, un tiers au montant seul) et chronomètre le rapprochement :
+- requetes : recherche en base pour chaque ligne (avant) ;
+- index : factures lues une fois, dictionnaires par clé (releves.rapprocher).
+
+    python benchmarks/bench_releves.py --factures 50000 --lignes 5000
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+
+from app import create_app  # noqa: E402
+from models import db, Client, Facture  # noqa: E402
+import releves  # noqa: E402
+
+
+def rapprocher_par_requetes(lignes, tolerance):
+    """Ancienne façon : une à trois requêtes par ligne du relevé"""
+    trouvees = 0
+    for ligne in lignes:
+        en_attente = Facture.query.filter(Facture.etat == 'En attente', Facture.type_document == 'facture')
+        facture = None
+        for prefixe, chiffres in releves.NUMERO.findall(ligne['reference']):
+            facture = en_attente.filter(Facture.numero == f'{prefixe}{chiffres}'.upper()).first()
+            if facture:
+                break
+        if facture is None and ligne['payeur']:
+            facture = en_attente.join(Client, Client.id == Facture.client_id).filter(
+                Facture.total - Facture.montant_paye == ligne['montant'],
+                Client.telephone == ligne['payeur']).first()
+        if facture is None:
+            facture = en_attente.filter(
+                db.func.abs(Facture.total - Facture.montant_paye - ligne['montant']) <= tolerance).first()
+        trouvees += facture is not None
+    return trouvees
+
+
+def generer(nb_factures, nb_lignes):
+    random.seed(42)
+    db.session.execute(Client.__table__.insert(), [
+        {'type_client': 'person', 'nom': f'Bench {i:04d}', 'telephone': f'79{i:06d}'} for i in range(500)
+    ])
+    clients = dict(db.session.query(Client.id, Client.telephone).filter(Client.nom.like('Bench %')))
+    debut = datetime.now() - timedelta(days=365)
+    premier = (db.session.query(db.func.max(Facture.id)).scalar() or 0) + 1
+    factures = [{
+        'numero': f'B{premier + i:07d}',
+        'client_id': random.choice(list(clients)),
+        'date_creation': debut + timedelta(minutes=random.randrange(365 * 24 * 60)),
+        'type_document': 'facture',
+        'etat': 'En attente',
+        'total': round(random.uniform(1000, 500000)),
+        'montant_paye': 0,
+    } for i in range(nb_factures)]
+    db.session.execute(Facture.__table__.insert(), factures)
+    db.session.commit()
+
+    lignes = []
+    for n, f in enumerate(random.sample(factures, nb_lignes)):
+        ligne = {'ligne': n + 2, 'date': datetime.now(), 'montant': f['total'], 'reference': 'Virement', 'payeur': ''}
+        if n % 3 == 0:
+            ligne['reference'] = f'Paiement {f["numero"]}'
+        elif n % 3 == 1:
+            ligne['payeur'] = clients[f['client_id']]
+        else:
+            ligne['montant'] += random.randint(-50, 50)
+        lignes.append(ligne)
+    return lignes
+
+
+def chrono(fonction, *args):
+    debut = time.perf_counter()
+    fonction(*args)
+    db.session.remove()
+    return (time.perf_counter() - debut) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--factures', type=int, default=50000)
+    parser.add_argument('--lignes', type=int, default=5000)
+    parser.add_argument('--tolerance', type=int, default=100)
+    args = parser.parse_args()
+
+    dossier = tempfile.mkdtemp()
+    try:
+        base = os.path.join(dossier, 'bench.db')
+        shutil.copy(os.path.join(RACINE, 'database', 'facturier.db'), base)
+        app = create_app({'DATABASE_PATH': base, 'JINJA_CACHE_DOSSIER': os.path.join(dossier, 'jinja')})
+        with app.app_context():
+            db.create_all()
+            lignes = generer(args.factures, args.lignes)
+            print(f'{args.factures} factures en attente, relevé de {args.lignes} lignes')
+            for nom, fonction in (('requetes', rapprocher_par_requetes), ('index', releves.rapprocher)):
+                print(f'  {nom:<10} {chrono(fonction, lignes, args.tolerance):9.1f} ms')
+    finally:
+        shutil.rmtree(dossier, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
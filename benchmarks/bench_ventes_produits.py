@@ -0,0 +1,108 @@
+"""Rapport des ventes par produit sur des millions de lignes
+
+Génère, sur une copie de la base, N factures de L lignes puis chronomètre la
+requête groupée du rapport (une période d'un an sur plusieurs) :
+- sans index : parcours complet de lignes_facture ;
+- index couvrants : ix_factures_date_creation puis ix_lignes_facture_ventes.
+
+    python benchmarks/bench_ventes_produits.py --factures 200000 --lignes 5 --annees 5
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+
+from flask_migrate import upgrade  # noqa: E402
+
+from app import create_app  # noqa: E402
+from models import db, Facture, LigneFacture, Produit  # noqa: E402
+from montants import montants_ligne  # noqa: E402
+import rapport  # noqa: E402
+
+INDEX = ('ix_factures_date_creation', 'ix_lignes_facture_ventes')
+
+
+def generer(nb_factures, nb_lignes, nb_annees):
+    random.seed(42)
+    produits = [p for (p,) in db.session.query(Produit.id)]
+    debut = datetime(datetime.now().year - nb_annees + 1, 1, 1)
+    minutes = nb_annees * 365 * 24 * 60
+    premier = (db.session.query(db.func.max(Facture.id)).scalar() or 0) + 1
+    for lot in range(0, nb_factures, 10000):
+        ids = range(premier + lot, premier + min(lot + 10000, nb_factures))
+        db.session.execute(Facture.__table__.insert(), [{
+            'id': i,
+            'numero': f'B{i:08d}',
+            'date_creation': debut + timedelta(minutes=random.randrange(minutes)),
+            'type_document': 'avoir' if random.random() < 0.05 else 'facture',
+            'total': 0,
+        } for i in ids])
+        lignes = [{
+            'facture_id': i,
+            'produit_id': random.choice(produits),
+            'quantite': random.randint(1, 10),
+            'prix_unitaire': random.choice((500, 1000, 2500, 10000)),
+            'tva': random.choice((0, 18)),
+        } for i in ids for _ in range(nb_lignes)]
+        for ligne in lignes:
+            ligne['montant_ht'], ligne['montant_tva'], ligne['montant_ttc'] = montants_ligne(
+                ligne['quantite'], ligne['prix_unitaire'], ligne['tva'])
+        db.session.execute(LigneFacture.__table__.insert(), lignes)
+    db.session.commit()
+    return datetime(datetime.now().year, 1, 1), datetime.now()
+
+
+def chrono(*args, repetitions=5):
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        db.session.execute(rapport.requete_ventes_produits(*args)).all()
+        durees.append(time.perf_counter() - debut)
+        db.session.remove()
+    return sorted(durees)[len(durees) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--factures', type=int, default=200000)
+    parser.add_argument('--lignes', type=int, default=5)
+    parser.add_argument('--annees', type=int, default=5)
+    args = parser.parse_args()
+
+    dossier = tempfile.mkdtemp()
+    try:
+        base = os.path.join(dossier, 'bench.db')
+        shutil.copy(os.path.join(RACINE, 'database', 'facturier.db'), base)
+        app = create_app({'DATABASE_PATH': base, 'JINJA_CACHE_DOSSIER': os.path.join(dossier, 'jinja')})
+        with app.app_context():
+            upgrade(directory=os.path.join(RACINE, 'migrations'))
+            db.create_all()
+            for nom in INDEX:
+                db.session.execute(db.text(f'DROP INDEX IF EXISTS {nom}'))
+            periode = generer(args.factures, args.lignes, args.annees)
+            print(f'{args.factures * args.lignes} lignes sur {args.annees} ans, rapport de la dernière année')
+
+            mesures = [('sans index', chrono(*periode, 'produit'))]
+            for table in (Facture.__table__, LigneFacture.__table__):
+                for index in table.indexes:
+                    index.create(db.engine, checkfirst=True)
+            mesures += [
+                ('index couvrants', chrono(*periode, 'produit')),
+                ('index couvrants, catégorie', chrono(*periode, 'categorie')),
+                ('index couvrants, top 20', chrono(*periode, 'produit', 20)),
+            ]
+            for nom, duree in mesures:
+                print(f'  {nom:<28} {duree:9.1f} ms')
+    finally:
+        shutil.rmtree(dossier, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+"""Plusieurs boutiques, une base SQLite chacune
+
+Chaque boutique est un sous-dossier de BOUTIQUES_DOSSIER
+(`<dossier>/<nom>/facturier.db`), servi par le même processus :
+
+- routage : sous-domaine `<nom>.<BOUTIQUES_DOMAINE>` ou préfixe d'URL
+  `<BOUTIQUES_PREFIXE>/<nom>/…` (déplacé dans SCRIPT_NAME) ; le reste va à
+  la base principale ;
+- chaque boutique est une application complète (`create_app` sur sa base),
+  créée à la demande et gardée dans un LRU : au plus BOUTIQUES_MAX
+  ouvertes, fermées après BOUTIQUES_INACTIVITE secondes sans requête, sauf
+  avec une requête ou une tâche en cours.
+
+`flask boutiques creer|migrer|sauvegarder` initialise, migre ou sauvegarde
+les boutiques.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from werkzeug.exceptions import NotFound
+from werkzeug.wsgi import ClosingIterator
+
+from models import db
+
+# Nom de boutique : sous-domaine valide
+NOM = re.compile(r'^[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?$')
+BASE = 'facturier.db'
+
+# Réglages dérivés du chemin de la base : recalculés pour chaque boutique
+_DERIVES = ('SQLALCHEMY_DATABASE_URI', 'ARCHIVES_DOSSIER', 'TACHES_DOSSIER', 'SAUVEGARDE_DOSSIER',
+            'REQUETES_LENTES_JOURNAL')
+
+
+def chemin_base(dossier, nom):
+    return os.path.join(dossier, nom, BASE)
+
+
+def lister(dossier):
+    """Noms des boutiques existantes, triés"""
+    if not dossier or not os.path.isdir(dossier):
+        return []
+    return sorted(nom for nom in os.listdir(dossier)
+                  if NOM.match(nom) and os.path.isfile(chemin_base(dossier, nom)))
+
+
+def config_boutique(config, nom):
+    """Configuration d'une boutique : celle de l'application principale sur sa base"""
+    dossier = config['BOUTIQUES_DOSSIER']
+    taille = config['BOUTIQUES_POOL_TAILLE']
+    surcharges = {cle: None for cle in _DERIVES}
+    surcharges.update({
+        'BOUTIQUE': nom,
+        'DATABASE_PATH': chemin_base(dossier, nom),
+        'SQLALCHEMY_ENGINE_OPTIONS': {'pool_size': taille, 'max_overflow': taille},
+        'LECTURE_POOL_TAILLE': taille,
+        'LECTURE_POOL_DEBORDEMENT': taille,
+        'SAUVEGARDE_INTERVALLE': 0,
+        'JINJA_CACHE_DOSSIER': config.get('JINJA_CACHE_DOSSIER'),
+        # Préfixe d'URL : même domaine, un cookie de session par boutique
+        'SESSION_COOKIE_NAME': f"{config.get('SESSION_COOKIE_NAME') or 'session'}_{nom}",
+    })
+    if config.get('RAPPORTS_CACHE_DOSSIER'):
+        # Cache sur disque partagé entre workers : un sous-dossier par boutique
+        surcharges['RAPPORTS_CACHE_DOSSIER'] = os.path.join(config['RAPPORTS_CACHE_DOSSIER'], nom)
+    base = {cle: valeur for cle, valeur in config.items() if cle.isupper()}
+    return {**base, **surcharges}
+
+
+def creer_application(config, nom):
+    from app import create_app
+    return create_app(config_boutique(config, nom))
+
+
+def fermer(app):
+    """Arrêter les threads d'une application de boutique et fermer ses connexions"""
+    app.extensions['ecritures'].arreter()
+    app.extensions['taches'].arreter()
+    app.extensions['requetes_lentes'].arreter()
+    lecture = app.extensions['lecture']
+    if lecture.engine is not None:
+        lecture.engine.dispose()
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+class _Ouverte:
+    __slots__ = ('app', 'derniere', 'en_cours')
+
+    def __init__(self, app):
+        self.app = app
+        self.derniere = time.monotonic()
+        self.en_cours = 0
+
+
+class Boutiques:
+    """Middleware WSGI : aiguille chaque requête vers l'application de sa boutique"""
+
+    def __init__(self, app, suivant):
+        config = app.config
+        self.config = config
+        self.suivant = suivant
+        self.dossier = config['BOUTIQUES_DOSSIER']
+        self.domaine = (config.get('BOUTIQUES_DOMAINE') or '').lower().lstrip('.')
+        self.prefixe = '/' + (config.get('BOUTIQUES_PREFIXE') or '').strip('/')
+        self.maximum = config['BOUTIQUES_MAX']
+        self.inactivite = config['BOUTIQUES_INACTIVITE']
+        self.lock = threading.Lock()
+        self.ouvertes = OrderedDict()
+        # Un verrou par boutique pour sa création : une seule application par
+        # boutique, sans faire attendre les requêtes des boutiques déjà ouvertes
+        self.creations_verrous = {}
+        # Métriques
+        self.creations = 0
+        self.fermetures = 0
+
+    def _nom(self, environ):
+        """(nom de boutique ou None, environ à transmettre à son application)"""
+        if self.domaine:
+            hote = (environ.get('HTTP_HOST') or '').split(':')[0].lower()
+            if hote.endswith('.' + self.domaine):
+                return hote[:-len(self.domaine) - 1], environ
+        if self.prefixe != '/':
+            chemin = environ.get('PATH_INFO', '')
+            if chemin.startswith(self.prefixe + '/'):
+                nom, _, reste = chemin[len(self.prefixe) + 1:].partition('/')
+                environ = dict(environ, SCRIPT_NAME=f"{environ.get('SCRIPT_NAME', '')}{self.prefixe}/{nom}",
+                               PATH_INFO='/' + reste)
+                return nom, environ
+        return None, environ
+
+    def _prendre(self, nom):
+        """Boutique ouverte marquée en cours, ou None (sous le verrou)"""
+        ouverte = self.ouvertes.get(nom)
+        if ouverte is not None:
+            self.ouvertes.move_to_end(nom)
+            ouverte.en_cours += 1
+            ouverte.derniere = time.monotonic()
+        return ouverte
+
+    def _acquerir(self, nom):
+        with self.lock:
+            ouverte = self._prendre(nom)
+            if ouverte is None:
+                creation = self.creations_verrous.setdefault(nom, threading.Lock())
+        if ouverte is None:
+            with creation:
+                with self.lock:
+                    ouverte = self._prendre(nom)  # créée pendant l'attente
+                if ouverte is None:
+                    # create_app hors du verrou global
+                    app = creer_application(self.config, nom)
+                    with self.lock:
+                        self.ouvertes[nom] = _Ouverte(app)
+                        self.creations += 1
+                        ouverte = self._prendre(nom)
+        with self.lock:
+            a_fermer = self._evincer()
+        for app in a_fermer:
+            fermer(app)
+        return ouverte
+
+    def _evincer(self):
+        """Retirer du LRU les boutiques inactives ou en trop (sous le verrou)"""
+        limite = time.monotonic() - self.inactivite
+        retirees = []
+        for nom, ouverte in list(self.ouvertes.items()):
+            if len(self.ouvertes) <= self.maximum and ouverte.derniere >= limite:
+                break
+            if ouverte.en_cours or ouverte.app.extensions['taches'].occupe():
+                continue
+            del self.ouvertes[nom]
+            retirees.append(ouverte.app)
+        self.fermetures += len(retirees)
+        return retirees
+
+    def _liberer(self, ouverte):
+        with self.lock:
+            ouverte.en_cours -= 1
+            ouverte.derniere = time.monotonic()
+
+    def __call__(self, environ, start_response):
+        nom, environ = self._nom(environ)
+        if nom is None:
+            return self.suivant(environ, start_response)
+        if not NOM.match(nom) or not os.path.isfile(chemin_base(self.dossier, nom)):
+            return NotFound(f'Boutique inconnue : {nom}')(environ, start_response)
+        ouverte = self._acquerir(nom)
+        try:
+            reponse = ouverte.app(environ, start_response)
+        except BaseException:
+            self._liberer(ouverte)
+            raise
+        # Libérée quand la réponse est entièrement envoyée (fichiers, flux)
+        return ClosingIterator(reponse, lambda: self._liberer(ouverte))
+
+    def fermer_tout(self):
+        with self.lock:
+            ouvertes, self.ouvertes = list(self.ouvertes.values()), OrderedDict()
+        for ouverte in ouvertes:
+            fermer(ouverte.app)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'ouvertes': len(self.ouvertes),
+                'maximum': self.maximum,
+                'en_cours': sum(o.en_cours for o in self.ouvertes.values()),
+                'creations': self.creations,
+                'fermetures': self.fermetures,
+            }
+
+
+# ===== COMMANDES =====
+
+boutiques_cli = AppGroup('boutiques', help='Boutiques (une base SQLite chacune)')
+
+
+def _dossier():
+    dossier = current_app.config.get('BOUTIQUES_DOSSIER')
+    if not dossier:
+        raise click.ClickException('BOUTIQUES_DOSSIER (FACTURIER_BOUTIQUES) n\'est pas configuré')
+    return dossier
+
+
+@boutiques_cli.command('liste')
+def liste_commande():
+    """Lister les boutiques"""
+    for nom in lister(_dossier()):
+        click.echo(nom)
+
+
+@boutiques_cli.command('creer')
+@click.argument('nom')
+def creer_commande(nom):
+    """Créer la base d'une nouvelle boutique (schéma à jour)"""
+    from flask_migrate import stamp
+    from app import initialiser_base
+    dossier = _dossier()
+    if not NOM.match(nom):
+        raise click.ClickException(f'Nom invalide : {nom} (minuscules, chiffres et tirets)')
+    if os.path.exists(chemin_base(dossier, nom)):
+        raise click.ClickException(f'La boutique {nom} existe déjà')
+    os.makedirs(os.path.dirname(chemin_base(dossier, nom)), exist_ok=True)
+    repertoire = current_app.extensions['migrate'].directory
+    app = creer_application(current_app.config, nom)
+    try:
+        with app.app_context():
+            initialiser_base()
+            stamp(directory=repertoire)
+    finally:
+        fermer(app)
+    click.echo(f'Boutique {nom} créée : {chemin_base(dossier, nom)}')
+
+
+@boutiques_cli.command('migrer')
+@click.option('--revision', default='head', show_default=True)
+@click.option('--sans-principale', is_flag=True, help='Ne pas migrer la base principale')
+def migrer_commande(revision, sans_principale):
+    """Appliquer les migrations à la base principale et à chaque boutique"""
+    from flask_migrate import upgrade
+    repertoire = current_app.extensions['migrate'].directory
+    echecs = []
+    if not sans_principale:
+        click.echo(f'principale : {current_app.config["DATABASE_PATH"]}')
+        upgrade(directory=repertoire, revision=revision)
+    for nom in lister(_dossier()):
+        click.echo(f'{nom} : {chemin_base(_dossier(), nom)}')
+        app = creer_application(current_app.config, nom)
+        try:
+            with app.app_context():
+                upgrade(directory=repertoire, revision=revision)
+        except Exception as e:
+            # Les autres boutiques sont migrées quand même
+            echecs.append(nom)
+            click.echo(f'  échec : {e}', err=True)
+        finally:
+            fermer(app)
+    if echecs:
+        raise click.ClickException(f'Migration échouée pour : {", ".join(echecs)}')
+
+
+@boutiques_cli.command('sauvegarder')
+def sauvegarder_commande():
+    """Sauvegarder chaque boutique (copie compressée et vérifiée)"""
+    import sauvegarde
+    echecs = []
+    for nom in lister(_dossier()):
+        app = creer_application(current_app.config, nom)
+        try:
+            resultat = sauvegarde.sauvegarder(app.config)
+            click.echo(f'{nom} : {resultat.chemin} ({resultat.taille} octets, {resultat.duree:.1f} s)')
+        except Exception as e:
+            echecs.append(nom)
+            click.echo(f'{nom} : échec : {e}', err=True)
+        finally:
+            fermer(app)
+    if echecs:
+        raise click.ClickException(f'Sauvegarde échouée pour : {", ".join(echecs)}')
+
+
+def stats():
+    boutiques = current_app.extensions.get('boutiques')
+    return boutiques.stats() if boutiques is not None else {'actif': False}
+
+
+def init_app(app):
+    app.cli.add_command(boutiques_cli)
+    if app.config.get('BOUTIQUES_DOSSIER') and not app.config.get('BOUTIQUE'):
+        boutiques = Boutiques(app, app.wsgi_app)
+        app.wsgi_app = boutiques
+        app.extensions['boutiques'] = boutiques
@@ -0,0 +1,328 @@
+"""Cache des résultats de rapports
+
+Les rapports (par client, tous clients) sont coûteux à recalculer alors que
+ceux des périodes closes ne changent plus. On garde le contexte calculé sous
+la clé (rapport, client_id, date_debut, date_fin) et on l'invalide dès qu'une
+facture dont la date tombe dans la période est écrite.
+
+L'invalidation ne touche que le cache du processus qui a écrit : avec
+plusieurs workers, chaque entrée retient aussi la version des données lue
+avant son calcul, comparée à chaque lecture (une requête sur `horodatages`) :
+- ('rapports', aaaamm) : dernière écriture d'une facture du mois, dans la
+  transaction de l'écriture (after_flush, ou `marquer_dates` pour les
+  écritures en bloc) ;
+- ('clients', 0) pour les rapports qui affichent des clients, ('catalogue', 0)
+  et ('referentiel', 0) pour ceux qui affichent produits, catégories et
+  unités (voir horodatages.py).
+"""
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import current_app, has_app_context
+from sqlalchemy import and_, event, inspect, or_
+from sqlalchemy.orm import Session
+
+from horodatages import marquer
+from models import db, Client, Facture, Horodatage
+
+
+def _jour(valeur):
+    if isinstance(valeur, datetime):
+        return valeur.date()
+    return valeur
+
+
+def _mois(valeur):
+    return valeur.year * 100 + valeur.month
+
+
+def _dependances(rapport):
+    """Horodatages (entite_id 0) des données affichées par un rapport, hors factures"""
+    if rapport.startswith('produits'):
+        return ('catalogue', 'referentiel')
+    return ('clients',)
+
+
+def version(rapport, date_debut, date_fin):
+    """Version des données d'un rapport sur une période, en une requête"""
+    lignes = db.session.query(Horodatage.entite, Horodatage.entite_id, Horodatage.date_modification).filter(or_(
+        and_(Horodatage.entite == 'rapports',
+             Horodatage.entite_id.between(_mois(date_debut), _mois(date_fin))),
+        and_(Horodatage.entite.in_(_dependances(rapport)), Horodatage.entite_id == 0),
+    )).order_by(Horodatage.entite, Horodatage.entite_id).all()
+    return hashlib.sha1(repr([tuple(ligne) for ligne in lignes]).encode()).hexdigest()[:16]
+
+
+def marquer_dates(session, dates):
+    """Horodater les mois des factures écrites, dans la transaction en cours"""
+    marquer(session, [('rapports', _mois(d)) for d in dates if d is not None])
+
+
+class BackendMemoire:
+    """Stockage LRU en mémoire du processus"""
+
+    def __init__(self, taille_max):
+        self.taille_max = taille_max
+        self.entrees = OrderedDict()
+
+    def get(self, cle):
+        if cle not in self.entrees:
+            return None
+        self.entrees.move_to_end(cle)
+        return self.entrees[cle]
+
+    def set(self, cle, valeur):
+        self.entrees[cle] = valeur
+        self.entrees.move_to_end(cle)
+        evictions = 0
+        while len(self.entrees) > self.taille_max:
+            self.entrees.popitem(last=False)
+            evictions += 1
+        return evictions
+
+    def cles(self):
+        return list(self.entrees.keys())
+
+    def supprimer(self, cle):
+        self.entrees.pop(cle, None)
+
+    def vider(self):
+        self.entrees.clear()
+
+    def __len__(self):
+        return len(self.entrees)
+
+
+class BackendDisque:
+    """Stockage sur disque partagé entre les workers
+
+    Un fichier pickle par entrée ; la clé est encodée dans le nom du fichier
+    pour pouvoir invalider sans relire les contenus. L'ordre LRU suit la date
+    de modification des fichiers (mise à jour à chaque lecture).
+    """
+
+    def __init__(self, dossier, taille_max):
+        self.dossier = dossier
+        self.taille_max = taille_max
+        os.makedirs(dossier, exist_ok=True)
+
+    def _chemin(self, cle):
+        rapport, client_id, debut, fin = cle
+        empreinte = hashlib.sha1(repr(cle).encode()).hexdigest()[:10]
+        nom = f'{rapport}__{client_id or 0}__{debut:%Y%m%d}__{fin:%Y%m%d}__{empreinte}.pkl'
+        return os.path.join(self.dossier, nom)
+
+    @staticmethod
+    def _cle_depuis_nom(nom):
+        rapport, client_id, debut, fin, _ = nom[:-4].split('__')
+        return (rapport, int(client_id) or None,
+                datetime.strptime(debut, '%Y%m%d').date(),
+                datetime.strptime(fin, '%Y%m%d').date())
+
+    def get(self, cle):
+        chemin = self._chemin(cle)
+        try:
+            with open(chemin, 'rb') as f:
+                valeur = pickle.load(f)
+            os.utime(chemin)
+            return valeur
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set(self, cle, valeur):
+        chemin = self._chemin(cle)
+        temporaire = f'{chemin}.{os.getpid()}.tmp'
+        with open(temporaire, 'wb') as f:
+            pickle.dump(valeur, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporaire, chemin)
+
+        fichiers = self._fichiers()
+        evictions = 0
+        if len(fichiers) > self.taille_max:
+            fichiers.sort(key=lambda c: os.path.getmtime(c))
+            for chemin_ancien in fichiers[:len(fichiers) - self.taille_max]:
+                try:
+                    os.remove(chemin_ancien)
+                    evictions += 1
+                except OSError:
+                    pass
+        return evictions
+
+    def _fichiers(self):
+        return [os.path.join(self.dossier, nom) for nom in os.listdir(self.dossier) if nom.endswith('.pkl')]
+
+    def cles(self):
+        return [self._cle_depuis_nom(nom) for nom in os.listdir(self.dossier) if nom.endswith('.pkl')]
+
+    def supprimer(self, cle):
+        try:
+            os.remove(self._chemin(cle))
+        except OSError:
+            pass
+
+    def vider(self):
+        for chemin in self._fichiers():
+            try:
+                os.remove(chemin)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self._fichiers())
+
+
+class CacheRapports:
+    """Cache LRU borné des contextes de rapports avec invalidation par période"""
+
+    def __init__(self, taille_max=128, dossier=None):
+        if dossier:
+            self.backend = BackendDisque(dossier, taille_max)
+        else:
+            self.backend = BackendMemoire(taille_max)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def cle(rapport, client_id, date_debut, date_fin):
+        return (rapport, int(client_id) if client_id else None, _jour(date_debut), _jour(date_fin))
+
+    def get(self, rapport, client_id, date_debut, date_fin, version_courante):
+        """Contexte en cache, s'il a été calculé sur la version courante des données"""
+        cle = self.cle(rapport, client_id, date_debut, date_fin)
+        with self.lock:
+            entree = self.backend.get(cle)
+            if entree is not None and (not isinstance(entree, tuple) or entree[0] != version_courante):
+                # Écriture vue par un autre worker (ou entrée sans version) : périmée
+                self.backend.supprimer(cle)
+                self.invalidations += 1
+                entree = None
+            if entree is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entree[1]
+
+    def set(self, rapport, client_id, date_debut, date_fin, contexte, version_calcul):
+        cle = self.cle(rapport, client_id, date_debut, date_fin)
+        with self.lock:
+            self.evictions += self.backend.set(cle, (version_calcul, contexte))
+
+    def obtenir(self, rapport, client_id, date_debut, date_fin, calculer):
+        """Contexte du rapport, depuis le cache ou calculé par `calculer()` puis gardé
+
+        La version est lue avant le calcul : une écriture concurrente rend
+        l'entrée périmée au lieu d'y être oubliée.
+        """
+        version_courante = version(rapport, date_debut, date_fin)
+        contexte = self.get(rapport, client_id, date_debut, date_fin, version_courante)
+        if contexte is None:
+            contexte = calculer()
+            self.set(rapport, client_id, date_debut, date_fin, contexte, version_courante)
+        return contexte
+
+    def invalider_dates(self, dates):
+        """Supprimer uniquement les entrées dont la période contient une des dates"""
+        jours = {_jour(d) for d in dates if d is not None}
+        if not jours:
+            return 0
+        with self.lock:
+            supprimees = 0
+            for cle in self.backend.cles():
+                _, _, debut, fin = cle
+                if any(debut <= jour <= fin for jour in jours):
+                    self.backend.supprimer(cle)
+                    supprimees += 1
+            self.invalidations += supprimees
+            return supprimees
+
+    def invalider_clients(self, clients_ids):
+        """Supprimer les entrées qui affichent les clients modifiés"""
+        clients_ids = {int(c) for c in clients_ids if c}
+        if not clients_ids:
+            return 0
+        with self.lock:
+            supprimees = 0
+            for cle in self.backend.cles():
+                rapport, client_id, _, _ = cle
+                if client_id is None or client_id in clients_ids:
+                    self.backend.supprimer(cle)
+                    supprimees += 1
+            self.invalidations += supprimees
+            return supprimees
+
+    def vider(self):
+        with self.lock:
+            self.backend.vider()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entrees': len(self.backend),
+            'taille_max': self.backend.taille_max,
+            'backend': 'disque' if isinstance(self.backend, BackendDisque) else 'memoire',
+            'hits': self.hits,
+            'misses': self.misses,
+            'ratio': round(self.hits / total, 3) if total else 0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+def _dates_facture(facture):
+    """Date actuelle et éventuelle ancienne date de création d'une facture"""
+    historique = inspect(facture).attrs.date_creation.history
+    dates = list(historique.added or []) + list(historique.deleted or []) + list(historique.unchanged or [])
+    return [d for d in dates if d is not None] or [datetime.utcnow()]
+
+
+@event.listens_for(Session, 'after_flush')
+def _collecter(session, flush_context):
+    dates = session.info.setdefault('rapports_dates', set())
+    clients = session.info.setdefault('rapports_clients', set())
+    dates_flush = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Facture):
+            dates_flush.update(_dates_facture(obj))
+        elif isinstance(obj, Client) and obj not in session.new \
+                and (obj in session.deleted or session.is_modified(obj, include_collections=False)):
+            clients.add(obj.id)
+    if dates_flush:
+        marquer_dates(session, dates_flush)
+        dates.update(dates_flush)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalider(session):
+    """Invalider le cache après chaque commit qui touche les factures ou les clients"""
+    dates = session.info.pop('rapports_dates', None)
+    clients = session.info.pop('rapports_clients', None)
+    cache = current_app.extensions.get('cache_rapports') if has_app_context() else None
+    if cache is None:
+        return
+    if dates:
+        cache.invalider_dates(dates)
+    if clients:
+        cache.invalider_clients(clients)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _oublier(session):
+    session.info.pop('rapports_dates', None)
+    session.info.pop('rapports_clients', None)
+
+
+def init_app(app):
+    """Créer le cache de l'application
+
+    RAPPORTS_CACHE_DOSSIER active le stockage sur disque (partagé entre
+    workers), sinon LRU en mémoire du processus.
+    """
+    app.extensions['cache_rapports'] = CacheRapports(app.config['RAPPORTS_CACHE_TAILLE'],
+                                                     app.config['RAPPORTS_CACHE_DOSSIER'])
@@ -0,0 +1,217 @@
+"""Mode caisse hors ligne (/caisse/)
+
+Un service worker garde la page et le catalogue des produits et clients,
+rechargé seulement quand sa version change. Les ventes sont enregistrées
+sur le poste (IndexedDB) avec une clé d'idempotence, puis envoyées par lots
+de CAISSE_LOT à /api/caisse/synchroniser, qui les accepte une par une : une
+vente en conflit est signalée sans bloquer les autres, une vente déjà reçue
+n'est pas recréée.
+"""
+import hashlib
+import os
+from datetime import datetime
+
+from flask import Blueprint, current_app, jsonify, make_response, render_template, request, url_for
+from sqlalchemy.exc import IntegrityError
+
+import lecture
+import referentiel
+from facture import BATCH_FACTURES_MAX, LotRefuse, completer_doublons, creer_lot, valider_lot
+from models import db, Client, Horodatage, Produit
+
+bp = Blueprint('caisse', __name__)
+
+# Horodatages dont dépend le catalogue de caisse
+_VERSIONS = ('catalogue', 'referentiel', 'clients')
+# Fichiers gardés par le service worker : leur date change le service worker
+_STATIQUES = ('style.css', 'caisse.js')
+ETATS = ('Payée', 'En attente')
+
+
+def version_catalogue():
+    """Version du catalogue de caisse, en une lecture de trois horodatages"""
+    dates = dict(db.session.query(Horodatage.entite, Horodatage.date_modification)
+                 .filter(Horodatage.entite.in_(_VERSIONS), Horodatage.entite_id == 0))
+    cle = '|'.join(str(dates.get(entite)) for entite in _VERSIONS)
+    return hashlib.sha1(cle.encode()).hexdigest()[:16]
+
+
+def _unite(unite_id):
+    unite = referentiel.unite(unite_id)
+    return (unite.symbole or unite.nom) if unite else ''
+
+
+def catalogue():
+    """Produits et clients nécessaires à la saisie d'une vente"""
+    produits = [{
+        'id': p.id,
+        'nom': p.nom,
+        'code': p.code,
+        'pv_ttc': p.pv_ttc,
+        'tva': p.tva,
+        'unite': _unite(p.unite_mesure_id),
+    } for p in db.session.query(Produit.id, Produit.nom, Produit.code, Produit.pv_ttc, Produit.tva,
+                                Produit.unite_mesure_id).order_by(Produit.nom)]
+    clients = [{
+        'id': c.id,
+        'nom': f'{c.nom} {c.prenom or ""}'.strip() if c.type_client == 'person' else c.nom,
+        'telephone': c.telephone,
+        'nif': c.nif,
+    } for c in db.session.query(Client.id, Client.type_client, Client.nom, Client.prenom,
+                                Client.telephone, Client.nif).order_by(Client.nom)]
+    return produits, clients
+
+
+@bp.route('/caisse/')
+def caisse():
+    """Page de caisse (gardée par le service worker)"""
+    return render_template('caisse.html', lot=current_app.config['CAISSE_LOT'])
+
+
+@bp.route('/caisse/sw.js')
+def service_worker():
+    """Service worker de la caisse, servi sous /caisse/ pour en couvrir la portée"""
+    dossier = current_app.static_folder
+    empreinte = '|'.join(str(os.stat(os.path.join(dossier, nom)).st_mtime_ns) for nom in _STATIQUES)
+    version = hashlib.sha1(empreinte.encode()).hexdigest()[:12]
+    fichiers = [url_for('caisse.caisse')] + [url_for('static', filename=nom) for nom in _STATIQUES]
+    reponse = make_response(render_template('caisse_sw.js', version=version, fichiers=fichiers,
+                                            catalogue=url_for('caisse.api_catalogue')))
+    reponse.mimetype = 'text/javascript'
+    # Le navigateur vérifie la mise à jour du service worker à chaque chargement
+    reponse.cache_control.no_cache = True
+    return reponse
+
+
+@bp.route('/api/caisse/version')
+@lecture.lecture_seule
+def api_version():
+    return jsonify({'success': True, 'version': version_catalogue()})
+
+
+@bp.route('/api/caisse/catalogue')
+@lecture.lecture_seule
+def api_catalogue():
+    """Catalogue de caisse ; 304 si le poste a déjà cette version"""
+    version = version_catalogue()
+    if version in request.if_none_match:
+        reponse = make_response('', 304)
+    else:
+        produits, clients = catalogue()
+        reponse = jsonify({'success': True, 'version': version, 'produits': produits, 'clients': clients})
+    reponse.set_etag(version)
+    reponse.cache_control.no_cache = True
+    return reponse
+
+
+def _preparer(vente, poste, conflits, index):
+    """Document de l'API batch pour une vente du poste (None : conflit noté)"""
+    if not isinstance(vente, dict):
+        conflits.append({'index': index, 'message': 'Vente invalide'})
+        return None
+    cle = vente.get('cle_idempotence')
+    if not isinstance(cle, str) or not cle:
+        conflits.append({'index': index, 'message': 'Clé d\'idempotence requise'})
+        return None
+    etat = vente.get('etat', 'Payée')
+    if etat not in ETATS:
+        conflits.append({'index': index, 'cle_idempotence': cle, 'message': f'État invalide: {etat}'})
+        return None
+    notes = vente.get('notes') or ''
+    if not isinstance(notes, str):
+        conflits.append({'index': index, 'cle_idempotence': cle, 'message': 'Notes invalides'})
+        return None
+    vendu_le = vente.get('vendu_le')
+    if vendu_le:
+        try:
+            vendu_le = datetime.fromisoformat(str(vendu_le))
+        except ValueError:
+            conflits.append({'index': index, 'cle_idempotence': cle, 'message': f'Date invalide: {vendu_le}'})
+            return None
+        mention = f'Vente de caisse du {vendu_le:%d/%m/%Y %H:%M}' + (f' ({poste})' if poste else '')
+        notes = f'{mention}\n{notes}' if notes else mention
+    return {
+        'cle_idempotence': cle,
+        'type_document': 'facture',
+        'client_id': vente.get('client_id') or None,
+        'paiement': vente.get('paiement'),
+        'devise': vente.get('devise'),
+        'etat': etat,
+        'notes': notes,
+        'lignes': vente.get('lignes'),
+    }
+
+
+def _ecarts(documents, resultats):
+    """Lignes vendues à un autre prix que celui du catalogue courant"""
+    produits_ids = {ligne.get('produit_id') for index in resultats if not resultats[index]['doublon']
+                    for ligne in documents[index]['lignes'] if isinstance(ligne, dict)}
+    if not produits_ids:
+        return []
+    prix = dict(db.session.query(Produit.id, Produit.pv_ttc).filter(Produit.id.in_(produits_ids)))
+    ecarts = []
+    for index, resultat in sorted(resultats.items()):
+        if resultat['doublon']:
+            continue
+        for ligne in documents[index]['lignes']:
+            vendu = ligne.get('prix_unitaire')
+            courant = prix.get(ligne.get('produit_id'))
+            if vendu is not None and courant is not None and abs(float(vendu) - float(courant)) > 0.005:
+                ecarts.append({'index': index, 'cle_idempotence': documents[index]['cle_idempotence'],
+                               'numero': resultat['numero'], 'produit_id': ligne['produit_id'],
+                               'prix_vendu': vendu, 'prix_catalogue': courant})
+    return ecarts
+
+
+@bp.route('/api/caisse/synchroniser', methods=['POST'])
+def api_synchroniser():
+    """Recevoir un lot de ventes saisies sur un poste de caisse
+
+    Réponse : numéros attribués (`factures`), ventes refusées (`conflits`,
+    à corriger sur le poste), prix différents du catalogue (`ecarts`) et
+    version courante du catalogue. 409 : numéros pris entre-temps, le lot
+    entier est à renvoyer.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': 'Objet JSON attendu'}), 400
+    ventes = data.get('factures')
+    poste = str(data.get('poste') or '')[:40]
+    if not isinstance(ventes, list) or not ventes:
+        return jsonify({'success': False, 'message': 'La liste "factures" est requise'}), 400
+    if len(ventes) > BATCH_FACTURES_MAX:
+        return jsonify({'success': False,
+                        'message': f'Maximum {BATCH_FACTURES_MAX} factures par lot'}), 400
+
+    conflits = []
+    documents = [_preparer(vente, poste, conflits, index) for index, vente in enumerate(ventes)]
+    a_valider = [(index, doc) for index, doc in enumerate(documents) if doc is not None]
+
+    # Validation de l'API batch sur les ventes recevables, erreurs rapportées à leur index
+    a_creer, erreurs, existantes, cles_du_lot = valider_lot([doc for _, doc in a_valider])
+    positions = [index for index, _ in a_valider]
+    for erreur in erreurs:
+        index = positions[erreur['index']]
+        conflits.append({'index': index, 'cle_idempotence': documents[index]['cle_idempotence'],
+                         'message': erreur['message']})
+    a_creer = [(positions[i], doc, lignes) for i, doc, lignes in a_creer]
+    cles_du_lot = {cle: positions[i] for cle, i in cles_du_lot.items()}
+
+    try:
+        resultats = creer_lot(a_creer)
+    except IntegrityError:
+        return jsonify({'success': False,
+                        'message': 'Conflit de numérotation, veuillez renvoyer le lot'}), 409
+    except LotRefuse as e:
+        # Pas d'avoir en caisse : ne devrait pas arriver
+        return jsonify({'success': False, 'message': 'Lot refusé', 'erreurs': e.erreurs}), 400
+    completer_doublons([doc or {} for doc in documents], resultats, existantes, cles_du_lot)
+
+    return jsonify({
+        'success': True,
+        'factures': [dict(index=index, cle_idempotence=documents[index]['cle_idempotence'], **resultat)
+                     for index, resultat in sorted(resultats.items())],
+        'conflits': sorted(conflits, key=lambda c: c['index']),
+        'ecarts': _ecarts(documents, resultats),
+        'version': version_catalogue(),
+    })
@@ -0,0 +1,311 @@
+"""Journal des changements et flux /api/changes
+
+Chaque écriture qui touche une facture, un produit, un mouvement de stock ou
+un approvisionnement ajoute une entrée à la table `changements` dans sa
+propre transaction (after_flush, et appels explicites des écritures en bloc).
+L'identifiant de l'entrée sert de curseur : attribué sous le verrou
+d'écriture de SQLite, il suit l'ordre des commits.
+
+`GET /api/changes?since=<curseur>` renvoie les entrées suivantes par pages,
+avec l'état courant des entités. Les entrées acquittées par tous les
+consommateurs (`POST /api/changes/ack`) sont compactées ; un curseur
+compacté reçoit 410 (resynchronisation complète).
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import click
+from flask import Blueprint, current_app, jsonify, request
+from flask.cli import AppGroup
+from sqlalchemy import delete, event, func, insert, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import ecritures  # module : ecritures -> journal_stock -> changements
+import lecture
+from models import (db, Approvisionnement, Changement, ConsommateurChangements, Facture,
+                    LigneApprovisionnement, LigneFacture, MouvementStock, Produit)
+
+bp = Blueprint('changements', __name__)
+
+CREATION = 'creation'
+MODIFICATION = 'modification'
+SUPPRESSION = 'suppression'
+ARCHIVAGE = 'archivage'  # facture déplacée dans la base d'un exercice archivé
+
+# Une entité touchée plusieurs fois dans un flush n'y a qu'une entrée
+_PRIORITE = {MODIFICATION: 0, CREATION: 1, SUPPRESSION: 2}
+
+# Entrées par page au plus
+PAGE_MAX = 5000
+
+# Entité du flux : (modèle, colonnes de son état)
+_ETATS = {
+    'facture': (Facture, (Facture.id, Facture.numero, Facture.type_document, Facture.client_id,
+                          Facture.facture_originale_id, Facture.date_creation, Facture.paiement,
+                          Facture.devise, Facture.etat, Facture.total, Facture.montant_paye)),
+    'produit': (Produit, (Produit.id, Produit.nom, Produit.code, Produit.categorie_id, Produit.unite_mesure_id,
+                          Produit.tva, Produit.pv_ttc, Produit.stock_actuel, Produit.stock_minimum,
+                          Produit.article_stockable)),
+    'mouvement_stock': (MouvementStock, (MouvementStock.id, MouvementStock.produit_id,
+                                         MouvementStock.type_mouvement, MouvementStock.quantite,
+                                         MouvementStock.stock_avant, MouvementStock.stock_apres,
+                                         MouvementStock.reference_type, MouvementStock.reference_id,
+                                         MouvementStock.date_mouvement)),
+    'approvisionnement': (Approvisionnement, (Approvisionnement.id, Approvisionnement.numero,
+                                              Approvisionnement.date_approvisionnement,
+                                              Approvisionnement.fournisseur, Approvisionnement.statut,
+                                              Approvisionnement.total_ht, Approvisionnement.total_ttc)),
+}
+ENTITES = tuple(_ETATS)
+
+
+def _changements(obj, operation):
+    """(entite, id, operation) des entités du flux touchées par l'objet"""
+    if isinstance(obj, Facture):
+        # Un avoir change le reste créditable de sa facture d'origine
+        return [('facture', obj.id, operation), ('facture', obj.facture_originale_id, MODIFICATION)]
+    if isinstance(obj, LigneFacture):
+        return [('facture', obj.facture_id, MODIFICATION)]
+    if isinstance(obj, Produit):
+        return [('produit', obj.id, operation)]
+    if isinstance(obj, MouvementStock):
+        return [('mouvement_stock', obj.id, operation)]
+    if isinstance(obj, Approvisionnement):
+        return [('approvisionnement', obj.id, operation)]
+    if isinstance(obj, LigneApprovisionnement):
+        return [('approvisionnement', obj.approvisionnement_id, MODIFICATION)]
+    return []
+
+
+def enregistrer(session, changements):
+    """Ajouter des entrées (entite, id, operation) au journal, dans la transaction de la session"""
+    operations = {}
+    for entite, entite_id, operation in changements:
+        if entite_id is None:
+            continue
+        cle = (entite, int(entite_id))
+        if _PRIORITE[operation] >= _PRIORITE[operations.get(cle, MODIFICATION)]:
+            operations[cle] = operation
+    if not operations:
+        return
+    maintenant = datetime.utcnow()
+    # Ordre stable : les entrées d'un même flush se suivent par entité puis id
+    lignes = [{'entite': entite, 'entite_id': entite_id, 'operation': operation, 'date_changement': maintenant}
+              for (entite, entite_id), operation in sorted(operations.items())]
+    session.connection().execute(insert(Changement.__table__), lignes)
+
+
+@event.listens_for(Session, 'after_flush')
+def _journaliser(session, flush_context):
+    """Journaliser les changements dans la transaction de chaque flush"""
+    changements = []
+    for obj in session.new:
+        changements.extend(_changements(obj, CREATION))
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            changements.extend(_changements(obj, MODIFICATION))
+    for obj in session.deleted:
+        changements.extend(_changements(obj, SUPPRESSION))
+    enregistrer(session, changements)
+
+
+# ===== FLUX =====
+
+def _valeur(valeur):
+    return valeur.isoformat() if isinstance(valeur, datetime) else valeur
+
+
+def _etats(changements):
+    """État courant des entités des entrées, une requête par type d'entité"""
+    ids = defaultdict(set)
+    for changement in changements:
+        if changement.operation not in (SUPPRESSION, ARCHIVAGE):
+            ids[changement.entite].add(changement.entite_id)
+    etats = {}
+    for entite, entite_ids in ids.items():
+        modele, colonnes = _ETATS[entite]
+        rows = db.session.execute(select(*colonnes).where(modele.id.in_(entite_ids)))
+        etats[entite] = {row.id: {cle: _valeur(v) for cle, v in row._asdict().items()} for row in rows}
+
+    factures = etats.get('facture')
+    if factures:
+        for facture in factures.values():
+            facture['lignes'] = []
+        L = LigneFacture
+        lignes = db.session.execute(
+            select(L.facture_id, L.id, L.produit_id, L.quantite, L.prix_unitaire, L.tva,
+                   L.montant_ht, L.montant_tva, L.montant_ttc, L.ligne_originale_id)
+            .where(L.facture_id.in_(list(factures))).order_by(L.id))
+        for ligne in lignes:
+            valeurs = ligne._asdict()
+            factures[valeurs.pop('facture_id')]['lignes'].append(valeurs)
+    return etats
+
+
+def _horizon():
+    """Dernier curseur compacté (0 : rien n'a été supprimé)
+
+    Les curseurs se suivent sans trou (AUTOINCREMENT, annulations comprises)
+    et le compactage ne supprime que des débuts de journal.
+    """
+    premier = db.session.execute(select(func.min(Changement.id))).scalar()
+    if premier is not None:
+        return premier - 1
+    sequence = db.session.execute(
+        text("SELECT seq FROM sqlite_sequence WHERE name = 'changements'")).scalar()
+    return sequence or 0
+
+
+@bp.route('/api/changes')
+@lecture.lecture_seule
+def api_changements():
+    """Entrées postérieures au curseur `since` (absent : toutes), dans l'ordre des commits
+
+    `limite` : entrées par page ; `entites` : types retenus (facture,
+    produit, mouvement_stock, approvisionnement, séparés par des virgules) ;
+    `etats=0` : entrées seules, sans l'état des entités.
+    """
+    depuis = request.args.get('since')
+    if depuis is not None:
+        # Curseur entier positif ou nul (un curseur négatif n'a jamais été renvoyé)
+        if not (depuis.isascii() and depuis.isdigit()):
+            return jsonify({'success': False, 'message': 'Curseur invalide'}), 400
+        depuis = int(depuis)
+    limite = max(1, min(request.args.get('limite', current_app.config['CHANGEMENTS_PAGE'], type=int), PAGE_MAX))
+    entites = [e for e in request.args.get('entites', '').split(',') if e]
+    inconnues = set(entites) - set(ENTITES)
+    if inconnues:
+        return jsonify({'success': False, 'message': f'Entités inconnues : {", ".join(sorted(inconnues))}'}), 400
+
+    horizon = _horizon()
+    if depuis is None:
+        # Premier appel : depuis la plus ancienne entrée conservée
+        depuis = horizon
+    elif depuis < horizon:
+        return jsonify({'success': False, 'horizon': horizon,
+                        'message': f'Les changements jusqu\'au curseur {horizon} ont été compactés : '
+                                   f'resynchronisation complète nécessaire'}), 410
+
+    requete = select(Changement).where(Changement.id > depuis)
+    if entites:
+        requete = requete.where(Changement.entite.in_(entites))
+    changements = db.session.execute(requete.order_by(Changement.id).limit(limite + 1)).scalars().all()
+    plus = len(changements) > limite
+    changements = changements[:limite]
+    # Dernier curseur de l'instantané : point de départ d'un consommateur qui
+    # se synchronise d'abord entièrement
+    dernier = max(horizon, db.session.execute(select(func.max(Changement.id))).scalar() or 0)
+    # Sans suite, les entrées écartées par le filtre sont dépassées aussi
+    curseur = changements[-1].id if plus else max(depuis, dernier)
+
+    reponse = {
+        'success': True,
+        'curseur': curseur,
+        'dernier': dernier,
+        'plus': plus,
+        'changements': [{'curseur': c.id, 'entite': c.entite, 'id': c.entite_id, 'operation': c.operation,
+                         'date': c.date_changement.isoformat()} for c in changements],
+    }
+    if request.args.get('etats', '1') != '0':
+        reponse['etats'] = _etats(changements)
+    return jsonify(reponse)
+
+
+# ===== ACQUITTEMENT ET COMPACTAGE =====
+
+def _limite_compactage():
+    """Curseur jusqu'auquel tous les consommateurs actifs ont acquitté (None : aucun consommateur)"""
+    requete = select(func.min(ConsommateurChangements.curseur))
+    jours = current_app.config['CHANGEMENTS_ABANDON_JOURS']
+    if jours:
+        requete = requete.where(ConsommateurChangements.date_acquittement
+                                >= datetime.utcnow() - timedelta(days=jours))
+    return db.session.execute(requete).scalar()
+
+
+def compacter(lot):
+    """Supprimer au plus `lot` entrées acquittées (thread d'écriture) ; nombre supprimé"""
+    limite = _limite_compactage()
+    if not limite:
+        return 0
+    bornes = select(Changement.id).where(Changement.id <= limite).order_by(Changement.id).limit(lot)
+    return db.session.execute(delete(Changement).where(Changement.id.in_(bornes))).rowcount
+
+
+def acquitter(nom, curseur, lot):
+    """Avancer le curseur d'un consommateur puis compacter (thread d'écriture)"""
+    stmt = sqlite_insert(ConsommateurChangements.__table__).values(
+        nom=nom, curseur=curseur, date_acquittement=datetime.utcnow())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['nom'],
+        # Un acquittement en retard (requêtes croisées) ne fait pas reculer le curseur
+        set_={'curseur': func.max(ConsommateurChangements.__table__.c.curseur, stmt.excluded.curseur),
+              'date_acquittement': stmt.excluded.date_acquittement}
+    )
+    db.session.execute(stmt)
+    return compacter(lot)
+
+
+@bp.route('/api/changes/ack', methods=['POST'])
+def api_acquitter():
+    """Enregistrer le dernier curseur traité par un consommateur"""
+    data = request.get_json(silent=True) or {}
+    nom = data.get('consommateur')
+    curseur = data.get('curseur')
+    if not isinstance(nom, str) or not nom.strip() or len(nom) > 60:
+        return jsonify({'success': False, 'message': 'Le nom du consommateur est requis (60 caractères au plus)'}), 400
+    if not isinstance(curseur, int) or isinstance(curseur, bool) or curseur < 0:
+        return jsonify({'success': False, 'message': 'Curseur invalide'}), 400
+    if curseur > (db.session.execute(select(func.max(Changement.id))).scalar() or _horizon()):
+        return jsonify({'success': False, 'message': 'Curseur postérieur au dernier changement'}), 400
+
+    supprimes = ecritures.ecrire(acquitter, nom.strip(), curseur, current_app.config['CHANGEMENTS_COMPACTAGE_LOT'])
+    return jsonify({'success': True, 'consommateur': nom.strip(), 'curseur': curseur, 'compactes': supprimes})
+
+
+# ===== COMMANDES =====
+
+changements_cli = AppGroup('changements', help='Journal des changements (flux /api/changes)')
+
+
+@changements_cli.command('compacter')
+def compacter_commande():
+    """Supprimer toutes les entrées acquittées par les consommateurs"""
+    lot = current_app.config['CHANGEMENTS_COMPACTAGE_LOT']
+    total = 0
+    while True:
+        # Un lot par transaction : l'écrivain de l'application n'attend pas tout le compactage
+        supprimes = compacter(lot)
+        db.session.commit()
+        total += supprimes
+        if supprimes < lot:
+            break
+    click.echo(f'{total} entrée(s) supprimée(s)')
+
+
+@changements_cli.command('consommateurs')
+def consommateurs_commande():
+    """Lister les consommateurs et leur retard"""
+    dernier = db.session.execute(select(func.max(Changement.id))).scalar() or 0
+    for consommateur in db.session.execute(
+            select(ConsommateurChangements).order_by(ConsommateurChangements.nom)).scalars():
+        date = consommateur.date_acquittement.strftime('%d/%m/%Y %H:%M') if consommateur.date_acquittement else '-'
+        click.echo(f'{consommateur.nom} : curseur {consommateur.curseur}, '
+                   f'{max(dernier - consommateur.curseur, 0)} en retard, acquitté le {date}')
+
+
+@changements_cli.command('oublier')
+@click.argument('nom')
+def oublier_commande(nom):
+    """Retirer un consommateur : il ne retient plus le compactage"""
+    supprimes = db.session.execute(
+        delete(ConsommateurChangements).where(ConsommateurChangements.nom == nom)).rowcount
+    db.session.commit()
+    if not supprimes:
+        raise click.ClickException(f'Consommateur inconnu : {nom}')
+    click.echo(f'Consommateur {nom} retiré')
+
+
+def init_app(app):
+    app.cli.add_command(changements_cli)
@@ -0,0 +1,107 @@
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from models import db, Client
+from ecritures import ecrire
+from horodatages import get_conditionnel
+from recherche import limite_demandee, rechercher_clients
+
+bp = Blueprint('clients', __name__)
+
+@bp.route('/clients')
+def clients_list():
+    clients = Client.query.all()
+    return render_template('clients_list.html', clients=clients)
+
+@bp.route('/client/<int:id>')
+@get_conditionnel('client')
+def client_detail(id):
+    client = Client.query.get_or_404(id)
+    return render_template('client.html', client=client)
+
+@bp.route('/client/new', methods=['GET', 'POST'])
+def client_new():
+    if request.method == 'POST':
+        # Get form data
+        type_client = request.form['type_client']
+        
+        # Common fields
+        client_data = {
+            'type_client': type_client,
+            'nom': request.form['nom'],
+            'telephone': request.form.get('telephone', ''),
+            'email': request.form.get('email', '')
+        }
+        
+        # Add fields based on client type
+        if type_client == 'person':
+            client_data['prenom'] = request.form.get('prenom', '')
+            # Company fields are null for physical person
+            client_data['quartier'] = request.form.get('quartier', '')
+            client_data['avenue'] = request.form.get('avenue', '')
+            client_data['numero'] = request.form.get('prenom', '')
+            client_data['nif'] = None
+        else:  # company
+            client_data['prenom'] = None
+            client_data['quartier'] = request.form.get('quartier', '')
+            client_data['avenue'] = request.form.get('avenue', '')
+            client_data['numero'] = request.form.get('numero', '')
+            client_data['nif'] = request.form.get('nif', '')
+        
+        ecrire(enregistrer_client, None, client_data)
+        flash('Client créé avec succès', 'success')
+        return redirect(url_for('clients.clients_list'))
+    
+    return render_template('client_form.html')
+
+@bp.route('/client/<int:id>/edit', methods=['GET', 'POST'])
+def client_edit(id):
+    client = Client.query.get_or_404(id)
+    if request.method == 'POST':
+        # Update common fields
+        client_data = {
+            'type_client': request.form['type_client'],
+            'nom': request.form['nom'],
+            'telephone': request.form.get('telephone', ''),
+            'email': request.form.get('email', '')
+        }
+        
+        # Update fields based on client type
+        if client_data['type_client'] == 'person':
+            client_data['prenom'] = request.form.get('prenom', '')
+            # Clear company fields
+            client_data['quartier'] = None
+            client_data['avenue'] = None
+            client_data['numero'] = None
+            client_data['nif'] = None
+        else:  # company
+            client_data['prenom'] = None
+            client_data['quartier'] = request.form.get('quartier', '')
+            client_data['avenue'] = request.form.get('avenue', '')
+            client_data['numero'] = request.form.get('numero', '')
+            client_data['nif'] = request.form.get('nif', '')
+        
+        ecrire(enregistrer_client, client.id, client_data)
+        flash('Client modifié avec succès', 'success')
+        return redirect(url_for('clients.client_detail', id=client.id))
+    
+    return render_template('client_form.html', client=client)
+
+def enregistrer_client(client_id, client_data):
+    """Créer (client_id None) ou modifier un client (exécuté par le thread d'écriture)"""
+    if client_id is None:
+        client = Client(**client_data)
+        db.session.add(client)
+    else:
+        client = db.session.get(Client, client_id)
+        for nom, valeur in client_data.items():
+            setattr(client, nom, valeur)
+    db.session.flush()
+    return client.id
+
+@bp.route('/api/clients/recherche')
+def api_recherche_clients():
+    """Clients dont le nom, le téléphone ou le NIF commence par ?q= (saisie semi-automatique)"""
+    texte = request.args.get('q', '').strip()
+    if not texte:
+        return jsonify({'success': True, 'clients': []})
+    limite = limite_demandee(request.args.get('limite', type=int))
+    return jsonify({'success': True, 'clients': rechercher_clients(texte, limite)})
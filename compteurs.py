@@ -0,0 +1,263 @@
+"""Compteurs du tableau de bord
+
+Les indicateurs de la page d'accueil (ventes du mois, impayés, avoirs,
+produits en stock bas, meilleurs produits) sont lus dans la table
+`compteurs` au lieu d'être recalculés par des parcours complets. Chaque
+flush qui touche une facture, une ligne ou un produit y ajoute la
+différence entre l'ancienne et la nouvelle contribution de l'objet ; les
+écritures en masse (API batch, remplacement des lignes) passent leurs
+différences explicitement. `flask recalculer-compteurs` reconstruit tout.
+
+Clés :
+- ventes:AAAA-MM, nb_factures:AAAA-MM, avoirs:AAAA-MM, nb_avoirs:AAAA-MM
+- impaye : restant dû des factures « En attente » (total - montant_paye)
+- stock_bas : produits stockables au niveau du stock minimum ou en dessous
+- produit:AAAA-MM:<id> : montant TTC vendu (avoirs déduits)
+"""
+from collections import defaultdict
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import case, event, func, inspect
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import archives
+from models import db, Compteur, Facture, LigneFacture, Produit
+from montants import montants_ligne
+
+NB_MEILLEURS_PRODUITS = 10
+
+_COLONNES_DOCUMENT = ('type_document', 'etat', 'date_creation', 'total', 'montant_paye')
+_COLONNES_LIGNE = ('produit_id', 'quantite', 'prix_unitaire', 'tva', 'facture_id')
+_COLONNES_PRODUIT = ('article_stockable', 'stock_actuel', 'stock_minimum')
+
+
+def _mois(date):
+    return (date or datetime.utcnow()).strftime('%Y-%m')
+
+
+def contribution_document(type_document, etat, date_creation, total, montant_paye=0):
+    """Compteurs auxquels contribue un document"""
+    mois = _mois(date_creation)
+    total = total or 0
+    if type_document == 'avoir':
+        return {f'avoirs:{mois}': total, f'nb_avoirs:{mois}': 1}
+    contribution = {f'ventes:{mois}': total, f'nb_factures:{mois}': 1}
+    if etat == 'En attente':
+        contribution['impaye'] = total - (montant_paye or 0)
+    return contribution
+
+
+def contribution_ligne(produit_id, quantite, prix_unitaire, tva, type_document, date_creation):
+    """Montant vendu d'un produit dans le mois du document (négatif pour un avoir)"""
+    montant = montants_ligne(quantite, prix_unitaire, tva)[2]
+    if type_document == 'avoir':
+        montant = -abs(montant)
+    return {f'produit:{_mois(date_creation)}:{produit_id}': montant}
+
+
+def contribution_produit(article_stockable, stock_actuel, stock_minimum):
+    stock_bas = article_stockable == 'OUI' and (stock_actuel or 0) <= (stock_minimum or 0)
+    return {'stock_bas': 1 if stock_bas else 0}
+
+
+def _ajouter(deltas, contribution, signe=1):
+    for cle, valeur in contribution.items():
+        deltas[cle] += signe * valeur
+
+
+def ajouter(session, deltas):
+    """Ajouter les différences aux compteurs (upsert, dans la transaction en cours)"""
+    lignes = [{'cle': cle, 'valeur': valeur} for cle, valeur in deltas.items() if valeur]
+    if not lignes:
+        return
+    stmt = sqlite_insert(Compteur.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['cle'],
+        set_={'valeur': Compteur.__table__.c.valeur + stmt.excluded.valeur}
+    )
+    session.connection().execute(stmt, lignes)
+
+
+# ===== DIFFÉRENCES PAR OBJET =====
+
+def _valeurs(obj, colonnes, anciennes):
+    """Valeurs des colonnes avant (anciennes=True) ou après le flush"""
+    etat = inspect(obj)
+    valeurs = []
+    for colonne in colonnes:
+        historique = etat.attrs[colonne].history
+        if anciennes and historique.deleted:
+            valeurs.append(historique.deleted[0])
+        else:
+            valeurs.append(getattr(obj, colonne))
+    return valeurs
+
+
+def _modifie(obj, colonnes):
+    etat = inspect(obj)
+    return any(etat.attrs[c].history.has_changes() for c in colonnes)
+
+
+def _document_de_ligne(session, facture_id):
+    facture = session.get(Facture, facture_id)
+    if facture is None:
+        return None, None
+    return facture.type_document, facture.date_creation
+
+
+def _contribution(session, obj, anciennes):
+    if isinstance(obj, Facture):
+        return contribution_document(*_valeurs(obj, _COLONNES_DOCUMENT, anciennes))
+    if isinstance(obj, LigneFacture):
+        produit_id, quantite, prix_unitaire, tva, facture_id = _valeurs(obj, _COLONNES_LIGNE, anciennes)
+        return contribution_ligne(produit_id, quantite, prix_unitaire, tva,
+                                  *_document_de_ligne(session, facture_id))
+    return contribution_produit(*_valeurs(obj, _COLONNES_PRODUIT, anciennes))
+
+
+_COLONNES = {Facture: _COLONNES_DOCUMENT, LigneFacture: _COLONNES_LIGNE, Produit: _COLONNES_PRODUIT}
+
+
+@event.listens_for(Session, 'after_flush')
+def _compter(session, flush_context):
+    """Reporter dans les compteurs les objets écrits par ce flush"""
+    deltas = defaultdict(int)
+    for obj in session.new:
+        if type(obj) in _COLONNES:
+            _ajouter(deltas, _contribution(session, obj, anciennes=False))
+    for obj in session.deleted:
+        if type(obj) in _COLONNES:
+            _ajouter(deltas, _contribution(session, obj, anciennes=True), -1)
+    for obj in session.dirty:
+        if type(obj) in _COLONNES and _modifie(obj, _COLONNES[type(obj)]):
+            _ajouter(deltas, _contribution(session, obj, anciennes=True), -1)
+            _ajouter(deltas, _contribution(session, obj, anciennes=False))
+    ajouter(session, deltas)
+
+
+# ===== ÉCRITURES EN MASSE =====
+
+def documents_inseres(session, entetes, lignes):
+    """Compter des factures et lignes insérées hors ORM (dicts des colonnes)"""
+    deltas = defaultdict(int)
+    documents = {}
+    for entete in entetes:
+        documents[entete['id']] = (entete['type_document'], entete['date_creation'])
+        _ajouter(deltas, contribution_document(entete['type_document'], entete['etat'],
+                                               entete['date_creation'], entete['total'],
+                                               entete.get('montant_paye', 0)))
+    for ligne in lignes:
+        _ajouter(deltas, contribution_ligne(ligne['produit_id'], ligne['quantite'], ligne['prix_unitaire'],
+                                            ligne['tva'], *documents[ligne['facture_id']]))
+    ajouter(session, deltas)
+
+
+def documents_modifies(session, avant, apres):
+    """Reporter des documents modifiés hors ORM (arguments de contribution_document)"""
+    deltas = defaultdict(int)
+    for valeurs in avant:
+        _ajouter(deltas, contribution_document(*valeurs), -1)
+    for valeurs in apres:
+        _ajouter(deltas, contribution_document(*valeurs))
+    ajouter(session, deltas)
+
+
+def lignes_supprimees(session, facture, lignes):
+    """Retirer des compteurs des lignes supprimées hors ORM (produit_id, quantite, prix_unitaire, tva)"""
+    deltas = defaultdict(int)
+    for produit_id, quantite, prix_unitaire, tva in lignes:
+        _ajouter(deltas, contribution_ligne(produit_id, quantite, prix_unitaire, tva,
+                                            facture.type_document, facture.date_creation), -1)
+    ajouter(session, deltas)
+
+
+# ===== LECTURE =====
+
+def tableau_de_bord():
+    """Indicateurs de la page d'accueil : quelques lectures par clé"""
+    mois = _mois(None)
+    cles = [f'ventes:{mois}', f'nb_factures:{mois}', f'avoirs:{mois}', f'nb_avoirs:{mois}', 'impaye', 'stock_bas']
+    valeurs = dict(db.session.query(Compteur.cle, Compteur.valeur).filter(Compteur.cle.in_(cles)))
+
+    # Meilleurs produits du mois : parcours de l'intervalle de clés produit:AAAA-MM:
+    prefixe = f'produit:{mois}:'
+    meilleurs = db.session.query(Compteur.cle, Compteur.valeur).filter(
+        Compteur.cle >= prefixe,
+        Compteur.cle < prefixe[:-1] + ';',
+        Compteur.valeur > 0
+    ).order_by(Compteur.valeur.desc()).limit(NB_MEILLEURS_PRODUITS).all()
+    ids = [int(cle.rsplit(':', 1)[1]) for cle, _ in meilleurs]
+    noms = dict(db.session.query(Produit.id, Produit.nom).filter(Produit.id.in_(ids))) if ids else {}
+
+    ventes = valeurs.get(f'ventes:{mois}', 0)
+    avoirs = valeurs.get(f'avoirs:{mois}', 0)
+    return {
+        'mois': mois,
+        'ventes_mois': ventes,
+        'nb_factures_mois': int(valeurs.get(f'nb_factures:{mois}', 0)),
+        'avoirs_mois': avoirs,
+        'nb_avoirs_mois': int(valeurs.get(f'nb_avoirs:{mois}', 0)),
+        'net_mois': ventes - avoirs,
+        'impaye': valeurs.get('impaye', 0),
+        'stock_bas': int(valeurs.get('stock_bas', 0)),
+        'meilleurs_produits': [
+            {'id': produit_id, 'nom': noms.get(produit_id, f'#{produit_id}'), 'montant': montant}
+            for produit_id, (_, montant) in zip(ids, meilleurs)
+        ],
+    }
+
+
+# ===== RECALCUL =====
+
+def _ajouter_documents(deltas, F, L):
+    """Contributions des factures F et de leurs lignes L (une base) aux compteurs"""
+    mois = func.strftime('%Y-%m', F.date_creation)
+    for type_document, m, total, nombre in db.session.query(
+            F.type_document, mois, func.sum(F.total), func.count()).group_by(F.type_document, mois):
+        cle_total, cle_nombre = ('avoirs', 'nb_avoirs') if type_document == 'avoir' else ('ventes', 'nb_factures')
+        deltas[f'{cle_total}:{m}'] += total or 0
+        deltas[f'{cle_nombre}:{m}'] += nombre
+
+    deltas['impaye'] += db.session.query(func.sum(F.total - F.montant_paye)).filter(
+        func.coalesce(F.type_document, 'facture') != 'avoir', F.etat == 'En attente').scalar() or 0
+
+    signe = case((F.type_document == 'avoir', -func.abs(L.montant_ttc)), else_=L.montant_ttc)
+    for produit_id, m, total in db.session.query(L.produit_id, mois, func.sum(signe))\
+            .join(F, F.id == L.facture_id).group_by(L.produit_id, mois):
+        deltas[f'produit:{m}:{produit_id}'] += total or 0
+
+
+def recalculer():
+    """Reconstruire tous les compteurs depuis les tables (exercices archivés compris)
+
+    Base vivante puis chaque exercice archivé, attachés par lots.
+    """
+    deltas = defaultdict(int)
+    _ajouter_documents(deltas, Facture, LigneFacture)
+    for lot in archives.par_lots(archives.annees()):
+        for annee in lot:
+            _ajouter_documents(deltas, archives.archivee(Facture, annee), archives.archivee(LigneFacture, annee))
+
+    deltas['stock_bas'] = Produit.query.filter(
+        Produit.article_stockable == 'OUI',
+        func.coalesce(Produit.stock_actuel, 0) <= func.coalesce(Produit.stock_minimum, 0)
+    ).count()
+
+    db.session.query(Compteur).delete()
+    ajouter(db.session, deltas)
+    db.session.commit()
+    return len(deltas)
+
+
+@click.command('recalculer-compteurs')
+@with_appcontext
+def recalculer_commande():
+    """Reconstruire les compteurs du tableau de bord"""
+    click.echo(f'{recalculer()} compteurs recalculés')
+
+
+def init_app(app):
+    app.cli.add_command(recalculer_commande)
@@ -0,0 +1,85 @@
+import os
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+
+
+class Config:
+    """Configuration par défaut, surchargeable par variables d'environnement"""
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'votre-cle-secrete-changez-moi')
+
+    # ===== DATABASE CONFIGURATION =====
+    # SQLALCHEMY_DATABASE_URI est dérivé de DATABASE_PATH dans create_app()
+    DATABASE_PATH = os.environ.get('FACTURIER_DB', os.path.join(basedir, 'database', 'facturier.db'))
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Cache des rapports (voir cache_rapports.py)
+    RAPPORTS_CACHE_TAILLE = int(os.environ.get('RAPPORTS_CACHE_TAILLE', 128))
+    RAPPORTS_CACHE_DOSSIER = os.environ.get('RAPPORTS_CACHE_DOSSIER')
+
+    # Coordinateur des écritures (voir ecritures.py) ; ECRITURES_DIRECTES=1
+    # écrit dans le thread de la requête (tests, scripts)
+    ECRITURES_DIRECTES = os.environ.get('ECRITURES_DIRECTES') == '1'
+    ECRITURES_FILE_TAILLE = int(os.environ.get('ECRITURES_FILE_TAILLE', 256))
+    ECRITURES_LOT_MAX = int(os.environ.get('ECRITURES_LOT_MAX', 32))
+    ECRITURES_ATTENTE_MAX = float(os.environ.get('ECRITURES_ATTENTE_MAX', 0.5))
+
+    # Moteur en lecture seule des rapports (voir lecture.py) ; délais en secondes
+    LECTURE_POOL_TAILLE = int(os.environ.get('LECTURE_POOL_TAILLE', 4))
+    LECTURE_POOL_DEBORDEMENT = int(os.environ.get('LECTURE_POOL_DEBORDEMENT', 4))
+    LECTURE_POOL_ATTENTE = float(os.environ.get('LECTURE_POOL_ATTENTE', 10))
+    LECTURE_DELAI_MAX = float(os.environ.get('LECTURE_DELAI_MAX', 30))
+    LECTURE_DELAI_EXPORT = float(os.environ.get('LECTURE_DELAI_EXPORT', 600))
+
+    # Tâches en arrière-plan (voir taches.py) ; durées en secondes
+    TACHES_TRAVAILLEURS = int(os.environ.get('TACHES_TRAVAILLEURS', 2))
+    TACHES_DUREE_RESULTAT = int(os.environ.get('TACHES_DUREE_RESULTAT', 24 * 3600))
+    TACHES_ABANDON = int(os.environ.get('TACHES_ABANDON', 900))
+    # Résultats des tâches (None : dossier taches/ à côté de la base)
+    TACHES_DOSSIER = os.environ.get('FACTURIER_TACHES')
+
+    # Sauvegarde à chaud (voir sauvegarde.py) ; SAUVEGARDE_INTERVALLE en secondes, 0 : pas de
+    # sauvegarde planifiée ; dossier None : sauvegardes/ à côté de la base
+    SAUVEGARDE_DOSSIER = os.environ.get('FACTURIER_SAUVEGARDES')
+    SAUVEGARDE_INTERVALLE = int(os.environ.get('SAUVEGARDE_INTERVALLE', 0))
+    SAUVEGARDE_PAGES = int(os.environ.get('SAUVEGARDE_PAGES', 256))
+    SAUVEGARDE_PAUSE = float(os.environ.get('SAUVEGARDE_PAUSE', 0.02))
+    SAUVEGARDE_QUALITE = int(os.environ.get('SAUVEGARDE_QUALITE', 5))
+    SAUVEGARDE_CONSERVER = int(os.environ.get('SAUVEGARDE_CONSERVER', 14))
+
+    # Import des relevés (voir releves.py) : écart accepté entre un crédit et un restant dû (FBU)
+    RELEVES_TOLERANCE = int(os.environ.get('RELEVES_TOLERANCE', 100))
+
+    # Journal des requêtes lentes (voir requetes_lentes.py) : seuil en ms (0 : désactivé),
+    # fenêtre de la page d'administration en secondes, fichier None : requetes_lentes.log
+    # à côté de la base, rotation par taille (octets)
+    REQUETES_LENTES_SEUIL_MS = float(os.environ.get('REQUETES_LENTES_SEUIL_MS', 200))
+    REQUETES_LENTES_FENETRE = int(os.environ.get('REQUETES_LENTES_FENETRE', 24 * 3600))
+    REQUETES_LENTES_JOURNAL = os.environ.get('FACTURIER_REQUETES_LENTES')
+    REQUETES_LENTES_JOURNAL_TAILLE = int(os.environ.get('REQUETES_LENTES_JOURNAL_TAILLE', 5 * 1024 * 1024))
+    REQUETES_LENTES_JOURNAL_NOMBRE = int(os.environ.get('REQUETES_LENTES_JOURNAL_NOMBRE', 5))
+
+    # Boutiques (voir boutiques.py) : dossier des bases par boutique (None : une seule
+    # boutique), routage par sous-domaine de BOUTIQUES_DOMAINE et/ou préfixe d'URL,
+    # boutiques ouvertes au plus, fermeture après inactivité (secondes)
+    BOUTIQUES_DOSSIER = os.environ.get('FACTURIER_BOUTIQUES')
+    BOUTIQUES_DOMAINE = os.environ.get('BOUTIQUES_DOMAINE')
+    BOUTIQUES_PREFIXE = os.environ.get('BOUTIQUES_PREFIXE', '/b')
+    BOUTIQUES_MAX = int(os.environ.get('BOUTIQUES_MAX', 16))
+    BOUTIQUES_INACTIVITE = int(os.environ.get('BOUTIQUES_INACTIVITE', 600))
+    BOUTIQUES_POOL_TAILLE = int(os.environ.get('BOUTIQUES_POOL_TAILLE', 2))
+
+    # Flux des changements (voir changements.py) : entrées par page de /api/changes,
+    # entrées compactées par transaction, jours sans acquittement après lesquels un
+    # consommateur ne retient plus le compactage (0 : jamais)
+    CHANGEMENTS_PAGE = int(os.environ.get('CHANGEMENTS_PAGE', 500))
+    CHANGEMENTS_COMPACTAGE_LOT = int(os.environ.get('CHANGEMENTS_COMPACTAGE_LOT', 5000))
+    CHANGEMENTS_ABANDON_JOURS = int(os.environ.get('CHANGEMENTS_ABANDON_JOURS', 30))
+
+    # Caisse hors ligne (voir caisse.py) : ventes envoyées par appel de synchronisation
+    CAISSE_LOT = int(os.environ.get('CAISSE_LOT', 50))
+
+    # Bases des exercices archivés (None : dossier archives/ à côté de la base)
+    ARCHIVES_DOSSIER = os.environ.get('FACTURIER_ARCHIVES')
+
+    # Cache du bytecode des templates Jinja (None : dossier instance/jinja_cache)
+    JINJA_CACHE_DOSSIER = os.environ.get('JINJA_CACHE_DOSSIER')
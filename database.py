@@ -0,0 +1,113 @@
+"""Réglages des connexions SQLite
+
+- WAL : les lectures continuent pendant qu'une écriture est en cours
+- transactions explicites : pysqlite ouvre ses transactions lui-même et casse
+  les SAVEPOINT ; on le désactive et on émet BEGIN nous-mêmes
+  (recette de la documentation SQLAlchemy, dialecte pysqlite)
+- BEGIN IMMEDIATE dans le thread d'écriture : le verrou est pris dès le début
+  de la transaction au lieu d'échouer au premier UPDATE
+- pools mesurés : temps passé à attendre une connexion, par pool
+- session routée : les requêtes marquées « lecture seule » passent par le
+  moteur des rapports (voir lecture.py)
+"""
+import sqlite3
+import threading
+import time
+
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+# Délai d'attente du verrou d'écriture (ms) pour les écritures hors coordinateur
+BUSY_TIMEOUT_MS = 5000
+
+_contexte = threading.local()
+
+
+def transactions_immediates(actif=True):
+    """Faire démarrer les transactions du thread courant par BEGIN IMMEDIATE"""
+    _contexte.immediat = actif
+
+
+@event.listens_for(Engine, 'connect')
+def _configurer_connexion(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    cursor.close()
+
+
+@event.listens_for(Engine, 'begin')
+def _debut_transaction(conn):
+    if conn.dialect.name != 'sqlite':
+        return
+    if getattr(_contexte, 'immediat', False):
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+    else:
+        conn.exec_driver_sql('BEGIN')
+
+
+class PoolMesure(QueuePool):
+    """QueuePool qui mesure l'attente des connexions (obtention comprise)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock_mesures = threading.Lock()
+        self.obtentions = 0
+        self.attente_totale = 0.0
+        self.attente_max = 0.0
+        self.expirations = 0
+
+    def _do_get(self):
+        debut = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self.lock_mesures:
+                self.expirations += 1
+            raise
+        finally:
+            attente = time.perf_counter() - debut
+            with self.lock_mesures:
+                self.obtentions += 1
+                self.attente_totale += attente
+                self.attente_max = max(self.attente_max, attente)
+
+    def stats(self):
+        return {
+            'taille': self.size(),
+            'utilisees': self.checkedout(),
+            'debordement': self.overflow(),
+            'obtentions': self.obtentions,
+            'attente_totale_ms': round(self.attente_totale * 1000, 1),
+            'attente_moyenne_ms': round(self.attente_totale * 1000 / self.obtentions, 3) if self.obtentions else 0,
+            'attente_max_ms': round(self.attente_max * 1000, 1),
+            'expirations': self.expirations,
+        }
+
+
+def stats_pool(engine):
+    pool = engine.pool
+    return pool.stats() if isinstance(pool, PoolMesure) else {'pool': type(pool).__name__}
+
+
+class SessionRoutee(Session):
+    """Session de Flask-SQLAlchemy qui lit sur le moteur des rapports en lecture seule
+
+    Une requête marquée par `lecture.activer()` (g.lecture_seule) envoie
+    toutes ses requêtes, ORM et Core, au moteur en lecture seule.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context() and g.get('lecture_seule'):
+            lecture = current_app.extensions.get('lecture')
+            if lecture is not None and lecture.engine is not None:
+                return lecture.engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
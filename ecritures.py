@@ -0,0 +1,220 @@
+"""Coordinateur des écritures SQLite
+
+SQLite n'accepte qu'un écrivain à la fois : quand plusieurs requêtes
+(factures, ajustements de stock, réceptions) écrivent en même temps, elles se
+battent pour le verrou et finissent en « database is locked ». Ici toutes les
+transactions d'écriture d'un processus passent par un seul thread :
+
+- la file est bornée : si elle est pleine, on refuse tout de suite
+  (FileEcrituresPleine -> 503) au lieu d'attendre un timeout du verrou ;
+- les petites transactions en attente sont regroupées dans un seul COMMIT
+  (un seul fsync), chacune dans son SAVEPOINT pour qu'un échec n'annule
+  que la sienne ;
+- les lectures ne passent pas par ici et restent concurrentes (WAL).
+
+Une fonction d'écriture travaille sur `db.session` sans commit ; elle reçoit
+ses données déjà extraites de la requête et renvoie des valeurs simples
+(identifiants), pas des objets ORM.
+"""
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+from flask import current_app
+
+import journal_stock
+from database import transactions_immediates
+from models import db
+
+
+class FileEcrituresPleine(Exception):
+    """La file d'écriture est saturée : le client doit réessayer plus tard"""
+
+
+class _Travail:
+    __slots__ = ('fonction', 'args', 'kwargs', 'future', 'seul')
+
+    def __init__(self, fonction, args, kwargs, seul):
+        self.fonction = fonction
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.seul = seul
+
+
+class CoordinateurEcritures:
+    """Un thread écrivain par processus, démarré à la première écriture"""
+
+    def __init__(self, app, taille_file=256, lot_max=32, attente_max=0.5):
+        self.app = app
+        self.file = queue.Queue(maxsize=taille_file)
+        self.lot_max = lot_max
+        self.attente_max = attente_max
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self._reporte = None
+        self._arret = False
+        # Métriques
+        self.transactions = 0
+        self.commits = 0
+        self.echecs = 0
+        self.refus = 0
+
+    def _demarrer(self):
+        # Après un fork (workers gunicorn) le thread du parent n'existe plus
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._boucle, name='ecrivain-sqlite', daemon=True)
+            self.thread.start()
+
+    def soumettre(self, fonction, *args, seul=False, **kwargs):
+        """Mettre une écriture en file ; `seul=True` interdit le regroupement"""
+        self._demarrer()
+        travail = _Travail(fonction, args, kwargs, seul)
+        try:
+            self.file.put(travail, timeout=self.attente_max)
+        except queue.Full:
+            self.refus += 1
+            raise FileEcrituresPleine('Trop d\'écritures en attente, veuillez réessayer')
+        return travail.future
+
+    def executer(self, fonction, *args, seul=False, **kwargs):
+        """Écrire et attendre le résultat (exceptions propagées à l'appelant)"""
+        return self.soumettre(fonction, *args, seul=seul, **kwargs).result()
+
+    def arreter(self):
+        """Terminer le thread écrivain après les écritures déjà en file (boutique fermée)"""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None and thread.is_alive():
+            self.file.put(None)
+            thread.join()
+        self._arret = False
+
+    def _prochain_lot(self):
+        premier = self.file.get()
+        if premier is None:
+            return None
+        lot = [premier]
+        if premier.seul:
+            return lot
+        while len(lot) < self.lot_max:
+            try:
+                suivant = self.file.get_nowait()
+            except queue.Empty:
+                break
+            if suivant is None:
+                # Arrêt demandé : finir ce lot
+                self._arret = True
+                break
+            if suivant.seul:
+                # Ne pas le mélanger au lot : il passera seul juste après
+                self._reporte = suivant
+                break
+            lot.append(suivant)
+        return lot
+
+    def _boucle(self):
+        transactions_immediates(True)
+        with self.app.app_context():
+            while True:
+                if self._reporte is not None:
+                    lot, self._reporte = [self._reporte], None
+                elif self._arret:
+                    return
+                else:
+                    lot = self._prochain_lot()
+                    if lot is None:
+                        return
+                self._executer_lot(lot)
+
+    def _executer_lot(self, lot):
+        reussis = []
+        try:
+            for travail in lot:
+                if not travail.future.set_running_or_notify_cancel():
+                    continue
+                savepoint = db.session.begin_nested()
+                try:
+                    resultat = travail.fonction(*travail.args, **travail.kwargs)
+                    journal_stock.vider(db.session)
+                    db.session.flush()
+                    savepoint.commit()
+                    reussis.append((travail, resultat))
+                except Exception as e:
+                    journal_stock.abandonner(db.session)
+                    savepoint.rollback()
+                    self.echecs += 1
+                    travail.future.set_exception(e)
+            db.session.commit()
+            self.commits += 1
+        except Exception as e:
+            db.session.rollback()
+            for travail, _ in reussis:
+                travail.future.set_exception(e)
+            self.echecs += len(reussis)
+            reussis = []
+        finally:
+            db.session.remove()
+
+        self.transactions += len(reussis)
+        for travail, resultat in reussis:
+            travail.future.set_result(resultat)
+
+    def stats(self):
+        return {
+            'en_attente': self.file.qsize(),
+            'taille_file': self.file.maxsize,
+            'transactions': self.transactions,
+            'commits': self.commits,
+            'transactions_par_commit': round(self.transactions / self.commits, 2) if self.commits else 0,
+            'echecs': self.echecs,
+            'refus': self.refus,
+        }
+
+
+class EcrituresDirectes:
+    """Même interface, exécution dans le thread appelant (tests, commandes CLI)"""
+
+    def __init__(self):
+        self.transactions = 0
+
+    def executer(self, fonction, *args, seul=False, **kwargs):
+        try:
+            resultat = fonction(*args, **kwargs)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        self.transactions += 1
+        return resultat
+
+    def stats(self):
+        return {'mode': 'direct', 'transactions': self.transactions}
+
+    def arreter(self):
+        pass
+
+
+def init_app(app):
+    if app.config.get('ECRITURES_DIRECTES'):
+        coordinateur = EcrituresDirectes()
+    else:
+        coordinateur = CoordinateurEcritures(app,
+                                             taille_file=app.config['ECRITURES_FILE_TAILLE'],
+                                             lot_max=app.config['ECRITURES_LOT_MAX'],
+                                             attente_max=app.config['ECRITURES_ATTENTE_MAX'])
+    app.extensions['ecritures'] = coordinateur
+
+    @app.errorhandler(FileEcrituresPleine)
+    def _file_pleine(e):
+        return str(e), 503, {'Retry-After': '1'}
+
+
+def ecrire(fonction, *args, seul=False, **kwargs):
+    """Exécuter une fonction d'écriture via le coordinateur de l'application"""
+    return current_app.extensions['ecritures'].executer(fonction, *args, seul=seul, **kwargs)
@@ -0,0 +1,829 @@
+from datetime import datetime
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, abort
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from models import db, Client, Produit, Facture, LigneFacture, CleIdempotence, Paiement
+from horodatages import get_conditionnel, marquer
+from ecritures import ecrire
+from produit import serialize_produits
+import archives
+import avoirs
+import cache_rapports
+import changements
+import compteurs
+import paiements
+from montants import MONTANT_MAX, arrondir, montants_ligne, nombre
+from recherche import limite_demandee, rechercher_factures
+
+bp = Blueprint('factures', __name__)
+
+@bp.route('/factures')
+def factures_list():
+    # Récupérer les paramètres de filtre depuis l'URL
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 10, type=int)
+    
+    search = request.args.get('search', '').strip()
+    type_doc = request.args.get('type', '')
+    etat = request.args.get('etat', '')
+    paiement = request.args.get('paiement', '')
+    date_debut = request.args.get('date_debut', '')
+    date_fin = request.args.get('date_fin', '')
+    
+    date_debut_obj = None
+    if date_debut:
+        try:
+            date_debut_obj = datetime.strptime(date_debut, '%Y-%m-%d')
+        except ValueError:
+            pass
+    
+    date_fin_obj = None
+    if date_fin:
+        try:
+            date_fin_obj = datetime.strptime(date_fin + ' 23:59:59', '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            pass
+    
+    # Construire la requête de base : les exercices archivés ne sont lus que
+    # si la période les recoupe (ou pour une recherche)
+    if search or date_debut_obj or date_fin_obj:
+        annees = archives.annees(date_debut_obj, date_fin_obj)
+        if not date_debut_obj and len(annees) > archives.LIMITE_ATTACHEES:
+            # Recherche sans date de début : les exercices archivés les plus récents
+            annees = annees[-archives.LIMITE_ATTACHEES:]
+            flash(f'Recherche limitée aux exercices archivés depuis {annees[0]} : '
+                  f'indiquez une date de début pour remonter plus loin', 'warning')
+        F = archives.source(Facture, annees)
+    else:
+        F = Facture
+    query = db.session.query(F)
+    
+    # Appliquer les filtres
+    if search:
+        query = query.join(Client, F.client_id == Client.id).filter(
+            db.or_(
+                F.numero.ilike(f'%{search}%'),
+                Client.nom.ilike(f'%{search}%'),
+                Client.prenom.ilike(f'%{search}%')
+            )
+        )
+    
+    if type_doc:
+        query = query.filter(F.type_document == type_doc)
+    
+    if etat:
+        query = query.filter(F.etat == etat)
+    
+    if paiement:
+        query = query.filter(F.paiement == paiement)
+    
+    if date_debut_obj:
+        query = query.filter(F.date_creation >= date_debut_obj)
+    
+    if date_fin_obj:
+        query = query.filter(F.date_creation <= date_fin_obj)
+    
+    # Pagination
+    pagination = query.order_by(F.date_creation.desc()).paginate(
+        page=page, per_page=per_page, error_out=False
+    )
+    factures = pagination.items
+    
+    # Calculer les statistiques : montants entiers, sommés en SQL
+    impaye = db.and_(Facture.etat == 'En attente', Facture.type_document == 'facture')
+    sommes = {type_document: (total or 0, nombre, total_impaye or 0, nb_impaye or 0)
+              for type_document, total, nombre, total_impaye, nb_impaye in db.session.query(
+                  Facture.type_document,
+                  func.sum(Facture.total),
+                  func.count(),
+                  func.sum(db.case((impaye, Facture.total - Facture.montant_paye))),
+                  func.sum(db.case((impaye, 1))),
+              ).filter(Facture.type_document.in_(('facture', 'avoir'))).group_by(Facture.type_document)}
+    total_facture, nb_factures, total_impaye, nb_impaye = sommes.get('facture', (0, 0, 0, 0))
+    total_avoir, nb_avoirs, _, _ = sommes.get('avoir', (0, 0, 0, 0))
+    stats = {
+        'total_facture': total_facture,
+        'total_avoir': total_avoir,
+        'total_net': total_facture - total_avoir,
+        'total_impaye': total_impaye,
+        'nb_factures': nb_factures,
+        'nb_avoirs': nb_avoirs,
+        'nb_impaye': nb_impaye
+    }
+    
+    return render_template(
+        'factures_list.html',
+        factures=factures,
+        pagination=pagination,
+        stats=stats,
+        search_term=search,
+        selected_type=type_doc,
+        selected_etat=etat,
+        selected_paiement=paiement,
+        date_debut=date_debut,
+        date_fin=date_fin,
+        per_page=per_page,
+        modes_paiement=paiements.MODES,
+        aujourd_hui=datetime.now()
+    )
+
+
+@bp.route('/facture/<int:id>')
+@get_conditionnel('facture')
+def facture_detail(id):
+    facture = archives.charger_facture(id)
+    if facture is None:
+        abort(404)
+    # Une facture d'un exercice archivé ne reçoit plus de paiement
+    archivee = db.session.get(Facture, id) is None
+    return render_template('facture.html', facture=facture, archivee=archivee,
+                           modes_paiement=paiements.MODES, aujourd_hui=datetime.now())
+
+
+def creer_facture(type_document, entete, lignes):
+    """Créer une facture ou un avoir (exécuté par le thread d'écriture)"""
+    # Générer le numéro
+    last_facture = Facture.query.order_by(Facture.id.desc()).first()
+    prefix = 'A' if type_document == 'avoir' else 'F'
+    if last_facture:
+        new_num = f'{prefix}{last_facture.id + 1:04d}'
+    else:
+        new_num = f'{prefix}0001'
+
+    if type_document == 'avoir':
+        # Rattacher chaque ligne à la facture d'origine, sans dépasser le reste créditable
+        avoirs.affecter(entete.get('facture_originale_id'), lignes)
+
+    facture = Facture(numero=new_num, type_document=type_document, **entete)
+    db.session.add(facture)
+    db.session.flush()
+
+    total = 0
+    for donnees in lignes:
+        ligne = LigneFacture(facture_id=facture.id, **donnees)
+        db.session.add(ligne)
+        total += ligne.total_ttc
+
+    facture.total = total
+    if type_document == 'avoir' and facture.etat != avoirs.ANNULEE:
+        avoirs.crediter(avoirs.credits(lignes))
+    if type_document == 'facture' and facture.etat == paiements.PAYEE:
+        # Réglée à la création : paiement du total
+        paiements.solder(facture)
+    return facture.id
+
+def ligne_originale(valeurs, i):
+    """Ligne d'origine désignée par la i-ème ligne d'un formulaire d'avoir (None si aucune)"""
+    try:
+        return int(valeurs[i]) if i < len(valeurs) and valeurs[i] else None
+    except ValueError:
+        return None
+
+@bp.route('/facture/new')
+@bp.route('/facture/new/<string:type>', methods=['GET', 'POST'])
+def facture_new(type='facture'):
+    # Récupérer l'ID de la facture d'origine si présent dans l'URL
+    facture_originale_id = request.args.get('originale', type=int)
+    facture_originale = None
+    
+    if facture_originale_id:
+        facture_originale = Facture.query.get_or_404(facture_originale_id)
+        # Vérifier que c'est bien une facture (pas un avoir)
+        if facture_originale.type_document != 'facture':
+            flash('La facture d\'origine doit être une facture, pas un avoir', 'error')
+            return redirect(url_for('factures.factures_list'))
+    
+    if request.method == 'POST':
+        # Récupérer les données du formulaire
+        paiement = request.form.get('paiement')
+        entete = {
+            'client_id': request.form.get('client_id'),
+            'paiement': paiement,
+            'etat': request.form.get('etat', 'En attente'),
+            'notes': request.form.get('notes', ''),
+            # Pour les avoirs, récupérer la facture d'origine
+            'facture_originale_id': request.form.get('facture_originale_id', type=int),
+            # Pour les paiements en espèces, récupérer la devise
+            'devise': request.form.get('devise') if paiement == 'espèces' else None,
+        }
+
+        # Traiter les lignes de produits
+        produits_ids = request.form.getlist('produit_id[]')
+        quantites = request.form.getlist('quantite[]')
+        prix_unitaires = request.form.getlist('prix_unitaire[]')
+        tva_values = request.form.getlist('tva[]')
+        lignes_originales = request.form.getlist('ligne_originale_id[]')
+
+        lignes = []
+        for i in range(len(produits_ids)):
+            if produits_ids[i] and quantites[i] and prix_unitaires[i]:
+                lignes.append({
+                    'produit_id': int(produits_ids[i]),
+                    'quantite': float(quantites[i]),
+                    'prix_unitaire': float(prix_unitaires[i]),
+                    'tva': float(tva_values[i]) if tva_values and i < len(tva_values) else 0
+                })
+                if type == 'avoir':
+                    lignes[-1]['ligne_originale_id'] = ligne_originale(lignes_originales, i)
+
+        try:
+            facture_id = ecrire(creer_facture, type, entete, lignes)
+        except ValueError as e:
+            # Quantité au-delà du reste créditable de la facture d'origine
+            flash(str(e), 'error')
+            return redirect(request.url)
+
+        flash(f'{ "Avoir" if type == "avoir" else "Facture" } créé(e) avec succès', 'success')
+        return redirect(url_for('factures.facture_detail', id=facture_id))
+
+    # GET request - afficher le formulaire (clients et factures d'origine
+    # sont cherchés à la frappe : /api/clients/recherche, /api/factures/recherche)
+    produits_disponibles = []
+    
+    lignes_creditables = None
+    if type == 'avoir' and facture_originale:
+        # Facture d'origine imposée : uniquement les produits de cette facture,
+        # lignes pré-remplies avec leur reste créditable
+        produits_disponibles = [ligne.produit for ligne in facture_originale.lignes]
+        # Supprimer les doublons (si un produit apparaît plusieurs fois)
+        produits_disponibles = list({p.id: p for p in produits_disponibles}.values())
+        _, lignes_creditables = avoirs.creditable(facture_originale.id)
+    else:
+        produits_disponibles = Produit.query.all()
+    
+    produits_serialized = serialize_produits(produits_disponibles)
+    
+    return render_template('facture_form.html', 
+                         produits=produits_disponibles,
+                         produits_serialized=produits_serialized,
+                         facture_originale=facture_originale,
+                         lignes_creditables=lignes_creditables,
+                         type_document=type,
+                         facture=None)
+
+def modifier_facture(facture_id, entete, lignes):
+    """Remplacer l'en-tête et les lignes d'un document (exécuté par le thread d'écriture)"""
+    facture = db.session.get(Facture, facture_id)
+    # Crédits portés par l'avoir avant modification (libérés puis recalculés)
+    credite = facture.type_document == 'avoir' and facture.etat != avoirs.ANNULEE
+    for nom, valeur in entete.items():
+        setattr(facture, nom, valeur)
+
+    # Supprimer les anciennes lignes (la suppression en masse ne passe pas par
+    # l'ORM : marquer les produits retirés pour leurs pages de détail et
+    # les retirer des compteurs du tableau de bord)
+    anciennes_lignes = db.session.query(LigneFacture.produit_id, LigneFacture.quantite,
+                                        LigneFacture.prix_unitaire, LigneFacture.tva, LigneFacture.id,
+                                        LigneFacture.ligne_originale_id, LigneFacture.quantite_creditee)\
+                                 .filter_by(facture_id=facture.id).all()
+    marquer(db.session, [('produit', ligne.produit_id) for ligne in anciennes_lignes])
+    compteurs.lignes_supprimees(db.session, facture, [ligne[:4] for ligne in anciennes_lignes])
+    if credite:
+        avoirs.crediter(avoirs.credits(ligne._asdict() for ligne in anciennes_lignes), -1)
+    LigneFacture.query.filter_by(facture_id=facture.id).delete()
+
+    # Ajouter les nouvelles lignes (ValueError au-delà du reste créditable)
+    if facture.type_document == 'avoir':
+        avoirs.affecter(facture.facture_originale_id, lignes)
+    nouvelles = [LigneFacture(facture_id=facture.id, **donnees) for donnees in lignes]
+    db.session.add_all(nouvelles)
+    if facture.type_document == 'avoir':
+        if facture.etat != avoirs.ANNULEE:
+            avoirs.crediter(avoirs.credits(lignes))
+    else:
+        # Lignes recréées : les avoirs déjà émis suivent la ligne du même produit
+        db.session.flush()
+        avoirs.reporter(anciennes_lignes, nouvelles)
+
+    facture.total = sum(ligne.total_ttc for ligne in nouvelles)
+    if facture.type_document == 'facture':
+        # « Payée » choisie dans le formulaire : paiement du restant dû ; l'état suit le réglé
+        if facture.etat == paiements.PAYEE:
+            paiements.solder(facture)
+        facture.etat = paiements.etat_derive(facture.etat, facture.total, facture.montant_paye)
+    return facture.id
+
+@bp.route('/facture/<int:id>/edit', methods=['GET', 'POST'])
+def facture_edit(id):
+    facture = Facture.query.get_or_404(id)
+    
+    if request.method == 'POST':
+        paiement = request.form.get('paiement')
+        entete = {
+            'client_id': request.form.get('client_id'),
+            'paiement': paiement,
+            'etat': request.form.get('etat', 'En attente'),
+            'notes': request.form.get('notes', ''),
+            # Mettre à jour la devise si nécessaire
+            'devise': request.form.get('devise') if paiement == 'espèces' else None,
+        }
+        # Pour les avoirs, mettre à jour la facture d'origine
+        if facture.type_document == 'avoir':
+            entete['facture_originale_id'] = request.form.get('facture_originale_id') or None
+
+        # Nouvelles lignes
+        produits_ids = request.form.getlist('produit_id[]')
+        quantites = request.form.getlist('quantite[]')
+        prix_unitaires = request.form.getlist('prix_unitaire[]')
+        tva_values = request.form.getlist('tva[]')
+        lignes_originales = request.form.getlist('ligne_originale_id[]')
+
+        lignes = []
+        for i in range(len(produits_ids)):
+            if produits_ids[i] and quantites[i] and prix_unitaires[i]:
+                # Pour les avoirs, garder les quantités négatives si elles existent
+                lignes.append({
+                    'produit_id': int(produits_ids[i]),
+                    'quantite': float(quantites[i]),
+                    'prix_unitaire': float(prix_unitaires[i]),
+                    'tva': float(tva_values[i]) if tva_values and i < len(tva_values) else 0
+                })
+                if facture.type_document == 'avoir':
+                    lignes[-1]['ligne_originale_id'] = ligne_originale(lignes_originales, i)
+
+        try:
+            ecrire(modifier_facture, facture.id, entete, lignes)
+        except ValueError as e:
+            # Quantité au-delà du reste créditable de la facture d'origine
+            flash(str(e), 'error')
+            return redirect(url_for('factures.facture_edit', id=id))
+        
+        flash('Document modifié avec succès', 'success')
+        return redirect(url_for('factures.facture_detail', id=facture.id))
+
+    # GET request - afficher le formulaire avec les données existantes
+    produits = Produit.query.all()
+    produits_serialized = serialize_produits(produits)
+
+    # Récupérer les produits bruts POUR LES TEMPLATES
+    produits_bruts = Produit.query.all()
+    
+    # Sérialiser les produits POUR LE JAVASCRIPT
+    produits_serialized = serialize_produits(produits_bruts)
+    
+    # Pour les avoirs, la facture d'origine actuelle (les autres sont cherchées à la frappe)
+    originale_choisie = None
+    if facture.type_document == 'avoir' and facture.facture_originale_id:
+        originale_choisie = db.session.get(Facture, facture.facture_originale_id)
+    
+    return render_template('facture_form.html', 
+                         facture=facture,
+                         produits=produits_bruts,  # ← Pour les boucles Jinja
+                         produits_serialized =produits_serialized,
+                         originale_choisie=originale_choisie,
+                         type_document=facture.type_document)
+
+@bp.route('/facture/<int:id>/convertir_en_avoir', methods=['POST'])
+def convertir_en_avoir(id):
+    """Convertir une facture en avoir"""
+    facture_originale = Facture.query.get_or_404(id)
+    
+    # Vérifier que c'est bien une facture
+    if facture_originale.type_document != 'facture':
+        flash('Seules les factures peuvent être converties en avoirs', 'error')
+        return redirect(url_for('factures.facture_detail', id=id))
+
+    avoir_id = ecrire(creer_avoir_complet, facture_originale.id)
+    if avoir_id is None:
+        flash('Cette facture est déjà entièrement créditée par ses avoirs', 'error')
+        return redirect(url_for('factures.facture_detail', id=id))
+    flash('Avoir créé avec succès', 'success')
+    return redirect(url_for('factures.facture_edit', id=avoir_id))
+
+def creer_avoir_complet(facture_id):
+    """Avoir du reste créditable d'une facture, None s'il n'y en a plus (thread d'écriture)"""
+    facture_originale = db.session.get(Facture, facture_id)
+
+    # Seul le reste créditable de chaque ligne passe dans l'avoir
+    restantes = [(ligne, ligne.quantite - ligne.quantite_creditee) for ligne in facture_originale.lignes]
+    restantes = [(ligne, quantite) for ligne, quantite in restantes if quantite > avoirs.TOLERANCE]
+    if not restantes:
+        return None
+    
+    # Générer un numéro pour l'avoir
+    last_facture = Facture.query.order_by(Facture.id.desc()).first()
+    new_num = f'A{last_facture.id + 1:04d}' if last_facture else 'A0001'
+    
+    # Créer l'avoir
+    avoir = Facture(
+        numero=new_num,
+        client_id=facture_originale.client_id,
+        type_document='avoir',
+        facture_originale_id=facture_originale.id,
+        notes=f"Avoir pour facture {facture_originale.numero}",
+        etat='En attente'
+    )
+    
+    db.session.add(avoir)
+    db.session.flush()
+    
+    # Copier les lignes avec des quantités négatives
+    for ligne, quantite in restantes:
+        ligne_avoir = LigneFacture(
+            facture_id=avoir.id,
+            produit_id=ligne.produit_id,
+            ligne_originale_id=ligne.id,
+            quantite=-quantite,  # Négatif pour l'avoir
+            prix_unitaire=ligne.prix_unitaire,
+            tva=ligne.tva
+        )
+        db.session.add(ligne_avoir)
+    
+    # Calculer le total
+    avoir.total = sum(l.total_ttc for l in avoir.lignes)
+    avoirs.crediter(avoirs.credits(avoir.lignes))
+    return avoir.id
+
+def lire_reglement(formulaire):
+    """(mode, date, référence) d'un formulaire de paiement ; ValueError si invalide"""
+    mode = formulaire.get('mode') or None
+    if mode is not None and mode not in paiements.MODES:
+        raise ValueError(f'Mode de paiement inconnu : {mode}')
+    date_paiement = formulaire.get('date_paiement')
+    try:
+        date_paiement = datetime.strptime(date_paiement, '%Y-%m-%d') if date_paiement else None
+    except ValueError:
+        raise ValueError('Date de paiement invalide')
+    return mode, date_paiement, (formulaire.get('reference') or '').strip() or None
+
+@bp.route('/factures/paiements', methods=['POST'])
+def factures_paiements():
+    """Régler les factures cochées de la liste (restant dû), ou une facture d'un montant donné"""
+    retour = request.form.get('retour') or url_for('factures.factures_list')
+    try:
+        mode, date_paiement, reference = lire_reglement(request.form)
+        factures_ids = [int(i) for i in request.form.getlist('facture_id')]
+        montant = request.form.get('montant')
+        if montant:
+            montant = arrondir(nombre(montant), 0)
+            if montant <= 0 or len(factures_ids) != 1:
+                raise ValueError('Le montant doit être positif et porter sur une seule facture')
+        else:
+            montant = None
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(retour)
+    if not factures_ids:
+        flash('Aucune facture sélectionnée', 'error')
+        return redirect(retour)
+
+    try:
+        regles, dates = ecrire(paiements.regler_factures, [(i, montant) for i in factures_ids],
+                               mode, date_paiement, reference)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(retour)
+    # UPDATE hors ORM : invalider explicitement les rapports des périodes touchées
+    current_app.extensions['cache_rapports'].invalider_dates(dates)
+
+    if regles:
+        flash(f'{len(regles)} facture(s) réglée(s) pour {sum(regles.values()):,.0f} FBU'.replace(',', ' '), 'success')
+    else:
+        flash('Aucune facture à régler (déjà soldées, annulées ou avoirs)', 'warning')
+    return redirect(retour)
+
+@bp.route('/facture/<int:id>/payer', methods=['POST'])
+def facture_payer(id):
+    """Solder une facture (bouton « Marquer comme payée » de la liste)"""
+    regles, dates = ecrire(paiements.regler_factures, [(id, None)], None)
+    if not regles:
+        return jsonify({'success': False, 'message': 'Facture introuvable, annulée ou déjà soldée'}), 400
+    current_app.extensions['cache_rapports'].invalider_dates(dates)
+    return jsonify({'success': True, 'montant': regles[id]})
+
+@bp.route('/api/factures/recherche')
+def api_recherche_factures():
+    """Factures dont le numéro ou le nom du client commence par ?q= (saisie semi-automatique)
+
+    ?type=facture ne garde que ce type de document, ?exclure=<id> écarte un document.
+    """
+    texte = request.args.get('q', '').strip()
+    if not texte:
+        return jsonify({'success': True, 'factures': []})
+    factures = rechercher_factures(texte,
+                                   limite_demandee(request.args.get('limite', type=int)),
+                                   type_document=request.args.get('type') or None,
+                                   exclure=request.args.get('exclure', type=int))
+    return jsonify({'success': True, 'factures': factures})
+
+@bp.route('/api/factures/<int:id>/creditable')
+def api_facture_creditable(id):
+    """Reste créditable de chaque ligne d'une facture (formulaire d'avoir), en une requête"""
+    resultat = avoirs.creditable(id)
+    if resultat is None:
+        return jsonify({'success': False, 'message': 'Facture introuvable'}), 404
+    facture, lignes = resultat
+    if facture['type_document'] != 'facture':
+        return jsonify({'success': False, 'message': 'Seules les factures peuvent être créditées'}), 400
+    return jsonify({'success': True, 'facture': facture, 'lignes': lignes})
+
+# Nombre maximum de documents acceptés par appel de l'API batch
+BATCH_FACTURES_MAX = 1000
+# Longueur de la colonne cles_idempotence.cle
+CLE_IDEMPOTENCE_MAX = 100
+
+@bp.route('/api/factures/batch', methods=['POST'])
+def api_factures_batch():
+    """Créer plusieurs factures/avoirs en une seule requête (caisses, e-commerce)
+
+    Tout le lot est validé avant la moindre écriture : si une facture est
+    invalide, rien n'est créé. Une facture portant une `cle_idempotence`
+    déjà connue n'est pas recréée, on renvoie le document existant.
+    """
+    data = request.get_json(silent=True)
+    documents = data.get('factures') if isinstance(data, dict) else None
+
+    if not isinstance(documents, list) or not documents:
+        return jsonify({'success': False, 'message': 'La liste "factures" est requise'}), 400
+    if len(documents) > BATCH_FACTURES_MAX:
+        return jsonify({'success': False,
+                        'message': f'Maximum {BATCH_FACTURES_MAX} factures par lot'}), 400
+
+    a_creer, erreurs, existantes, cles_du_lot = valider_lot(documents)
+    if erreurs:
+        return jsonify({'success': False, 'message': 'Lot refusé, aucune facture créée',
+                        'erreurs': erreurs}), 400
+
+    try:
+        resultats = creer_lot(a_creer)
+    except IntegrityError:
+        # Un autre processus a pris les mêmes numéros entre-temps : le client peut réessayer
+        return jsonify({'success': False,
+                        'message': 'Conflit de numérotation, veuillez renvoyer le lot'}), 409
+    except LotRefuse as e:
+        # Avoirs au-delà du reste créditable de leur facture d'origine
+        return jsonify({'success': False, 'message': 'Lot refusé, aucune facture créée',
+                        'erreurs': e.erreurs}), 400
+    completer_doublons(documents, resultats, existantes, cles_du_lot)
+
+    return jsonify({
+        'success': True,
+        'factures': [dict(index=i, **resultats[i]) for i in range(len(documents))]
+    }), 201
+
+def _identifiant(valeur):
+    """Identifiant entier d'un document JSON (None si absent) ; ValueError sinon"""
+    if valeur is None:
+        return None
+    if isinstance(valeur, bool) or not isinstance(valeur, int):
+        raise ValueError(f'identifiant invalide : {valeur!r}')
+    return valeur
+
+def _cle(doc):
+    """Clé d'idempotence d'un document, si elle est bien formée"""
+    cle = doc.get('cle_idempotence') if isinstance(doc, dict) else None
+    return cle if isinstance(cle, str) and 0 < len(cle) <= CLE_IDEMPOTENCE_MAX else None
+
+def verifier_document(doc):
+    """Contrôles de forme d'un document de l'API batch ; message d'erreur ou None
+
+    Seuls les documents bien formés sont ensuite cherchés en base et insérés :
+    une valeur mal typée est une erreur du document, pas une erreur serveur.
+    """
+    if not isinstance(doc, dict):
+        return 'Document invalide'
+    cle = doc.get('cle_idempotence')
+    if cle is not None and (not isinstance(cle, str) or len(cle) > CLE_IDEMPOTENCE_MAX):
+        return f'Clé d\'idempotence invalide (texte de {CLE_IDEMPOTENCE_MAX} caractères au plus)'
+    type_document = doc.get('type_document', 'facture')
+    if type_document not in ('facture', 'avoir'):
+        return f'Type de document inconnu: {type_document}'
+    for champ in ('client_id', 'facture_originale_id'):
+        try:
+            _identifiant(doc.get(champ))
+        except ValueError as e:
+            return f'{champ} : {e}'
+    etat = doc.get('etat', 'En attente')
+    if etat not in paiements.ETATS:
+        return f'État inconnu: {etat}'
+    paiement = doc.get('paiement')
+    if paiement is not None and paiement not in paiements.MODES:
+        return f'Mode de paiement inconnu: {paiement}'
+    devise = doc.get('devise')
+    if devise is not None and (not isinstance(devise, str) or len(devise) > 10):
+        return f'Devise invalide: {devise}'
+    notes = doc.get('notes')
+    if notes is not None and not isinstance(notes, str):
+        return 'Notes invalides'
+    if not isinstance(doc.get('lignes'), list):
+        return 'La liste "lignes" est requise'
+    return None
+
+def valider_lot(documents):
+    """Valider un lot de documents de l'API batch, sans rien écrire
+
+    Renvoie (a_creer, erreurs, existantes, cles_du_lot) : documents valides
+    avec leurs lignes préparées, erreurs par index, clés d'idempotence déjà
+    enregistrées et première occurrence de chaque clé du lot. Les documents
+    dont la clé est connue ou répétée ne sont ni validés ni recréés.
+    """
+    # Idempotence : retrouver en une requête les clés déjà enregistrées
+    cles = [cle for cle in map(_cle, documents) if cle]
+    existantes = {}
+    if cles:
+        rows = db.session.query(CleIdempotence.cle, Facture.id, Facture.numero)\
+                         .join(Facture, Facture.id == CleIdempotence.facture_id)\
+                         .filter(CleIdempotence.cle.in_(cles)).all()
+        existantes = {cle: (fid, numero) for cle, fid, numero in rows}
+
+    erreurs = []
+    valides = {}  # index -> document bien formé, pas encore reçu
+    for index, doc in enumerate(documents):
+        if _cle(doc) in existantes:
+            continue
+        message = verifier_document(doc)
+        if message:
+            erreurs.append({'index': index, 'message': message})
+        else:
+            valides[index] = doc
+
+    # Collecter les références pour une validation ensembliste
+    produits_ids, clients_ids, originales_ids = set(), set(), set()
+    for doc in valides.values():
+        if doc.get('client_id'):
+            clients_ids.add(doc['client_id'])
+        if doc.get('facture_originale_id'):
+            originales_ids.add(doc['facture_originale_id'])
+        for ligne in doc['lignes']:
+            if isinstance(ligne, dict) and isinstance(ligne.get('produit_id'), int):
+                produits_ids.add(ligne['produit_id'])
+
+    produits = {}
+    if produits_ids:
+        produits = {p.id: p for p in db.session.query(Produit.id, Produit.pv_ttc, Produit.tva)
+                                                .filter(Produit.id.in_(produits_ids))}
+    clients_connus = set()
+    if clients_ids:
+        clients_connus = {cid for (cid,) in db.session.query(Client.id).filter(Client.id.in_(clients_ids))}
+    originales_connues = set()
+    if originales_ids:
+        originales_connues = {fid for (fid,) in db.session.query(Facture.id).filter(
+            Facture.id.in_(originales_ids), Facture.type_document == 'facture')}
+
+    # Valider chaque document et préparer les lignes
+    a_creer = []  # (index, document, lignes préparées)
+    cles_du_lot = {}
+    for index, doc in valides.items():
+        cle = _cle(doc)
+        if cle in cles_du_lot:
+            continue
+
+        type_document = doc.get('type_document', 'facture')
+        if doc.get('client_id') and doc['client_id'] not in clients_connus:
+            erreurs.append({'index': index, 'message': f'Client {doc["client_id"]} introuvable'})
+            continue
+        if doc.get('facture_originale_id') and doc['facture_originale_id'] not in originales_connues:
+            erreurs.append({'index': index,
+                            'message': f'Facture d\'origine {doc["facture_originale_id"]} introuvable'})
+            continue
+
+        lignes = []
+        try:
+            for ligne in doc['lignes']:
+                produit = produits.get(_identifiant(ligne.get('produit_id')))
+                if produit is None:
+                    raise ValueError(f'Produit {ligne.get("produit_id")} introuvable')
+                prix_unitaire = ligne.get('prix_unitaire')
+                tva = ligne.get('tva')
+                preparee = {
+                    'produit_id': produit.id,
+                    'quantite': nombre(ligne['quantite']),
+                    'prix_unitaire': nombre(produit.pv_ttc if prix_unitaire is None else prix_unitaire),
+                    'tva': nombre(produit.tva if tva is None else tva),
+                    'ligne_originale_id': (_identifiant(ligne['ligne_originale_id'])
+                                           if type_document == 'avoir' and ligne.get('ligne_originale_id')
+                                           else None),
+                }
+                # Chaque facteur est borné, pas leur produit : contrôler le montant de la ligne
+                if abs(montants_ligne(preparee['quantite'], preparee['prix_unitaire'],
+                                      preparee['tva'])[2]) > MONTANT_MAX:
+                    raise ValueError('montant de ligne trop élevé')
+                lignes.append(preparee)
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            erreurs.append({'index': index, 'message': f'Ligne invalide: {e}'})
+            continue
+
+        if not lignes:
+            erreurs.append({'index': index, 'message': 'Au moins une ligne est requise'})
+            continue
+
+        if cle:
+            cles_du_lot[cle] = index
+        a_creer.append((index, doc, lignes))
+
+    erreurs.sort(key=lambda e: e['index'])
+    return a_creer, erreurs, existantes, cles_du_lot
+
+def creer_lot(a_creer):
+    """Insérer les documents validés par `valider_lot` ; {index: {id, numero, doublon}}
+
+    Lève IntegrityError (numéros pris entre-temps) ou LotRefuse (avoirs).
+    """
+    if not a_creer:
+        return {}
+    resultats, maintenant = ecrire(inserer_lot_factures, a_creer)
+    # Les insertions en bloc ne passent pas par l'ORM : invalider explicitement
+    current_app.extensions['cache_rapports'].invalider_dates([maintenant])
+    return resultats
+
+def completer_doublons(documents, resultats, existantes, cles_du_lot):
+    """Ajouter aux résultats les doublons (clé déjà connue ou répétée dans le lot)"""
+    for index, doc in enumerate(documents):
+        cle = _cle(doc)
+        if index in resultats or cle is None:
+            continue
+        if cle in existantes:
+            fid, numero = existantes[cle]
+        elif cle in cles_du_lot and cles_du_lot[cle] in resultats:
+            fid, numero = resultats[cles_du_lot[cle]]['id'], resultats[cles_du_lot[cle]]['numero']
+        else:
+            continue
+        resultats[index] = {'id': fid, 'numero': numero, 'doublon': True}
+    return resultats
+
+class LotRefuse(Exception):
+    """Lot rejeté par le thread d'écriture (erreurs par document, comme la validation)"""
+
+    def __init__(self, erreurs):
+        super().__init__('Lot refusé')
+        self.erreurs = erreurs
+
+def inserer_lot_factures(a_creer):
+    """Insérer les factures validées d'un lot (exécuté par le thread d'écriture)"""
+    # Attribuer les numéros en bloc, à la suite du dernier identifiant
+    dernier_id = db.session.query(func.max(Facture.id)).scalar() or 0
+    maintenant = datetime.utcnow()
+    entetes, lignes_a_inserer, cles_a_inserer, paiements_a_inserer = [], [], [], []
+    resultats = {}
+    erreurs = []
+
+    for offset, (index, doc, lignes) in enumerate(a_creer):
+        facture_id = dernier_id + 1 + offset
+        type_document = doc.get('type_document', 'facture')
+        if type_document == 'avoir':
+            # Contrôlé ici, dans la transaction d'écriture, contre les crédits déjà enregistrés
+            try:
+                avoirs.affecter(doc.get('facture_originale_id'), lignes)
+            except ValueError as e:
+                erreurs.append({'index': index, 'message': str(e)})
+                continue
+            if doc.get('etat', 'En attente') != avoirs.ANNULEE:
+                avoirs.crediter(avoirs.credits(lignes))
+        prefix = 'A' if type_document == 'avoir' else 'F'
+        numero = f'{prefix}{facture_id:04d}'
+        paiement = doc.get('paiement')
+
+        total = 0
+        for ligne in lignes:
+            ligne['facture_id'] = facture_id
+            # Insertion hors ORM : calculer ici les montants que l'ORM calcule au flush
+            ligne['montant_ht'], ligne['montant_tva'], ligne['montant_ttc'] = montants_ligne(
+                ligne['quantite'], ligne['prix_unitaire'], ligne['tva'])
+            total += ligne['montant_ttc']
+            lignes_a_inserer.append(ligne)
+
+        etat = doc.get('etat', 'En attente')
+        # Réglée à la création : paiement du total (voir paiements.py)
+        montant_paye = total if etat == paiements.PAYEE and type_document == 'facture' else 0
+        if montant_paye > 0:
+            paiements_a_inserer.append({'facture_id': facture_id, 'montant': montant_paye, 'mode': paiement,
+                                        'date_paiement': maintenant, 'date_creation': maintenant})
+
+        entetes.append({
+            'id': facture_id,
+            'numero': numero,
+            'client_id': doc.get('client_id'),
+            'date_creation': maintenant,
+            'type_document': type_document,
+            'facture_originale_id': doc.get('facture_originale_id'),
+            'paiement': paiement,
+            'devise': doc.get('devise') if paiement == 'espèces' else None,
+            'etat': etat,
+            'total': total,
+            'montant_paye': montant_paye,
+            'notes': doc.get('notes', ''),
+        })
+        if doc.get('cle_idempotence'):
+            cles_a_inserer.append({'cle': doc['cle_idempotence'], 'facture_id': facture_id,
+                                   'date_creation': maintenant})
+        resultats[index] = {'id': facture_id, 'numero': numero, 'doublon': False}
+
+    if erreurs:
+        # Les crédits déjà posés sont annulés avec le point de sauvegarde du lot
+        raise LotRefuse(erreurs)
+    if entetes:
+        db.session.execute(Facture.__table__.insert(), entetes)
+        db.session.execute(LigneFacture.__table__.insert(), lignes_a_inserer)
+    if paiements_a_inserer:
+        db.session.execute(Paiement.__table__.insert(), paiements_a_inserer)
+    if cles_a_inserer:
+        db.session.execute(CleIdempotence.__table__.insert(), cles_a_inserer)
+    marquer(db.session, [('client', e['client_id']) for e in entetes]
+                        + [('facture', e['facture_originale_id']) for e in entetes]
+                        + [('produit', l['produit_id']) for l in lignes_a_inserer])
+    changements.enregistrer(db.session, [('facture', e['id'], changements.CREATION) for e in entetes]
+                            + [('facture', e['facture_originale_id'], changements.MODIFICATION) for e in entetes])
+    compteurs.documents_inseres(db.session, entetes, lignes_a_inserer)
+    if entetes:
+        cache_rapports.marquer_dates(db.session, [maintenant])
+    return resultats, maintenant
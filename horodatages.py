@@ -0,0 +1,146 @@
+"""Horodatages de modification et GET conditionnels des pages de détail
+
+Chaque commit qui touche une facture, un client, un produit ou un
+approvisionnement met à jour la date de modification de l'entité affichée
+(table `horodatages`). Les pages de détail comparent ces dates aux en-têtes
+If-None-Match / If-Modified-Since avant de charger les relations et
+répondent 304 sans rendu quand rien n'a changé.
+"""
+import hashlib
+from datetime import datetime
+from functools import wraps
+
+from flask import make_response, request, session as flask_session
+from sqlalchemy import event, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from werkzeug.http import is_resource_modified
+
+from models import (db, Approvisionnement, Categorie, Client, Facture, Horodatage,
+                    LigneApprovisionnement, LigneFacture, MouvementStock, Produit, UniteMesure)
+
+# Colonnes d'un produit qui ne changent pas son affichage sur les factures
+_COLONNES_STOCK = {'stock_actuel'}
+
+
+def _entites_touchees(obj, session):
+    """Entités dont la page affiche l'objet modifié"""
+    if isinstance(obj, Facture):
+        entites = [('facture', obj.id), ('client', obj.client_id), ('facture', obj.facture_originale_id)]
+        ancien_client = inspect(obj).attrs.client_id.history.deleted
+        entites += [('client', c) for c in ancien_client or []]
+        return entites
+    if isinstance(obj, LigneFacture):
+        return [('facture', obj.facture_id), ('produit', obj.produit_id)]
+    if isinstance(obj, Client):
+        # 'clients' : version de la liste des clients du catalogue de caisse (caisse.py)
+        return [('client', obj.id), ('clients', 0)]
+    if isinstance(obj, Produit):
+        entites = [('produit', obj.id)]
+        etat = inspect(obj)
+        modifiees = {a.key for a in etat.attrs if a.history.has_changes()}
+        if obj in session.new or obj in session.deleted or modifiees - _COLONNES_STOCK:
+            entites.append(('catalogue', 0))
+        return entites
+    if isinstance(obj, MouvementStock):
+        return [('produit', obj.produit_id)]
+    if isinstance(obj, Approvisionnement):
+        return [('approvisionnement', obj.id)]
+    if isinstance(obj, LigneApprovisionnement):
+        return [('approvisionnement', obj.approvisionnement_id), ('produit', obj.produit_id)]
+    if isinstance(obj, (Categorie, UniteMesure)):
+        # 'referentiel' : version du cache des catégories et unités (referentiel.py)
+        return [('catalogue', 0), ('referentiel', 0)]
+    return []
+
+
+def marquer(session, entites):
+    """Enregistrer maintenant comme date de modification des entités (upsert)"""
+    maintenant = datetime.utcnow()
+    lignes = [{'entite': entite, 'entite_id': int(entite_id), 'date_modification': maintenant}
+              for entite, entite_id in set(entites) if entite_id is not None]
+    if not lignes:
+        return
+    stmt = sqlite_insert(Horodatage.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['entite', 'entite_id'],
+        set_={'date_modification': stmt.excluded.date_modification}
+    )
+    session.connection().execute(stmt, lignes)
+
+
+@event.listens_for(Session, 'after_flush')
+def _horodater(session, flush_context):
+    """Mettre à jour les horodatages dans la transaction de chaque flush"""
+    entites = []
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+        entites.extend(_entites_touchees(obj, session))
+    marquer(session, entites)
+
+
+def _date(entite, colonne_id):
+    return select(Horodatage.date_modification).where(
+        Horodatage.entite == entite, Horodatage.entite_id == colonne_id
+    ).scalar_subquery()
+
+
+def _ligne_validateur(entite, entite_id):
+    """Lire en une requête les dates qui déterminent le rendu de la page"""
+    if entite == 'facture':
+        colonnes = [Facture.date_creation, _date('facture', Facture.id),
+                    _date('client', Facture.client_id), _date('catalogue', 0)]
+        return db.session.execute(select(*colonnes).where(Facture.id == entite_id)).first()
+    if entite == 'client':
+        colonnes = [Client.date_creation, _date('client', Client.id)]
+        return db.session.execute(select(*colonnes).where(Client.id == entite_id)).first()
+    if entite == 'produit':
+        colonnes = [Produit.date_creation, _date('produit', Produit.id), _date('catalogue', 0)]
+        return db.session.execute(select(*colonnes).where(Produit.id == entite_id)).first()
+    if entite == 'approvisionnement':
+        colonnes = [Approvisionnement.date_creation, Approvisionnement.statut,
+                    _date('approvisionnement', Approvisionnement.id), _date('catalogue', 0)]
+        return db.session.execute(select(*colonnes).where(Approvisionnement.id == entite_id)).first()
+    raise ValueError(f'Entité inconnue: {entite}')
+
+
+def validateur(entite, entite_id):
+    """(etag, last_modified) de la page, ou None si l'entité n'existe pas"""
+    ligne = _ligne_validateur(entite, entite_id)
+    if ligne is None:
+        return None
+    dates = [v for v in ligne if isinstance(v, datetime)]
+    derniere_modification = max(dates).replace(microsecond=0) if dates else None
+    etag = hashlib.sha1(f'{entite}:{entite_id}:{tuple(ligne)!r}'.encode()).hexdigest()[:20]
+    return etag, derniere_modification
+
+
+def get_conditionnel(entite):
+    """Décorateur : répondre 304 sans rendu si la page n'a pas changé"""
+    def decorateur(vue):
+        @wraps(vue)
+        def wrapper(id, *args, **kwargs):
+            # Les messages flash rendent la page unique : pas de 304 dans ce cas
+            if request.method != 'GET' or flask_session.get('_flashes'):
+                return vue(id, *args, **kwargs)
+
+            valeurs = validateur(entite, id)
+            if valeurs is None:
+                return vue(id, *args, **kwargs)  # 404 habituel
+            etag, derniere_modification = valeurs
+
+            if not is_resource_modified(request.environ, etag=etag, last_modified=derniere_modification):
+                reponse = make_response('', 304)
+            else:
+                reponse = make_response(vue(id, *args, **kwargs))
+
+            reponse.set_etag(etag)
+            if derniere_modification:
+                reponse.last_modified = derniere_modification
+            # Toujours revalider : même une facture payée change (avoirs, client, catalogue)
+            reponse.cache_control.private = True
+            reponse.cache_control.no_cache = True
+            return reponse
+        return wrapper
+    return decorateur
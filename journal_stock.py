@@ -0,0 +1,125 @@
+"""Journal des mouvements de stock écrit en bloc
+
+Au lieu d'ajouter un objet MouvementStock par ligne (un INSERT chacun au
+flush), les chemins d'écriture déclarent leurs mouvements dans le journal de
+la session. Le chaînage stock_avant / stock_apres est calculé en mémoire sur
+`produit.stock_actuel`, et toutes les lignes partent en un seul INSERT
+multi-lignes à la fin de l'unité de travail : avant le COMMIT, ou avant le
+SAVEPOINT d'un travail du coordinateur d'écritures. Les identifiants
+attribués (RETURNING) alimentent le journal des changements.
+"""
+import threading
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import changements
+from horodatages import marquer
+from models import MouvementStock
+
+_CLE = 'journal_mouvements'
+
+
+class JournalMouvements:
+    """Mouvements en attente d'une unité de travail"""
+
+    def __init__(self):
+        self.lignes = []
+
+    def ajouter(self, produit, type_mouvement, quantite, reference_type=None,
+                reference_id=None, commentaire=None, utilisateur=None):
+        """Appliquer un mouvement au produit et le mettre en attente
+
+        Pour un ajustement, `quantite` est le nouveau niveau de stock ; le
+        mouvement enregistre l'écart, comme l'écran d'ajustement.
+        """
+        stock_avant = produit.stock_actuel or 0
+
+        if type_mouvement == MouvementStock.TYPE_ENTREE:
+            stock_apres = stock_avant + quantite
+        elif type_mouvement == MouvementStock.TYPE_SORTIE:
+            stock_apres = max(0, stock_avant - quantite)  # Prevent negative stock
+        elif type_mouvement == MouvementStock.TYPE_AJUSTEMENT:
+            stock_apres = quantite
+            quantite = abs(quantite - stock_avant)
+        else:
+            raise ValueError(f'Type de mouvement inconnu: {type_mouvement}')
+
+        produit.stock_actuel = stock_apres
+        self.lignes.append({
+            'produit_id': produit.id,
+            'type_mouvement': type_mouvement,
+            'quantite': quantite,
+            'stock_avant': stock_avant,
+            'stock_apres': stock_apres,
+            'reference_type': reference_type,
+            'reference_id': reference_id,
+            'commentaire': commentaire,
+            'date_mouvement': datetime.utcnow(),
+            'utilisateur': utilisateur,
+        })
+
+
+class _Metriques:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flushs = 0
+        self.lignes = 0
+        self.dernier = 0
+        self.max = 0
+
+    def enregistrer(self, nb):
+        with self.lock:
+            self.flushs += 1
+            self.lignes += nb
+            self.dernier = nb
+            self.max = max(self.max, nb)
+
+    def stats(self):
+        return {
+            'flushs': self.flushs,
+            'lignes': self.lignes,
+            'lignes_par_flush': round(self.lignes / self.flushs, 2) if self.flushs else 0,
+            'dernier_flush': self.dernier,
+            'max_flush': self.max,
+        }
+
+
+metriques = _Metriques()
+
+
+def journal(session):
+    """Journal de l'unité de travail en cours de la session"""
+    if _CLE not in session.info:
+        session.info[_CLE] = JournalMouvements()
+    return session.info[_CLE]
+
+
+def vider(session):
+    """Écrire les mouvements en attente en un seul INSERT ; renvoie le nombre de lignes"""
+    journal_en_cours = session.info.pop(_CLE, None)
+    if journal_en_cours is None or not journal_en_cours.lignes:
+        return 0
+    table = MouvementStock.__table__
+    ids = session.execute(table.insert().returning(table.c.id), journal_en_cours.lignes).scalars().all()
+    changements.enregistrer(session, [('mouvement_stock', mouvement_id, changements.CREATION) for mouvement_id in ids])
+    marquer(session, [('produit', ligne['produit_id']) for ligne in journal_en_cours.lignes])
+    nb = len(journal_en_cours.lignes)
+    metriques.enregistrer(nb)
+    return nb
+
+
+def abandonner(session):
+    """Oublier les mouvements d'une unité de travail annulée"""
+    session.info.pop(_CLE, None)
+
+
+@event.listens_for(Session, 'before_commit')
+def _vider_avant_commit(session):
+    vider(session)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _abandonner_apres_rollback(session):
+    abandonner(session)
@@ -0,0 +1,128 @@
+"""Connexion en lecture seule des rapports
+
+Les rapports, exports et le tableau de bord ne lisent plus par le moteur
+des écritures : une année de rapport « tous clients » ne garde ni une
+connexion de ce pool ni une transaction de lecture à côté de la saisie des
+factures. Leurs requêtes passent par un second moteur (voir
+database.SessionRoutee) :
+
+- base ouverte en `mode=ro` et `PRAGMA query_only` : aucune écriture
+  possible, même par erreur (flush, archive attachée) ;
+- pool à part, de taille propre (LECTURE_POOL_TAILLE / _DEBORDEMENT) ;
+- délai par requête (LECTURE_DELAI_MAX secondes, lecture du résultat
+  comprise) : un gestionnaire de progression SQLite interrompt la requête
+  qui le dépasse (RequeteTropLongue -> 503).
+
+Le temps d'attente des connexions de chaque pool est publié dans
+/api/metriques.
+
+Une vue s'y branche par `activer()` (before_request d'un blueprint) ou le
+décorateur `lecture_seule`, avant toute requête de la session.
+"""
+import math
+import os
+import time
+from functools import wraps
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+from database import PoolMesure, stats_pool
+
+# Instructions SQLite entre deux vérifications du délai
+PAS_PROGRESSION = 10000
+
+
+class RequeteTropLongue(Exception):
+    """Requête de rapport interrompue : délai de lecture dépassé"""
+
+
+class Lecture:
+    """Moteur en lecture seule d'une application (None : base sans fichier)"""
+
+    def __init__(self, engine, delai_max):
+        self.engine = engine
+        self.delai_max = delai_max
+        self.interruptions = 0
+
+    def stats(self):
+        if self.engine is None:
+            return {'actif': False}
+        return {'actif': True, 'delai_max_s': self.delai_max, 'interruptions': self.interruptions,
+                **stats_pool(self.engine)}
+
+
+def _echeance(lecture):
+    delai = g.get('lecture_delai', lecture.delai_max) if has_app_context() else lecture.delai_max
+    return time.monotonic() + delai if delai else math.inf
+
+
+def _creer_moteur(lecture, chemin, config):
+    engine = create_engine(
+        f'sqlite:///file:{chemin}?mode=ro&uri=true',
+        poolclass=PoolMesure,
+        pool_size=config['LECTURE_POOL_TAILLE'],
+        max_overflow=config['LECTURE_POOL_DEBORDEMENT'],
+        pool_timeout=config['LECTURE_POOL_ATTENTE'],
+    )
+
+    @event.listens_for(engine, 'connect')
+    def _configurer(dbapi_connection, connection_record):
+        dbapi_connection.execute('PRAGMA query_only=ON')
+        info = connection_record.info
+        dbapi_connection.set_progress_handler(
+            lambda: 1 if time.monotonic() > info.get('echeance', math.inf) else 0, PAS_PROGRESSION)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _armer(conn, cursor, statement, parameters, context, executemany):
+        conn.info['echeance'] = _echeance(lecture)
+
+    @event.listens_for(engine, 'handle_error')
+    def _interrompue(contexte):
+        connexion = contexte.connection
+        if connexion is None or 'interrupted' not in str(contexte.original_exception):
+            return
+        if time.monotonic() > connexion.info.get('echeance', math.inf):
+            lecture.interruptions += 1
+            raise RequeteTropLongue('Rapport interrompu : la requête a dépassé le délai de lecture, '
+                                    'réduisez la période') from contexte.original_exception
+
+    return engine
+
+
+def activer(delai=None):
+    """Faire lire la requête en cours par le moteur en lecture seule
+
+    `delai` remplace LECTURE_DELAI_MAX pour cette requête (exports longs).
+    """
+    g.lecture_seule = True
+    if delai is not None:
+        g.lecture_delai = delai
+
+
+def lecture_seule(vue):
+    """Décorateur : la vue lit par le moteur en lecture seule"""
+    @wraps(vue)
+    def wrapper(*args, **kwargs):
+        activer()
+        return vue(*args, **kwargs)
+    return wrapper
+
+
+def stats():
+    return current_app.extensions['lecture'].stats()
+
+
+def init_app(app):
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    lecture = Lecture(None, app.config['LECTURE_DELAI_MAX'])
+    if url.get_backend_name() == 'sqlite' and url.database and url.database != ':memory:':
+        # Chemin relatif : résolu comme Flask-SQLAlchemy, dans instance_path
+        chemin = os.path.join(app.instance_path, url.database)
+        lecture.engine = _creer_moteur(lecture, chemin, app.config)
+    app.extensions['lecture'] = lecture
+
+    @app.errorhandler(RequeteTropLongue)
+    def _trop_longue(e):
+        return str(e), 503
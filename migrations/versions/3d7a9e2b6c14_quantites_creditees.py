@@ -0,0 +1,103 @@
+"""Quantités déjà créditées des lignes de facture
+
+Revision ID: 3d7a9e2b6c14
+Revises: 8c4f2a6d1e37
+Create Date: 2026-10-19 18:00:00
+
+Ajoute lignes_facture.ligne_originale_id (ligne de facture créditée par une
+ligne d'avoir) et lignes_facture.quantite_creditee (somme des quantités des
+lignes d'avoir qui la désignent, hors avoirs annulés), dans la base vivante
+et les exercices archivés.
+
+Reprise : chaque ligne d'un avoir existant est rattachée à la première
+ligne du même produit de sa facture d'origine, puis les quantités créditées
+sont calculées. Les avoirs déjà émis au-delà de la quantité facturée sont
+repris tels quels : leur facture n'a simplement plus de reste créditable.
+"""
+import os
+import sqlite3
+
+from alembic import op
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = '3d7a9e2b6c14'
+down_revision = '8c4f2a6d1e37'
+branch_labels = None
+depends_on = None
+
+INDEX_ORIGINALE = 'ix_lignes_facture_originale'
+
+RATTACHER = """UPDATE lignes_facture SET ligne_originale_id = (
+    SELECT o.id FROM lignes_facture o JOIN factures a ON a.id = lignes_facture.facture_id
+    WHERE o.facture_id = a.facture_originale_id AND o.produit_id = lignes_facture.produit_id
+    ORDER BY o.id LIMIT 1)
+WHERE ligne_originale_id IS NULL AND facture_id IN (
+    SELECT id FROM factures WHERE type_document = 'avoir' AND facture_originale_id IS NOT NULL)"""
+
+CREDITER = """UPDATE lignes_facture SET quantite_creditee = (
+    SELECT coalesce(sum(abs(a.quantite)), 0) FROM lignes_facture a JOIN factures f ON f.id = a.facture_id
+    WHERE a.ligne_originale_id = lignes_facture.id AND f.etat != 'Annulée')"""
+
+
+def _colonnes(connexion, table):
+    return [c[1] for c in connexion.execute(f'PRAGMA table_info("{table}")')]
+
+
+def _monter(connexion):
+    colonnes = _colonnes(connexion, 'lignes_facture')
+    if 'ligne_originale_id' not in colonnes:
+        connexion.execute('ALTER TABLE lignes_facture ADD COLUMN ligne_originale_id INTEGER '
+                          'REFERENCES lignes_facture (id)')
+    if 'quantite_creditee' not in colonnes:
+        connexion.execute('ALTER TABLE lignes_facture ADD COLUMN quantite_creditee FLOAT NOT NULL DEFAULT 0')
+    connexion.execute(f'CREATE INDEX IF NOT EXISTS {INDEX_ORIGINALE} ON lignes_facture (ligne_originale_id)')
+    connexion.execute(RATTACHER)
+    connexion.execute(CREDITER)
+
+
+def _descendre(connexion):
+    connexion.execute(f'DROP INDEX IF EXISTS {INDEX_ORIGINALE}')
+    colonnes = _colonnes(connexion, 'lignes_facture')
+    if 'quantite_creditee' in colonnes:
+        connexion.execute('ALTER TABLE lignes_facture DROP COLUMN quantite_creditee')
+    if 'ligne_originale_id' in colonnes:
+        connexion.execute('ALTER TABLE lignes_facture DROP COLUMN ligne_originale_id')
+
+
+def _archives():
+    """Chemins des bases des exercices archivés"""
+    bind = op.get_bind()
+    if not bind.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'archives_exercices'").first():
+        return []
+    dossier = current_app.config['ARCHIVES_DOSSIER']
+    return [os.path.join(dossier, fichier)
+            for (fichier,) in bind.exec_driver_sql('SELECT fichier FROM archives_exercices ORDER BY annee')]
+
+
+def _migrer_archives(fonction):
+    """Appliquer la modification à chaque archive (fichiers en lecture seule le reste du temps)"""
+    for chemin in _archives():
+        mode = os.stat(chemin).st_mode
+        os.chmod(chemin, 0o644)
+        try:
+            connexion = sqlite3.connect(chemin, isolation_level=None)
+            try:
+                connexion.execute('BEGIN')
+                fonction(connexion)
+                connexion.execute('COMMIT')
+            finally:
+                connexion.close()
+        finally:
+            os.chmod(chemin, mode)
+
+
+def upgrade():
+    _monter(op.get_bind().connection.dbapi_connection)
+    _migrer_archives(_monter)
+
+
+def downgrade():
+    _descendre(op.get_bind().connection.dbapi_connection)
+    _migrer_archives(_descendre)
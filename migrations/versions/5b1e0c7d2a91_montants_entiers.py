@@ -0,0 +1,164 @@
+"""Montants en entiers (francs, prix unitaires en centimes)
+
+Revision ID: 5b1e0c7d2a91
+Revises:
+Create Date: 2026-10-19 09:00:00
+
+SQLite ne change pas le type d'une colonne : les tables concernées sont
+reconstruites (copie, suppression, renommage, index recréés), dans la base
+vivante puis dans chaque exercice archivé. Les valeurs sont converties avec
+les règles d'arrondi de montants.py, les montants des lignes de facture
+sont calculés et le total de chaque document est recalé sur la somme de
+ses lignes (écarts d'arrondi des anciens flottants, au franc près).
+
+Les compteurs du tableau de bord sont vidés : `flask recalculer-compteurs`
+(ou `flask init-db`) les reconstruit.
+"""
+import os
+import re
+import sqlite3
+
+from alembic import op
+from flask import current_app
+
+from montants import DECIMALES_PRIX, arrondir, montants_ligne
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1e0c7d2a91'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# Colonnes converties : {table: {colonne: décimales}}
+COLONNES = {
+    'produits': {'pv_ttc': 0, 'pru': DECIMALES_PRIX},
+    'approvisionnements': {'total_ht': 0, 'total_ttc': 0},
+    'lignes_approvisionnement': {'prix_unitaire_ht': DECIMALES_PRIX, 'prix_unitaire_ttc': DECIMALES_PRIX},
+    'factures': {'total': 0},
+    'lignes_facture': {'prix_unitaire': DECIMALES_PRIX},
+    'compteurs': {'valeur': 0},
+}
+MONTANTS_LIGNE = ('montant_ht', 'montant_tva', 'montant_ttc')
+
+INDEX_VENTES = 'ix_lignes_facture_ventes'
+INDEX_VENTES_AVANT = (f'CREATE INDEX {INDEX_VENTES} ON lignes_facture '
+                      f'(facture_id, produit_id, quantite, prix_unitaire, tva)')
+INDEX_VENTES_APRES = (f'CREATE INDEX {INDEX_VENTES} ON lignes_facture '
+                      f'(facture_id, produit_id, quantite, montant_ht, montant_tva)')
+
+
+def _fonctions(connexion):
+    """Règles de montants.py utilisables dans les ordres SQL"""
+    connexion.create_function('vers_entier', 2, lambda v, d: None if v is None else arrondir(v, d),
+                              deterministic=True)
+    connexion.create_function('vers_reel', 2, lambda v, d: None if v is None else v / 10 ** d,
+                              deterministic=True)
+    connexion.create_function(
+        'montant_ligne', 4,
+        lambda q, p, tva, rang: montants_ligne(q, (p or 0) / 10 ** DECIMALES_PRIX, tva)[rang],
+        deterministic=True)
+
+
+def _existe(connexion, type_objet, nom):
+    return connexion.execute('SELECT 1 FROM sqlite_master WHERE type = ? AND name = ?',
+                             (type_objet, nom)).fetchone() is not None
+
+
+def _reconstruire(connexion, table, types, expressions):
+    """Recréer la table avec d'autres types de colonnes, données converties"""
+    (sql,) = connexion.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                               (table,)).fetchone()
+    index = [s for (s,) in connexion.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,))]
+    colonnes = [c[1] for c in connexion.execute(f'PRAGMA table_info("{table}")')]
+
+    for colonne, type_sql in types.items():
+        sql = re.sub(rf'([(,]\s*"?{colonne}"?\s+)\w+', rf'\g<1>{type_sql}', sql, count=1)
+    temporaire = f'{table}__montants'
+    sql = re.sub(r'^CREATE TABLE\s+"?\w+"?', f'CREATE TABLE "{temporaire}"', sql)
+
+    connexion.execute(sql)
+    liste = ', '.join(f'"{c}"' for c in colonnes)
+    valeurs = ', '.join(expressions.get(c, f'"{c}"') for c in colonnes)
+    connexion.execute(f'INSERT INTO "{temporaire}" ({liste}) SELECT {valeurs} FROM "{table}"')
+    connexion.execute(f'DROP TABLE "{table}"')
+    connexion.execute(f'ALTER TABLE "{temporaire}" RENAME TO "{table}"')
+    for ordre in index:
+        connexion.execute(ordre)
+
+
+def _monter(connexion):
+    if 'montant_ht' in [c[1] for c in connexion.execute('PRAGMA table_info(lignes_facture)')]:
+        return  # base créée par create_all avec les nouveaux types
+    _fonctions(connexion)
+    for table, colonnes in COLONNES.items():
+        if not _existe(connexion, 'table', table):
+            continue
+        _reconstruire(connexion, table, {c: 'INTEGER' for c in colonnes},
+                      {c: f'vers_entier("{c}", {d})' for c, d in colonnes.items()})
+
+    for colonne in MONTANTS_LIGNE:
+        connexion.execute(f'ALTER TABLE lignes_facture ADD COLUMN {colonne} INTEGER')
+    connexion.execute('UPDATE lignes_facture SET ' + ', '.join(
+        f'{colonne} = montant_ligne(quantite, prix_unitaire, tva, {rang})'
+        for rang, colonne in enumerate(MONTANTS_LIGNE)))
+    connexion.execute(f'DROP INDEX IF EXISTS {INDEX_VENTES}')
+    connexion.execute(INDEX_VENTES_APRES)
+
+    connexion.execute('UPDATE factures SET total = (SELECT sum(montant_ttc) FROM lignes_facture '
+                      'WHERE facture_id = factures.id) '
+                      'WHERE EXISTS (SELECT 1 FROM lignes_facture WHERE facture_id = factures.id)')
+    if _existe(connexion, 'table', 'compteurs'):
+        connexion.execute('DELETE FROM compteurs')
+
+
+def _descendre(connexion):
+    _fonctions(connexion)
+    connexion.execute(f'DROP INDEX IF EXISTS {INDEX_VENTES}')
+    for colonne in MONTANTS_LIGNE:
+        connexion.execute(f'ALTER TABLE lignes_facture DROP COLUMN {colonne}')
+    connexion.execute(INDEX_VENTES_AVANT)
+
+    for table, colonnes in COLONNES.items():
+        if not _existe(connexion, 'table', table):
+            continue
+        _reconstruire(connexion, table, {c: 'FLOAT' for c in colonnes},
+                      {c: f'vers_reel("{c}", {d})' for c, d in colonnes.items()})
+
+
+def _archives():
+    """Chemins des bases des exercices archivés"""
+    bind = op.get_bind()
+    if not bind.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'archives_exercices'").first():
+        return []
+    dossier = current_app.config['ARCHIVES_DOSSIER']
+    return [os.path.join(dossier, fichier)
+            for (fichier,) in bind.exec_driver_sql('SELECT fichier FROM archives_exercices ORDER BY annee')]
+
+
+def _migrer_archives(fonction):
+    """Appliquer la conversion à chaque archive (fichiers en lecture seule le reste du temps)"""
+    for chemin in _archives():
+        mode = os.stat(chemin).st_mode
+        os.chmod(chemin, 0o644)
+        try:
+            connexion = sqlite3.connect(chemin, isolation_level=None)
+            try:
+                connexion.execute('BEGIN')
+                fonction(connexion)
+                connexion.execute('COMMIT')
+            finally:
+                connexion.close()
+        finally:
+            os.chmod(chemin, mode)
+
+
+def upgrade():
+    _monter(op.get_bind().connection.dbapi_connection)
+    _migrer_archives(_monter)
+
+
+def downgrade():
+    _descendre(op.get_bind().connection.dbapi_connection)
+    _migrer_archives(_descendre)
@@ -0,0 +1,49 @@
+"""Journal des changements et consommateurs du flux
+
+Revision ID: 6f2b8d4a9c35
+Revises: 3d7a9e2b6c14
+Create Date: 2026-10-19 20:00:00
+
+Ajoute les tables `changements` (journal écrit dans la transaction de
+chaque changement de facture, produit, mouvement de stock ou
+approvisionnement ; AUTOINCREMENT pour ne jamais réattribuer un curseur)
+et `consommateurs_changements` (dernier curseur acquitté de chaque
+consommateur). Base vivante seulement. Le journal part vide : un
+consommateur se synchronise d'abord entièrement, puis suit le flux depuis
+le curseur `dernier` lu avant cette synchronisation.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '6f2b8d4a9c35'
+down_revision = '3d7a9e2b6c14'
+branch_labels = None
+depends_on = None
+
+TABLE_CHANGEMENTS = """CREATE TABLE IF NOT EXISTS changements (
+    id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+    entite VARCHAR(30) NOT NULL,
+    entite_id INTEGER NOT NULL,
+    operation VARCHAR(20) NOT NULL,
+    date_changement DATETIME NOT NULL
+)"""
+
+TABLE_CONSOMMATEURS = """CREATE TABLE IF NOT EXISTS consommateurs_changements (
+    nom VARCHAR(60) NOT NULL,
+    curseur INTEGER NOT NULL,
+    date_acquittement DATETIME,
+    PRIMARY KEY (nom)
+)"""
+
+
+def upgrade():
+    connexion = op.get_bind().connection.dbapi_connection
+    connexion.execute(TABLE_CHANGEMENTS)
+    connexion.execute(TABLE_CONSOMMATEURS)
+
+
+def downgrade():
+    connexion = op.get_bind().connection.dbapi_connection
+    connexion.execute('DROP TABLE IF EXISTS consommateurs_changements')
+    connexion.execute('DROP TABLE IF EXISTS changements')
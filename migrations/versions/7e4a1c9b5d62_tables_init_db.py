@@ -0,0 +1,139 @@
+"""Tables et index jusqu'ici créés par `flask init-db` seulement
+
+Revision ID: 7e4a1c9b5d62
+Revises: 6f2b8d4a9c35
+Create Date: 2026-10-20 09:00:00
+
+Les tables `compteurs`, `horodatages`, `cles_idempotence`, `taches`,
+`verifications` et `archives_exercices`, et les index de recherche des
+clients, des factures et des mouvements de stock, n'étaient créés que par
+`flask init-db` (create_all) : une base mise à jour par `flask db upgrade`
+seul n'avait pas de table `compteurs` et la page d'accueil échouait.
+
+IF NOT EXISTS : sans effet sur une base déjà passée par `flask init-db`.
+Les compteurs du tableau de bord sont calculés ici s'ils sont vides, avec
+les mêmes agrégats que `compteurs.recalculer` (pas encore d'exercice
+archivé : la table des archives est créée ici).
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '7e4a1c9b5d62'
+down_revision = '6f2b8d4a9c35'
+branch_labels = None
+depends_on = None
+
+TABLES = {
+    'compteurs': """CREATE TABLE IF NOT EXISTS compteurs (
+    cle VARCHAR(60) NOT NULL,
+    valeur INTEGER NOT NULL,
+    PRIMARY KEY (cle)
+)""",
+    'horodatages': """CREATE TABLE IF NOT EXISTS horodatages (
+    entite VARCHAR(30) NOT NULL,
+    entite_id INTEGER NOT NULL,
+    date_modification DATETIME NOT NULL,
+    PRIMARY KEY (entite, entite_id)
+)""",
+    'cles_idempotence': """CREATE TABLE IF NOT EXISTS cles_idempotence (
+    id INTEGER NOT NULL,
+    cle VARCHAR(100) NOT NULL,
+    facture_id INTEGER NOT NULL,
+    date_creation DATETIME,
+    PRIMARY KEY (id),
+    UNIQUE (cle),
+    FOREIGN KEY(facture_id) REFERENCES factures (id)
+)""",
+    'taches': """CREATE TABLE IF NOT EXISTS taches (
+    id INTEGER NOT NULL,
+    type VARCHAR(30) NOT NULL,
+    parametres TEXT,
+    etat VARCHAR(20) NOT NULL,
+    progression INTEGER NOT NULL,
+    lignes_traitees INTEGER NOT NULL,
+    message TEXT,
+    fichier VARCHAR(255),
+    nom_telechargement VARCHAR(255),
+    date_creation DATETIME NOT NULL,
+    date_maj DATETIME NOT NULL,
+    date_expiration DATETIME NOT NULL,
+    PRIMARY KEY (id)
+)""",
+    'verifications': """CREATE TABLE IF NOT EXISTS verifications (
+    controle VARCHAR(30) NOT NULL,
+    dernier_id INTEGER NOT NULL,
+    date_verification DATETIME,
+    PRIMARY KEY (controle)
+)""",
+    'archives_exercices': """CREATE TABLE IF NOT EXISTS archives_exercices (
+    annee INTEGER NOT NULL,
+    fichier VARCHAR(200) NOT NULL,
+    date_archivage DATETIME,
+    nb_factures INTEGER NOT NULL,
+    nb_lignes INTEGER NOT NULL,
+    nb_mouvements INTEGER NOT NULL,
+    facture_id_min INTEGER,
+    facture_id_max INTEGER,
+    PRIMARY KEY (annee)
+)""",
+}
+
+INDEX = {
+    'ix_taches_expiration': 'CREATE INDEX IF NOT EXISTS ix_taches_expiration ON taches (date_expiration)',
+    'ix_clients_nom': 'CREATE INDEX IF NOT EXISTS ix_clients_nom ON clients (lower(nom))',
+    'ix_clients_nif': 'CREATE INDEX IF NOT EXISTS ix_clients_nif ON clients (nif)',
+    'ix_clients_telephone': 'CREATE INDEX IF NOT EXISTS ix_clients_telephone ON clients (telephone)',
+    'ix_factures_client': 'CREATE INDEX IF NOT EXISTS ix_factures_client ON factures (client_id, date_creation)',
+    'ix_factures_date_creation': ('CREATE INDEX IF NOT EXISTS ix_factures_date_creation '
+                                  'ON factures (date_creation, type_document)'),
+    'ix_mouvements_stock_produit': ('CREATE INDEX IF NOT EXISTS ix_mouvements_stock_produit '
+                                    'ON mouvements_stock (produit_id, id)'),
+}
+
+# Agrégats de compteurs.recalculer, en SQL (valeurs nulles omises comme compteurs.ajouter)
+COMPTEURS = [
+    """INSERT INTO compteurs (cle, valeur)
+       SELECT CASE WHEN type_document = 'avoir' THEN 'avoirs:' ELSE 'ventes:' END
+              || strftime('%Y-%m', date_creation), sum(coalesce(total, 0))
+       FROM factures GROUP BY coalesce(type_document, '') = 'avoir', strftime('%Y-%m', date_creation)
+       HAVING sum(coalesce(total, 0)) != 0""",
+    """INSERT INTO compteurs (cle, valeur)
+       SELECT CASE WHEN type_document = 'avoir' THEN 'nb_avoirs:' ELSE 'nb_factures:' END
+              || strftime('%Y-%m', date_creation), count(*)
+       FROM factures GROUP BY coalesce(type_document, '') = 'avoir', strftime('%Y-%m', date_creation)""",
+    """INSERT INTO compteurs (cle, valeur)
+       SELECT 'impaye', sum(total - montant_paye) FROM factures
+       WHERE coalesce(type_document, 'facture') != 'avoir' AND etat = 'En attente'
+       HAVING coalesce(sum(total - montant_paye), 0) != 0""",
+    """INSERT INTO compteurs (cle, valeur)
+       SELECT 'produit:' || strftime('%Y-%m', f.date_creation) || ':' || l.produit_id,
+              sum(CASE WHEN f.type_document = 'avoir' THEN -abs(l.montant_ttc) ELSE l.montant_ttc END)
+       FROM lignes_facture l JOIN factures f ON f.id = l.facture_id
+       GROUP BY l.produit_id, strftime('%Y-%m', f.date_creation)
+       HAVING sum(CASE WHEN f.type_document = 'avoir' THEN -abs(l.montant_ttc) ELSE l.montant_ttc END) != 0""",
+    """INSERT INTO compteurs (cle, valeur)
+       SELECT 'stock_bas', count(*) FROM produits
+       WHERE article_stockable = 'OUI' AND coalesce(stock_actuel, 0) <= coalesce(stock_minimum, 0)
+       HAVING count(*) != 0""",
+]
+
+
+def upgrade():
+    connexion = op.get_bind().connection.dbapi_connection
+    for ordre in TABLES.values():
+        connexion.execute(ordre)
+    for ordre in INDEX.values():
+        connexion.execute(ordre)
+    (vides,) = connexion.execute('SELECT NOT EXISTS (SELECT 1 FROM compteurs)').fetchone()
+    if vides:
+        for ordre in COMPTEURS:
+            connexion.execute(ordre)
+
+
+def downgrade():
+    connexion = op.get_bind().connection.dbapi_connection
+    for nom in INDEX:
+        connexion.execute(f'DROP INDEX IF EXISTS {nom}')
+    for nom in reversed(list(TABLES)):
+        connexion.execute(f'DROP TABLE IF EXISTS {nom}')
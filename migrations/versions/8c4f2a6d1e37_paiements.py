@@ -0,0 +1,128 @@
+"""Paiements des factures et montant réglé
+
+Revision ID: 8c4f2a6d1e37
+Revises: 5b1e0c7d2a91
+Create Date: 2026-10-19 16:00:00
+
+Ajoute factures.montant_paye (base vivante et exercices archivés) et la
+table `paiements` (base vivante seulement : les paiements ne sont pas
+archivés). Les factures déjà « Payée » reçoivent un paiement de reprise de
+leur total, daté de leur création, pour que montant_paye reste la somme de
+leurs paiements. L'index de la balance âgée couvre désormais montant_paye
+(restant dû).
+
+Rien n'étant réglé sur les factures « En attente », leur restant dû est
+leur total : les compteurs du tableau de bord restent justes.
+"""
+import os
+import sqlite3
+from datetime import datetime
+
+from alembic import op
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4f2a6d1e37'
+down_revision = '5b1e0c7d2a91'
+branch_labels = None
+depends_on = None
+
+INDEX_IMPAYES = 'ix_factures_impayes'
+INDEX_IMPAYES_AVANT = (f'CREATE INDEX {INDEX_IMPAYES} ON factures '
+                       f'(etat, type_document, date_creation, client_id, total)')
+INDEX_IMPAYES_APRES = (f'CREATE INDEX {INDEX_IMPAYES} ON factures '
+                       f'(etat, type_document, date_creation, client_id, total, montant_paye)')
+
+TABLE_PAIEMENTS = """CREATE TABLE paiements (
+    id INTEGER NOT NULL,
+    facture_id INTEGER NOT NULL,
+    montant INTEGER NOT NULL,
+    mode VARCHAR(50),
+    date_paiement DATETIME NOT NULL,
+    reference VARCHAR(100),
+    date_creation DATETIME,
+    PRIMARY KEY (id),
+    FOREIGN KEY(facture_id) REFERENCES factures (id)
+)"""
+INDEX_PAIEMENTS = 'CREATE INDEX ix_paiements_facture ON paiements (facture_id, montant)'
+
+
+def _existe(connexion, type_objet, nom):
+    return connexion.execute('SELECT 1 FROM sqlite_master WHERE type = ? AND name = ?',
+                             (type_objet, nom)).fetchone() is not None
+
+
+def _colonnes(connexion, table):
+    return [c[1] for c in connexion.execute(f'PRAGMA table_info("{table}")')]
+
+
+def _monter_factures(connexion):
+    if 'montant_paye' not in _colonnes(connexion, 'factures'):
+        connexion.execute('ALTER TABLE factures ADD COLUMN montant_paye INTEGER NOT NULL DEFAULT 0')
+        connexion.execute("UPDATE factures SET montant_paye = coalesce(total, 0) "
+                          "WHERE etat = 'Payée' AND type_document = 'facture'")
+    connexion.execute(f'DROP INDEX IF EXISTS {INDEX_IMPAYES}')
+    connexion.execute(INDEX_IMPAYES_APRES)
+
+
+def _monter(connexion):
+    _monter_factures(connexion)
+    if not _existe(connexion, 'table', 'paiements'):
+        connexion.execute(TABLE_PAIEMENTS)
+        connexion.execute(INDEX_PAIEMENTS)
+    # Paiements de reprise des factures réglées qui n'en ont pas
+    connexion.execute(
+        "INSERT INTO paiements (facture_id, montant, mode, date_paiement, reference, date_creation) "
+        "SELECT id, montant_paye, paiement, coalesce(date_creation, ?), 'Reprise', ? FROM factures "
+        "WHERE montant_paye > 0 AND NOT EXISTS (SELECT 1 FROM paiements WHERE facture_id = factures.id)",
+        (str(datetime.utcnow()), str(datetime.utcnow())))
+
+
+def _descendre_factures(connexion):
+    connexion.execute(f'DROP INDEX IF EXISTS {INDEX_IMPAYES}')
+    if 'montant_paye' in _colonnes(connexion, 'factures'):
+        connexion.execute('ALTER TABLE factures DROP COLUMN montant_paye')
+    connexion.execute(INDEX_IMPAYES_AVANT)
+
+
+def _descendre(connexion):
+    connexion.execute('DROP TABLE IF EXISTS paiements')
+    _descendre_factures(connexion)
+
+
+def _archives():
+    """Chemins des bases des exercices archivés"""
+    bind = op.get_bind()
+    if not bind.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'archives_exercices'").first():
+        return []
+    dossier = current_app.config['ARCHIVES_DOSSIER']
+    return [os.path.join(dossier, fichier)
+            for (fichier,) in bind.exec_driver_sql('SELECT fichier FROM archives_exercices ORDER BY annee')]
+
+
+def _migrer_archives(fonction):
+    """Appliquer la modification à chaque archive (fichiers en lecture seule le reste du temps)"""
+    for chemin in _archives():
+        mode = os.stat(chemin).st_mode
+        os.chmod(chemin, 0o644)
+        try:
+            connexion = sqlite3.connect(chemin, isolation_level=None)
+            try:
+                connexion.execute('BEGIN')
+                fonction(connexion)
+                connexion.execute('COMMIT')
+            finally:
+                connexion.close()
+        finally:
+            os.chmod(chemin, mode)
+
+
+def upgrade():
+    _monter(op.get_bind().connection.dbapi_connection)
+    _migrer_archives(_monter_factures)
+
+
+def downgrade():
+    _descendre(op.get_bind().connection.dbapi_connection)
+    _migrer_archives(_descendre_factures)
@@ -1,7 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from sqlalchemy import event
 
-db = SQLAlchemy()
+from database import SessionRoutee
+from montants import DECIMALES_PRIX, Montant, montants_ligne
+
+db = SQLAlchemy(session_options={'class_': SessionRoutee})
 
 class Categorie(db.Model):
     __tablename__ = 'categories'
@@ -47,12 +51,12 @@ class Produit(db.Model):
     tc = db.Column(db.String(5), nullable=False)
     pf = db.Column(db.String(5), nullable=False)
     article_stockable = db.Column(db.String(5), nullable=False)
-    pv_ttc = db.Column(db.Float, nullable=False, default=0.0)
+    pv_ttc = db.Column(Montant(), nullable=False, default=0)
     
     # New stock fields
     quantite_initiale = db.Column(db.Float, default=0.0)  # Initial quantity
     stock_minimum = db.Column(db.Float, default=0.0)  # Alert threshold
-    pru = db.Column(db.Float, default=0.0)  # Prix de revient unitaire
+    pru = db.Column(Montant(DECIMALES_PRIX), default=0)  # Prix de revient unitaire
     stock_actuel = db.Column(db.Float, default=0.0)  # Current stock (calculated from movements)
     
     date_creation = db.Column(db.DateTime, default=datetime.utcnow)
@@ -104,6 +108,10 @@ class Produit(db.Model):
 
 class MouvementStock(db.Model):
     __tablename__ = 'mouvements_stock'
+    __table_args__ = (
+        # Historique d'un produit dans l'ordre du journal (rejeu, vérification)
+        db.Index('ix_mouvements_stock_produit', 'produit_id', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     produit_id = db.Column(db.Integer, db.ForeignKey('produits.id'), nullable=False)
     
@@ -149,8 +157,8 @@ class Approvisionnement(db.Model):
     statut = db.Column(db.String(20), default=STATUT_EN_ATTENTE)
     
     # Total
-    total_ht = db.Column(db.Float, default=0.0)
-    total_ttc = db.Column(db.Float, default=0.0)
+    total_ht = db.Column(Montant(), default=0)
+    total_ttc = db.Column(Montant(), default=0)
     
     # Notes
     notes = db.Column(db.Text)
@@ -169,8 +177,8 @@ class LigneApprovisionnement(db.Model):
     produit_id = db.Column(db.Integer, db.ForeignKey('produits.id'), nullable=False)
     
     quantite = db.Column(db.Integer, nullable=False)
-    prix_unitaire_ht = db.Column(db.Float, nullable=False)
-    prix_unitaire_ttc = db.Column(db.Float, nullable=False)
+    prix_unitaire_ht = db.Column(Montant(DECIMALES_PRIX), nullable=False)
+    prix_unitaire_ttc = db.Column(Montant(DECIMALES_PRIX), nullable=False)
     
     # Taxes appliquées
     tva = db.Column(db.Float, nullable=False)
@@ -179,11 +187,11 @@ class LigneApprovisionnement(db.Model):
     
     @property
     def total_ht(self):
-        return self.quantite * self.prix_unitaire_ht
+        return montants_ligne(self.quantite, self.prix_unitaire_ht, self.tva)[0]
     
     @property
     def total_ttc(self):
-        return self.quantite * self.prix_unitaire_ttc
+        return montants_ligne(self.quantite, self.prix_unitaire_ht, self.tva)[2]
     
     def __repr__(self):
         return f'<LigneApprovisionnement {self.produit_id} x{self.quantite}>'
@@ -191,6 +199,12 @@ class LigneApprovisionnement(db.Model):
 
 class Client(db.Model):
     __tablename__ = 'clients'
+    __table_args__ = (
+        # Recherche par préfixe (voir recherche.py)
+        db.Index('ix_clients_nom', db.text('lower(nom)')),
+        db.Index('ix_clients_telephone', 'telephone'),
+        db.Index('ix_clients_nif', 'nif'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     type_client = db.Column(db.String(10), nullable=False, default='person')
     nom = db.Column(db.String(100), nullable=False)
@@ -219,6 +233,15 @@ class Client(db.Model):
 
 class Facture(db.Model):
     __tablename__ = 'factures'
+    __table_args__ = (
+        # Parcours par période (listes, rapports) ; couvre le type de document
+        db.Index('ix_factures_date_creation', 'date_creation', 'type_document'),
+        # Balance âgée des impayés : tranche de dates d'un état, couvre client et restant dû
+        db.Index('ix_factures_impayes', 'etat', 'type_document', 'date_creation', 'client_id', 'total',
+                 'montant_paye'),
+        # Factures d'un client, les plus récentes d'abord (recherche, rapports)
+        db.Index('ix_factures_client', 'client_id', 'date_creation'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     numero = db.Column(db.String(20), unique=True)
@@ -238,35 +261,217 @@ class Facture(db.Model):
     # Champs existants
     paiement = db.Column(db.String(50))
     etat = db.Column(db.String(50), default='En attente')
-    total = db.Column(db.Float, default=0)
+    total = db.Column(Montant(), default=0)  # somme des montant_ttc des lignes
+    # Somme des paiements ; l'état en est déduit (voir paiements.py)
+    montant_paye = db.Column(Montant(), nullable=False, default=0, server_default='0')
     notes = db.Column(db.Text)
     
     # Changement 2: Utilisation de back_populates au lieu de backref='factures'
     client = db.relationship('Client', back_populates='factures')
     lignes = db.relationship('LigneFacture', backref='facture', lazy=True, cascade='all, delete-orphan')
+    paiements = db.relationship('Paiement', backref='facture', lazy=True, order_by='Paiement.id')
+    
+    @property
+    def restant_du(self):
+        return (self.total or 0) - (self.montant_paye or 0)
+    
+    @property
+    def total_ht(self):
+        return sum(ligne.total_ht for ligne in self.lignes)
+    
+    @property
+    def total_tva(self):
+        return sum(ligne.total_tva for ligne in self.lignes)
     
     def __repr__(self):
         return f'<Facture {self.numero}>'
     
 
+class Paiement(db.Model):
+    """Règlement, partiel ou complet, d'une facture (voir paiements.py)"""
+    __tablename__ = 'paiements'
+    __table_args__ = (
+        # Somme des paiements d'une facture (couvrant)
+        db.Index('ix_paiements_facture', 'facture_id', 'montant'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    facture_id = db.Column(db.Integer, db.ForeignKey('factures.id'), nullable=False)
+    montant = db.Column(Montant(), nullable=False)
+    mode = db.Column(db.String(50))  # mêmes valeurs que Facture.paiement
+    date_paiement = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    reference = db.Column(db.String(100))  # n° de chèque, de virement...
+    date_creation = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Paiement {self.id} facture {self.facture_id} {self.montant}>'
+
+
 class LigneFacture(db.Model):
     __tablename__ = 'lignes_facture'
+    __table_args__ = (
+        # Lignes d'une facture ; index couvrant du rapport des ventes par produit
+        db.Index('ix_lignes_facture_ventes', 'facture_id', 'produit_id', 'quantite', 'montant_ht', 'montant_tva'),
+        # Lignes d'avoir d'une ligne de facture (report des crédits, recalcul)
+        db.Index('ix_lignes_facture_originale', 'ligne_originale_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     facture_id = db.Column(db.Integer, db.ForeignKey('factures.id'), nullable=False)
     produit_id = db.Column(db.Integer, db.ForeignKey('produits.id'), nullable=False)
     
     quantite = db.Column(db.Float, nullable=False)  # Changé de Integer à Float
-    prix_unitaire = db.Column(db.Float, nullable=False)
+    prix_unitaire = db.Column(Montant(DECIMALES_PRIX), nullable=False)
     tva = db.Column(db.Float, default=0)  # NOUVEAU : TVA par ligne
+
+    # Avoirs (voir avoirs.py) : ligne de la facture d'origine créditée par une
+    # ligne d'avoir ; sur une ligne de facture, quantité déjà créditée
+    ligne_originale_id = db.Column(db.Integer, db.ForeignKey('lignes_facture.id'))
+    quantite_creditee = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    
+    # Montants arrondis au franc, calculés à l'écriture (voir montants.py) :
+    # les rapports les somment en SQL
+    montant_ht = db.Column(Montant())
+    montant_tva = db.Column(Montant())
+    montant_ttc = db.Column(Montant())
     
     # Relations
     produit = db.relationship('Produit')
     
     @property
     def total_ht(self):
-        return self.quantite * self.prix_unitaire
+        return montants_ligne(self.quantite, self.prix_unitaire, self.tva)[0]
+    
+    @property
+    def total_tva(self):
+        return montants_ligne(self.quantite, self.prix_unitaire, self.tva)[1]
     
     @property
     def total_ttc(self):
-        return self.total_ht * (1 + self.tva/100)
\ No newline at end of file
+        return montants_ligne(self.quantite, self.prix_unitaire, self.tva)[2]
+
+
+@event.listens_for(LigneFacture, 'before_insert')
+@event.listens_for(LigneFacture, 'before_update')
+def _calculer_montants(mapper, connection, ligne):
+    ligne.montant_ht, ligne.montant_tva, ligne.montant_ttc = montants_ligne(
+        ligne.quantite, ligne.prix_unitaire, ligne.tva)
+
+
+class CleIdempotence(db.Model):
+    """Clé d'idempotence d'une facture créée par l'API batch"""
+    __tablename__ = 'cles_idempotence'
+
+    id = db.Column(db.Integer, primary_key=True)
+    cle = db.Column(db.String(100), unique=True, nullable=False)
+    facture_id = db.Column(db.Integer, db.ForeignKey('factures.id'), nullable=False)
+    date_creation = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<CleIdempotence {self.cle}>'
+
+
+class Horodatage(db.Model):
+    """Date de dernière modification d'une entité affichée (validateur HTTP)"""
+    __tablename__ = 'horodatages'
+
+    entite = db.Column(db.String(30), primary_key=True)  # 'facture', 'client', 'produit', 'approvisionnement', 'catalogue'
+    entite_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    date_modification = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Horodatage {self.entite} {self.entite_id}>'
+
+
+class Changement(db.Model):
+    """Entrée du journal des changements, écrite dans la transaction du changement (voir changements.py)"""
+    __tablename__ = 'changements'
+    # AUTOINCREMENT : un curseur n'est jamais réattribué après compactage
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = db.Column(db.Integer, primary_key=True)  # curseur du flux, dans l'ordre des commits
+    entite = db.Column(db.String(30), nullable=False)  # 'facture', 'produit', 'mouvement_stock', 'approvisionnement'
+    entite_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(20), nullable=False)  # creation, modification, suppression, archivage
+    date_changement = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Changement {self.id} {self.operation} {self.entite} {self.entite_id}>'
+
+
+class ConsommateurChangements(db.Model):
+    """Dernier curseur acquitté par un consommateur du flux des changements"""
+    __tablename__ = 'consommateurs_changements'
+
+    nom = db.Column(db.String(60), primary_key=True)
+    curseur = db.Column(db.Integer, nullable=False, default=0)
+    date_acquittement = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<ConsommateurChangements {self.nom} {self.curseur}>'
+
+
+class ArchiveExercice(db.Model):
+    """Exercice clos déplacé dans sa propre base (voir archives.py)"""
+    __tablename__ = 'archives_exercices'
+
+    annee = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    fichier = db.Column(db.String(200), nullable=False)  # relatif au dossier des archives
+    date_archivage = db.Column(db.DateTime, default=datetime.utcnow)
+    nb_factures = db.Column(db.Integer, nullable=False, default=0)
+    nb_lignes = db.Column(db.Integer, nullable=False, default=0)
+    nb_mouvements = db.Column(db.Integer, nullable=False, default=0)
+    # Intervalle des identifiants archivés : trouver l'archive d'une facture sans l'ouvrir
+    facture_id_min = db.Column(db.Integer)
+    facture_id_max = db.Column(db.Integer)
+
+    def __repr__(self):
+        return f'<ArchiveExercice {self.annee}>'
+
+
+class Compteur(db.Model):
+    """Valeur agrégée du tableau de bord, tenue à jour par les écritures (voir compteurs.py)"""
+    __tablename__ = 'compteurs'
+
+    cle = db.Column(db.String(60), primary_key=True)  # 'ventes:2026-03', 'impaye', 'produit:2026-03:12'...
+    valeur = db.Column(db.Integer, nullable=False, default=0)  # nombre ou montant en francs
+
+    def __repr__(self):
+        return f'<Compteur {self.cle}={self.valeur}>'
+
+
+class Verification(db.Model):
+    """Point d'avancement d'un contrôle de cohérence (voir verification.py)"""
+    __tablename__ = 'verifications'
+
+    controle = db.Column(db.String(30), primary_key=True)  # 'totaux', 'stocks'
+    dernier_id = db.Column(db.Integer, nullable=False, default=0)  # plus grand id contrôlé
+    date_verification = db.Column(db.DateTime)  # début du dernier passage
+
+    def __repr__(self):
+        return f'<Verification {self.controle} {self.dernier_id}>'
+
+
+class Tache(db.Model):
+    """Traitement long exécuté en arrière-plan (voir taches.py)"""
+    __tablename__ = 'taches'
+
+    id = db.Column(db.Integer, primary_key=True)
+    type = db.Column(db.String(30), nullable=False)  # 'tous_clients', 'ventes_produits'
+    parametres = db.Column(db.Text)  # JSON
+    etat = db.Column(db.String(20), nullable=False, default='en_attente')  # en_attente, en_cours, terminee, echouee
+    progression = db.Column(db.Integer, nullable=False, default=0)  # pourcentage
+    lignes_traitees = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.Text)
+    fichier = db.Column(db.String(255))  # résultat, dans TACHES_DOSSIER
+    nom_telechargement = db.Column(db.String(255))
+    date_creation = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    date_maj = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # dernier signe de vie
+    date_expiration = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_taches_expiration', 'date_expiration'),
+    )
+
+    def __repr__(self):
+        return f'<Tache {self.id} {self.type} {self.etat}>'
@@ -0,0 +1,87 @@
+"""Montants en entiers
+
+Les montants (totaux, montants des lignes, prix de vente) sont stockés en
+francs burundais entiers et les prix unitaires en centimes (échelle fixe,
+comme la saisie à 0,01 près). SUM() en SQL est alors exact et retombe sur
+les totaux des factures, sans dérive des flottants.
+
+Les calculs passent par Decimal, arrondi au plus proche (moitié loin de
+zéro, symétrique pour les avoirs) :
+- montant HT de ligne = quantité x prix unitaire, arrondi au franc ;
+- TVA de ligne = montant HT x taux, arrondie au franc ;
+- TTC de ligne = HT + TVA ; total du document = somme des TTC de ligne.
+"""
+import math
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy.types import Integer, TypeDecorator
+
+# Décimales des prix unitaires (centimes)
+DECIMALES_PRIX = 2
+# Montant le plus grand accepté en saisie : les sommes restent loin de la
+# limite des entiers SQLite (2**63)
+MONTANT_MAX = 10 ** 15
+
+
+def _decimal(valeur):
+    if isinstance(valeur, Decimal):
+        return valeur
+    # str() : 2.675 vaut 2.675, pas 2.67499999...
+    return Decimal(str(valeur or 0))
+
+
+def nombre(valeur):
+    """Nombre saisi (formulaire ou JSON) en float ; ValueError si non numérique ou non fini"""
+    if isinstance(valeur, bool):
+        raise ValueError(f'Nombre invalide : {valeur!r}')
+    try:
+        resultat = float(valeur)
+    except (TypeError, ValueError):
+        raise ValueError(f'Nombre invalide : {valeur!r}')
+    # float() accepte 'nan', 'inf' et 1e400 : Decimal puis SQLite les refuseraient à l'écriture
+    if not math.isfinite(resultat) or abs(resultat) > MONTANT_MAX:
+        raise ValueError(f'Nombre invalide : {valeur!r}')
+    return resultat
+
+
+def arrondir(valeur, decimales=0):
+    """Valeur arrondie à `decimales` décimales, en entier à cette échelle"""
+    return int((_decimal(valeur) * 10 ** decimales).to_integral_value(ROUND_HALF_UP))
+
+
+def prix(valeur):
+    """Prix unitaire ramené à l'échelle stockée (Decimal exact)"""
+    return Decimal(arrondir(valeur, DECIMALES_PRIX)).scaleb(-DECIMALES_PRIX)
+
+
+def montants_ligne(quantite, prix_unitaire, tva):
+    """(HT, TVA, TTC) d'une ligne, en francs entiers"""
+    ht = arrondir(_decimal(quantite) * prix(prix_unitaire))
+    montant_tva = arrondir(ht * _decimal(tva) / 100)
+    return ht, montant_tva, ht + montant_tva
+
+
+class Montant(TypeDecorator):
+    """Montant stocké en entier : francs (decimales=0) ou échelle fixe
+
+    Côté Python, un montant en francs est un int ; un prix à échelle fixe
+    est rendu en float pour les calculs existants (quantité x prix).
+    """
+    impl = Integer
+    cache_ok = True
+
+    def __init__(self, decimales=0):
+        super().__init__()
+        self.decimales = decimales
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return arrondir(value, self.decimales)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if self.decimales:
+            return value / 10 ** self.decimales
+        return int(value)
@@ -0,0 +1,124 @@
+"""Paiements des factures (règlements partiels ou complets)
+
+Chaque règlement est une ligne de `paiements`. La facture garde la somme
+réglée (`montant_paye`) et son état en est déduit à chaque écriture :
+« Payée » quand le réglé couvre le total, « En attente » sinon ; une
+facture « Annulée » le reste. Le restant dû (total - montant_paye) est ce
+que comptent les impayés : tableau de bord, balance âgée, liste des
+factures.
+
+Le règlement groupé de la liste des factures s'écrit en une transaction
+ensembliste : un INSERT de tous les paiements, puis un seul UPDATE des
+factures concernées qui recalcule montant_paye et l'état depuis la table
+des paiements. Les lignes de facture ne sont pas touchées.
+
+Les paiements restent dans la base vivante quand leur facture est archivée.
+"""
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import case, func, insert, select, update
+
+import cache_rapports
+import changements
+import compteurs
+from horodatages import marquer
+from models import db, Facture, Paiement
+
+PAYEE = 'Payée'
+EN_ATTENTE = 'En attente'
+ANNULEE = 'Annulée'
+ETATS = (PAYEE, EN_ATTENTE, ANNULEE)
+
+MODES = ('espèces', 'carte', 'crédit', 'banque', 'mobile')
+
+
+def etat_derive(etat, total, montant_paye):
+    """État d'une facture d'après ce qui en est réglé"""
+    if etat == ANNULEE or not total:
+        return etat
+    return PAYEE if (montant_paye or 0) >= total else EN_ATTENTE
+
+
+def solder(facture, mode=None, date_paiement=None, reference=None):
+    """Régler le restant dû d'une facture de la session (formulaires, API batch)"""
+    restant = facture.restant_du
+    if facture.type_document == 'avoir' or restant <= 0:
+        return None
+    paiement = Paiement(montant=restant, mode=mode or facture.paiement,
+                        date_paiement=date_paiement or datetime.utcnow(), reference=reference)
+    facture.paiements.append(paiement)
+    facture.montant_paye = (facture.montant_paye or 0) + restant
+    return paiement
+
+
+def regler_factures(reglements, mode, date_paiement=None, reference=None):
+    """Enregistrer des paiements et mettre à jour leurs factures (thread d'écriture)
+
+    `reglements` : [(facture_id, montant)], montant None pour solder le
+    restant dû ; sans `mode`, celui de la facture. Un règlement peut porter
+    sa propre date et sa référence : (facture_id, montant, date, référence)
+    (lignes d'un relevé). Les avoirs, les factures annulées ou déjà soldées
+    sont ignorés ; un montant qui dépasse le restant dû lève ValueError
+    (rien n'est écrit). Renvoie ({facture_id: montant réglé}, dates des factures).
+    """
+    date_paiement = date_paiement or datetime.utcnow()
+    factures = {f.id: f for f in db.session.query(
+        Facture.id, Facture.numero, Facture.client_id, Facture.type_document, Facture.etat,
+        Facture.paiement, Facture.date_creation, Facture.total, Facture.montant_paye
+    ).filter(Facture.id.in_({reglement[0] for reglement in reglements}),
+             Facture.type_document == 'facture', Facture.etat != ANNULEE)}
+
+    restants = {f.id: (f.total or 0) - f.montant_paye for f in factures.values()}
+    regles = defaultdict(int)
+    lignes = []
+    for reglement in reglements:
+        facture_id, montant = reglement[:2]
+        date_ligne, reference_ligne = reglement[2:] if len(reglement) > 2 else (date_paiement, reference)
+        if facture_id not in factures:
+            continue
+        montant = restants[facture_id] if montant is None else montant
+        if montant <= 0:
+            continue
+        if montant > restants[facture_id]:
+            raise ValueError(f'Le paiement de {montant} dépasse le restant dû de la facture '
+                             f'{factures[facture_id].numero} ({restants[facture_id]})')
+        restants[facture_id] -= montant
+        regles[facture_id] += montant
+        lignes.append({'facture_id': facture_id, 'montant': montant, 'mode': mode or factures[facture_id].paiement,
+                       'date_paiement': date_ligne or date_paiement, 'reference': reference_ligne,
+                       'date_creation': datetime.utcnow()})
+    if not lignes:
+        return {}, []
+
+    db.session.execute(insert(Paiement.__table__), lignes)
+
+    # Un seul UPDATE : montant réglé recalculé depuis les paiements, état déduit
+    regle = select(func.coalesce(func.sum(Paiement.montant), 0))\
+        .where(Paiement.facture_id == Facture.id).scalar_subquery()
+    db.session.execute(
+        update(Facture.__table__)
+        .where(Facture.id.in_(list(regles)))
+        .values(montant_paye=regle,
+                etat=case((Facture.etat == ANNULEE, Facture.etat),
+                          (func.coalesce(Facture.total, 0) == 0, Facture.etat),
+                          (regle >= Facture.total, PAYEE),
+                          else_=EN_ATTENTE))
+        .execution_options(synchronize_session=False)
+    )
+
+    # UPDATE hors ORM : compteurs et horodatages reportés explicitement
+    avant, apres = [], []
+    for facture_id, montant in regles.items():
+        f = factures[facture_id]
+        paye = f.montant_paye + montant
+        avant.append((f.type_document, f.etat, f.date_creation, f.total, f.montant_paye))
+        apres.append((f.type_document, etat_derive(f.etat, f.total, paye), f.date_creation, f.total, paye))
+    compteurs.documents_modifies(db.session, avant, apres)
+    marquer(db.session, [('facture', facture_id) for facture_id in regles]
+                        + [('client', factures[facture_id].client_id) for facture_id in regles])
+    changements.enregistrer(db.session, [('facture', facture_id, changements.MODIFICATION)
+                                         for facture_id in regles])
+    dates = [factures[facture_id].date_creation for facture_id in regles]
+    cache_rapports.marquer_dates(db.session, dates)
+    return dict(regles), dates
@@ -0,0 +1,469 @@
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from models import db, Produit, Categorie, UniteMesure, MouvementStock
+from ecritures import ecrire
+from horodatages import get_conditionnel
+from journal_stock import journal
+import referentiel
+
+bp = Blueprint('produits', __name__)
+
+# Helper function to serialize products - FIXED: changed 'prix' to 'pv_ttc'
+#def serialize_produits(produits):
+    #return [{'id': p.id, 'nom': p.nom, 'prix': p.pv_ttc} for p in produits]
+
+def serialize_produits(produits):
+    """Convertir les produits en format JSON-friendly (unités lues dans le cache du référentiel)"""
+    produits_serialized = []
+    for p in produits:
+        unite = referentiel.unite(p.unite_mesure_id)
+        produits_serialized.append({
+            'id': p.id,
+            'nom': p.nom,
+            'code': p.code,
+            'pv_ttc': p.pv_ttc,
+            'tva': p.tva,
+            'unite_mesure': unite.nom if unite else ''
+        })
+    return produits_serialized
+
+@bp.route('/produits')
+def produits_list():
+    # Pagination parameters
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 10, type=int)
+    
+    # Filter parameters
+    search = request.args.get('search', '').strip()
+    categorie_id = request.args.get('categorie_id', type=int)
+    unite_id = request.args.get('unite_id', type=int)
+    tc_filter = request.args.get('tc', '')
+    pf_filter = request.args.get('pf', '')
+    stockable_filter = request.args.get('stockable', '')
+    
+    # Base query: unit and category names come from the reference cache
+    # (referentiel.py), no join or lazy load per product
+    query = Produit.query
+    
+    # Apply filters - here we use the COLUMN names (with _id suffix)
+    if search:
+        query = query.filter(
+            or_(
+                Produit.nom.ilike(f'%{search}%'),
+                Produit.code.ilike(f'%{search}%')
+            )
+        )
+    
+    if categorie_id:
+        query = query.filter(Produit.categorie_id == categorie_id)  # Column name
+    
+    if unite_id:
+        query = query.filter(Produit.unite_mesure_id == unite_id)  # Column name
+    
+    if tc_filter:
+        query = query.filter(Produit.tc == tc_filter)
+    
+    if pf_filter:
+        query = query.filter(Produit.pf == pf_filter)
+    
+    if stockable_filter == 'true':
+        query = query.filter(Produit.article_stockable == True)
+    elif stockable_filter == 'false':
+        query = query.filter(Produit.article_stockable == False)
+    
+    # Order by
+    sort_by = request.args.get('sort_by', 'nom')
+    sort_order = request.args.get('sort_order', 'asc')
+    
+    # Handle sorting for relationship fields
+    if sort_by == 'categorie':
+        # If sorting by category name
+        if sort_order == 'asc':
+            query = query.join(Produit.categorie).order_by(Categorie.nom.asc())
+        else:
+            query = query.join(Produit.categorie).order_by(Categorie.nom.desc())
+    elif sort_by == 'unite_mesure':
+        # If sorting by unit name
+        if sort_order == 'asc':
+            query = query.join(Produit.unite_mesure).order_by(UniteMesure.nom.asc())
+        else:
+            query = query.join(Produit.unite_mesure).order_by(UniteMesure.nom.desc())
+    else:
+        # Regular column sorting
+        if sort_order == 'asc':
+            query = query.order_by(getattr(Produit, sort_by))
+        else:
+            query = query.order_by(getattr(Produit, sort_by).desc())
+    
+    # Get paginated results
+    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    produits = pagination.items
+    
+    # Get filter options (for dropdowns)
+    categories = referentiel.categories()
+    unites = referentiel.unites()
+    
+    return render_template('produits_list.html',
+                         produits=produits,
+                         pagination=pagination,
+                         categories=categories,
+                         unites=unites,
+                         search_term=search,
+                         selected_categorie=categorie_id,
+                         selected_unite=unite_id,
+                         selected_tc=tc_filter,
+                         selected_pf=pf_filter,
+                         selected_stockable=stockable_filter,
+                         sort_by=sort_by,
+                         sort_order=sort_order,
+                         per_page=per_page)
+
+
+@bp.route('/produit/<int:id>')
+@get_conditionnel('produit')
+def produit_detail(id):
+    produit = Produit.query.get_or_404(id)
+    return render_template('produit.html', produit=produit)
+
+@bp.route('/produit/new', methods=['GET', 'POST'])
+def produit_new():
+    if request.method == 'POST':
+        try:
+            tc_value = request.form.get('tc', 'NON')
+            pf_value = request.form.get('pf', 'NON')
+            
+            # Check if article is stockable
+            article_stockable = request.form.get('article_stockable', 'NON')
+            
+            # Get stock values if stockable
+            quantite_initiale = 0
+            stock_minimum = 0
+            pru = 0
+            
+            if article_stockable == 'OUI':
+                quantite_initiale = float(request.form.get('quantite_initiale', 0))
+                stock_minimum = float(request.form.get('stock_minimum', 0))
+                pru = float(request.form.get('pru', 0))
+
+            # Check if code already exists (optional - can rely on IntegrityError)
+            code = request.form.get('code', '')
+            if code:
+                existing_product = Produit.query.filter_by(code=code).first()
+                if existing_product:
+                    flash(f'Le code "{code}" est déjà utilisé par le produit "{existing_product.nom}". Veuillez choisir un code différent.', 'error')
+                    return redirect(url_for('produits.produit_new'))    
+            
+            # Create product with all fields
+            donnees = {
+                'nom': request.form['nom'],
+                'code': request.form.get('code', ''),
+                'unite_mesure_id': int(request.form['unite_mesure_id']),
+                'categorie_id': int(request.form['categorie_id']),
+                'tva': float(request.form['tva']),
+                'tc': tc_value,
+                'pf': pf_value,
+                'article_stockable': article_stockable,
+                'pv_ttc': float(request.form['pv_ttc']),
+                'quantite_initiale': quantite_initiale,
+                'stock_minimum': stock_minimum,
+                'pru': pru,
+                'stock_actuel': quantite_initiale  # Set current stock to initial quantity
+            }
+            ecrire(creer_produit, donnees)
+            
+            flash('Produit créé avec succès', 'success')
+            return redirect(url_for('produits.produits_list'))
+        
+
+        except IntegrityError as e:
+            # Check if it's a unique constraint violation for code
+            if 'unique' in str(e).lower() and 'code' in str(e).lower():
+                flash(f'Erreur: Le code "{request.form.get("code", "")}" est déjà utilisé. Veuillez choisir un code différent.', 'error')
+            else:
+                # Other integrity error
+                flash(f'Erreur de base de données: {str(e)}', 'error')
+            return redirect(url_for('produits.produit_new'))
+            
+        except Exception as e:
+            flash(f'Erreur lors de la création: {str(e)}', 'error')
+            return redirect(url_for('produits.produit_new'))
+    
+    # GET request - show form
+    categories = referentiel.categories()
+    unites = referentiel.unites()
+    options_tva = [0, 5.5, 10, 20]
+    options_tc = [0, 1, 2, 5]
+    options_pf = [0, 0.5, 1, 2]
+    
+    return render_template('produit_form.html', 
+                         categories=categories,
+                         unites=unites,
+                         options_tva=options_tva,
+                         options_tc=options_tc,
+                         options_pf=options_pf,
+                         produit=None)
+
+@bp.route('/produit/<int:id>/edit', methods=['GET', 'POST'])
+def produit_edit(id):
+    produit = Produit.query.get_or_404(id)
+    
+    if request.method == 'POST':
+        try:
+            # Check if code already exists (excluding current product)
+            code = request.form.get('code', '')
+            if code and code != produit.code:
+                existing_product = Produit.query.filter(Produit.code == code, Produit.id != id).first()
+                if existing_product:
+                    flash(f'Le code "{code}" est déjà utilisé par le produit "{existing_product.nom}". Veuillez choisir un code différent.', 'error')
+                    return redirect(url_for('produits.produit_edit', id=id))
+            
+            # Update product fields
+            article_stockable = request.form.get('article_stockable', 'NON')
+            donnees = {
+                'nom': request.form['nom'],
+                'code': code,
+                'unite_mesure_id': int(request.form['unite_mesure_id']),
+                'categorie_id': int(request.form['categorie_id']),
+                'tva': float(request.form['tva']),
+                'tc': request.form.get('tc', 'NON'),
+                'pf': request.form.get('pf', 'NON'),
+                'article_stockable': article_stockable,
+                'pv_ttc': float(request.form['pv_ttc']),
+            }
+
+            # Update stock fields based on stockable status
+            if article_stockable == 'OUI':
+                donnees['quantite_initiale'] = float(request.form.get('quantite_initiale', produit.quantite_initiale))
+                donnees['stock_minimum'] = float(request.form.get('stock_minimum', produit.stock_minimum))
+                donnees['pru'] = float(request.form.get('pru', produit.pru))
+                # Note: stock_actuel is managed through stock movements
+            else:
+                donnees['quantite_initiale'] = 0
+                donnees['stock_minimum'] = 0
+                donnees['pru'] = 0
+                donnees['stock_actuel'] = 0
+            
+            ecrire(enregistrer, Produit, produit.id, donnees)
+            flash('Produit modifié avec succès', 'success')
+            return redirect(url_for('produits.produit_detail', id=produit.id))
+            
+        except IntegrityError as e:
+            if 'unique' in str(e).lower() and 'code' in str(e).lower():
+                flash(f'Erreur: Le code "{request.form.get("code", "")}" est déjà utilisé. Veuillez choisir un code différent.', 'error')
+            else:
+                flash(f'Erreur de base de données: {str(e)}', 'error')
+            return redirect(url_for('produits.produit_edit', id=id))
+            
+        except Exception as e:
+            flash(f'Erreur lors de la modification: {str(e)}', 'error')
+            return redirect(url_for('produits.produit_edit', id=id))
+    
+    # GET request - show form
+    unites = referentiel.unites()
+    categories = referentiel.categories()
+    return render_template('produit_form.html', 
+                         produit=produit,
+                         unites=unites, 
+                         categories=categories)
+    
+@bp.route('/produit/<int:id>/delete', methods=['POST'])
+def produit_delete(id):
+    produit = Produit.query.get_or_404(id)
+    try:
+        ecrire(supprimer, Produit, produit.id)
+        flash('Produit supprimé avec succès', 'success')
+    except IntegrityError:
+        flash('Impossible de supprimer ce produit (utilisé dans des factures)', 'error')
+    return redirect(url_for('produits.produits_list'))
+
+def creer_produit(donnees):
+    """Créer un produit et son stock initial (exécuté par le thread d'écriture)"""
+    produit = Produit(**donnees)
+    db.session.add(produit)
+    db.session.flush()
+
+    # If stockable and has initial quantity, create stock movement
+    if produit.article_stockable == 'OUI' and produit.quantite_initiale > 0:
+        produit.stock_actuel = 0
+        journal(db.session).ajouter(
+            produit,
+            MouvementStock.TYPE_ENTREE,
+            produit.quantite_initiale,
+            reference_type='initial',
+            commentaire='Stock initial',
+            utilisateur='System'
+        )
+    return produit.id
+
+def enregistrer(modele, objet_id, donnees):
+    """Créer (objet_id None) ou modifier un produit, une catégorie ou une unité (thread d'écriture)"""
+    if objet_id is None:
+        objet = modele(**donnees)
+        db.session.add(objet)
+    else:
+        objet = db.session.get(modele, objet_id)
+        for nom, valeur in donnees.items():
+            setattr(objet, nom, valeur)
+    db.session.flush()
+    return objet.id
+
+def supprimer(modele, objet_id):
+    """Supprimer un produit, une catégorie ou une unité (thread d'écriture) ; IntegrityError s'il est utilisé"""
+    db.session.delete(db.session.get(modele, objet_id))
+
+@bp.route('/api/check-code')
+def check_code():
+    """Check if a product code already exists"""
+    code = request.args.get('code', '').strip()
+    produit_id = request.args.get('produit_id', 0, type=int)
+    
+    if not code:
+        return jsonify({'exists': False})
+    
+    # Query excluding current product if in edit mode
+    query = Produit.query.filter(Produit.code == code)
+    if produit_id:
+        query = query.filter(Produit.id != produit_id)
+    
+    exists = query.first() is not None
+    
+    return jsonify({
+        'exists': exists,
+        'code': code
+    })
+
+@bp.route('/categories')
+def categories_list():
+    categories = Categorie.query.all()
+    return render_template('categories_list.html', categories=categories)
+
+@bp.route('/categorie/new', methods=['GET', 'POST'])
+def categorie_new():
+    if request.method == 'POST':
+        ecrire(enregistrer, Categorie, None, {
+            'nom': request.form['nom'],
+            'description': request.form.get('description', '')
+        })
+        flash('Catégorie créée avec succès', 'success')
+        return redirect(url_for('produits.categories_list'))
+    return render_template('categorie_form.html')
+
+@bp.route('/categorie/<int:id>/edit', methods=['GET', 'POST'])
+def categorie_edit(id):
+    categorie = Categorie.query.get_or_404(id)
+    if request.method == 'POST':
+        ecrire(enregistrer, Categorie, categorie.id, {
+            'nom': request.form['nom'],
+            'description': request.form.get('description', '')
+        })
+        flash('Catégorie modifiée avec succès', 'success')
+        return redirect(url_for('produits.categories_list'))
+    return render_template('categorie_form.html', categorie=categorie)
+
+@bp.route('/categorie/<int:id>/delete', methods=['POST'])
+def categorie_delete(id):
+    categorie = Categorie.query.get_or_404(id)
+    try:
+        ecrire(supprimer, Categorie, categorie.id)
+        flash('Catégorie supprimée avec succès', 'success')
+    except IntegrityError:
+        flash('Impossible de supprimer cette catégorie (utilisée par des produits)', 'error')
+    return redirect(url_for('produits.categories_list'))
+
+# ---------- Unités de Mesure Routes ----------
+@bp.route('/unites')
+def unites_list():
+    unites = UniteMesure.query.all()
+    return render_template('unites_list.html', unites=unites)
+
+@bp.route('/unite/new', methods=['GET', 'POST'])
+def unite_new():
+    if request.method == 'POST':
+        ecrire(enregistrer, UniteMesure, None, {
+            'nom': request.form['nom'],
+            'symbole': request.form.get('symbole', ''),
+            'description': request.form.get('description', '')
+        })
+        flash('Unité de mesure créée avec succès', 'success')
+        return redirect(url_for('produits.unites_list'))
+    return render_template('unite_form.html')
+
+@bp.route('/unite/<int:id>/edit', methods=['GET', 'POST'])
+def unite_edit(id):
+    unite = UniteMesure.query.get_or_404(id)
+    if request.method == 'POST':
+        ecrire(enregistrer, UniteMesure, unite.id, {
+            'nom': request.form['nom'],
+            'symbole': request.form.get('symbole', ''),
+            'description': request.form.get('description', '')
+        })
+        flash('Unité de mesure modifiée avec succès', 'success')
+        return redirect(url_for('produits.unites_list'))
+    return render_template('unite_form.html', unite=unite)
+
+@bp.route('/unite/<int:id>/delete', methods=['POST'])
+def unite_delete(id):
+    unite = UniteMesure.query.get_or_404(id)
+    try:
+        ecrire(supprimer, UniteMesure, unite.id)
+        flash('Unité de mesure supprimée avec succès', 'success')
+    except IntegrityError:
+        flash('Impossible de supprimer cette unité (utilisée par des produits)', 'error')
+    return redirect(url_for('produits.unites_list'))
+
+
+@bp.route('/api/unites', methods=['POST'])
+def api_create_unite():
+    try:
+        data = request.get_json()
+        
+        # Validate required fields
+        if not data.get('nom'):
+            return jsonify({'success': False, 'message': 'Le nom est requis'}), 400
+        
+        # Create new unit
+        unite = {
+            'nom': data['nom'],
+            'symbole': data.get('symbole', ''),
+            'description': data.get('description', '')
+        }
+        unite_id = ecrire(enregistrer, UniteMesure, None, unite)
+        
+        return jsonify({
+            'success': True,
+            'unite': {
+                'id': unite_id,
+                'nom': unite['nom'],
+                'symbole': unite['symbole']
+            }
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/api/categories', methods=['POST'])
+def api_create_categorie():
+    try:
+        data = request.get_json()
+        
+        # Validate required fields
+        if not data.get('nom'):
+            return jsonify({'success': False, 'message': 'Le nom est requis'}), 400
+        
+        # Create new category
+        categorie = {
+            'nom': data['nom'],
+            'description': data.get('description', '')
+        }
+        categorie_id = ecrire(enregistrer, Categorie, None, categorie)
+        
+        return jsonify({
+            'success': True,
+            'categorie': {
+                'id': categorie_id,
+                'nom': categorie['nom'],
+                'description': categorie['description']
+            }
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
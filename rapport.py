@@ -0,0 +1,576 @@
+import csv
+import io
+from datetime import date, datetime, time, timedelta
+from flask import Blueprint, Response, render_template, request, redirect, url_for, flash, jsonify, current_app, stream_with_context, abort
+from sqlalchemy import case, func, select, tuple_, union_all
+from models import db, Categorie, Client, Facture, LigneFacture, Produit, UniteMesure
+import analytique
+import archives
+import lecture
+import taches
+
+bp = Blueprint('rapports', __name__)
+# Rapports et exports lisent par le moteur en lecture seule (lecture.py)
+bp.before_request(lecture.activer)
+
+@bp.route('/rapports')
+def rapports_index():
+    """Page d'accueil des rapports"""
+    return render_template('rapports_index.html')
+
+def resume_document(f):
+    """Copie des champs d'une facture affichés dans les rapports (mise en cache)"""
+    return {
+        'id': f.id,
+        'numero': f.numero,
+        'date_creation': f.date_creation,
+        'type_document': f.type_document,
+        'total': f.total,
+        'etat': f.etat,
+        'paiement': f.paiement,
+    }
+
+def resume_client(client):
+    return {
+        'id': client.id,
+        'nom': client.nom,
+        'prenom': client.prenom,
+        'telephone': client.telephone,
+        'email': client.email,
+    }
+
+@bp.route('/rapports/client', methods=['GET', 'POST'])
+def rapport_client():
+    """Rapport pour un client spécifique sur une période"""
+    if request.method == 'POST':
+        client_id = request.form.get('client_id', type=int)
+        date_debut = request.form.get('date_debut')
+        date_fin = request.form.get('date_fin')
+        if client_id is None:
+            flash('Veuillez choisir un client', 'error')
+            return render_template('rapport_client_form.html', maintenant=datetime.now()), 400
+        
+        periode = lire_periode(date_debut, date_fin)
+        if periode is None:
+            flash(PERIODE_INVALIDE, 'error')
+            return redirect(url_for('rapports.rapport_client'))
+        date_debut_obj, date_fin_obj = periode
+
+        cache = current_app.extensions['cache_rapports']
+        contexte = cache.obtenir('client', client_id, date_debut_obj, date_fin_obj,
+                                 lambda: calculer_rapport_client(client_id, date_debut_obj, date_fin_obj))
+
+        return render_template('rapport_client_resultat.html', **contexte)
+    
+    # GET request - afficher le formulaire (client cherché à la frappe)
+    maintenant = datetime.now()
+    return render_template('rapport_client_form.html', maintenant=maintenant)
+
+def calculer_rapport_client(client_id, date_debut_obj, date_fin_obj):
+    """Calculer le contexte du rapport client (sans objets ORM, pour le cache)"""
+    maintenant = datetime.now()
+
+    # Récupérer le client
+    client = Client.query.get_or_404(client_id)
+    
+    # Documents du client sur la période, exercices archivés compris
+    periode = analytique.charger(date_debut_obj, date_fin_obj, client_id=client.id, numeros=True)
+    factures = periode.factures
+    avoirs = periode.avoirs
+    
+    # Calculer les totaux
+    total_factures = float(periode.total[factures].sum())
+    total_avoirs = float(periode.total[avoirs].sum())
+    net_a_payer = total_factures - total_avoirs
+    
+    # Réglé et restant dû (paiements partiels compris)
+    en_attente = factures & periode.masque_etat('En attente')
+    total_paye = float(periode.paye[factures & ~periode.masque_etat('Annulée')].sum())
+    total_impaye = float((periode.total[en_attente] - periode.paye[en_attente]).sum())
+    
+    # Statistiques par mode de paiement
+    paiements = analytique.par_paiement(periode, factures)
+    
+    return dict(client=resume_client(client),
+                date_debut=date_debut_obj,
+                date_fin=date_fin_obj,
+                factures=periode.documents(factures),
+                avoirs=periode.documents(avoirs),
+                total_factures=total_factures,
+                total_avoirs=total_avoirs,
+                net_a_payer=net_a_payer,
+                total_paye=total_paye,
+                total_impaye=total_impaye,
+                paiements=paiements,
+                maintenant=maintenant,
+                nb_factures=int(factures.sum()),
+                nb_avoirs=int(avoirs.sum()))
+
+@bp.route('/rapports/tous-clients', methods=['GET', 'POST'])
+def rapport_tous_clients():
+    """Rapport pour tous les clients sur une période"""
+    if request.method == 'POST':
+        date_debut = request.form.get('date_debut')
+        date_fin = request.form.get('date_fin')
+        
+        periode = lire_periode(date_debut, date_fin)
+        if periode is None:
+            flash(PERIODE_INVALIDE, 'error')
+            return redirect(url_for('rapports.rapport_tous_clients'))
+        date_debut_obj, date_fin_obj = periode
+
+        cache = current_app.extensions['cache_rapports']
+        contexte = cache.obtenir('tous_clients', None, date_debut_obj, date_fin_obj,
+                                 lambda: calculer_rapport_tous_clients(date_debut_obj, date_fin_obj))
+
+        return render_template('rapport_tous_clients_resultat.html', **contexte)
+    
+    # GET request - afficher le formulaire
+    maintenant = datetime.now()
+    return render_template('rapport_tous_clients_form.html', maintenant=maintenant)
+
+def calculer_rapport_tous_clients(date_debut_obj, date_fin_obj):
+    """Calculer le contexte du rapport tous clients (sans objets ORM, pour le cache)"""
+    maintenant = datetime.now()
+    
+    # Documents de la période, exercices archivés compris
+    periode = analytique.charger(date_debut_obj, date_fin_obj)
+    par_client = analytique.par_client(periode)
+    
+    # N'inclure que les clients avec activité
+    clients = Client.query.filter(Client.id.in_(list(par_client))).order_by(Client.nom).all()
+    stats_clients = [
+        dict(client=resume_client(client), **par_client[client.id])
+        for client in clients
+        if par_client[client.id]['total_factures'] > 0 or par_client[client.id]['total_avoirs'] > 0
+    ]
+    
+    # Trier par net (du plus grand au plus petit)
+    stats_clients.sort(key=lambda x: x['net'], reverse=True)
+    
+    total_general_factures = sum(s['total_factures'] for s in stats_clients)
+    total_general_avoirs = sum(s['total_avoirs'] for s in stats_clients)
+    total_general_net = sum(s['net'] for s in stats_clients)
+    
+    # Statistiques globales supplémentaires
+    factures = periode.factures
+    total_toutes_factures = float(periode.total[factures].sum())
+    nb_total_factures = int(factures.sum())
+    
+    # Paiements par mode
+    paiements = analytique.par_paiement(periode, factures)
+    
+    return dict(date_debut=date_debut_obj,
+                date_fin=date_fin_obj,
+                stats_clients=stats_clients,
+                total_general_factures=total_general_factures,
+                total_general_avoirs=total_general_avoirs,
+                total_general_net=total_general_net,
+                total_toutes_factures=total_toutes_factures,
+                nb_total_factures=nb_total_factures,
+                paiements=paiements,
+                maintenant=maintenant,
+                nb_clients_actifs=len(stats_clients))
+
+@bp.route('/rapports/tendances', methods=['GET', 'POST'])
+def rapport_tendances():
+    """Tendances sur une période : mois par mois, cumul, distribution des montants"""
+    if request.method == 'POST':
+        date_debut = request.form.get('date_debut')
+        date_fin = request.form.get('date_fin')
+        
+        periode = lire_periode(date_debut, date_fin)
+        if periode is None:
+            flash(PERIODE_INVALIDE, 'error')
+            return redirect(url_for('rapports.rapport_tendances'))
+        date_debut_obj, date_fin_obj = periode
+
+        cache = current_app.extensions['cache_rapports']
+        contexte = cache.obtenir('tendances', None, date_debut_obj, date_fin_obj,
+                                 lambda: calculer_rapport_tendances(date_debut_obj, date_fin_obj))
+
+        return render_template('rapport_tendances_resultat.html', **contexte)
+    
+    # GET request - afficher le formulaire
+    maintenant = datetime.now()
+    return render_template('rapport_tendances_form.html', maintenant=maintenant)
+
+def calculer_rapport_tendances(date_debut_obj, date_fin_obj):
+    """Calculer le contexte du rapport des tendances (sans objets ORM, pour le cache)"""
+    periode = analytique.charger(date_debut_obj, date_fin_obj)
+    contexte = analytique.tendances(periode)
+    
+    # Noms des meilleurs clients
+    ids = [client_id for client_id, _ in contexte['meilleurs_clients']]
+    clients = {c.id: resume_client(c) for c in Client.query.filter(Client.id.in_(ids))}
+    contexte['meilleurs_clients'] = [
+        dict(client=clients[client_id], **stats)
+        for client_id, stats in contexte['meilleurs_clients'] if client_id in clients
+    ]
+    contexte.update(date_debut=date_debut_obj, date_fin=date_fin_obj)
+    return contexte
+
+REGROUPEMENTS = {
+    'produit': 'Produit',
+    'categorie': 'Catégorie',
+    'unite': 'Unité',
+}
+
+# Message des périodes refusées par lire_periode
+PERIODE_INVALIDE = 'Veuillez fournir des dates valides, la date de début avant la date de fin'
+
+def lire_periode(date_debut, date_fin):
+    """(date_debut, date_fin) du formulaire, fin de journée incluse ; None si invalide ou inversée"""
+    try:
+        periode = (datetime.strptime(date_debut, '%Y-%m-%d'),
+                   datetime.strptime(date_fin + ' 23:59:59', '%Y-%m-%d %H:%M:%S'))
+    except (ValueError, TypeError):
+        return None
+    return periode if periode[0] <= periode[1] else None
+
+def lire_top(valeur):
+    try:
+        top = int(valeur)
+    except (ValueError, TypeError):
+        return None
+    return top if top > 0 else None
+
+def requete_ventes_produits(date_debut_obj, date_fin_obj, regroupement='produit', top=None):
+    """Quantités et montants vendus par produit, catégorie ou unité
+
+    Une requête groupée par base (vivante puis exercices archivés), chacune
+    servie par les index couvrants ix_factures_date_creation et
+    ix_lignes_facture_ventes, puis regroupée et jointe aux produits. Les
+    montants sont les montants entiers des lignes : les sommes retombent
+    exactement sur les totaux des factures. Les lignes d'avoir sont déduites
+    (quantité et montant comptés en négatif, quel que soit leur signe).
+    """
+    annees = archives.annees(date_debut_obj, date_fin_obj)
+    parties = []
+    for f, l in zip(archives.tables(Facture, annees), archives.tables(LigneFacture, annees)):
+        avoir = f.c.type_document == 'avoir'
+        quantite = case((avoir, -func.abs(l.c.quantite)), else_=l.c.quantite)
+        montant_ht = case((avoir, -func.abs(l.c.montant_ht)), else_=l.c.montant_ht)
+        montant_tva = case((avoir, -func.abs(l.c.montant_tva)), else_=l.c.montant_tva)
+        parties.append(
+            select(
+                l.c.produit_id,
+                func.sum(quantite).label('quantite'),
+                func.sum(montant_ht).label('total_ht'),
+                func.sum(montant_tva).label('total_tva'),
+                func.count().label('nb_lignes'),
+            )
+            .join_from(f, l, l.c.facture_id == f.c.id)
+            .where(f.c.date_creation >= date_debut_obj, f.c.date_creation <= date_fin_obj)
+            .group_by(l.c.produit_id)
+        )
+    ventes = (parties[0] if len(parties) == 1 else union_all(*parties)).subquery('ventes')
+
+    if regroupement == 'categorie':
+        cles = [Categorie.id, Categorie.nom.label('libelle')]
+    elif regroupement == 'unite':
+        cles = [UniteMesure.id, UniteMesure.nom.label('libelle'), UniteMesure.symbole]
+    else:
+        cles = [ventes.c.produit_id.label('id'), Produit.nom.label('libelle'), Produit.code,
+                Categorie.nom.label('categorie'), UniteMesure.symbole]
+
+    total_ht = func.sum(ventes.c.total_ht)
+    total_tva = func.sum(ventes.c.total_tva)
+    requete = select(
+        *cles,
+        func.sum(ventes.c.quantite).label('quantite'),
+        total_ht.label('total_ht'),
+        total_tva.label('total_tva'),
+        (total_ht + total_tva).label('total_ttc'),
+        func.sum(ventes.c.nb_lignes).label('nb_lignes'),
+    ).select_from(ventes) \
+     .outerjoin(Produit, Produit.id == ventes.c.produit_id) \
+     .outerjoin(Categorie, Categorie.id == Produit.categorie_id) \
+     .outerjoin(UniteMesure, UniteMesure.id == Produit.unite_mesure_id) \
+     .group_by(cles[0])
+
+    if top:
+        return requete.order_by((total_ht + total_tva).desc()).limit(top)
+    return requete.order_by(cles[1], cles[0])
+
+@bp.route('/rapports/produits', methods=['GET', 'POST'])
+def rapport_produits():
+    """Ventes par produit, catégorie ou unité sur une période"""
+    if request.method == 'POST':
+        periode = lire_periode(request.form.get('date_debut'), request.form.get('date_fin'))
+        if periode is None:
+            flash(PERIODE_INVALIDE, 'error')
+            return redirect(url_for('rapports.rapport_produits'))
+        date_debut_obj, date_fin_obj = periode
+        regroupement = request.form.get('regroupement')
+        if regroupement not in REGROUPEMENTS:
+            regroupement = 'produit'
+        top = lire_top(request.form.get('top'))
+
+        cache = current_app.extensions['cache_rapports']
+        rapport = f'produits_{regroupement}_{top or 0}'
+        contexte = cache.obtenir(rapport, None, date_debut_obj, date_fin_obj,
+                                 lambda: calculer_rapport_produits(date_debut_obj, date_fin_obj, regroupement, top))
+
+        return render_template('rapport_produits_resultat.html', **contexte)
+    
+    # GET request - afficher le formulaire
+    maintenant = datetime.now()
+    return render_template('rapport_produits_form.html', maintenant=maintenant, regroupements=REGROUPEMENTS)
+
+def calculer_rapport_produits(date_debut_obj, date_fin_obj, regroupement, top):
+    """Calculer le contexte du rapport des ventes par produit (sans objets ORM, pour le cache)"""
+    lignes = [dict(ligne._mapping) for ligne in
+              db.session.execute(requete_ventes_produits(date_debut_obj, date_fin_obj, regroupement, top))]
+    return dict(date_debut=date_debut_obj,
+                date_fin=date_fin_obj,
+                regroupement=regroupement,
+                libelle_regroupement=REGROUPEMENTS[regroupement],
+                top=top,
+                lignes=lignes,
+                total_ht=sum(l['total_ht'] or 0 for l in lignes),
+                total_tva=sum(l['total_tva'] or 0 for l in lignes),
+                total_ttc=sum(l['total_ttc'] or 0 for l in lignes),
+                maintenant=datetime.now())
+
+# Colonnes des exports CSV du rapport des ventes par produit
+COLONNES_EXPORT = {
+    'produit': ['id', 'code', 'libelle', 'categorie', 'symbole'],
+    'categorie': ['id', 'libelle'],
+    'unite': ['id', 'libelle', 'symbole'],
+}
+COLONNES_MONTANTS = ['quantite', 'total_ht', 'total_tva', 'total_ttc', 'nb_lignes']
+
+def morceaux_csv(resultat, colonnes, progression=None):
+    """Texte CSV d'un résultat lu par lots (yield_per), un morceau par lot"""
+    tampon = io.StringIO()
+    # Point-virgule et BOM : ouverture directe dans un tableur en français
+    writer = csv.writer(tampon, delimiter=';')
+    tampon.write('\ufeff')
+    writer.writerow(colonnes)
+    for lot in resultat.partitions():
+        for ligne in lot:
+            writer.writerow([ligne._mapping[c] for c in colonnes])
+        if progression is not None:
+            progression.avancer(len(lot))
+        yield tampon.getvalue()
+        tampon.seek(0)
+        tampon.truncate()
+    if tampon.tell():
+        yield tampon.getvalue()
+
+@bp.route('/rapports/produits.csv')
+def rapport_produits_csv():
+    """Export CSV du rapport des ventes par produit, envoyé au fil de la lecture"""
+    # La lecture dure autant que l'envoi : délai des exports
+    lecture.activer(delai=current_app.config['LECTURE_DELAI_EXPORT'])
+    periode = lire_periode(request.args.get('date_debut'), request.args.get('date_fin'))
+    if periode is None:
+        return jsonify({'success': False, 'message': PERIODE_INVALIDE}), 400
+    regroupement = request.args.get('regroupement')
+    if regroupement not in REGROUPEMENTS:
+        regroupement = 'produit'
+    requete = requete_ventes_produits(*periode, regroupement, lire_top(request.args.get('top')))
+    colonnes = COLONNES_EXPORT[regroupement] + COLONNES_MONTANTS
+
+    def generer():
+        yield from morceaux_csv(db.session.execute(requete.execution_options(yield_per=1000)), colonnes)
+
+    nom = f'ventes_{regroupement}_{periode[0]:%Y%m%d}_{periode[1]:%Y%m%d}.csv'
+    return Response(stream_with_context(generer()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={nom}'})
+
+# ===== TÂCHES EN ARRIÈRE-PLAN (voir taches.py) =====
+
+def lire_parametres_periode(formulaire):
+    """Paramètres d'une tâche de rapport : la période du formulaire, en texte"""
+    if lire_periode(formulaire.get('date_debut'), formulaire.get('date_fin')) is None:
+        raise ValueError(PERIODE_INVALIDE)
+    return {'date_debut': formulaire['date_debut'], 'date_fin': formulaire['date_fin']}
+
+def lire_parametres_produits(formulaire):
+    parametres = lire_parametres_periode(formulaire)
+    regroupement = formulaire.get('regroupement')
+    parametres['regroupement'] = regroupement if regroupement in REGROUPEMENTS else 'produit'
+    parametres['top'] = lire_top(formulaire.get('top'))
+    return parametres
+
+@taches.tache('tous_clients', 'Rapport tous clients', lire_parametres_periode)
+def tache_tous_clients(parametres, sortie, progression):
+    """Rapport tous clients en CSV : une ligne par client actif, puis le total"""
+    date_debut_obj, date_fin_obj = lire_periode(parametres['date_debut'], parametres['date_fin'])
+    progression.avancer(0, pourcentage=5)
+    contexte = calculer_rapport_tous_clients(date_debut_obj, date_fin_obj)
+    progression.prevoir(len(contexte['stats_clients']), debut=60)
+
+    writer = csv.writer(sortie, delimiter=';')
+    sortie.write('\ufeff')
+    writer.writerow(['client_id', 'client', 'telephone', 'nb_factures', 'total_factures',
+                     'nb_avoirs', 'total_avoirs', 'net'])
+    for stats in contexte['stats_clients']:
+        client = stats['client']
+        # Montants entiers en francs
+        writer.writerow([client['id'], ' '.join(filter(None, (client['nom'], client['prenom']))),
+                         client['telephone'], stats['nb_factures'], int(stats['total_factures']),
+                         stats['nb_avoirs'], int(stats['total_avoirs']), int(stats['net'])])
+        progression.avancer()
+    writer.writerow(['', 'Total', '', '', int(contexte['total_general_factures']), '',
+                     int(contexte['total_general_avoirs']), int(contexte['total_general_net'])])
+    return f'clients_{date_debut_obj:%Y%m%d}_{date_fin_obj:%Y%m%d}.csv'
+
+@taches.tache('ventes_produits', 'Ventes par produit', lire_parametres_produits)
+def tache_ventes_produits(parametres, sortie, progression):
+    """Export CSV des ventes par produit, catégorie ou unité (mêmes colonnes que /rapports/produits.csv)"""
+    periode = lire_periode(parametres['date_debut'], parametres['date_fin'])
+    regroupement, top = parametres['regroupement'], parametres['top']
+    # Au plus une ligne par produit, catégorie ou unité : estimation du total
+    modele = {'produit': Produit, 'categorie': Categorie, 'unite': UniteMesure}[regroupement]
+    nombre = db.session.query(func.count(modele.id)).scalar() or 0
+    progression.prevoir(min(nombre, top) if top else nombre)
+
+    requete = requete_ventes_produits(*periode, regroupement, top)
+    resultat = db.session.execute(requete.execution_options(yield_per=1000))
+    for morceau in morceaux_csv(resultat, COLONNES_EXPORT[regroupement] + COLONNES_MONTANTS, progression):
+        sortie.write(morceau)
+    return f'ventes_{regroupement}_{periode[0]:%Y%m%d}_{periode[1]:%Y%m%d}.csv'
+
+# Tranches d'ancienneté des impayés : (code, libellé, âge minimum, âge maximum en jours)
+TRANCHES_ANCIENNETE = (
+    ('0-30', '0 à 30 jours', 0, 30),
+    ('31-60', '31 à 60 jours', 31, 60),
+    ('61-90', '61 à 90 jours', 61, 90),
+    ('90+', 'Plus de 90 jours', 91, None),
+)
+SANS_CLIENT = analytique.SANS_CLIENT
+IMPAYES_PAR_PAGE = 50
+
+def limite_anciennete(jours, aujourd_hui=None):
+    """Début du jour situé `jours` jours avant aujourd'hui"""
+    return datetime.combine((aujourd_hui or date.today()) - timedelta(days=jours), time.min)
+
+def filtre_impayes(f):
+    """Factures en attente de paiement (colonnes de tête de ix_factures_impayes)"""
+    return [f.c.etat == 'En attente', f.c.type_document == 'facture']
+
+def expression_tranche(f, aujourd_hui=None):
+    """CASE donnant la tranche d'ancienneté d'une facture par comparaison de dates"""
+    return case(
+        *[(f.c.date_creation >= limite_anciennete(age_max, aujourd_hui), code)
+          for code, _, _, age_max in TRANCHES_ANCIENNETE if age_max is not None],
+        else_=TRANCHES_ANCIENNETE[-1][0]
+    )
+
+def bornes_tranche(code, aujourd_hui=None):
+    """(date minimum incluse, date maximum exclue) d'une tranche ; None : non bornée"""
+    for tranche, _, age_min, age_max in TRANCHES_ANCIENNETE:
+        if tranche == code:
+            debut = limite_anciennete(age_max, aujourd_hui) if age_max is not None else None
+            fin = limite_anciennete(age_min - 1, aujourd_hui) if age_min else None
+            return debut, fin
+    return None
+
+def calculer_anciennete(aujourd_hui=None):
+    """Balance âgée des restants dus par client, en un passage groupé
+
+    Base vivante seulement : un exercice qui a des factures en attente n'est
+    pas archivé (sauf `flask archiver --forcer`). Parcours sur l'index ix_factures_impayes (etat,
+    type_document, date_creation, client_id, total, montant_paye) : les
+    factures ne sont pas chargées, seules les sommes par (client, tranche)
+    remontent.
+    """
+    f = Facture.__table__
+    tranche = expression_tranche(f, aujourd_hui)
+    lignes = db.session.execute(
+        select(
+            func.coalesce(f.c.client_id, SANS_CLIENT),
+            tranche,
+            func.sum(f.c.total - f.c.montant_paye),
+            func.count(),
+        ).where(*filtre_impayes(f)).group_by(f.c.client_id, tranche)
+    ).all()
+
+    def vide():
+        return {code: {'total': 0, 'nombre': 0} for code, _, _, _ in TRANCHES_ANCIENNETE}
+
+    par_client = {}
+    totaux = vide()
+    for client_id, tranche, total, nombre in lignes:
+        for cible in (par_client.setdefault(client_id, vide()), totaux):
+            cible[tranche]['total'] += total or 0
+            cible[tranche]['nombre'] += nombre
+
+    clients = {c.id: resume_client(c) for c in Client.query.filter(Client.id.in_(list(par_client)))}
+    stats_clients = [
+        dict(client_id=client_id, client=clients.get(client_id), tranches=tranches,
+             total=sum(t['total'] for t in tranches.values()),
+             nombre=sum(t['nombre'] for t in tranches.values()))
+        for client_id, tranches in par_client.items()
+    ]
+    stats_clients.sort(key=lambda s: s['total'], reverse=True)
+    return dict(tranches=TRANCHES_ANCIENNETE,
+                stats_clients=stats_clients,
+                totaux=totaux,
+                total_general=sum(t['total'] for t in totaux.values()),
+                nb_total=sum(t['nombre'] for t in totaux.values()),
+                maintenant=datetime.now())
+
+@bp.route('/rapports/anciennete')
+def rapport_anciennete():
+    """Balance âgée des factures impayées (non mise en cache : elle dépend du jour)"""
+    return render_template('rapport_anciennete.html', **calculer_anciennete())
+
+@bp.route('/rapports/anciennete/<tranche>')
+def rapport_anciennete_detail(tranche):
+    """Factures impayées d'une tranche, pagination par clé (date, id)"""
+    bornes = bornes_tranche(tranche)
+    if bornes is None:
+        abort(404)
+    debut, fin = bornes
+    client_id = request.args.get('client_id', type=int)
+
+    F = Facture  # pas de facture en attente dans les exercices archivés
+    query = db.session.query(F).filter(F.etat == 'En attente', F.type_document == 'facture')
+    if debut is not None:
+        query = query.filter(F.date_creation >= debut)
+    if fin is not None:
+        query = query.filter(F.date_creation < fin)
+    if client_id == SANS_CLIENT:
+        query = query.filter(F.client_id.is_(None))
+    elif client_id is not None:
+        query = query.filter(F.client_id == client_id)
+
+    # Reprise après la dernière facture de la page précédente (plus anciennes d'abord)
+    apres_date = request.args.get('apres_date')
+    apres_id = request.args.get('apres_id', type=int)
+    if apres_date and apres_id is not None:
+        try:
+            apres_date_obj = datetime.fromisoformat(apres_date)
+        except ValueError:
+            abort(400)
+        query = query.filter(tuple_(F.date_creation, F.id) > tuple_(apres_date_obj, apres_id))
+
+    factures = query.order_by(F.date_creation, F.id).limit(IMPAYES_PAR_PAGE + 1).all()
+    suivante = None
+    if len(factures) > IMPAYES_PAR_PAGE:
+        factures = factures[:IMPAYES_PAR_PAGE]
+        derniere = factures[-1]
+        suivante = dict(apres_date=derniere.date_creation.isoformat(), apres_id=derniere.id)
+
+    clients = {c.id: c for c in Client.query.filter(Client.id.in_({f.client_id for f in factures if f.client_id}))}
+    client = db.session.get(Client, client_id) if client_id else None
+    libelle = next(l for code, l, _, _ in TRANCHES_ANCIENNETE if code == tranche)
+    return render_template('rapport_anciennete_detail.html',
+                           tranche=tranche,
+                           libelle_tranche=libelle,
+                           factures=factures,
+                           clients=clients,
+                           client=client,
+                           client_id=client_id,
+                           suivante=suivante,
+                           premiere_page=apres_id is None,
+                           aujourd_hui=date.today())
+
+@bp.route('/api/rapports/cache')
+def api_rapports_cache():
+    """Compteurs du cache des rapports (hits/misses, évictions)"""
+    return jsonify(current_app.extensions['cache_rapports'].stats())
@@ -0,0 +1,106 @@
+"""Recherche par préfixe des clients et factures (champs de saisie semi-automatique)
+
+Chaque critère est un intervalle de préfixe (col >= 'abc' AND col < 'abd')
+lu dans un index, avec une petite limite. Le nom est comparé en minuscules
+(index sur lower(nom)) ; comme lower() de SQLite, seules les lettres ASCII
+sont ramenées en minuscules.
+"""
+from sqlalchemy import and_, func
+from sqlalchemy.orm import contains_eager, load_only
+
+from models import db, Client, Facture
+
+LIMITE_DEFAUT = 10
+LIMITE_MAX = 25
+
+_COLONNES_CLIENT = (Client.id, Client.type_client, Client.nom, Client.prenom, Client.telephone, Client.nif)
+
+
+def _minuscules(texte):
+    """Minuscules à la manière de lower() de SQLite (ASCII seulement)"""
+    return ''.join(c.lower() if c.isascii() else c for c in texte)
+
+
+def prefixe(colonne, texte):
+    """Condition « commence par `texte` » utilisable par un index"""
+    return and_(colonne >= texte, colonne < texte[:-1] + chr(ord(texte[-1]) + 1))
+
+
+def limite_demandee(valeur):
+    return max(1, min(valeur or LIMITE_DEFAUT, LIMITE_MAX))
+
+
+def _option_client(client):
+    return {
+        'id': client.id,
+        'nom': client.display_name,
+        'telephone': client.telephone,
+        'nif': client.nif,
+    }
+
+
+def _clients_par_prefixe(texte, limite):
+    """Clients dont le nom, le téléphone ou le NIF commence par `texte` (nom d'abord)"""
+    criteres = [
+        (func.lower(Client.nom), _minuscules(texte)),
+        (Client.telephone, texte),
+        (Client.nif, texte),
+    ]
+    clients = {}
+    for expression, valeur in criteres:
+        requete = Client.query.options(load_only(*_COLONNES_CLIENT))\
+            .filter(prefixe(expression, valeur))\
+            .order_by(expression)\
+            .limit(limite)
+        for client in requete:
+            clients.setdefault(client.id, client)
+        if len(clients) >= limite:
+            break
+    return list(clients.values())[:limite]
+
+
+def rechercher_clients(texte, limite=LIMITE_DEFAUT):
+    return [_option_client(client) for client in _clients_par_prefixe(texte, limite)]
+
+
+def _option_facture(facture):
+    return {
+        'id': facture.id,
+        'numero': facture.numero,
+        'client': facture.client.display_name if facture.client else None,
+        'date': facture.date_creation.strftime('%d/%m/%Y') if facture.date_creation else None,
+        'total': facture.total,
+        'type_document': facture.type_document,
+    }
+
+
+def rechercher_factures(texte, limite=LIMITE_DEFAUT, type_document=None, exclure=None):
+    """Factures dont le numéro, ou le nom du client, commence par `texte`
+
+    Les plus récentes d'abord pour un client. Seule la base vivante est lue :
+    un exercice archivé ne reçoit plus d'avoir.
+    """
+    def requete():
+        q = db.session.query(Facture)\
+            .outerjoin(Client, Facture.client_id == Client.id)\
+            .options(contains_eager(Facture.client).load_only(*_COLONNES_CLIENT))
+        if type_document:
+            q = q.filter(Facture.type_document == type_document)
+        if exclure:
+            q = q.filter(Facture.id != exclure)
+        return q
+
+    # Les numéros sont générés en majuscules (F0001, A0002)
+    factures = requete().filter(prefixe(Facture.numero, texte.upper()))\
+        .order_by(Facture.numero).limit(limite).all()
+
+    if len(factures) < limite:
+        clients_ids = [client.id for client in _clients_par_prefixe(texte, limite)]
+        if clients_ids:
+            vues = {facture.id for facture in factures}
+            factures += [facture for facture in requete()
+                         .filter(Facture.client_id.in_(clients_ids))
+                         .order_by(Facture.date_creation.desc())
+                         .limit(limite)
+                         if facture.id not in vues]
+    return [_option_facture(facture) for facture in factures[:limite]]
@@ -0,0 +1,112 @@
+"""Cache des données de référence (catégories, unités de mesure)
+
+Les catégories et unités sont de petites tables qui ne changent presque
+jamais, mais chaque liste ou formulaire de produits les relisait, et chaque
+produit affiché chargeait les siennes par ses relations. Chaque processus
+les garde en mémoire, sous forme de tuples immuables partagés entre threads.
+
+Cohérence entre workers : toute écriture d'une catégorie ou d'une unité
+(pages catégorie/unité, API de création) met à jour l'horodatage
+('referentiel', 0) dans la même transaction (voir horodatages.py). Le cache
+retient l'horodatage lu avec ses données et le compare au plus une fois par
+requête (une lecture par clé primaire) ; s'il a changé, il recharge.
+"""
+import threading
+from collections import namedtuple
+
+from flask import current_app, g, has_request_context
+from sqlalchemy import null
+
+from models import db, Categorie, Horodatage, UniteMesure
+
+Reference = namedtuple('Reference', ['id', 'nom', 'symbole', 'description'])
+
+_ABSENT = object()
+
+
+def _charger(modele):
+    symbole = modele.symbole if modele is UniteMesure else null()
+    return [Reference(*ligne) for ligne in db.session.query(
+        modele.id, modele.nom, symbole, modele.description).order_by(modele.nom)]
+
+
+class Referentiel:
+    """Catégories et unités d'un processus, rechargées quand l'horodatage change"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.horodatage = _ABSENT
+        self.categories = []
+        self.unites = []
+        self.categories_par_id = {}
+        self.unites_par_id = {}
+        # Métriques
+        self.verifications = 0
+        self.rechargements = 0
+
+    def _lire_horodatage(self):
+        return db.session.query(Horodatage.date_modification).filter_by(
+            entite='referentiel', entite_id=0).scalar()
+
+    def verifier(self):
+        """Recharger si une écriture a eu lieu depuis le dernier chargement"""
+        if has_request_context():
+            if g.get('referentiel_verifie'):
+                return
+            g.referentiel_verifie = True
+        self.verifications += 1
+        horodatage = self._lire_horodatage()
+        if horodatage == self.horodatage:
+            return
+        with self.lock:
+            if horodatage == self.horodatage:
+                return
+            # Horodatage lu avant les tables, dans la même transaction : au pire
+            # un rechargement de trop, jamais des données plus vieilles que lui
+            categories = _charger(Categorie)
+            unites = _charger(UniteMesure)
+            self.categories_par_id = {c.id: c for c in categories}
+            self.unites_par_id = {u.id: u for u in unites}
+            self.categories = categories
+            self.unites = unites
+            self.horodatage = horodatage
+            self.rechargements += 1
+
+    def stats(self):
+        return {
+            'categories': len(self.categories),
+            'unites': len(self.unites),
+            'verifications': self.verifications,
+            'rechargements': self.rechargements,
+        }
+
+
+def _referentiel():
+    referentiel = current_app.extensions['referentiel']
+    referentiel.verifier()
+    return referentiel
+
+
+def categories():
+    """Catégories triées par nom"""
+    return _referentiel().categories
+
+
+def unites():
+    """Unités de mesure triées par nom"""
+    return _referentiel().unites
+
+
+def categorie(categorie_id):
+    return _referentiel().categories_par_id.get(categorie_id)
+
+
+def unite(unite_id):
+    return _referentiel().unites_par_id.get(unite_id)
+
+
+def init_app(app):
+    app.extensions['referentiel'] = Referentiel()
+    # Dans les templates : categorie_ref(produit.categorie_id).nom, unite_ref(produit.unite_mesure_id).symbole
+    app.add_template_global(categorie, 'categorie_ref')
+    app.add_template_global(unite, 'unite_ref')
@@ -0,0 +1,378 @@
+"""Import des relevés bancaires et mobile money
+
+Chaque crédit d'un relevé CSV est rapproché des factures en attente, par
+ordre de confiance :
+
+1. numéro de facture trouvé dans la référence du virement (F0042) ;
+2. montant égal au restant dû et téléphone ou NIF du client trouvé dans la
+   référence ou la colonne du payeur ;
+3. montant à RELEVES_TOLERANCE francs près du restant dû ; à confirmer.
+
+Les factures en attente sont lues en une requête et indexées en
+dictionnaires : aucune requête par ligne. Rien n'est écrit à l'import ; les
+lignes confirmées à la revue sont enregistrées en une transaction
+(paiements.regler_factures).
+"""
+import csv
+import io
+import re
+import unicodedata
+from collections import defaultdict
+from datetime import datetime
+
+from flask import Blueprint, current_app, flash, redirect, render_template, request, url_for
+
+import paiements
+from ecritures import ecrire
+from models import db, Client, Facture
+from montants import arrondir, nombre
+
+bp = Blueprint('releves', __name__)
+
+# Colonnes reconnues (en-têtes sans accents ni casse), par ordre de préférence
+COLONNES = {
+    'date': ('date operation', 'date valeur', 'date'),
+    'montant': ('credit', 'montant', 'amount', 'somme'),
+    'reference': ('reference', 'libelle', 'description', 'motif', 'details', 'communication'),
+    'payeur': ('telephone', 'expediteur', 'emetteur', 'payeur', 'msisdn', 'tel', 'phone'),
+}
+
+FORMATS_DATE = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%d/%m/%Y', '%d/%m/%Y %H:%M:%S',
+                '%d/%m/%Y %H:%M', '%d-%m-%Y', '%d.%m.%Y')
+
+# Un numéro de téléphone se compare sur ses 8 derniers chiffres (sans +257)
+CHIFFRES_TELEPHONE = 8
+# Suites de chiffres plus courtes : ni téléphone ni NIF
+CHIFFRES_MIN = 6
+
+NUMERO = re.compile(r'\b([A-Za-z]{1,3})[-\s]?(\d{3,})\b')
+CHIFFRES = re.compile(r'\+?\d[\d\s.\-]{4,}\d')
+
+# Méthodes de rapprochement
+PAR_NUMERO = 'numero'
+PAR_CONTACT = 'montant_contact'
+PAR_MONTANT = 'montant_approche'
+
+LIBELLES = {
+    PAR_NUMERO: 'N° de facture',
+    PAR_CONTACT: 'Montant et téléphone/NIF',
+    PAR_MONTANT: 'Montant approché',
+}
+
+
+def _normaliser(texte):
+    texte = unicodedata.normalize('NFKD', texte or '').encode('ascii', 'ignore').decode()
+    return ' '.join(texte.lower().replace('_', ' ').split())
+
+
+def _chiffres(texte):
+    return re.sub(r'\D', '', texte or '')
+
+
+def lire_montant(texte):
+    """Montant en francs d'une cellule (« 12 500 », « 12.500,00 », « 12,500.00 ») ou None"""
+    # Espaces (insécables comprises) et symboles monétaires retirés
+    texte = re.sub(r'[^\d,.\-]', '', texte or '')
+    if not texte:
+        return None
+    if ',' in texte and '.' in texte:
+        # Le dernier séparateur est la virgule décimale
+        decimal = ',' if texte.rfind(',') > texte.rfind('.') else '.'
+        milliers = '.' if decimal == ',' else ','
+        texte = texte.replace(milliers, '').replace(decimal, '.')
+    elif ',' in texte:
+        entier, _, fraction = texte.rpartition(',')
+        texte = f'{entier.replace(",", "")}.{fraction}' if len(fraction) <= 2 else texte.replace(',', '')
+    elif texte.count('.') > 1 or re.search(r'\.\d{3}$', texte):
+        texte = texte.replace('.', '')
+    try:
+        return arrondir(nombre(texte), 0)
+    except ValueError:
+        return None
+
+
+def lire_date(texte):
+    texte = (texte or '').strip()
+    for format_date in FORMATS_DATE:
+        try:
+            return datetime.strptime(texte, format_date)
+        except ValueError:
+            pass
+    return None
+
+
+def _colonnes(entetes):
+    """{rôle: [indices]} d'après les en-têtes du relevé"""
+    normalises = [_normaliser(e) for e in entetes]
+    roles = {}
+    for role, noms in COLONNES.items():
+        for nom in noms:
+            indices = [i for i, entete in enumerate(normalises) if entete == nom or entete.startswith(nom + ' ')]
+            if indices:
+                # Plusieurs colonnes de libellé : toutes lues ; sinon la première
+                roles[role] = indices if role == 'reference' else indices[:1]
+                break
+    return roles
+
+
+def lire_releve(contenu):
+    """(lignes, ignorées) d'un relevé CSV ; ValueError si le fichier est illisible
+
+    Lignes : dicts (numero de ligne, date, montant, référence, payeur) des
+    crédits ; les débits et les lignes vides sont ignorés, les lignes
+    illisibles renvoyées avec leur motif.
+    """
+    try:
+        texte = contenu.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        # Exports de tableur sous Windows
+        texte = contenu.decode('cp1252', errors='replace')
+    try:
+        dialecte = csv.Sniffer().sniff(texte[:4096], delimiters=';,\t')
+    except csv.Error:
+        dialecte = csv.excel
+    lecteur = csv.reader(io.StringIO(texte), dialecte)
+    entetes = next(lecteur, None)
+    if not entetes:
+        raise ValueError('Relevé vide')
+    roles = _colonnes(entetes)
+    if 'date' not in roles or 'montant' not in roles:
+        raise ValueError('Colonnes « date » et « crédit » (ou « montant ») introuvables dans le relevé')
+
+    def cellule(ligne, role):
+        return ' '.join(ligne[i].strip() for i in roles.get(role, ()) if i < len(ligne) and ligne[i].strip())
+
+    lignes, ignorees = [], []
+    for numero_ligne, ligne in enumerate(lecteur, start=2):
+        if not any(c.strip() for c in ligne):
+            continue
+        montant = lire_montant(cellule(ligne, 'montant'))
+        if montant is None or montant <= 0:
+            # Débit ou cellule crédit vide : pas un paiement reçu
+            continue
+        date_operation = lire_date(cellule(ligne, 'date'))
+        if date_operation is None:
+            ignorees.append({'ligne': numero_ligne, 'motif': f'date illisible « {cellule(ligne, "date")} »'})
+            continue
+        lignes.append({
+            'ligne': numero_ligne,
+            'date': date_operation,
+            'montant': montant,
+            'reference': cellule(ligne, 'reference'),
+            'payeur': cellule(ligne, 'payeur'),
+        })
+    return lignes, ignorees
+
+
+# ===== RAPPROCHEMENT =====
+
+def _telephone(chiffres):
+    return chiffres[-CHIFFRES_TELEPHONE:] if len(chiffres) >= CHIFFRES_TELEPHONE else None
+
+
+class Index:
+    """Factures en attente rangées par clé de rapprochement (une lecture par import)"""
+
+    def __init__(self, factures, tolerance):
+        self.factures = {f['id']: f for f in factures}
+        self.restants = {f['id']: f['restant'] for f in factures}
+        self.tolerance = tolerance
+        # Tranches de largeur tolérance + 1 : les candidats d'un montant sont dans 3 tranches
+        self.largeur = tolerance + 1
+        self.par_numero = {}
+        self.par_contact = defaultdict(list)
+        self.par_tranche = defaultdict(list)
+        for f in factures:  # plus anciennes d'abord
+            if f['numero']:
+                self.par_numero[f['numero'].upper()] = f['id']
+            telephone = _telephone(_chiffres(f['telephone']))
+            if telephone:
+                self.par_contact[(f['restant'], telephone)].append(f['id'])
+            nif = _chiffres(f['nif'])
+            if len(nif) >= CHIFFRES_MIN:
+                self.par_contact[(f['restant'], nif)].append(f['id'])
+            self.par_tranche[f['restant'] // self.largeur].append(f['id'])
+        self.prises = set()
+
+    def _libre(self, facture_id):
+        return facture_id not in self.prises and self.restants[facture_id] > 0
+
+    def par_reference(self, ligne):
+        for prefixe, chiffres in NUMERO.findall(ligne['reference']):
+            facture_id = self.par_numero.get(f'{prefixe}{chiffres}'.upper())
+            if facture_id is not None and self.restants[facture_id] > 0:
+                return facture_id
+        return None
+
+    def par_montant_contact(self, ligne):
+        cles = set()
+        for bloc in CHIFFRES.findall(f'{ligne["reference"]} {ligne["payeur"]}'):
+            chiffres = _chiffres(bloc)
+            if len(chiffres) >= CHIFFRES_MIN:
+                cles.add(chiffres)
+                cles.add(_telephone(chiffres))
+        payeur = _chiffres(ligne['payeur'])
+        if payeur:
+            cles.update((payeur, _telephone(payeur)))
+        for cle in cles - {None}:
+            for facture_id in self.par_contact.get((ligne['montant'], cle), ()):
+                if self._libre(facture_id):
+                    return facture_id
+        return None
+
+    def par_montant(self, ligne):
+        """(facture la plus proche à la tolérance près, nombre de candidates)"""
+        montant = ligne['montant']
+        tranche = montant // self.largeur
+        candidates = [facture_id
+                      for t in (tranche - 1, tranche, tranche + 1)
+                      for facture_id in self.par_tranche.get(t, ())
+                      if self._libre(facture_id) and abs(self.restants[facture_id] - montant) <= self.tolerance]
+        if not candidates:
+            return None, 0
+        # Écart le plus faible, puis facture la plus ancienne
+        return min(candidates, key=lambda i: (abs(self.restants[i] - montant), self.factures[i]['ordre'])), len(candidates)
+
+    def proposer(self, ligne, facture_id, methode, candidates=1):
+        """Proposition pour une ligne du relevé, restant dû réservé en mémoire"""
+        if facture_id is None:
+            return dict(ligne, facture=None, methode=None, restant=0, montant_applique=0, excedent=0,
+                        candidates=0, coche=False)
+        # Le paiement ne dépasse pas le restant dû ; un excédent reste à traiter à la main
+        restant = self.restants[facture_id]
+        applique = min(ligne['montant'], restant)
+        self.restants[facture_id] -= applique
+        self.prises.add(facture_id)
+        return dict(ligne, facture=self.factures[facture_id], methode=methode, restant=restant,
+                    montant_applique=applique, excedent=ligne['montant'] - applique, candidates=candidates,
+                    coche=methode != PAR_MONTANT)
+
+
+def factures_en_attente():
+    """Factures vivantes avec un restant dû, et téléphone/NIF du client (une requête)"""
+    requete = db.session.query(
+        Facture.id, Facture.numero, Facture.date_creation, Facture.total, Facture.montant_paye,
+        Client.nom, Client.prenom, Client.telephone, Client.nif
+    ).outerjoin(Client, Client.id == Facture.client_id).filter(
+        Facture.etat == paiements.EN_ATTENTE,
+        Facture.type_document == 'facture',
+        Facture.total > Facture.montant_paye
+    ).order_by(Facture.date_creation, Facture.id)
+    return [{
+        'id': f.id,
+        'ordre': ordre,
+        'numero': f.numero,
+        'date_creation': f.date_creation,
+        'client': ' '.join(filter(None, (f.nom, f.prenom))) or '-',
+        'telephone': f.telephone,
+        'nif': f.nif,
+        'total': f.total,
+        'restant': f.total - f.montant_paye,
+    } for ordre, f in enumerate(requete)]
+
+
+def rapprocher(lignes, tolerance):
+    """Propositions de rapprochement des lignes du relevé, dans l'ordre du relevé
+
+    Une passe par méthode, de la plus sûre à la moins sûre : une facture
+    désignée par son numéro n'est pas d'abord prise par le rapprochement au
+    montant d'une ligne précédente. Le numéro peut désigner la même facture
+    sur plusieurs lignes (paiements partiels) tant qu'il en reste un dû.
+    """
+    index = Index(factures_en_attente(), tolerance)
+    propositions = [None] * len(lignes)
+    for methode, trouver in ((PAR_NUMERO, index.par_reference), (PAR_CONTACT, index.par_montant_contact)):
+        for n, ligne in enumerate(lignes):
+            if propositions[n] is None:
+                facture_id = trouver(ligne)
+                if facture_id is not None:
+                    propositions[n] = index.proposer(ligne, facture_id, methode)
+    for n, ligne in enumerate(lignes):
+        if propositions[n] is None:
+            facture_id, candidates = index.par_montant(ligne)
+            propositions[n] = index.proposer(ligne, facture_id, PAR_MONTANT, candidates)
+    return propositions
+
+
+# ===== ROUTES =====
+
+def _tolerance(formulaire):
+    try:
+        tolerance = int(formulaire.get('tolerance', current_app.config['RELEVES_TOLERANCE']))
+    except ValueError:
+        raise ValueError('Tolérance invalide')
+    if tolerance < 0:
+        raise ValueError('Tolérance invalide')
+    return tolerance
+
+
+@bp.route('/paiements/releve', methods=['GET', 'POST'])
+def releve_import():
+    """Importer un relevé CSV et afficher les rapprochements proposés"""
+    if request.method == 'GET':
+        return render_template('releve_import.html', modes_paiement=paiements.MODES,
+                               tolerance=current_app.config['RELEVES_TOLERANCE'])
+
+    fichier = request.files.get('releve')
+    mode = request.form.get('mode') or None
+    try:
+        if fichier is None or not fichier.filename:
+            raise ValueError('Choisissez le fichier CSV du relevé')
+        if mode is not None and mode not in paiements.MODES:
+            raise ValueError(f'Mode de paiement inconnu : {mode}')
+        tolerance = _tolerance(request.form)
+        lignes, ignorees = lire_releve(fichier.read())
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('releves.releve_import'))
+
+    propositions = rapprocher(lignes, tolerance)
+    rapprochees = [p for p in propositions if p['facture'] is not None]
+    return render_template('releve_revue.html',
+                           propositions=propositions,
+                           ignorees=ignorees,
+                           nom_fichier=fichier.filename,
+                           mode=mode,
+                           tolerance=tolerance,
+                           libelles=LIBELLES,
+                           nb_rapprochees=len(rapprochees),
+                           total_credits=sum(p['montant'] for p in propositions),
+                           total_rapproche=sum(p['montant_applique'] for p in rapprochees))
+
+
+@bp.route('/paiements/releve/appliquer', methods=['POST'])
+def releve_appliquer():
+    """Enregistrer les rapprochements confirmés comme paiements, en une transaction"""
+    mode = request.form.get('mode') or None
+    reglements = []
+    try:
+        if mode is not None and mode not in paiements.MODES:
+            raise ValueError(f'Mode de paiement inconnu : {mode}')
+        for n in request.form.getlist('ligne'):
+            montant = int(request.form[f'montant_{n}'])
+            if montant <= 0:
+                raise ValueError('Montant invalide')
+            reglements.append((int(request.form[f'facture_{n}']), montant,
+                               datetime.strptime(request.form[f'date_{n}'], '%Y-%m-%d %H:%M:%S'),
+                               request.form.get(f'reference_{n}', '')[:100] or None))
+    except KeyError:
+        flash('Formulaire de rapprochement incomplet', 'error')
+        return redirect(url_for('releves.releve_import'))
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('releves.releve_import'))
+    if not reglements:
+        flash('Aucun rapprochement confirmé', 'warning')
+        return redirect(url_for('releves.releve_import'))
+
+    try:
+        regles, dates = ecrire(paiements.regler_factures, reglements, mode)
+    except ValueError as e:
+        # Facture réglée entre la revue et la confirmation : rien n'est écrit
+        flash(f'{e}. Aucun paiement enregistré : réimportez le relevé.', 'error')
+        return redirect(url_for('releves.releve_import'))
+    current_app.extensions['cache_rapports'].invalider_dates(dates)
+
+    total = f'{sum(regles.values()):,.0f}'.replace(',', ' ')
+    flash(f'{len(reglements)} ligne(s) du relevé enregistrée(s) : {len(regles)} facture(s), {total} FBU', 'success')
+    return redirect(url_for('factures.factures_list'))
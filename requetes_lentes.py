@@ -0,0 +1,298 @@
+"""Journal des requêtes lentes
+
+Quand une page ralentit, il faut savoir quelle requête SQL en est la cause
+et si elle a trouvé un index. Chaque instruction est chronométrée par les
+événements de curseur de SQLAlchemy (tous les moteurs : écritures, lecture
+seule, archives) ; celles qui dépassent REQUETES_LENTES_SEUIL_MS sont :
+
+- écrites, une ligne JSON chacune, dans un journal à rotation
+  (REQUETES_LENTES_JOURNAL) : durée, requête, paramètres, vue d'origine
+  (endpoint, ou thread hors requête : écrivain, tâches) et plan
+  `EXPLAIN QUERY PLAN` ;
+- gardées en mémoire sur une fenêtre glissante (REQUETES_LENTES_FENETRE
+  secondes) pour la page /admin/requetes-lentes, qui classe les requêtes
+  par temps total.
+
+Le plan est obtenu sur une connexion à part, en lecture seule, par un
+thread du journal : la requête lente n'attend ni l'EXPLAIN ni l'écriture du
+fichier, elle dépose seulement son relevé dans une file bornée (relevés
+perdus comptés si elle déborde). Le temps mesuré est celui de l'exécution,
+sans la lecture des lignes qui suit.
+
+Fenêtre et compteurs sont propres à chaque processus.
+"""
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import Blueprint, current_app, has_app_context, has_request_context, render_template, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+bp = Blueprint('requetes_lentes', __name__)
+
+# Relevés gardés en mémoire au plus (fenêtre glissante)
+RELEVES_MAX = 10000
+# Taille de la file vers le thread du journal
+FILE_TAILLE = 1000
+# Paramètres tronqués dans le journal (caractères)
+PARAMETRES_MAX = 500
+# Instructions dont on peut demander le plan
+EXPLICABLES = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+_LISTE_PARAMETRES = re.compile(r'\(\?(?:, \?)+\)')
+_ESPACES = re.compile(r'\s+')
+
+
+def normaliser(requete):
+    """Clé de regroupement : listes IN (?, ?, …) de toutes longueurs confondues, espaces réduits"""
+    return _ESPACES.sub(' ', _LISTE_PARAMETRES.sub('(?, …)', requete)).strip()
+
+
+def _chemin_base(url):
+    """Fichier SQLite d'un moteur (None : base en mémoire ou autre SGBD)"""
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        return None
+    chemin = url.database
+    # Moteur en lecture seule : URI file:...?mode=ro
+    return chemin[len('file:'):] if chemin.startswith('file:') else chemin
+
+
+def _origine():
+    if has_request_context():
+        return request.endpoint or request.path
+    return f'thread {threading.current_thread().name}'
+
+
+class Releve:
+    """Une exécution lente"""
+    __slots__ = ('horodatage', 'duree_ms', 'requete', 'cle', 'parametres', 'origine', 'chemin', 'plan')
+
+    def __init__(self, duree_ms, requete, parametres, origine, chemin):
+        self.horodatage = time.time()
+        self.duree_ms = duree_ms
+        self.requete = requete
+        self.cle = normaliser(requete)
+        self.parametres = parametres
+        self.origine = origine
+        self.chemin = chemin
+        self.plan = None
+
+
+class JournalLent:
+    """Requêtes lentes d'une application : file, thread du journal, fenêtre glissante"""
+
+    def __init__(self, config):
+        self.seuil_ms = config['REQUETES_LENTES_SEUIL_MS']
+        self.fenetre = config['REQUETES_LENTES_FENETRE']
+        self.fichier = config['REQUETES_LENTES_JOURNAL']
+        self.taille_fichier = config['REQUETES_LENTES_JOURNAL_TAILLE']
+        self.nombre_fichiers = config['REQUETES_LENTES_JOURNAL_NOMBRE']
+        self.file = queue.Queue(maxsize=FILE_TAILLE)
+        self.releves = deque(maxlen=RELEVES_MAX)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self._logger = None
+        # Métriques
+        self.signalees = 0
+        self.perdues = 0
+
+    def signaler(self, releve):
+        """Déposer un relevé (thread de la requête lente : rien de bloquant)"""
+        self._demarrer()
+        try:
+            self.file.put_nowait(releve)
+            self.signalees += 1
+        except queue.Full:
+            self.perdues += 1
+
+    def _demarrer(self):
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        # Après un fork (workers gunicorn) le thread du parent n'existe plus
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._boucle, name='requetes-lentes', daemon=True)
+            self.thread.start()
+
+    def arreter(self):
+        """Terminer le thread du journal après les relevés en file (boutique fermée)"""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None and thread.is_alive():
+            self.file.put(None)
+            thread.join()
+        if self._logger is not None:
+            for handler in self._logger.handlers:
+                handler.close()
+            self._logger = None
+
+    def _boucle(self):
+        connexions = {}
+        while True:
+            releve = self.file.get()
+            if releve is None:
+                for connexion in connexions.values():
+                    connexion.close()
+                return
+            try:
+                releve.plan = self._expliquer(connexions, releve)
+                self._ecrire(releve)
+            except Exception:
+                logging.getLogger(__name__).exception('Relevé de requête lente non enregistré')
+            with self.lock:
+                self.releves.append(releve)
+            self.file.task_done()
+
+    def _expliquer(self, connexions, releve):
+        """Plan de la requête, une étape par ligne (indentée sous son parent)"""
+        if releve.chemin is None:
+            return None
+        if not releve.requete.lstrip().upper().startswith(EXPLICABLES):
+            return None
+        connexion = connexions.get(releve.chemin)
+        if connexion is None:
+            connexion = sqlite3.connect(f'file:{releve.chemin}?mode=ro', uri=True)
+            connexion.execute('PRAGMA query_only=ON')
+            connexions[releve.chemin] = connexion
+        try:
+            etapes = connexion.execute('EXPLAIN QUERY PLAN ' + releve.requete, releve.parametres or ()).fetchall()
+        except (sqlite3.Error, ValueError) as e:
+            # Table temporaire, archive attachée, paramètres nommés… : pas de plan
+            return f'Plan indisponible : {e}'
+        profondeurs = {0: -1}
+        lignes = []
+        for identifiant, parent, _, detail in etapes:
+            profondeurs[identifiant] = profondeurs.get(parent, -1) + 1
+            lignes.append('  ' * profondeurs[identifiant] + detail)
+        return '\n'.join(lignes)
+
+    def _ecrire(self, releve):
+        if self._logger is None:
+            os.makedirs(os.path.dirname(self.fichier) or '.', exist_ok=True)
+            handler = RotatingFileHandler(self.fichier, maxBytes=self.taille_fichier,
+                                          backupCount=self.nombre_fichiers, encoding='utf-8')
+            logger = logging.Logger('requetes_lentes')
+            logger.addHandler(handler)
+            self._logger = logger
+        parametres = repr(releve.parametres)
+        if len(parametres) > PARAMETRES_MAX:
+            parametres = parametres[:PARAMETRES_MAX] + '…'
+        self._logger.warning(json.dumps({
+            'date': datetime.fromtimestamp(releve.horodatage).isoformat(timespec='milliseconds'),
+            'duree_ms': round(releve.duree_ms, 1),
+            'origine': releve.origine,
+            'requete': releve.requete,
+            'parametres': parametres,
+            'plan': releve.plan,
+        }, ensure_ascii=False))
+
+    def classement(self, fenetre=None, limite=50):
+        """Requêtes lentes des `fenetre` dernières secondes (au plus REQUETES_LENTES_FENETRE)
+        regroupées par requête, par temps total décroissant"""
+        maintenant = time.time()
+        with self.lock:
+            while self.releves and self.releves[0].horodatage < maintenant - self.fenetre:
+                self.releves.popleft()
+            depuis = maintenant - min(fenetre or self.fenetre, self.fenetre)
+            releves = [releve for releve in self.releves if releve.horodatage >= depuis]
+        groupes = {}
+        for releve in releves:
+            groupe = groupes.get(releve.cle)
+            if groupe is None:
+                groupe = groupes[releve.cle] = {'requete': releve.cle, 'executions': 0, 'total_ms': 0.0,
+                                                'max_ms': 0.0, 'origines': Counter()}
+            groupe['executions'] += 1
+            groupe['total_ms'] += releve.duree_ms
+            groupe['origines'][releve.origine] += 1
+            if releve.duree_ms >= groupe['max_ms']:
+                # Plan et paramètres de l'exécution la plus lente
+                groupe['max_ms'] = releve.duree_ms
+                groupe['plan'] = releve.plan
+                groupe['parametres'] = repr(releve.parametres)[:PARAMETRES_MAX]
+            groupe['derniere'] = datetime.fromtimestamp(releve.horodatage)
+        classement = sorted(groupes.values(), key=lambda g: g['total_ms'], reverse=True)[:limite]
+        for groupe in classement:
+            groupe['moyenne_ms'] = groupe['total_ms'] / groupe['executions']
+            groupe['origines'] = groupe['origines'].most_common()
+        return classement
+
+    def stats(self):
+        return {
+            'seuil_ms': self.seuil_ms,
+            'signalees': self.signalees,
+            'perdues': self.perdues,
+            'en_file': self.file.qsize(),
+            'en_fenetre': len(self.releves),
+        }
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _debut_requete(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('chronos_requetes', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _fin_requete(conn, cursor, statement, parameters, context, executemany):
+    chronos = conn.info.get('chronos_requetes')
+    if not chronos:
+        return
+    duree_ms = (time.perf_counter() - chronos.pop()) * 1000
+    if not has_app_context():
+        return
+    journal = current_app.extensions.get('requetes_lentes')
+    if journal is None or not journal.seuil_ms or duree_ms < journal.seuil_ms:
+        return
+    if executemany:
+        # Plan de la première ligne du lot
+        parametres = parameters[0] if parameters else ()
+    else:
+        parametres = parameters
+    journal.signaler(Releve(duree_ms, statement, parametres, _origine(), _chemin_base(conn.engine.url)))
+
+
+@event.listens_for(Engine, 'handle_error')
+def _echec_requete(contexte):
+    # Pas d'after_cursor_execute pour une instruction en erreur
+    chronos = contexte.connection.info.get('chronos_requetes') if contexte.connection is not None else None
+    if chronos:
+        chronos.pop()
+
+
+# ===== ROUTES =====
+
+FENETRES = [(300, '5 minutes'), (3600, '1 heure'), (6 * 3600, '6 heures'), (24 * 3600, '24 heures')]
+
+
+@bp.route('/admin/requetes-lentes')
+def requetes_lentes():
+    """Requêtes les plus coûteuses de la fenêtre glissante"""
+    journal = current_app.extensions['requetes_lentes']
+    fenetre = min(request.args.get('fenetre', journal.fenetre, type=int), journal.fenetre)
+    fenetres = [(secondes, libelle) for secondes, libelle in FENETRES if secondes < journal.fenetre]
+    fenetres.append((journal.fenetre, f'{journal.fenetre // 60} minutes'))
+    return render_template('requetes_lentes.html', classement=journal.classement(fenetre),
+                           fenetre=fenetre, fenetres=fenetres, stats=journal.stats(),
+                           fichier=journal.fichier)
+
+
+def stats():
+    return current_app.extensions['requetes_lentes'].stats()
+
+
+def init_app(app):
+    if not app.config.get('REQUETES_LENTES_JOURNAL'):
+        app.config['REQUETES_LENTES_JOURNAL'] = os.path.join(os.path.dirname(app.config['DATABASE_PATH']),
+                                                             'requetes_lentes.log')
+    app.extensions['requetes_lentes'] = JournalLent(app.config)
@@ -0,0 +1,283 @@
+"""Sauvegarde à chaud de la base
+
+Copier database/facturier.db pendant que l'application écrit donne une copie
+incohérente (pages modifiées pendant la copie, WAL oublié), et la rendre
+cohérente obligeait à bloquer les écrivains. `flask sauvegarder` (et la
+sauvegarde planifiée) passe par l'API de sauvegarde en ligne de SQLite :
+
+- la connexion source, en lecture seule, garde une transaction de lecture
+  pendant toute la copie : en WAL les écrivains continuent (leurs pages vont
+  dans le WAL) et la copie reste un instantané cohérent, sans repartir du
+  début à chaque écriture ;
+- copie par pas de SAUVEGARDE_PAGES pages, avec une pause de
+  SAUVEGARDE_PAUSE secondes entre deux pas pour laisser le disque aux
+  requêtes ;
+- compression brotli (facturier_AAAAMMJJ_HHMMSS.db.br), sous un nom
+  provisoire renommé à la fin ;
+- vérification de restauration : la sauvegarde est décompressée, ouverte et
+  passée à PRAGMA integrity_check avant d'être gardée ;
+- un fichier verrou empêche deux sauvegardes simultanées (commande,
+  plusieurs workers) ; seules les SAUVEGARDE_CONSERVER dernières sont
+  gardées.
+
+Sauvegarde planifiée : avec SAUVEGARDE_INTERVALLE (secondes) non nul, chaque
+processus de l'application démarre à sa première requête un thread qui
+sauvegarde quand la dernière sauvegarde est plus vieille que l'intervalle ;
+le verrou évite les doublons entre workers.
+
+Les bases d'archives (exercices clos, en lecture seule) ne changent plus :
+elles se copient une fois, après `flask archiver`.
+"""
+import glob
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import brotli
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Taille des blocs lus et écrits pendant la compression
+TAILLE_BLOC = 1024 * 1024
+
+# Attente minimale entre deux essais de la sauvegarde planifiée (secondes)
+ATTENTE_MIN = 60
+
+Sauvegarde = namedtuple('Sauvegarde', ['chemin', 'pages', 'taille_base', 'taille', 'duree'])
+
+
+class SauvegardeEnCours(Exception):
+    """Une autre sauvegarde tient le verrou"""
+
+
+class SauvegardeInvalide(Exception):
+    """La sauvegarde ne se restaure pas en une base intègre"""
+
+
+class _Verrou:
+    """Verrou exclusif non bloquant sur un fichier (libéré si le processus meurt)"""
+
+    def __init__(self, chemin):
+        self.chemin = chemin
+        self.fichier = None
+
+    def __enter__(self):
+        self.fichier = open(self.chemin, 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.fichier, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(self.fichier.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            self.fichier.close()
+            raise SauvegardeEnCours('Une sauvegarde est déjà en cours')
+        return self
+
+    def __exit__(self, *exc):
+        # La fermeture libère le verrou
+        self.fichier.close()
+
+
+def _copier(chemin_base, copie, pages, pause):
+    """Copie en ligne de la base, par pas de `pages` pages ; nombre de pages copiées"""
+    source = sqlite3.connect(f'file:{chemin_base}?mode=ro', uri=True, isolation_level=None, timeout=30)
+    destination = sqlite3.connect(copie)
+    try:
+        # Instantané : une seule transaction de lecture pour toute la copie
+        source.execute('BEGIN')
+        nb_pages = source.execute('PRAGMA page_count').fetchone()[0]
+
+        def progression(statut, restantes, total):
+            if restantes:
+                time.sleep(pause)
+
+        source.backup(destination, pages=pages, progress=progression)
+        source.execute('COMMIT')
+        # Copie autonome : pas de WAL à côté du fichier compressé
+        destination.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        destination.close()
+        source.close()
+    return nb_pages
+
+
+def _compresser(entree, sortie, qualite):
+    compresseur = brotli.Compressor(quality=qualite)
+    with open(entree, 'rb') as f, open(sortie, 'wb') as g:
+        while bloc := f.read(TAILLE_BLOC):
+            g.write(compresseur.process(bloc))
+        g.write(compresseur.finish())
+
+
+def _decompresser(entree, sortie):
+    decompresseur = brotli.Decompressor()
+    with open(entree, 'rb') as f, open(sortie, 'wb') as g:
+        while bloc := f.read(TAILLE_BLOC):
+            g.write(decompresseur.process(bloc))
+    if not decompresseur.is_finished():
+        raise SauvegardeInvalide(f'{entree} : fichier compressé tronqué')
+
+
+def verifier_sauvegarde(chemin):
+    """Restaurer la sauvegarde dans un fichier temporaire et en contrôler l'intégrité
+
+    Renvoie le nombre de tables ; lève SauvegardeInvalide sinon.
+    """
+    descripteur, restauree = tempfile.mkstemp(suffix='.db', dir=os.path.dirname(chemin) or None)
+    os.close(descripteur)
+    try:
+        try:
+            _decompresser(chemin, restauree)
+        except brotli.error as e:
+            raise SauvegardeInvalide(f'{chemin} : décompression impossible ({e})')
+        connexion = sqlite3.connect(f'file:{restauree}?mode=ro', uri=True)
+        try:
+            resultat = [ligne[0] for ligne in connexion.execute('PRAGMA integrity_check')]
+            nb_tables = connexion.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table'").fetchone()[0]
+        except sqlite3.DatabaseError as e:
+            raise SauvegardeInvalide(f'{chemin} : base illisible ({e})')
+        finally:
+            connexion.close()
+        if resultat != ['ok']:
+            raise SauvegardeInvalide(f'{chemin} : ' + '; '.join(resultat[:10]))
+        if not nb_tables:
+            raise SauvegardeInvalide(f'{chemin} : aucune table')
+        return nb_tables
+    finally:
+        os.remove(restauree)
+
+
+def _sauvegardes(dossier, prefixe):
+    """Sauvegardes existantes, de la plus ancienne à la plus récente"""
+    return sorted(glob.glob(os.path.join(glob.escape(dossier), f'{glob.escape(prefixe)}_*.db.br')))
+
+
+def derniere_sauvegarde(config):
+    """Date (timestamp) de la dernière sauvegarde, None s'il n'y en a pas"""
+    prefixe = os.path.splitext(os.path.basename(config['DATABASE_PATH']))[0]
+    existantes = _sauvegardes(config['SAUVEGARDE_DOSSIER'], prefixe)
+    return os.path.getmtime(existantes[-1]) if existantes else None
+
+
+def sauvegarder(config, verifier=True, age_min=None):
+    """Sauvegarder la base de `config` dans SAUVEGARDE_DOSSIER
+
+    `age_min` (secondes) : ne rien faire si la dernière sauvegarde est plus
+    récente (sauvegarde planifiée) ; renvoie alors None.
+    """
+    chemin_base = config['DATABASE_PATH']
+    dossier = config['SAUVEGARDE_DOSSIER']
+    os.makedirs(dossier, exist_ok=True)
+    prefixe = os.path.splitext(os.path.basename(chemin_base))[0]
+
+    with _Verrou(os.path.join(dossier, '.sauvegarde.lock')):
+        derniere = derniere_sauvegarde(config)
+        if age_min is not None and derniere is not None and time.time() - derniere < age_min:
+            return None
+
+        debut = time.monotonic()
+        chemin = os.path.join(dossier, f'{prefixe}_{datetime.now():%Y%m%d_%H%M%S}.db.br')
+        copie = chemin[:-len('.br')] + '.part'
+        provisoire = chemin + '.part'
+        try:
+            pages = _copier(chemin_base, copie, config['SAUVEGARDE_PAGES'], config['SAUVEGARDE_PAUSE'])
+            taille_base = os.path.getsize(copie)
+            _compresser(copie, provisoire, config['SAUVEGARDE_QUALITE'])
+            if verifier:
+                verifier_sauvegarde(provisoire)
+            os.replace(provisoire, chemin)
+        finally:
+            for fichier in (copie, provisoire):
+                if os.path.exists(fichier):
+                    os.remove(fichier)
+
+        for ancienne in _sauvegardes(dossier, prefixe)[:-config['SAUVEGARDE_CONSERVER']]:
+            os.remove(ancienne)
+        return Sauvegarde(chemin, pages, taille_base, os.path.getsize(chemin), time.monotonic() - debut)
+
+
+class Planificateur:
+    """Thread de la sauvegarde planifiée d'un processus, démarré à la première requête"""
+
+    def __init__(self, app, intervalle):
+        self.app = app
+        self.intervalle = intervalle
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def demarrer(self):
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        # Après un fork (workers gunicorn) le thread du parent n'existe plus
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._boucle, name='sauvegarde', daemon=True)
+            self.thread.start()
+
+    def _attente(self):
+        derniere = derniere_sauvegarde(self.app.config)
+        if derniere is None:
+            return ATTENTE_MIN
+        return max(ATTENTE_MIN, derniere + self.intervalle - time.time())
+
+    def _boucle(self):
+        while True:
+            time.sleep(self._attente())
+            try:
+                sauvegarde = sauvegarder(self.app.config, age_min=self.intervalle)
+            except SauvegardeEnCours:
+                continue
+            except Exception:
+                self.app.logger.exception('Sauvegarde planifiée échouée')
+                continue
+            if sauvegarde is not None:
+                self.app.logger.info('Sauvegarde %s (%.1f s)', sauvegarde.chemin, sauvegarde.duree)
+
+
+@click.command('sauvegarder')
+@click.option('--sans-verification', is_flag=True, help='Ne pas restaurer la copie pour la contrôler')
+@with_appcontext
+def sauvegarder_commande(sans_verification):
+    """Sauvegarder la base à chaud (copie compressée et vérifiée)"""
+    try:
+        sauvegarde = sauvegarder(current_app.config, verifier=not sans_verification)
+    except (SauvegardeEnCours, SauvegardeInvalide) as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Sauvegarde {sauvegarde.chemin} : {sauvegarde.pages} pages, '
+               f'{sauvegarde.taille_base} -> {sauvegarde.taille} octets en {sauvegarde.duree:.1f} s')
+
+
+@click.command('verifier-sauvegarde')
+@click.argument('chemin', type=click.Path(exists=True, dir_okay=False))
+def verifier_sauvegarde_commande(chemin):
+    """Restaurer une sauvegarde dans un fichier temporaire et contrôler son intégrité"""
+    try:
+        nb_tables = verifier_sauvegarde(chemin)
+    except SauvegardeInvalide as e:
+        raise click.ClickException(str(e))
+    click.echo(f'{chemin} : intègre, {nb_tables} tables')
+
+
+def init_app(app):
+    if not app.config.get('SAUVEGARDE_DOSSIER'):
+        app.config['SAUVEGARDE_DOSSIER'] = os.path.join(os.path.dirname(app.config['DATABASE_PATH']), 'sauvegardes')
+    app.cli.add_command(sauvegarder_commande)
+    app.cli.add_command(verifier_sauvegarde_commande)
+    if app.config['SAUVEGARDE_INTERVALLE']:
+        planificateur = Planificateur(app, app.config['SAUVEGARDE_INTERVALLE'])
+        app.extensions['sauvegarde'] = planificateur
+        app.before_request(planificateur.demarrer)
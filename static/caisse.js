@@ -0,0 +1,462 @@
+// Caisse hors ligne (voir caisse.py) : le catalogue est lu une fois (gardé
+// par le service worker), chaque vente est enregistrée dans IndexedDB sur le
+// poste puis envoyée en arrière-plan, par lots, au serveur qui attribue les
+// numéros. Une vente n'attend donc jamais le réseau.
+(function () {
+    const racine = document.getElementById('caisse');
+    if (!racine) {
+        return;
+    }
+    const urls = racine.dataset;
+    const LOT = parseInt(racine.dataset.lot, 10) || 50;
+    // Une base par boutique : les boutiques d'un même domaine partagent l'origine
+    const BASE = `caisse${racine.dataset.racine}`;
+    const EN_ATTENTE = 'en_attente';
+    const CONFLIT = 'conflit';
+    const ENVOYEE = 'envoyee';
+    // Ventes envoyées gardées sur le poste pour la liste des dernières ventes
+    const ENVOYEES_GARDEES = 50;
+    // Envoi des ventes et vérification du catalogue (ms)
+    const INTERVALLE = 30000;
+
+    const champProduit = document.getElementById('produit_recherche');
+    const zoneProduits = document.getElementById('produits');
+    const champClient = document.getElementById('client_recherche');
+    const listeClients = document.getElementById('clients');
+    const corpsTicket = document.getElementById('ticket');
+    const selectPaiement = document.getElementById('paiement');
+    const selectDevise = document.getElementById('devise');
+    const boutonEncaisser = document.getElementById('encaisser');
+    const etatCatalogue = document.getElementById('catalogue_etat');
+
+    let produits = [];
+    let clientsParLibelle = new Map();
+    let version = null;
+    let ticket = [];  // {produit, quantite}
+    let envoiEnCours = false;
+
+    // ===== IndexedDB =====
+
+    function ouvrirBase() {
+        return new Promise((resoudre, rejeter) => {
+            const demande = indexedDB.open(BASE, 1);
+            demande.onupgradeneeded = () => {
+                const ventes = demande.result.createObjectStore('ventes', {keyPath: 'cle_idempotence'});
+                ventes.createIndex('statut', 'statut');
+            };
+            demande.onsuccess = () => resoudre(demande.result);
+            demande.onerror = () => rejeter(demande.error);
+        });
+    }
+
+    const base = ouvrirBase();
+
+    // Exécuter `action(store)` dans une transaction ; résultat de sa requête éventuelle
+    function transaction(mode, action) {
+        return base.then(db => new Promise((resoudre, rejeter) => {
+            const tx = db.transaction('ventes', mode);
+            const requete = action(tx.objectStore('ventes'));
+            tx.oncomplete = () => resoudre(requete ? requete.result : undefined);
+            tx.onerror = () => rejeter(tx.error);
+        }));
+    }
+
+    const lireVentes = statut => transaction('readonly', store => store.index('statut').getAll(statut));
+    const ecrireVentes = ventes => transaction('readwrite', store => {
+        ventes.forEach(vente => store.put(vente));
+    });
+    const supprimerVentes = cles => transaction('readwrite', store => {
+        cles.forEach(cle => store.delete(cle));
+    });
+
+    // ===== CATALOGUE =====
+
+    function libelleClient(client) {
+        const detail = client.telephone || client.nif;
+        return detail ? `${client.nom} (${detail})` : client.nom;
+    }
+
+    function chargerCatalogue() {
+        return fetch(urls.catalogue)
+            .then(r => {
+                if (!r.ok) {
+                    throw new Error(r.status);
+                }
+                return r.json();
+            })
+            .then(data => {
+                version = data.version;
+                produits = data.produits;
+                clientsParLibelle = new Map(data.clients.map(c => [libelleClient(c), c]));
+                listeClients.replaceChildren(...data.clients.map(c => {
+                    const option = document.createElement('option');
+                    option.value = libelleClient(c);
+                    return option;
+                }));
+                afficherProduits();
+                etatCatalogue.textContent = `${produits.length} article(s), ${data.clients.length} client(s)`
+                    + (navigator.onLine ? '' : ' — hors ligne, catalogue gardé sur le poste');
+            })
+            .catch(() => {
+                if (version === null) {
+                    etatCatalogue.textContent = 'Catalogue indisponible : connectez ce poste une première fois.';
+                }
+            });
+    }
+
+    // Recharger le catalogue seulement s'il a changé sur le serveur
+    function verifierCatalogue(versionServeur) {
+        if (versionServeur && versionServeur === version) {
+            return;
+        }
+        if (versionServeur) {
+            chargerCatalogue();
+            return;
+        }
+        if (!navigator.onLine) {
+            return;
+        }
+        fetch(urls.version)
+            .then(r => r.json())
+            .then(data => {
+                if (data.version !== version) {
+                    chargerCatalogue();
+                }
+            })
+            .catch(() => {});
+    }
+
+    function produitsTrouves() {
+        const texte = champProduit.value.trim().toLowerCase();
+        if (!texte) {
+            return produits;
+        }
+        return produits.filter(p => p.nom.toLowerCase().includes(texte)
+            || (p.code || '').toLowerCase().includes(texte));
+    }
+
+    function afficherProduits() {
+        zoneProduits.replaceChildren(...produitsTrouves().slice(0, 60).map(produit => {
+            const bouton = document.createElement('button');
+            bouton.type = 'button';
+            const nom = document.createElement('strong');
+            nom.textContent = produit.nom;
+            const prix = document.createElement('small');
+            prix.textContent = `${formater(produit.pv_ttc)} FBU${produit.unite ? ' / ' + produit.unite : ''}`;
+            bouton.append(nom, document.createElement('br'), prix);
+            bouton.addEventListener('click', () => ajouter(produit));
+            return bouton;
+        }));
+    }
+
+    // ===== TICKET =====
+
+    function formater(montant) {
+        return Number(montant).toLocaleString('fr-FR');
+    }
+
+    // Même arrondi que le serveur : HT puis TVA de la ligne au franc près
+    function totalLigne(ligne) {
+        const ht = Math.round(ligne.quantite * ligne.produit.pv_ttc);
+        return ht + Math.round(ht * (ligne.produit.tva || 0) / 100);
+    }
+
+    function totalTicket() {
+        return ticket.reduce((total, ligne) => total + totalLigne(ligne), 0);
+    }
+
+    function ajouter(produit) {
+        const ligne = ticket.find(l => l.produit.id === produit.id);
+        if (ligne) {
+            ligne.quantite += 1;
+        } else {
+            ticket.push({produit, quantite: 1});
+        }
+        afficherTicket();
+    }
+
+    function afficherTicket() {
+        if (!ticket.length) {
+            corpsTicket.innerHTML = '<tr><td colspan="5" class="text-center">Ticket vide</td></tr>';
+        } else {
+            corpsTicket.replaceChildren(...ticket.map(ligne => {
+                const tr = document.createElement('tr');
+                const nom = document.createElement('td');
+                nom.textContent = ligne.produit.nom;
+                const quantite = document.createElement('input');
+                quantite.type = 'number';
+                quantite.min = '0.01';
+                quantite.step = '0.01';
+                quantite.value = ligne.quantite;
+                quantite.addEventListener('change', () => {
+                    ligne.quantite = parseFloat(quantite.value) || 0;
+                    if (ligne.quantite <= 0) {
+                        ticket = ticket.filter(l => l !== ligne);
+                    }
+                    afficherTicket();
+                });
+                const celluleQuantite = document.createElement('td');
+                celluleQuantite.append(quantite);
+                const prix = document.createElement('td');
+                prix.textContent = formater(ligne.produit.pv_ttc);
+                const total = document.createElement('td');
+                total.textContent = formater(totalLigne(ligne));
+                const retirer = document.createElement('button');
+                retirer.type = 'button';
+                retirer.className = 'btn btn-danger btn-sm';
+                retirer.textContent = '✕';
+                retirer.addEventListener('click', () => {
+                    ticket = ticket.filter(l => l !== ligne);
+                    afficherTicket();
+                });
+                const celluleRetirer = document.createElement('td');
+                celluleRetirer.append(retirer);
+                tr.append(nom, celluleQuantite, prix, total, celluleRetirer);
+                return tr;
+            }));
+        }
+        document.getElementById('total_ttc').textContent = formater(totalTicket());
+        boutonEncaisser.disabled = !ticket.length;
+    }
+
+    // ===== VENTES =====
+
+    function nouvelleCle() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        const octets = crypto.getRandomValues(new Uint8Array(16));
+        return Array.from(octets, o => o.toString(16).padStart(2, '0')).join('');
+    }
+
+    // Heure locale du poste, sans fuseau (notée telle quelle sur la facture)
+    function heureLocale(date) {
+        const deux = n => String(n).padStart(2, '0');
+        return `${date.getFullYear()}-${deux(date.getMonth() + 1)}-${deux(date.getDate())}`
+            + `T${deux(date.getHours())}:${deux(date.getMinutes())}:${deux(date.getSeconds())}`;
+    }
+
+    function nomPoste() {
+        let poste = localStorage.getItem(`${BASE}-poste`);
+        if (!poste) {
+            poste = `poste-${nouvelleCle().slice(0, 6)}`;
+            localStorage.setItem(`${BASE}-poste`, poste);
+        }
+        return poste;
+    }
+
+    function encaisser() {
+        if (!ticket.length) {
+            return;
+        }
+        const libelle = champClient.value.trim();
+        const client = clientsParLibelle.get(libelle);
+        if (libelle && !client) {
+            alert('Client inconnu : choisissez-le dans la liste, ou laissez vide pour un client comptoir.');
+            champClient.focus();
+            return;
+        }
+        const paiement = selectPaiement.value;
+        const vente = {
+            cle_idempotence: nouvelleCle(),
+            vendu_le: heureLocale(new Date()),
+            client_id: client ? client.id : null,
+            client: client ? client.nom : '',
+            paiement: paiement,
+            devise: paiement === 'espèces' ? selectDevise.value : null,
+            etat: paiement === 'crédit' ? 'En attente' : 'Payée',
+            lignes: ticket.map(ligne => ({
+                produit_id: ligne.produit.id,
+                quantite: ligne.quantite,
+                prix_unitaire: ligne.produit.pv_ttc,
+                tva: ligne.produit.tva,
+            })),
+            total: totalTicket(),
+            statut: EN_ATTENTE,
+        };
+        boutonEncaisser.disabled = true;
+        ecrireVentes([vente])
+            .then(() => {
+                ticket = [];
+                champClient.value = '';
+                afficherTicket();
+                afficherVentes();
+                envoyer();
+            })
+            .catch(e => {
+                alert(`Vente non enregistrée sur le poste : ${e}`);
+                afficherTicket();
+            });
+    }
+
+    // Champs d'une vente attendus par /api/caisse/synchroniser
+    function pourServeur(vente) {
+        return {
+            cle_idempotence: vente.cle_idempotence,
+            vendu_le: vente.vendu_le,
+            client_id: vente.client_id,
+            paiement: vente.paiement,
+            devise: vente.devise,
+            etat: vente.etat,
+            lignes: vente.lignes,
+        };
+    }
+
+    function envoyerLots(ventes) {
+        if (!ventes.length) {
+            return Promise.resolve();
+        }
+        const lot = ventes.slice(0, LOT);
+        return fetch(urls.synchroniser, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({poste: nomPoste(), factures: lot.map(pourServeur)}),
+        })
+            .then(r => r.json())
+            .then(data => {
+                if (!data.success) {
+                    // 409 (numéros pris entre-temps) ou lot refusé : tout est renvoyé plus tard
+                    throw new Error(data.message);
+                }
+                const envoyeeLe = new Date().toISOString();
+                data.factures.forEach(f => Object.assign(lot[f.index], {
+                    statut: ENVOYEE, numero: f.numero, facture_id: f.id, envoyee_le: envoyeeLe,
+                }));
+                data.conflits.forEach(c => Object.assign(lot[c.index], {statut: CONFLIT, message: c.message}));
+                data.ecarts.forEach(e => {
+                    lot[e.index].ecart = `prix vendu ${formater(e.prix_vendu)}, catalogue ${formater(e.prix_catalogue)}`;
+                });
+                verifierCatalogue(data.version);
+                return ecrireVentes(lot).then(() => envoyerLots(ventes.slice(LOT)));
+            });
+    }
+
+    function oublierAnciennes() {
+        return lireVentes(ENVOYEE).then(ventes => {
+            ventes.sort((a, b) => b.envoyee_le.localeCompare(a.envoyee_le));
+            return supprimerVentes(ventes.slice(ENVOYEES_GARDEES).map(v => v.cle_idempotence));
+        });
+    }
+
+    function envoyer() {
+        if (envoiEnCours || !navigator.onLine) {
+            return Promise.resolve();
+        }
+        envoiEnCours = true;
+        return lireVentes(EN_ATTENTE)
+            // Dans l'ordre des ventes : les numéros suivent l'ordre de saisie
+            .then(ventes => envoyerLots(ventes.sort((a, b) => a.vendu_le.localeCompare(b.vendu_le))))
+            .then(oublierAnciennes)
+            .catch(() => {})  // hors ligne ou serveur indisponible : nouvel essai plus tard
+            .finally(() => {
+                envoiEnCours = false;
+                afficherVentes();
+            });
+    }
+
+    // ===== ÉTAT DU POSTE =====
+
+    function afficherConnexion() {
+        const badge = document.getElementById('connexion');
+        badge.textContent = navigator.onLine ? 'En ligne' : 'Hors ligne';
+        badge.className = `badge-connexion ${navigator.onLine ? 'en-ligne' : 'hors-ligne'}`;
+    }
+
+    function elementVente(vente) {
+        const li = document.createElement('li');
+        const heure = vente.vendu_le.replace('T', ' ').slice(0, 16);
+        const texte = `${heure} — ${vente.client || 'Client comptoir'} — ${formater(vente.total)} FBU`;
+        if (vente.statut === ENVOYEE) {
+            const lien = document.createElement('a');
+            lien.href = urls.facture.replace(/0$/, vente.facture_id);
+            lien.textContent = vente.numero;
+            li.append(lien, ` ${texte}`);
+        } else {
+            li.textContent = `${vente.statut === CONFLIT ? '❌' : '⏳'} ${texte}`;
+        }
+        if (vente.ecart || vente.message) {
+            const detail = document.createElement('small');
+            detail.textContent = ` (${vente.message || vente.ecart})`;
+            li.append(detail);
+        }
+        return li;
+    }
+
+    function afficherVentes() {
+        Promise.all([lireVentes(EN_ATTENTE), lireVentes(CONFLIT), lireVentes(ENVOYEE)])
+            .then(([attente, conflits, envoyees]) => {
+                document.getElementById('en_attente').textContent = `${attente.length} vente(s) à envoyer`;
+                const recentes = attente.concat(envoyees)
+                    .sort((a, b) => b.vendu_le.localeCompare(a.vendu_le))
+                    .slice(0, 20);
+                document.getElementById('ventes').replaceChildren(...recentes.map(elementVente));
+
+                document.getElementById('conflits_carte').hidden = !conflits.length;
+                document.getElementById('conflits').replaceChildren(...conflits.map(vente => {
+                    const li = elementVente(vente);
+                    const retirer = document.createElement('button');
+                    retirer.type = 'button';
+                    retirer.className = 'btn btn-danger btn-sm';
+                    retirer.textContent = 'Retirer';
+                    retirer.addEventListener('click', () => {
+                        if (confirm('Retirer cette vente du poste ? Elle ne sera pas facturée.')) {
+                            supprimerVentes([vente.cle_idempotence]).then(afficherVentes);
+                        }
+                    });
+                    li.append(' ', retirer);
+                    return li;
+                }));
+            });
+    }
+
+    function afficherDevise() {
+        document.getElementById('devise-container').hidden = selectPaiement.value !== 'espèces';
+    }
+
+    // ===== INITIALISATION =====
+
+    champProduit.addEventListener('input', afficherProduits);
+    champProduit.addEventListener('keydown', e => {
+        // Lecteur de code-barres : code complet suivi d'Entrée
+        if (e.key !== 'Enter') {
+            return;
+        }
+        e.preventDefault();
+        const texte = champProduit.value.trim().toLowerCase();
+        const trouves = produitsTrouves();
+        const produit = trouves.find(p => (p.code || '').toLowerCase() === texte)
+            || (trouves.length === 1 ? trouves[0] : null);
+        if (produit) {
+            ajouter(produit);
+            champProduit.value = '';
+            afficherProduits();
+        }
+    });
+    selectPaiement.addEventListener('change', afficherDevise);
+    boutonEncaisser.addEventListener('click', encaisser);
+    document.getElementById('vider').addEventListener('click', () => {
+        ticket = [];
+        afficherTicket();
+    });
+    document.getElementById('synchroniser').addEventListener('click', envoyer);
+    window.addEventListener('online', () => {
+        afficherConnexion();
+        envoyer();
+        verifierCatalogue();
+    });
+    window.addEventListener('offline', afficherConnexion);
+
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.register(urls.serviceWorker).catch(() => {});
+    }
+
+    afficherConnexion();
+    afficherDevise();
+    afficherTicket();
+    afficherVentes();
+    chargerCatalogue().then(envoyer);
+    setInterval(() => {
+        envoyer();
+        verifierCatalogue();
+    }, INTERVALLE);
+})();
@@ -0,0 +1,124 @@
+// Saisie semi-automatique : les options sont demandées au serveur à la frappe
+// (voir recherche.py) au lieu d'être toutes rendues dans un <select>.
+//
+// rechercheAuto({
+//     champ: 'client_recherche',   // <input type="search"> visible
+//     cible: 'client_id',          // <input type="hidden"> envoyé avec le formulaire
+//     url: '/api/clients/recherche',
+//     cle: 'clients',              // tableau des résultats dans la réponse JSON
+//     libelle: c => c.nom,         // texte d'une option
+//     parametres: {type: 'facture'},
+//     obligatoire: 'Veuillez sélectionner un client.'
+// });
+function rechercheAuto(options) {
+    const champ = document.getElementById(options.champ);
+    const cible = document.getElementById(options.cible);
+    if (!champ || !cible || champ.disabled) {
+        return;
+    }
+
+    const liste = document.createElement('ul');
+    liste.className = 'recherche-auto-liste';
+    liste.hidden = true;
+    champ.parentNode.style.position = 'relative';
+    champ.insertAdjacentElement('afterend', liste);
+
+    let minuterie = null;
+    let derniere = 0;
+    let resultats = [];
+    let actif = -1;
+
+    function fermer() {
+        liste.hidden = true;
+        actif = -1;
+    }
+
+    function choisir(resultat) {
+        cible.value = resultat.id;
+        champ.value = options.libelle(resultat);
+        fermer();
+        cible.dispatchEvent(new Event('change'));
+    }
+
+    function afficher() {
+        liste.innerHTML = '';
+        resultats.forEach((resultat, i) => {
+            const element = document.createElement('li');
+            element.textContent = options.libelle(resultat);
+            if (i === actif) {
+                element.className = 'actif';
+            }
+            // mousedown : avant le blur du champ
+            element.addEventListener('mousedown', e => {
+                e.preventDefault();
+                choisir(resultat);
+            });
+            liste.appendChild(element);
+        });
+        if (!resultats.length) {
+            const element = document.createElement('li');
+            element.className = 'vide';
+            element.textContent = 'Aucun résultat';
+            liste.appendChild(element);
+        }
+        liste.hidden = false;
+    }
+
+    function chercher() {
+        const texte = champ.value.trim();
+        if (!texte) {
+            fermer();
+            return;
+        }
+        const params = new URLSearchParams(Object.assign({q: texte}, options.parametres || {}));
+        const numero = ++derniere;
+        fetch(`${options.url}?${params}`)
+            .then(r => r.json())
+            .then(data => {
+                // Ignorer les réponses d'une frappe déjà dépassée
+                if (numero !== derniere) {
+                    return;
+                }
+                resultats = data[options.cle] || [];
+                actif = resultats.length ? 0 : -1;
+                afficher();
+            })
+            .catch(() => fermer());
+    }
+
+    champ.addEventListener('input', () => {
+        // Le texte ne correspond plus à l'option choisie
+        cible.value = '';
+        clearTimeout(minuterie);
+        minuterie = setTimeout(chercher, 200);
+    });
+
+    champ.addEventListener('keydown', e => {
+        if (liste.hidden) {
+            return;
+        }
+        if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+            e.preventDefault();
+            const pas = e.key === 'ArrowDown' ? 1 : -1;
+            actif = (actif + pas + resultats.length) % resultats.length;
+            afficher();
+        } else if (e.key === 'Enter' && actif >= 0) {
+            e.preventDefault();
+            choisir(resultats[actif]);
+        } else if (e.key === 'Escape') {
+            fermer();
+        }
+    });
+
+    champ.addEventListener('blur', fermer);
+
+    if (options.obligatoire && champ.form) {
+        champ.form.addEventListener('submit', e => {
+            if (!cible.value) {
+                e.preventDefault();
+                alert(options.obligatoire);
+                champ.focus();
+            }
+        });
+    }
+}
@@ -0,0 +1,52 @@
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from models import db, Produit, MouvementStock
+from ecritures import ecrire
+from journal_stock import journal
+import archives
+
+bp = Blueprint('stock', __name__)
+
+@bp.route('/stock')
+def stock_list():
+    produits = Produit.query.filter_by(article_stockable="OUI").all()
+    return render_template('stock_list.html', produits=produits)
+
+@bp.route('/stock/mouvements/<int:produit_id>')
+def stock_mouvements(produit_id):
+    produit = Produit.query.get_or_404(produit_id)
+    annees_archivees = archives.annees()
+    annee = request.args.get('annee', type=int)
+    
+    # ?annee=AAAA : historique d'un exercice archivé
+    M = archives.mouvements(annee) if annee in annees_archivees else MouvementStock
+    mouvements = db.session.query(M).filter(M.produit_id == produit_id).order_by(M.date_mouvement.desc()).all()
+    return render_template('stock_mouvements.html', produit=produit, mouvements=mouvements,
+                           annees_archivees=annees_archivees, annee=annee if M is not MouvementStock else None)
+
+@bp.route('/stock/ajuster/<int:produit_id>', methods=['GET', 'POST'])
+def stock_ajuster(produit_id):
+    produit = Produit.query.get_or_404(produit_id)
+    if request.method == 'POST':
+        nouvelle_quantite = int(request.form['nouvelle_quantite'])
+        commentaire = request.form.get('commentaire', '')
+
+        ecrire(ajuster_stock, produit.id, nouvelle_quantite, commentaire)
+        
+        flash('Stock ajusté avec succès', 'success')
+        return redirect(url_for('stock.stock_mouvements', produit_id=produit.id))
+    
+    return render_template('stock_ajuster.html', produit=produit)
+
+def ajuster_stock(produit_id, nouvelle_quantite, commentaire):
+    """Fixer le stock d'un produit (exécuté par le thread d'écriture)"""
+    # Relire le produit sous le verrou d'écriture : le stock a pu changer
+    produit = db.session.get(Produit, produit_id)
+
+    # Enregistrer le mouvement
+    journal(db.session).ajouter(
+        produit,
+        MouvementStock.TYPE_AJUSTEMENT,
+        nouvelle_quantite,
+        commentaire=commentaire,
+        utilisateur='admin'  # À améliorer avec système d'auth
+    )
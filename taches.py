@@ -0,0 +1,316 @@
+"""Traitements longs en arrière-plan (rapports, exports)
+
+Un rapport « tous clients » sur plusieurs années ou un gros export ne se
+calcule plus dans la requête, qui bloquait un worker jusqu'au délai du
+proxy : le formulaire crée une tâche (table `taches`) et redirige vers sa
+page de suivi, qui interroge /api/taches/<id> (pourcentage, lignes
+traitées). Le résultat est écrit dans un fichier de TACHES_DOSSIER,
+téléchargeable une fois la tâche terminée et jusqu'à son expiration
+(TACHES_DUREE_RESULTAT) ; les tâches expirées sont purgées, fichier compris,
+à chaque nouvelle soumission.
+
+Pas de courtier : chaque processus exécute les tâches qu'il a reçues dans
+son propre pool de threads (TACHES_TRAVAILLEURS) ; l'état est dans la base,
+donc visible de tous les workers. Une tâche lit par le moteur en lecture
+seule avec le délai des exports ; ses changements d'état passent par le
+coordinateur des écritures, au plus un par seconde pour la progression.
+
+Si le processus disparaît (redémarrage), sa tâche en cours ne donne plus
+signe de vie : passé TACHES_ABANDON secondes, elle est présentée comme
+échouée.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import Blueprint, abort, current_app, flash, jsonify, redirect, render_template, request, send_file, url_for
+
+import lecture
+from ecritures import ecrire
+from models import db, Tache
+
+bp = Blueprint('taches', __name__)
+
+# Intervalle minimal entre deux enregistrements de la progression (secondes)
+INTERVALLE_PROGRESSION = 1.0
+
+TypeTache = namedtuple('TypeTache', ['libelle', 'lire', 'fonction'])
+
+_TYPES = {}
+
+
+def tache(nom, libelle, lire):
+    """Décorateur : enregistrer une fonction de tâche sous `nom`
+
+    `lire(formulaire)` extrait les paramètres (dict sérialisable en JSON) ou
+    lève ValueError avec le message à afficher. La fonction reçoit
+    (parametres, sortie, progression), écrit son résultat dans le fichier
+    texte `sortie` et renvoie le nom du fichier à télécharger.
+    """
+    def enregistrer(fonction):
+        _TYPES[nom] = TypeTache(libelle, lire, fonction)
+        return fonction
+    return enregistrer
+
+
+# ===== ÉCRITURES =====
+
+def _creer_tache(type_tache, parametres, duree):
+    """Purger les tâches expirées et créer la nouvelle ; (id, fichiers à supprimer)"""
+    maintenant = datetime.utcnow()
+    expirees = db.session.query(Tache.id, Tache.fichier).filter(Tache.date_expiration < maintenant).all()
+    if expirees:
+        db.session.query(Tache).filter(Tache.id.in_([t.id for t in expirees]))\
+            .delete(synchronize_session=False)
+    tache = Tache(type=type_tache, parametres=parametres, date_expiration=maintenant + duree)
+    db.session.add(tache)
+    db.session.flush()
+    return tache.id, [t.fichier for t in expirees if t.fichier]
+
+
+def _modifier_tache(tache_id, valeurs):
+    db.session.query(Tache).filter_by(id=tache_id).update(dict(valeurs, date_maj=datetime.utcnow()))
+
+
+def _mettre_a_jour(app, tache_id, **valeurs):
+    # Contexte neuf : session à part, hors du routage en lecture seule de la tâche
+    with app.app_context():
+        ecrire(_modifier_tache, tache_id, valeurs)
+
+
+class Progression:
+    """Avancement d'une tâche, enregistré au plus une fois par INTERVALLE_PROGRESSION"""
+
+    def __init__(self, app, tache_id):
+        self.app = app
+        self.tache_id = tache_id
+        self.lignes = 0
+        self.pourcentage = 0
+        self._etape = None
+        self._enregistre = 0.0
+
+    def prevoir(self, total, debut=None, fin=100):
+        """Les `total` lignes à venir mènent la progression de `debut` (actuelle) à `fin`"""
+        debut = self.pourcentage if debut is None else debut
+        self._etape = (self.lignes, total, debut, fin)
+
+    def avancer(self, lignes=1, pourcentage=None):
+        self.lignes += lignes
+        if pourcentage is None and self._etape is not None:
+            depart, total, debut, fin = self._etape
+            if total:
+                pourcentage = debut + (fin - debut) * (self.lignes - depart) / total
+        if pourcentage is not None:
+            # 100 % seulement quand le résultat est écrit
+            self.pourcentage = max(self.pourcentage, min(int(pourcentage), 99))
+        if time.monotonic() - self._enregistre >= INTERVALLE_PROGRESSION:
+            self._enregistre = time.monotonic()
+            _mettre_a_jour(self.app, self.tache_id, progression=self.pourcentage, lignes_traitees=self.lignes)
+
+
+class ExecuteurTaches:
+    """Pool de threads des tâches d'un processus, créé à la première soumission"""
+
+    def __init__(self, app, travailleurs=2):
+        self.app = app
+        self.travailleurs = travailleurs
+        self.lock = threading.Lock()
+        self.pool = None
+        self.pid = None
+        # Métriques (sous self.lock : plusieurs threads du pool les modifient)
+        self.soumises = 0
+        self.terminees = 0
+        self.echecs = 0
+        self.en_vol = 0  # soumises, ni terminées ni échouées
+
+    def _pool(self):
+        # Après un fork (workers gunicorn) les threads du parent n'existent plus
+        with self.lock:
+            if self.pool is None or self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.pool = ThreadPoolExecutor(max_workers=self.travailleurs, thread_name_prefix='tache')
+            return self.pool
+
+    def soumettre(self, tache_id):
+        with self.lock:
+            self.soumises += 1
+            self.en_vol += 1
+        try:
+            self._pool().submit(self._executer, tache_id)
+        except BaseException:
+            with self.lock:
+                self.en_vol -= 1
+                self.echecs += 1
+            raise
+
+    def _executer(self, tache_id):
+        reussie = False
+        try:
+            reussie = self._executer_tache(tache_id)
+        except Exception:
+            self.app.logger.exception('Tâche %s échouée', tache_id)
+        finally:
+            # Toujours compté, même si la lecture ou l'état de la tâche échoue :
+            # sinon occupe() resterait vrai et la boutique ne serait jamais évincée
+            with self.lock:
+                self.en_vol -= 1
+                if reussie:
+                    self.terminees += 1
+                else:
+                    self.echecs += 1
+
+    def _executer_tache(self, tache_id):
+        """Produire le fichier de la tâche ; False si elle a échoué"""
+        app = self.app
+        with app.app_context():
+            type_tache, parametres = db.session.query(Tache.type, Tache.parametres).filter_by(id=tache_id).one()
+            db.session.close()
+            _mettre_a_jour(app, tache_id, etat='en_cours')
+
+            dossier = app.config['TACHES_DOSSIER']
+            fichier = f'{tache_id}_{uuid.uuid4().hex}'
+            provisoire = os.path.join(dossier, fichier + '.part')
+            progression = Progression(app, tache_id)
+            lecture.activer(delai=app.config['LECTURE_DELAI_EXPORT'])
+            try:
+                os.makedirs(dossier, exist_ok=True)
+                with open(provisoire, 'w', encoding='utf-8', newline='') as sortie:
+                    nom = _TYPES[type_tache].fonction(json.loads(parametres or '{}'), sortie, progression)
+                os.replace(provisoire, os.path.join(dossier, fichier))
+            except Exception as e:
+                app.logger.exception('Tâche %s (%s) échouée', tache_id, type_tache)
+                if os.path.exists(provisoire):
+                    os.remove(provisoire)
+                _mettre_a_jour(app, tache_id, etat='echouee', message=str(e) or type(e).__name__,
+                               lignes_traitees=progression.lignes)
+                return False
+
+            # Durée de conservation comptée à partir de la fin
+            duree = timedelta(seconds=app.config['TACHES_DUREE_RESULTAT'])
+            _mettre_a_jour(app, tache_id, etat='terminee', progression=100, lignes_traitees=progression.lignes,
+                           fichier=fichier, nom_telechargement=nom, date_expiration=datetime.utcnow() + duree)
+            return True
+
+    def occupe(self):
+        """Des tâches sont en file ou en cours"""
+        with self.lock:
+            return self.en_vol > 0
+
+    def arreter(self):
+        """Libérer les threads du pool (boutique fermée, aucune tâche en cours)"""
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def stats(self):
+        file = self.pool._work_queue.qsize() if self.pool is not None else 0
+        with self.lock:
+            return {
+                'travailleurs': self.travailleurs,
+                'en_file': file,
+                'en_vol': self.en_vol,
+                'soumises': self.soumises,
+                'terminees': self.terminees,
+                'echecs': self.echecs,
+            }
+
+
+def soumettre(type_tache, parametres):
+    """Enregistrer la tâche et la confier au pool du processus ; renvoie son id"""
+    duree = timedelta(seconds=current_app.config['TACHES_DUREE_RESULTAT'])
+    tache_id, expires = ecrire(_creer_tache, type_tache, json.dumps(parametres), duree)
+    for fichier in expires:
+        chemin = os.path.join(current_app.config['TACHES_DOSSIER'], fichier)
+        if os.path.exists(chemin):
+            os.remove(chemin)
+    current_app.extensions['taches'].soumettre(tache_id)
+    return tache_id
+
+
+def etat_tache(tache):
+    """(état, message) présentés : une tâche sans signe de vie est échouée"""
+    abandon = datetime.utcnow() - timedelta(seconds=current_app.config['TACHES_ABANDON'])
+    if tache.etat == 'en_cours' and tache.date_maj < abandon:
+        return 'echouee', 'Tâche interrompue (redémarrage du serveur)'
+    return tache.etat, tache.message
+
+
+def serialize_tache(tache):
+    etat, message = etat_tache(tache)
+    type_tache = _TYPES.get(tache.type)
+    return {
+        'id': tache.id,
+        'type': tache.type,
+        'libelle': type_tache.libelle if type_tache else tache.type,
+        'parametres': json.loads(tache.parametres or '{}'),
+        'etat': etat,
+        'progression': tache.progression,
+        'lignes_traitees': tache.lignes_traitees,
+        'message': message,
+        'date_creation': tache.date_creation.isoformat(),
+        'date_expiration': tache.date_expiration.isoformat(),
+        'resultat': url_for('taches.tache_resultat', tache_id=tache.id) if etat == 'terminee' else None,
+    }
+
+
+# ===== ROUTES =====
+
+@bp.route('/taches/<type_tache>', methods=['POST'])
+def soumettre_tache(type_tache):
+    """Lancer une tâche depuis un formulaire de rapport"""
+    if type_tache not in _TYPES:
+        abort(404)
+    try:
+        parametres = _TYPES[type_tache].lire(request.form)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(request.referrer or url_for('rapports.rapports_index'))
+    tache_id = soumettre(type_tache, parametres)
+    return redirect(url_for('taches.tache_detail', tache_id=tache_id))
+
+
+@bp.route('/taches/<int:tache_id>')
+@lecture.lecture_seule
+def tache_detail(tache_id):
+    """Page de suivi d'une tâche"""
+    tache = db.session.get(Tache, tache_id) or abort(404)
+    return render_template('tache.html', tache=serialize_tache(tache))
+
+
+@bp.route('/api/taches/<int:tache_id>')
+@lecture.lecture_seule
+def api_tache(tache_id):
+    """État et progression d'une tâche (interrogé périodiquement par la page de suivi)"""
+    tache = db.session.get(Tache, tache_id)
+    if tache is None:
+        return jsonify({'success': False, 'message': 'Tâche introuvable ou expirée'}), 404
+    return jsonify({'success': True, 'tache': serialize_tache(tache)})
+
+
+@bp.route('/taches/<int:tache_id>/resultat')
+@lecture.lecture_seule
+def tache_resultat(tache_id):
+    """Télécharger le résultat d'une tâche terminée"""
+    tache = db.session.get(Tache, tache_id) or abort(404)
+    if tache.etat != 'terminee':
+        abort(404)
+    chemin = os.path.join(current_app.config['TACHES_DOSSIER'], tache.fichier)
+    if tache.date_expiration < datetime.utcnow() or not os.path.exists(chemin):
+        abort(410)
+    return send_file(chemin, mimetype='text/csv', as_attachment=True, download_name=tache.nom_telechargement)
+
+
+def stats():
+    return current_app.extensions['taches'].stats()
+
+
+def init_app(app):
+    if not app.config.get('TACHES_DOSSIER'):
+        app.config['TACHES_DOSSIER'] = os.path.join(os.path.dirname(app.config['DATABASE_PATH']), 'taches')
+    app.extensions['taches'] = ExecuteurTaches(app, travailleurs=app.config['TACHES_TRAVAILLEURS'])
@@ -0,0 +1,82 @@
+// Service worker de la caisse (voir caisse.py) : page, scripts, styles et
+// catalogue disponibles hors ligne. Rendu par l'application : les URL
+// suivent le préfixe de la boutique, et la version change avec les fichiers
+// statiques, ce qui fait réinstaller le service worker.
+const RACINE = {{ request.script_root|tojson }};
+const PREFIXE = `caisse-${RACINE}-`;
+const CACHE = `${PREFIXE}{{ version }}`;
+// Le catalogue survit aux mises à jour du service worker
+const CACHE_CATALOGUE = `${PREFIXE}catalogue`;
+const FICHIERS = {{ fichiers|tojson }};
+const PAGE = FICHIERS[0];
+const CATALOGUE = {{ catalogue|tojson }};
+// Réseau lent : réponse du cache après ce délai (ms)
+const DELAI_RESEAU = 3000;
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(CACHE)
+            .then(cache => cache.addAll(FICHIERS))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    // Caches des versions précédentes de la caisse de cette boutique
+    event.waitUntil(
+        caches.keys()
+            .then(noms => Promise.all(noms
+                .filter(nom => nom.startsWith(PREFIXE) && nom !== CACHE && nom !== CACHE_CATALOGUE)
+                .map(nom => caches.delete(nom))))
+            .then(() => self.clients.claim())
+    );
+});
+
+// Le réseau d'abord (réponse à jour, gardée), le cache hors ligne ou si le
+// réseau tarde
+function reseauPuisCache(requete, nom) {
+    const enCache = () => caches.open(nom).then(cache => cache.match(requete, {ignoreSearch: true}));
+    return new Promise(resoudre => {
+        let repondu = false;
+        const repondre = reponse => {
+            if (reponse && !repondu) {
+                repondu = true;
+                resoudre(reponse);
+            }
+        };
+        const minuterie = setTimeout(() => enCache().then(repondre), DELAI_RESEAU);
+        fetch(requete)
+            .then(reponse => {
+                clearTimeout(minuterie);
+                if (reponse.ok) {
+                    const copie = reponse.clone();
+                    caches.open(nom).then(cache => cache.put(requete, copie));
+                }
+                repondre(reponse);
+            })
+            .catch(() => {
+                clearTimeout(minuterie);
+                enCache().then(reponse => repondre(reponse || Response.error()));
+            });
+    });
+}
+
+self.addEventListener('fetch', event => {
+    const requete = event.request;
+    // Synchronisation et autres écritures : toujours le réseau
+    if (requete.method !== 'GET') {
+        return;
+    }
+    const url = new URL(requete.url);
+    if (url.origin !== location.origin) {
+        return;
+    }
+    if (url.pathname === CATALOGUE) {
+        event.respondWith(reseauPuisCache(requete, CACHE_CATALOGUE));
+    } else if (url.pathname === PAGE) {
+        event.respondWith(reseauPuisCache(requete, CACHE));
+    } else if (FICHIERS.includes(url.pathname)) {
+        // Fichiers statiques : versionnés par le service worker lui-même
+        event.respondWith(caches.match(requete).then(reponse => reponse || fetch(requete)));
+    }
+});
@@ -0,0 +1,41 @@
+"""Application de test sur une base neuve, dans un dossier temporaire
+
+Chaque test reçoit sa propre base (schéma de `flask init-db`) avec un
+client et deux articles. `app` est paramétrée : écritures par le thread
+d'écriture (production) et écritures directes (ECRITURES_DIRECTES).
+"""
+import pytest
+
+from app import create_app, initialiser_base
+from boutiques import fermer
+from models import db, Categorie, Client, Produit, UniteMesure
+
+
+@pytest.fixture(params=[False, True], ids=['ecrivain', 'directes'])
+def app(request, tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'DATABASE_PATH': str(tmp_path / 'facturier.db'),
+        'JINJA_CACHE_DOSSIER': str(tmp_path / 'jinja'),
+        'ECRITURES_DIRECTES': request.param,
+        'REQUETES_LENTES_SEUIL_MS': 0,
+    })
+    with app.app_context():
+        initialiser_base()
+        categorie = Categorie(nom='Divers')
+        unite = UniteMesure(nom='Pièce', symbole='pc')
+        db.session.add_all([categorie, unite])
+        db.session.flush()
+        for nom, code, prix in (('Cahier', 'CAH', 1500), ('Stylo', 'STY', 500)):
+            db.session.add(Produit(nom=nom, code=code, pv_ttc=prix, tva=0, tc='non', pf='non',
+                                   article_stockable='non', categorie_id=categorie.id,
+                                   unite_mesure_id=unite.id))
+        db.session.add(Client(nom='Ndayishimiye', prenom='Alice', telephone='79000000'))
+        db.session.commit()
+    yield app
+    fermer(app)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,133 @@
+"""Archivage d'un exercice clos : refusé tant qu'il reste des créances"""
+import os
+import sqlite3
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text, update
+
+import archives
+import compteurs
+from models import db, ArchiveExercice, Compteur, Facture
+
+ANNEE = datetime.now().year - 1
+
+
+@pytest.fixture
+def exercice(client, app):
+    """Une facture de l'exercice clos (2 cahiers, non réglée) et une de l'exercice courant"""
+    r = client.post('/api/factures/batch', json={'factures': [
+        {'client_id': 1, 'lignes': [{'produit_id': 1, 'quantite': 2}]},
+        {'client_id': 1, 'etat': 'Payée', 'lignes': [{'produit_id': 2, 'quantite': 1}]},
+    ]})
+    ancienne, courante = (f['id'] for f in r.get_json()['factures'])
+    with app.app_context():
+        db.session.execute(update(Facture).where(Facture.id == ancienne)
+                           .values(date_creation=datetime(ANNEE, 6, 1)))
+        db.session.commit()
+    return ancienne
+
+
+def archiver(app, *options):
+    return app.test_cli_runner().invoke(args=['archiver', str(ANNEE), *options])
+
+
+def archivee(app):
+    with app.app_context():
+        return db.session.get(ArchiveExercice, ANNEE) is not None
+
+
+def test_refuse_facture_non_soldee(app, exercice):
+    resultat = archiver(app)
+    assert resultat.exit_code != 0
+    assert '1 facture(s) non soldée(s) (3 000 FBU restant dû)' in resultat.output
+    assert not archivee(app)
+    # Pas d'archive partielle laissée dans le dossier
+    assert os.listdir(app.config['ARCHIVES_DOSSIER']) == []
+
+
+def test_refuse_facture_creditable(client, app, exercice):
+    client.post(f'/facture/{exercice}/payer')
+    resultat = archiver(app)
+    assert resultat.exit_code != 0
+    assert 'non soldée' not in resultat.output
+    assert '1 facture(s) encore créditable(s)' in resultat.output
+    assert not archivee(app)
+
+
+def test_archive_facture_soldee_et_creditee(client, app, exercice):
+    client.post(f'/facture/{exercice}/payer')
+    r = client.post('/api/factures/batch', json={'factures': [{
+        'type_document': 'avoir', 'client_id': 1, 'facture_originale_id': exercice,
+        'lignes': [{'produit_id': 1, 'quantite': -2}]}]})
+    assert r.status_code == 201
+    resultat = archiver(app)
+    assert resultat.exit_code == 0, resultat.output
+    assert archivee(app)
+
+
+def test_forcer(app, exercice):
+    assert archiver(app).exit_code != 0
+    # Après un refus, la connexion rendue au pool n'a plus l'archive attachée
+    resultat = archiver(app, '--forcer')
+    assert resultat.exit_code == 0, resultat.output
+    assert archivee(app)
+
+
+@pytest.fixture
+def exercices_archives(app):
+    """Plus d'exercices archivés que de bases attachables : une facture soldée par exercice"""
+    dossier = app.config['ARCHIVES_DOSSIER']
+    os.makedirs(dossier, exist_ok=True)
+    premiere = ANNEE - archives.LIMITE_ATTACHEES
+    with app.app_context():
+        schema = [sql for (sql,) in db.session.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' "
+            "AND name IN ('factures', 'lignes_facture', 'mouvements_stock')"))]
+        for annee in range(premiere, ANNEE + 1):
+            facture_id = annee  # identifiants croissants avec les exercices
+            fichier = f'facturier_{annee}.db'
+            with sqlite3.connect(os.path.join(dossier, fichier)) as connexion:
+                for sql in schema:
+                    connexion.execute(sql)
+                connexion.execute(
+                    "INSERT INTO factures (id, numero, client_id, date_creation, type_document, etat, total, "
+                    "montant_paye) VALUES (?, ?, 1, ?, 'facture', 'Payée', 1500, 1500)",
+                    (facture_id, f'F{annee}', f'{annee}-06-01 10:00:00.000000'))
+                connexion.execute(
+                    "INSERT INTO lignes_facture (id, facture_id, produit_id, quantite, prix_unitaire, tva, "
+                    "montant_ht, montant_tva, montant_ttc, quantite_creditee) "
+                    "VALUES (?, ?, 1, 1, 1500, 0, 1500, 0, 1500, 1)", (facture_id, facture_id))
+            db.session.add(ArchiveExercice(annee=annee, fichier=fichier, nb_factures=1, nb_lignes=1,
+                                           nb_mouvements=0, facture_id_min=facture_id,
+                                           facture_id_max=facture_id))
+        db.session.commit()
+    return list(range(premiere, ANNEE + 1))
+
+
+def test_plus_d_exercices_que_de_bases_attachables(client, app, exercices_archives):
+    assert len(exercices_archives) > archives.LIMITE_ATTACHEES
+    # Balance âgée : base vivante seulement
+    assert client.get('/rapports/anciennete').status_code == 200
+    assert client.get('/rapports/anciennete/90+').status_code == 200
+
+    # Recherche sans date : exercices les plus récents, avec un avertissement
+    r = client.get(f'/factures?search=F{ANNEE}')
+    assert r.status_code == 200 and f'F{ANNEE}'.encode() in r.data
+    assert f'depuis {exercices_archives[1]}'.encode() in r.data
+    # Période explicite trop longue : 400 au lieu d'une erreur serveur
+    r = client.get(f'/factures?search=F&date_debut={exercices_archives[0]}-01-01')
+    assert r.status_code == 400
+
+    # Détail d'une facture du plus ancien exercice archivé
+    r = client.get(f'/facture/{exercices_archives[0]}')
+    assert r.status_code == 200 and f'F{exercices_archives[0]}'.encode() in r.data
+
+
+def test_recalculer_compteurs_par_lots(app, exercices_archives):
+    with app.app_context():
+        compteurs.recalculer()
+        valeurs = {c.cle: c.valeur for c in Compteur.query}
+    for annee in exercices_archives:
+        assert valeurs[f'ventes:{annee}-06'] == 1500
+        assert valeurs[f'produit:{annee}-06:1'] == 1500
@@ -0,0 +1,54 @@
+"""Boutiques : une boutique qui s'ouvre ne bloque pas les boutiques déjà ouvertes"""
+import threading
+
+import pytest
+
+import boutiques
+from app import create_app
+
+
+@pytest.fixture
+def principale(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'DATABASE_PATH': str(tmp_path / 'facturier.db'),
+        'JINJA_CACHE_DOSSIER': str(tmp_path / 'jinja'),
+        'BOUTIQUES_DOSSIER': str(tmp_path / 'boutiques'),
+    })
+    runner = app.test_cli_runner()
+    for nom in ('nord', 'sud'):
+        with app.app_context():
+            resultat = runner.invoke(args=['boutiques', 'creer', nom])
+        assert resultat.exit_code == 0, resultat.output
+    yield app
+    app.extensions['boutiques'].fermer_tout()
+    boutiques.fermer(app)
+
+
+def test_creation_hors_du_verrou_global(principale, monkeypatch):
+    client = principale.test_client()
+    assert client.get('/b/nord/').status_code == 200
+
+    creer = boutiques.creer_application
+    commencee, liberee = threading.Event(), threading.Event()
+
+    def creation_lente(config, nom):
+        commencee.set()
+        assert liberee.wait(10)
+        return creer(config, nom)
+
+    monkeypatch.setattr(boutiques, 'creer_application', creation_lente)
+    statuts = []
+    requetes = [threading.Thread(target=lambda: statuts.append(client.get('/b/sud/').status_code))
+                for _ in range(2)]
+    for requete in requetes:
+        requete.start()
+    assert commencee.wait(10)
+    # Pendant la création de « sud », « nord » répond
+    assert client.get('/b/nord/').status_code == 200
+    liberee.set()
+    for requete in requetes:
+        requete.join(10)
+    assert statuts == [200, 200]
+    # Deux requêtes simultanées sur « sud » : une seule application créée
+    assert principale.extensions['boutiques'].stats()['creations'] == 2
@@ -0,0 +1,71 @@
+"""Cache des rapports : validation des paramètres et cohérence entre workers"""
+from datetime import date, timedelta
+
+import pytest
+
+from app import create_app
+from boutiques import fermer
+from models import db, Produit
+
+PERIODE = {'date_debut': (date.today() - timedelta(days=1)).isoformat(),
+           'date_fin': (date.today() + timedelta(days=1)).isoformat()}
+
+
+@pytest.fixture
+def autre_worker(app):
+    """Second processus sur la même base : son propre cache en mémoire"""
+    autre = create_app({'TESTING': True, 'DATABASE_PATH': app.config['DATABASE_PATH'],
+                        'JINJA_CACHE_DOSSIER': app.config['JINJA_CACHE_DOSSIER'],
+                        'ECRITURES_DIRECTES': app.config['ECRITURES_DIRECTES'],
+                        'REQUETES_LENTES_SEUIL_MS': 0})
+    yield autre
+    fermer(autre)
+
+
+def facturer(client, quantite):
+    r = client.post('/api/factures/batch', json={'factures': [
+        {'client_id': 1, 'lignes': [{'produit_id': 1, 'quantite': quantite}]}]})
+    return r.get_json()['factures'][0]['numero']
+
+
+@pytest.mark.parametrize('client_id', ['abc', '', '1.5'])
+def test_client_id_invalide(client, client_id):
+    r = client.post('/rapports/client', data={'client_id': client_id, **PERIODE})
+    assert r.status_code == 400
+
+
+def test_rapport_client_en_cache(client, app):
+    numero = facturer(client, 1)
+    premier = client.post('/rapports/client', data={'client_id': '1', **PERIODE})
+    assert premier.status_code == 200 and numero.encode() in premier.data
+    second = client.post('/rapports/client', data={'client_id': '1', **PERIODE})
+    assert second.data == premier.data
+    assert app.extensions['cache_rapports'].stats()['hits'] == 1
+
+
+def test_ecriture_d_un_autre_worker(client, autre_worker):
+    """Une facture écrite par un worker périme le cache des autres"""
+    autre = autre_worker.test_client()
+    premier = facturer(client, 1)
+    assert premier.encode() in autre.post('/rapports/client', data={'client_id': '1', **PERIODE}).data
+
+    second = facturer(client, 2)
+    r = autre.post('/rapports/client', data={'client_id': '1', **PERIODE})
+    assert second.encode() in r.data
+    assert autre_worker.extensions['cache_rapports'].stats()['hits'] == 0
+
+    # Règlement (écriture en bloc hors ORM) par le premier worker
+    client.post('/factures/paiements', data={'facture_id': 1, 'montant': '100', 'mode': 'espèces'})
+    autre.post('/rapports/client', data={'client_id': '1', **PERIODE})
+    assert autre_worker.extensions['cache_rapports'].stats()['hits'] == 0
+
+
+def test_renommage_produit(client, app, autre_worker):
+    facturer(client, 1)
+    formulaire = {'regroupement': 'produit', **PERIODE}
+    autre = autre_worker.test_client()
+    assert b'Cahier' in autre.post('/rapports/produits', data=formulaire).data
+    with app.app_context():
+        db.session.get(Produit, 1).nom = 'Cahier 200 pages'
+        db.session.commit()
+    assert b'Cahier 200 pages' in autre.post('/rapports/produits', data=formulaire).data
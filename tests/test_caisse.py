@@ -0,0 +1,89 @@
+"""Synchronisation des ventes de la caisse hors ligne"""
+import pytest
+
+from models import db, Facture
+
+URL = '/api/caisse/synchroniser'
+
+
+def vente(cle, **champs):
+    return {'cle_idempotence': cle, 'vendu_le': '2026-10-19T10:15:00', 'paiement': 'espèces',
+            'lignes': [{'produit_id': 1, 'quantite': 1, 'prix_unitaire': 1500}], **champs}
+
+
+@pytest.mark.parametrize('corps', [[vente('k1')], 'x', {'factures': []}, {'factures': 'k1'}])
+def test_corps_invalide(client, corps):
+    r = client.post(URL, json=corps)
+    assert r.status_code == 400
+    assert r.get_json()['success'] is False
+
+
+def test_vente_recue_et_notee(client, app):
+    r = client.post(URL, json={'poste': 'P1', 'factures': [vente('k1', client_id=1)]})
+    assert r.status_code == 200
+    data = r.get_json()
+    assert data['conflits'] == [] and data['ecarts'] == []
+    (facture,) = data['factures']
+    assert (facture['index'], facture['cle_idempotence'], facture['doublon']) == (0, 'k1', False)
+    with app.app_context():
+        enregistree = db.session.get(Facture, facture['id'])
+        assert enregistree.notes == 'Vente de caisse du 19/10/2026 10:15 (P1)'
+        assert (enregistree.etat, enregistree.total, enregistree.montant_paye) == ('Payée', 1500, 1500)
+
+
+@pytest.mark.parametrize('mauvaise', [
+    'pas une vente',
+    {'lignes': [{'produit_id': 1, 'quantite': 1}]},
+    vente('m', etat='Annulée'),
+    vente('m', vendu_le='hier'),
+    vente('m', notes=['x']),
+    vente('m', client_id=[1]),
+    vente('m', paiement='bidon'),
+    vente('m', lignes=[{'produit_id': [1], 'quantite': 1}]),
+    vente('m', lignes=[{'produit_id': 999, 'quantite': 1}]),
+    vente('m', lignes=[{'produit_id': 1, 'quantite': 'nan'}]),
+    vente('m', lignes=[{'produit_id': 1, 'quantite': 1, 'prix_unitaire': 'inf'}]),
+])
+def test_vente_en_conflit_ne_bloque_pas_le_lot(client, app, mauvaise):
+    r = client.post(URL, json={'factures': [vente('a'), mauvaise, vente('b')]})
+    assert r.status_code == 200
+    data = r.get_json()
+    assert [f['cle_idempotence'] for f in data['factures']] == ['a', 'b']
+    assert [f['index'] for f in data['factures']] == [0, 2]
+    assert [c['index'] for c in data['conflits']] == [1]
+    with app.app_context():
+        assert db.session.query(Facture).count() == 2
+
+
+def test_lot_renvoye(client, app):
+    ventes = [vente('a'), vente('b'), vente('a')]
+    premier = client.post(URL, json={'factures': ventes}).get_json()['factures']
+    assert [f['doublon'] for f in premier] == [False, False, True]
+    assert premier[2]['id'] == premier[0]['id']
+
+    second = client.post(URL, json={'factures': ventes}).get_json()['factures']
+    assert [f['doublon'] for f in second] == [True, True, True]
+    assert [f['id'] for f in second] == [f['id'] for f in premier]
+    with app.app_context():
+        assert db.session.query(Facture).count() == 2
+
+
+def test_ecart_de_prix_accepte_et_signale(client):
+    r = client.post(URL, json={'factures': [
+        vente('a', lignes=[{'produit_id': 1, 'quantite': 2, 'prix_unitaire': 1400}])]})
+    data = r.get_json()
+    assert len(data['factures']) == 1
+    (ecart,) = data['ecarts']
+    assert (ecart['index'], ecart['prix_vendu'], ecart['prix_catalogue']) == (0, 1400, 1500)
+
+
+def test_catalogue_et_version(client, app):
+    r = client.get('/api/caisse/catalogue')
+    assert r.status_code == 200
+    data = r.get_json()
+    assert [p['nom'] for p in data['produits']] == ['Cahier', 'Stylo']
+    assert client.get('/api/caisse/catalogue', headers={'If-None-Match': r.headers['ETag']}).status_code == 304
+
+    client.post('/client/1/edit', data={'type_client': 'person', 'nom': 'Ndayishimiye', 'prenom': 'Alice',
+                                        'telephone': '79111111'})
+    assert client.get('/api/caisse/version').get_json()['version'] != data['version']
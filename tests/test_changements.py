@@ -0,0 +1,91 @@
+"""Flux /api/changes : pages, acquittement, compactage et curseurs compactés"""
+import pytest
+
+
+def facturer(client, n):
+    r = client.post('/api/factures/batch', json={'factures': [
+        {'client_id': 1, 'lignes': [{'produit_id': 1, 'quantite': 1}]} for _ in range(n)]})
+    assert r.status_code == 201
+
+
+def lire(client, **params):
+    return client.get('/api/changes', query_string=params)
+
+
+@pytest.mark.parametrize('since', ['-5', 'abc', '1.5', ''])
+def test_curseur_invalide(client, since):
+    r = lire(client, since=since)
+    assert r.status_code == 400 and r.get_json()['success'] is False
+
+
+def test_lecture_par_pages(client):
+    facturer(client, 3)
+    tout = lire(client, entites='facture').get_json()
+    assert [c['id'] for c in tout['changements']] == [1, 2, 3]
+    assert tout['etats']['facture']['1']['lignes'][0]['produit_id'] == 1
+
+    curseur, vus = 0, []
+    while True:
+        page = lire(client, since=curseur, limite=2, entites='facture').get_json()
+        vus += [c['id'] for c in page['changements']]
+        curseur = page['curseur']
+        if not page['plus']:
+            break
+    assert vus == [1, 2, 3]
+    assert curseur == tout['dernier']
+    # Rien de nouveau après le dernier curseur
+    assert lire(client, since=curseur).get_json()['changements'] == []
+
+
+def test_entite_inconnue(client):
+    assert lire(client, entites='facture,client').status_code == 400
+
+
+def test_acquittement_et_compactage(client):
+    facturer(client, 2)
+    dernier = lire(client).get_json()['dernier']
+    assert lire(client, since=0).status_code == 200
+
+    r = client.post('/api/changes/ack', json={'consommateur': 'compta', 'curseur': dernier})
+    assert r.get_json()['compactes'] == dernier
+    # Un acquittement en retard ne fait pas reculer le curseur
+    r = client.post('/api/changes/ack', json={'consommateur': 'compta', 'curseur': 1})
+    assert r.get_json()['compactes'] == 0
+
+    # Curseur compacté : resynchronisation complète
+    r = lire(client, since=0)
+    assert r.status_code == 410 and r.get_json()['horizon'] == dernier
+    # Le dernier curseur acquitté reste valide et voit les nouveaux changements
+    facturer(client, 1)
+    page = lire(client, since=dernier, entites='facture').get_json()
+    assert [c['operation'] for c in page['changements']] == ['creation']
+
+
+def test_compactage_retenu_par_le_plus_lent(client):
+    facturer(client, 2)
+    dernier = lire(client).get_json()['dernier']
+    client.post('/api/changes/ack', json={'consommateur': 'lent', 'curseur': 1})
+    r = client.post('/api/changes/ack', json={'consommateur': 'rapide', 'curseur': dernier})
+    assert r.get_json()['compactes'] == 0  # déjà compacté jusqu'à 1 par « lent »
+    assert lire(client, since=1).status_code == 200
+    assert lire(client, since=0).status_code == 410
+
+
+def test_acquittement_invalide(client):
+    assert client.post('/api/changes/ack', json={'consommateur': '', 'curseur': 1}).status_code == 400
+    assert client.post('/api/changes/ack', json={'consommateur': 'compta', 'curseur': -1}).status_code == 400
+    assert client.post('/api/changes/ack', json={'consommateur': 'compta', 'curseur': 10 ** 6}).status_code == 400
+
+
+def test_commande_compacter(client, app):
+    facturer(client, 3)
+    dernier = lire(client).get_json()['dernier']
+    app.config['CHANGEMENTS_COMPACTAGE_LOT'] = 1
+    r = client.post('/api/changes/ack', json={'consommateur': 'compta', 'curseur': dernier})
+    assert r.get_json()['compactes'] == 1
+
+    with app.app_context():
+        resultat = app.test_cli_runner().invoke(args=['changements', 'compacter'])
+    assert f'{dernier - 1} entrée(s) supprimée(s)' in resultat.output
+    assert lire(client, since=dernier - 1).status_code == 410
+    assert lire(client, since=dernier).status_code == 200
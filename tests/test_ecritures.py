@@ -0,0 +1,117 @@
+"""Écritures des formulaires : toutes passent par le coordinateur d'écriture"""
+import pytest
+
+from models import db, Approvisionnement, Categorie, Client, Facture, MouvementStock, Produit, UniteMesure
+
+
+def transactions(app):
+    return app.extensions['ecritures'].stats()['transactions']
+
+
+@pytest.fixture
+def ecrit(app):
+    """Vérifie qu'une requête a fait exactement `n` transactions par le coordinateur"""
+    def verifier(reponse, n=1):
+        assert reponse.status_code < 400, reponse.data
+        assert transactions(app) - verifier.avant == n
+        verifier.avant = transactions(app)
+        return reponse
+    verifier.avant = transactions(app)
+    return verifier
+
+
+def test_client(client, app, ecrit):
+    formulaire = {'type_client': 'company', 'nom': 'Kaze SARL', 'nif': '4000123', 'numero': '12'}
+    ecrit(client.post('/client/new', data=formulaire))
+    ecrit(client.post('/client/2/edit', data={**formulaire, 'type_client': 'person', 'prenom': 'Eric'}))
+    with app.app_context():
+        kaze = db.session.get(Client, 2)
+        assert (kaze.nom, kaze.prenom, kaze.nif) == ('Kaze SARL', 'Eric', None)
+
+
+def test_produit(client, app, ecrit):
+    formulaire = {'nom': 'Règle', 'code': 'REG', 'unite_mesure_id': 1, 'categorie_id': 1, 'tva': 0,
+                  'pv_ttc': 800, 'article_stockable': 'OUI', 'quantite_initiale': 5}
+    ecrit(client.post('/produit/new', data=formulaire))
+    with app.app_context():
+        regle = Produit.query.filter_by(code='REG').one()
+        assert regle.stock_actuel == 5
+        assert MouvementStock.query.filter_by(produit_id=regle.id).count() == 1
+        regle_id = regle.id
+
+    ecrit(client.post(f'/produit/{regle_id}/edit', data={**formulaire, 'pv_ttc': 900}))
+    with app.app_context():
+        assert db.session.get(Produit, regle_id).pv_ttc == 900
+
+    # Code déjà pris par un autre produit : refusé par la contrainte d'unicité
+    r = client.post(f'/produit/{regle_id}/edit', data={**formulaire, 'code': 'CAH'}, follow_redirects=True)
+    assert 'déjà utilisé'.encode() in r.data
+
+    ecrit(client.post(f'/produit/{regle_id}/delete'))
+    with app.app_context():
+        assert db.session.get(Produit, regle_id) is None
+
+
+def test_produit_utilise_non_supprime(client, app):
+    client.post('/api/factures/batch', json={'factures': [
+        {'client_id': 1, 'lignes': [{'produit_id': 1, 'quantite': 1}]}]})
+    r = client.post('/produit/1/delete', follow_redirects=True)
+    assert 'Impossible de supprimer ce produit'.encode() in r.data
+    with app.app_context():
+        assert db.session.get(Produit, 1) is not None
+
+
+def test_categories_et_unites(client, app, ecrit):
+    ecrit(client.post('/categorie/new', data={'nom': 'Papeterie'}))
+    ecrit(client.post('/categorie/2/edit', data={'nom': 'Fournitures'}))
+    ecrit(client.post('/unite/new', data={'nom': 'Boîte', 'symbole': 'bt'}))
+    ecrit(client.post('/unite/2/edit', data={'nom': 'Carton', 'symbole': 'ct'}))
+    r = ecrit(client.post('/api/categories', json={'nom': 'Informatique'}))
+    assert r.get_json()['categorie']['id'] == 3
+    r = ecrit(client.post('/api/unites', json={'nom': 'Ramette', 'symbole': 'rm'}))
+    assert r.get_json()['unite'] == {'id': 3, 'nom': 'Ramette', 'symbole': 'rm'}
+    ecrit(client.post('/unite/3/delete'))
+    with app.app_context():
+        assert db.session.get(Categorie, 2).nom == 'Fournitures'
+        assert db.session.get(UniteMesure, 2).symbole == 'ct'
+        assert db.session.get(UniteMesure, 3) is None
+
+    # Catégorie utilisée par des produits : refusée, rien d'écrit
+    r = client.post('/categorie/1/delete', follow_redirects=True)
+    assert 'Impossible de supprimer cette catégorie'.encode() in r.data
+
+
+def test_approvisionnement(client, app, ecrit):
+    ecrit(client.post('/approvisionnement/new', data={
+        'fournisseur': 'Grossiste', 'produit_id[]': ['1', '2'], 'quantite[]': ['10', '4'],
+        'prix_ht[]': ['1000', '300'], 'tva[]': ['0', '18']}))
+    with app.app_context():
+        appro = db.session.get(Approvisionnement, 1)
+        assert (appro.numero, appro.statut, len(appro.lignes)) == ('APP0001', Approvisionnement.STATUT_EN_ATTENTE, 2)
+        assert appro.total_ht == 11200
+    ecrit(client.post('/approvisionnement/1/annuler'))
+    with app.app_context():
+        assert db.session.get(Approvisionnement, 1).statut == Approvisionnement.STATUT_ANNULE
+
+
+def test_facture_edit_et_avoir(client, app, ecrit):
+    ecrit(client.post('/api/factures/batch', json={'factures': [
+        {'client_id': 1, 'lignes': [{'produit_id': 1, 'quantite': 2}]}]}))
+    ecrit(client.post('/facture/1/edit', data={
+        'client_id': '1', 'paiement': 'espèces', 'devise': 'BIF', 'etat': 'En attente',
+        'produit_id[]': ['1', '2'], 'quantite[]': ['3', '1'], 'prix_unitaire[]': ['1500', '500'],
+        'tva[]': ['0', '0']}))
+    with app.app_context():
+        facture = db.session.get(Facture, 1)
+        assert (facture.total, facture.devise, len(facture.lignes)) == (5000, 'BIF', 2)
+
+    ecrit(client.post('/facture/1/convertir_en_avoir'))
+    with app.app_context():
+        avoir = Facture.query.filter_by(type_document='avoir').one()
+        assert (avoir.facture_originale_id, avoir.total) == (1, -5000)
+
+    # Plus rien à créditer (vérifié sous le verrou d'écriture) : pas de second avoir
+    r = ecrit(client.post('/facture/1/convertir_en_avoir', follow_redirects=True))
+    assert 'entièrement créditée'.encode() in r.data
+    with app.app_context():
+        assert Facture.query.filter_by(type_document='avoir').count() == 1
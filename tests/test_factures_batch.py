@@ -0,0 +1,98 @@
+"""API batch des factures : validation par document et idempotence"""
+import pytest
+
+from models import db, Facture
+
+URL = '/api/factures/batch'
+
+
+def ligne(**champs):
+    return {'produit_id': 1, 'quantite': 2, **champs}
+
+
+def nombre_factures(app):
+    with app.app_context():
+        return db.session.query(Facture).count()
+
+
+def test_lot_valide(client, app):
+    r = client.post(URL, json={'factures': [
+        {'client_id': 1, 'etat': 'Payée', 'paiement': 'espèces', 'devise': 'FBU', 'lignes': [ligne()]},
+        {'lignes': [ligne(produit_id=2, quantite=1, prix_unitaire=450)]},
+    ]})
+    assert r.status_code == 201
+    factures = r.get_json()['factures']
+    assert [f['doublon'] for f in factures] == [False, False]
+    with app.app_context():
+        premiere, seconde = (db.session.get(Facture, f['id']) for f in factures)
+        assert (premiere.total, premiere.montant_paye, premiere.etat) == (3000, 3000, 'Payée')
+        assert (seconde.total, seconde.montant_paye, seconde.etat) == (450, 0, 'En attente')
+
+
+@pytest.mark.parametrize('corps', [[1, 2], 'factures', 42, {'factures': {}}, {'factures': []}])
+def test_corps_invalide(client, corps):
+    r = client.post(URL, json=corps)
+    assert r.status_code == 400
+    assert r.get_json()['success'] is False
+
+
+@pytest.mark.parametrize('document, message', [
+    ('pas un document', 'Document invalide'),
+    ({'client_id': [1], 'lignes': [ligne()]}, 'client_id'),
+    ({'client_id': '1', 'lignes': [ligne()]}, 'client_id'),
+    ({'facture_originale_id': {'id': 1}, 'lignes': [ligne()]}, 'facture_originale_id'),
+    ({'client_id': 999, 'lignes': [ligne()]}, 'introuvable'),
+    ({'cle_idempotence': ['k'], 'lignes': [ligne()]}, 'idempotence'),
+    ({'cle_idempotence': 12, 'lignes': [ligne()]}, 'idempotence'),
+    ({'cle_idempotence': 'k' * 101, 'lignes': [ligne()]}, 'idempotence'),
+    ({'etat': 'bidon', 'lignes': [ligne()]}, 'État inconnu'),
+    ({'paiement': 'bidon', 'lignes': [ligne()]}, 'Mode de paiement inconnu'),
+    ({'devise': ['FBU'], 'lignes': [ligne()]}, 'Devise'),
+    ({'notes': {'a': 1}, 'lignes': [ligne()]}, 'Notes'),
+    ({'type_document': 'devis', 'lignes': [ligne()]}, 'Type de document'),
+    ({'lignes': 3}, 'lignes'),
+    ({'lignes': []}, 'Au moins une ligne'),
+    ({'lignes': ['x']}, 'Ligne invalide'),
+    ({'lignes': [ligne(produit_id=[1])]}, 'Ligne invalide'),
+    ({'lignes': [ligne(produit_id=999)]}, 'introuvable'),
+    ({'lignes': [{'produit_id': 1}]}, 'Ligne invalide'),
+    ({'lignes': [ligne(quantite='nan')]}, 'Ligne invalide'),
+    ({'lignes': [ligne(quantite='inf')]}, 'Ligne invalide'),
+    ({'lignes': [ligne(quantite=[2])]}, 'Ligne invalide'),
+    ({'lignes': [ligne(prix_unitaire='-inf')]}, 'Ligne invalide'),
+    ({'lignes': [ligne(prix_unitaire=1e400)]}, 'Ligne invalide'),
+    ({'lignes': [ligne(tva='NaN')]}, 'Ligne invalide'),
+    ({'lignes': [ligne(quantite=1e12, prix_unitaire=1e12)]}, 'Ligne invalide'),
+])
+def test_document_invalide_refuse_le_lot(client, app, document, message):
+    """Toute erreur de forme est une erreur 400 du document, jamais une 500"""
+    r = client.post(URL, json={'factures': [{'lignes': [ligne()]}, document]})
+    assert r.status_code == 400
+    erreurs = r.get_json()['erreurs']
+    assert [e['index'] for e in erreurs] == [1]
+    assert message in erreurs[0]['message']
+    assert nombre_factures(app) == 0
+
+
+def test_idempotence(client, app):
+    document = {'cle_idempotence': 'vente-1', 'client_id': 1, 'lignes': [ligne()]}
+    r = client.post(URL, json={'factures': [document, dict(document)]})
+    assert r.status_code == 201
+    premiere, repetee = r.get_json()['factures']
+    assert premiere['doublon'] is False
+    assert repetee == {**premiere, 'index': 1, 'doublon': True}
+
+    # Lot renvoyé après une coupure : rien n'est recréé
+    r = client.post(URL, json={'factures': [document]})
+    assert r.status_code == 201
+    assert r.get_json()['factures'][0] == {**premiere, 'doublon': True}
+    assert nombre_factures(app) == 1
+
+
+def test_idempotence_cle_connue_sans_revalidation(client, app):
+    """Un document déjà reçu est rendu tel quel, même si le catalogue a changé depuis"""
+    document = {'cle_idempotence': 'vente-2', 'lignes': [ligne()]}
+    premiere = client.post(URL, json={'factures': [document]}).get_json()['factures'][0]
+    r = client.post(URL, json={'factures': [{**document, 'lignes': [ligne(produit_id=999)]}]})
+    assert r.status_code == 201
+    assert r.get_json()['factures'][0]['id'] == premiere['id']
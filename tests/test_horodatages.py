@@ -0,0 +1,21 @@
+"""GET conditionnels des pages de détail : 304 seulement si rien n'a changé"""
+
+
+def test_facture_payee_revalidee(client):
+    r = client.post('/api/factures/batch', json={'factures': [
+        {'client_id': 1, 'etat': 'Payée', 'lignes': [{'produit_id': 1, 'quantite': 2}]}]})
+    facture_id = r.get_json()['factures'][0]['id']
+
+    premiere = client.get(f'/facture/{facture_id}')
+    assert premiere.status_code == 200
+    assert premiere.cache_control.no_cache and premiere.cache_control.max_age is None
+    etag = premiere.headers['ETag']
+    assert client.get(f'/facture/{facture_id}', headers={'If-None-Match': etag}).status_code == 304
+
+    # Un avoir sur la facture payée change sa page
+    r = client.post('/api/factures/batch', json={'factures': [{
+        'type_document': 'avoir', 'client_id': 1, 'facture_originale_id': facture_id,
+        'lignes': [{'produit_id': 1, 'quantite': -1}]}]})
+    numero_avoir = r.get_json()['factures'][0]['numero']
+    r = client.get(f'/facture/{facture_id}', headers={'If-None-Match': etag})
+    assert r.status_code == 200 and numero_avoir.encode() in r.data
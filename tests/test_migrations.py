@@ -0,0 +1,71 @@
+"""Base de données livrée : `flask db upgrade` suffit à la mettre à jour"""
+import os
+import shutil
+import sqlite3
+
+import pytest
+from flask_migrate import downgrade, upgrade
+
+from app import create_app
+from boutiques import fermer
+from models import Compteur
+import compteurs
+
+BASE_LIVREE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'facturier.db')
+TABLES = {'compteurs', 'horodatages', 'cles_idempotence', 'taches', 'verifications',
+          'archives_exercices'}
+
+
+def application(chemin, tmp_path):
+    return create_app({'TESTING': True, 'DATABASE_PATH': str(chemin),
+                       'JINJA_CACHE_DOSSIER': str(tmp_path / 'jinja')})
+
+
+def tables(chemin):
+    with sqlite3.connect(chemin) as connexion:
+        return {nom for (nom,) in connexion.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+@pytest.fixture
+def base(tmp_path):
+    chemin = tmp_path / 'facturier.db'
+    shutil.copy(BASE_LIVREE, chemin)
+    app = application(chemin, tmp_path)
+    yield app, chemin
+    fermer(app)
+
+
+def test_base_livree_a_jour(base):
+    app, chemin = base
+    assert TABLES <= tables(chemin)
+    assert app.test_client().get('/').status_code == 200
+
+
+def test_upgrade_cree_les_tables_et_compteurs(base):
+    app, chemin = base
+    with app.app_context():
+        attendus = {c.cle: c.valeur for c in Compteur.query}
+        downgrade(revision='6f2b8d4a9c35')
+    assert not TABLES & tables(chemin)
+
+    with app.app_context():
+        upgrade()
+        migres = {c.cle: c.valeur for c in Compteur.query}
+        compteurs.recalculer()
+        assert migres == {c.cle: c.valeur for c in Compteur.query} == attendus
+    assert app.test_client().get('/').status_code == 200
+
+
+def test_init_db_marque_une_base_neuve(tmp_path):
+    chemin = tmp_path / 'neuve.db'
+    app = application(chemin, tmp_path)
+    try:
+        with app.app_context():
+            resultat = app.test_cli_runner().invoke(args=['init-db'])
+        assert resultat.exit_code == 0, resultat.output
+        with sqlite3.connect(chemin) as connexion:
+            assert connexion.execute('SELECT version_num FROM alembic_version').fetchall() == [('7e4a1c9b5d62',)]
+        with app.app_context():
+            upgrade()  # rien à appliquer
+    finally:
+        fermer(app)
@@ -0,0 +1,36 @@
+"""Règlement des factures depuis la liste"""
+import pytest
+
+from models import db, Facture
+
+
+@pytest.fixture
+def facture_id(client):
+    r = client.post('/api/factures/batch', json={'factures': [
+        {'client_id': 1, 'lignes': [{'produit_id': 1, 'quantite': 2}]}]})
+    return r.get_json()['factures'][0]['id']
+
+
+def payer(client, facture_id, montant):
+    return client.post('/factures/paiements', data={'facture_id': facture_id, 'montant': montant,
+                                                    'mode': 'espèces', 'retour': '/factures'})
+
+
+def montant_paye(app, facture_id):
+    with app.app_context():
+        facture = db.session.get(Facture, facture_id)
+        return facture.montant_paye, facture.etat
+
+
+@pytest.mark.parametrize('montant', ['inf', '-inf', 'nan', '1e400', '1e300', 'abc', '0', '-5'])
+def test_montant_invalide(client, app, facture_id, montant):
+    r = payer(client, facture_id, montant)
+    assert r.status_code == 302
+    assert montant_paye(app, facture_id) == (0, 'En attente')
+
+
+def test_reglement_partiel_puis_solde(client, app, facture_id):
+    assert payer(client, facture_id, '1000').status_code == 302
+    assert montant_paye(app, facture_id) == (1000, 'En attente')
+    assert client.post(f'/facture/{facture_id}/payer').get_json() == {'success': True, 'montant': 2000}
+    assert montant_paye(app, facture_id) == (3000, 'Payée')
@@ -0,0 +1,25 @@
+"""Rapports : période du formulaire"""
+import pytest
+
+INVERSEE = {'date_debut': '2026-03-31', 'date_fin': '2026-01-01'}
+
+
+@pytest.mark.parametrize('url, donnees', [
+    ('/rapports/tendances', {}),
+    ('/rapports/tous-clients', {}),
+    ('/rapports/client', {'client_id': '1'}),
+    ('/rapports/produits', {'regroupement': 'produit'}),
+])
+def test_periode_inversee(client, url, donnees):
+    r = client.post(url, data={**INVERSEE, **donnees})
+    assert r.status_code == 302
+    assert 'date de début avant la date de fin' in client.get(r.headers['Location']).get_data(as_text=True)
+
+
+def test_export_periode_inversee(client):
+    assert client.get('/rapports/produits.csv', query_string=INVERSEE).status_code == 400
+
+
+def test_tendances_sur_un_jour(client):
+    r = client.post('/rapports/tendances', data={'date_debut': '2026-03-01', 'date_fin': '2026-03-01'})
+    assert r.status_code == 200
@@ -0,0 +1,111 @@
+"""Rapprochement des relevés : numéro, montant et contact, montant approché"""
+import io
+
+import pytest
+
+import releves
+from models import db, Facture
+
+# Client 1 : téléphone 79000000 (conftest)
+FACTURES = [
+    [{'produit_id': 1, 'quantite': 2}],  # F0001 : 3 000
+    [{'produit_id': 2, 'quantite': 1}],  # F0002 : 500
+    [{'produit_id': 1, 'quantite': 3}],  # F0003 : 4 500
+    [{'produit_id': 1, 'quantite': 1}],  # F0004 : 1 500
+]
+
+RELEVE = '''Date opération;Libellé;Téléphone;Crédit;Débit
+02/03/2026;Virement divers;;1 480;
+02/03/2026;Paiement F0001;;1 000;
+03/03/2026;Solde F-0001 merci;;2 500;
+04/03/2026;Transfert mobile;+257 79 00 00 00;500;
+05/03/2026;Reglement fact F0004;;1 500;
+06/03/2026;Depot;;4 480;
+06/03/2026;Frais tenue de compte;;;2 000
+07/03/2026;Virement inconnu;;99 999;
+'''
+
+
+@pytest.fixture
+def factures(client):
+    r = client.post('/api/factures/batch', json={'factures': [
+        {'client_id': 1, 'lignes': lignes} for lignes in FACTURES]})
+    return {f['numero']: f['id'] for f in r.get_json()['factures']}
+
+
+def importer(client, contenu=RELEVE, **formulaire):
+    return client.post('/paiements/releve', content_type='multipart/form-data', data={
+        'releve': (io.BytesIO(contenu.encode()), 'releve.csv'), **formulaire})
+
+
+def test_rapprochement(app, factures):
+    with app.app_context():
+        lignes, ignorees = releves.lire_releve(RELEVE.encode())
+        propositions = releves.rapprocher(lignes, tolerance=50)
+    assert ignorees == [] and len(lignes) == 7  # le débit n'est pas un crédit
+    resultat = [(p['facture']['numero'] if p['facture'] else None, p['methode'],
+                 p['montant_applique'], p['excedent'], p['coche']) for p in propositions]
+    assert resultat == [
+        # Montant approché de F0004, mais F0004 est désignée par son numéro plus bas :
+        # la passe par numéro passe d'abord, la ligne reste sans facture
+        (None, None, 0, 0, False),
+        # Paiement partiel puis référence en double : le même numéro tant qu'il reste un dû,
+        # l'excédent n'est pas appliqué
+        ('F0001', releves.PAR_NUMERO, 1000, 0, True),
+        ('F0001', releves.PAR_NUMERO, 2000, 500, True),
+        ('F0002', releves.PAR_CONTACT, 500, 0, True),
+        ('F0004', releves.PAR_NUMERO, 1500, 0, True),
+        # À la tolérance près : proposé mais pas coché
+        ('F0003', releves.PAR_MONTANT, 4480, 0, False),
+        (None, None, 0, 0, False),
+    ]
+
+
+def test_numero_deja_solde(app, factures):
+    """Une référence en double sur une facture déjà soldée passe aux méthodes suivantes"""
+    releve = 'Date;Référence;Montant\n2026-03-02;F0002;500\n2026-03-03;F0002 bis;500\n'
+    with app.app_context():
+        propositions = releves.rapprocher(releves.lire_releve(releve.encode())[0], tolerance=0)
+    assert [(p['facture'] and p['facture']['numero'], p['methode']) for p in propositions] == [
+        ('F0002', releves.PAR_NUMERO), (None, None)]
+
+
+def test_import_et_application(client, app, factures):
+    r = importer(client, mode='banque')
+    assert r.status_code == 200 and b'F0004' in r.data
+
+    r = client.post('/paiements/releve/appliquer', data={
+        'mode': 'banque', 'ligne': ['2', '5'],
+        'facture_2': factures['F0001'], 'montant_2': '1000', 'date_2': '2026-03-02 00:00:00',
+        'reference_2': 'Paiement F0001',
+        'facture_5': factures['F0004'], 'montant_5': '1500', 'date_5': '2026-03-04 00:00:00'})
+    assert r.status_code == 302
+    with app.app_context():
+        f1 = db.session.get(Facture, factures['F0001'])
+        f4 = db.session.get(Facture, factures['F0004'])
+        assert (f1.montant_paye, f1.etat) == (1000, 'En attente')
+        assert (f4.montant_paye, f4.etat) == (1500, 'Payée')
+        assert f1.paiements[0].reference == 'Paiement F0001'
+
+
+def test_facture_reglee_entre_revue_et_confirmation(client, app, factures):
+    """regler_factures lève ValueError : rien n'est écrit, pas même les autres lignes"""
+    client.post(f'/facture/{factures["F0002"]}/payer')
+    r = client.post('/paiements/releve/appliquer', follow_redirects=True, data={
+        'ligne': ['2', '4'],
+        'facture_2': factures['F0001'], 'montant_2': '1000', 'date_2': '2026-03-02 00:00:00',
+        'facture_4': factures['F0002'], 'montant_4': '500', 'date_4': '2026-03-03 00:00:00'})
+    assert 'Aucun paiement enregistré'.encode() in r.data
+    with app.app_context():
+        assert db.session.get(Facture, factures['F0001']).montant_paye == 0
+
+
+@pytest.mark.parametrize('contenu, message', [
+    ('', 'Relevé vide'),
+    ('Nom;Valeur\nx;1\n', 'introuvables'),
+])
+def test_releve_illisible(client, contenu, message):
+    r = importer(client, contenu)
+    assert r.status_code == 302
+    r = client.get(r.headers['Location'])
+    assert message.encode() in r.data
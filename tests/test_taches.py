@@ -0,0 +1,43 @@
+"""Exécuteur des tâches : chaque tâche soumise est comptée terminée ou échouée"""
+from unittest import mock
+
+import taches
+
+
+def attendre(app):
+    executeur = app.extensions['taches']
+    executeur.arreter()  # attend la fin des tâches soumises
+    return executeur
+
+
+def test_tache_terminee(client, app):
+    r = client.post('/taches/ventes_produits', data={'date_debut': '2020-01-01', 'date_fin': '2020-12-31'})
+    assert r.status_code == 302
+    executeur = attendre(app)
+    assert executeur.stats()['terminees'] == 1
+    assert not executeur.occupe()
+
+
+def test_tache_inconnue_comptee_en_echec(app):
+    """Une erreur avant l'exécution (lecture de la tâche) ne laisse pas la boutique occupée"""
+    executeur = app.extensions['taches']
+    executeur.soumettre(12345)
+    attendre(app)
+    assert executeur.stats()['echecs'] == 1
+    assert not executeur.occupe()
+
+
+def test_echec_de_l_etat_final(client, app):
+    """L'état « terminée » qui ne peut être enregistré compte comme un échec"""
+    mettre_a_jour = taches._mettre_a_jour
+
+    def sauf_terminee(app, tache_id, **valeurs):
+        if valeurs.get('etat') == 'terminee':
+            raise RuntimeError('base indisponible')
+        mettre_a_jour(app, tache_id, **valeurs)
+
+    with mock.patch.object(taches, '_mettre_a_jour', sauf_terminee):
+        client.post('/taches/ventes_produits', data={'date_debut': '2020-01-01', 'date_fin': '2020-12-31'})
+        executeur = attendre(app)
+    assert (executeur.stats()['terminees'], executeur.stats()['echecs']) == (0, 1)
+    assert not executeur.occupe()
@@ -0,0 +1,315 @@
+"""Contrôles de cohérence des valeurs stockées
+
+Deux valeurs sont tenues à jour à côté de ce dont elles dérivent :
+- `Facture.total`, somme des montants TTC de ses lignes ;
+- `Produit.stock_actuel`, aboutissement du journal `mouvements_stock`.
+
+`flask verify` les recalcule et signale les écarts ; `--reparer` les corrige
+par le coordinateur d'écritures (les compteurs et horodatages suivent).
+
+- totaux : une requête groupée par lot d'identifiants de factures ;
+- stocks : le journal est rejoué produit par produit dans un pool de
+  processus, chacun sur sa tranche de produit_id et sa propre connexion.
+  Le rejeu applique les règles du journal (voir journal_stock.py) et vérifie
+  aussi le chaînage stock_avant / stock_apres.
+
+Chaque contrôle garde dans la table `verifications` le plus grand id vu et
+l'heure de son dernier passage : un passage incrémental (par défaut) ne
+relit que les nouvelles factures / nouveaux mouvements et les entités
+modifiées depuis (table `horodatages`). `--complet` repart de zéro.
+
+Les exercices archivés, clos et en lecture seule, ne sont pas contrôlés ; le
+rejeu d'un produit part du stock_avant de son premier mouvement encore dans
+la base vivante.
+"""
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func
+
+from ecritures import ecrire
+from models import db, Facture, Horodatage, LigneFacture, MouvementStock, Produit, Verification
+
+TAILLE_LOT = 5000
+# Écart toléré sur les quantités (colonnes flottantes)
+TOLERANCE = 1e-6
+# Tranches de produits par processus : équilibre les produits très mouvementés
+TRANCHES_PAR_PROCESSUS = 4
+
+
+def _point(controle):
+    point = db.session.get(Verification, controle)
+    return (point.dernier_id, point.date_verification) if point else (0, None)
+
+
+def enregistrer_point(controle, dernier_id, date_verification):
+    """Avancer le point d'un contrôle (fonction d'écriture)"""
+    point = db.session.get(Verification, controle) or Verification(controle=controle)
+    point.dernier_id = dernier_id
+    point.date_verification = date_verification
+    db.session.add(point)
+
+
+def _modifies_depuis(entite, depuis):
+    """Identifiants des entités modifiées depuis `depuis` (horodatages)"""
+    if depuis is None:
+        return []
+    return [i for (i,) in db.session.query(Horodatage.entite_id).filter(
+        Horodatage.entite == entite, Horodatage.date_modification >= depuis)]
+
+
+def _lots(identifiants, taille=TAILLE_LOT):
+    for debut in range(0, len(identifiants), taille):
+        yield identifiants[debut:debut + taille]
+
+
+# ===== TOTAUX DES FACTURES =====
+
+def _somme_lignes():
+    # HT + TVA plutôt que montant_ttc : lu dans l'index ix_lignes_facture_ventes
+    return func.coalesce(func.sum(LigneFacture.montant_ht + LigneFacture.montant_tva), 0)
+
+
+def _ecarts_totaux(filtre):
+    """[(facture_id, total stocké, total des lignes)] des factures du lot en écart"""
+    somme = _somme_lignes()
+    return db.session.query(Facture.id, Facture.total, somme)\
+        .outerjoin(LigneFacture, LigneFacture.facture_id == Facture.id)\
+        .filter(filtre)\
+        .group_by(Facture.id)\
+        .having(func.coalesce(Facture.total, 0) != somme)\
+        .all()
+
+
+def verifier_totaux(complet=False):
+    """Contrôler les totaux ; renvoie (écarts, nombre de factures lues, borne)"""
+    dernier_id, depuis = (0, None) if complet else _point('totaux')
+    borne = db.session.query(func.max(Facture.id)).scalar() or 0
+    ecarts = []
+    nb = 0
+
+    # Nouvelles factures : intervalles d'identifiants
+    for debut in range(dernier_id + 1, borne + 1, TAILLE_LOT):
+        fin = min(debut + TAILLE_LOT - 1, borne)
+        filtre = Facture.id.between(debut, fin)
+        ecarts += _ecarts_totaux(filtre)
+        nb += db.session.query(func.count(Facture.id)).filter(filtre).scalar()
+    # Factures déjà vues mais modifiées depuis le dernier passage
+    modifiees = sorted(i for i in _modifies_depuis('facture', depuis) if i <= dernier_id)
+    for lot in _lots(modifiees, 500):
+        ecarts += _ecarts_totaux(Facture.id.in_(lot))
+        nb += len(lot)
+    db.session.remove()
+    return ecarts, nb, borne
+
+
+def reparer_totaux(facture_ids):
+    """Remettre le total des factures à la somme de leurs lignes (relue sous le verrou)"""
+    sommes = dict(db.session.query(LigneFacture.facture_id, func.sum(LigneFacture.montant_ttc))
+                  .filter(LigneFacture.facture_id.in_(facture_ids))
+                  .group_by(LigneFacture.facture_id))
+    corrigees = 0
+    for facture in Facture.query.filter(Facture.id.in_(facture_ids)):
+        total = sommes.get(facture.id) or 0
+        if facture.total != total:
+            facture.total = total
+            corrigees += 1
+    return corrigees
+
+
+# ===== STOCKS =====
+
+def _rejouer(type_mouvement, quantite, stock, stock_apres):
+    """Stock après un mouvement appliqué à `stock`, selon les règles du journal"""
+    if type_mouvement == MouvementStock.TYPE_ENTREE:
+        return stock + quantite
+    if type_mouvement == MouvementStock.TYPE_SORTIE:
+        return max(0, stock - quantite)
+    # Ajustement : le niveau fixé est celui enregistré
+    return stock_apres
+
+
+def _filtre_tranche(colonne, produits):
+    condition = f'{colonne} BETWEEN ? AND ?'
+    if produits is not None:
+        condition += f" AND {colonne} IN ({','.join('?' * len(produits))})"
+    return condition
+
+
+def rejouer_tranche(chemin, premier, dernier, produits, depuis_id, borne):
+    """Rejouer le journal des produits premier..dernier (exécuté dans un processus du pool)
+
+    `produits` restreint la tranche (passage incrémental) ; seuls les
+    mouvements depuis_id < id <= borne sont relus, à partir du stock_apres
+    du dernier mouvement déjà contrôlé. Renvoie {produit_id: (stock rejoué,
+    nombre de mouvements, anomalies [(mouvement_id, champ, attendu, trouvé)])}.
+    """
+    connexion = sqlite3.connect(chemin, timeout=30, isolation_level=None)
+    try:
+        # Une seule transaction de lecture : instantané cohérent de la tranche
+        connexion.execute('BEGIN')
+        parametres = [premier, dernier] + (produits or [])
+
+        # Point de départ : stock_apres du dernier mouvement déjà contrôlé
+        stocks = {}
+        if depuis_id:
+            for produit_id, stock_apres in connexion.execute(
+                    f'SELECT p.id, (SELECT m.stock_apres FROM mouvements_stock m '
+                    f'WHERE m.produit_id = p.id AND m.id <= ? ORDER BY m.id DESC LIMIT 1) '
+                    f'FROM produits p WHERE {_filtre_tranche("p.id", produits)}',
+                    [depuis_id] + parametres):
+                if stock_apres is not None:
+                    stocks[produit_id] = stock_apres
+
+        resultats = {}
+        curseur = connexion.execute(
+            f'SELECT id, produit_id, type_mouvement, quantite, stock_avant, stock_apres '
+            f'FROM mouvements_stock WHERE {_filtre_tranche("produit_id", produits)} AND id > ? AND id <= ? ORDER BY produit_id, id',
+            parametres + [depuis_id, borne])
+        for mouvement_id, produit_id, type_mouvement, quantite, stock_avant, stock_apres in curseur:
+            if produit_id not in resultats:
+                resultats[produit_id] = [stocks.get(produit_id, stock_avant), 0, []]
+            resultat = resultats[produit_id]
+            stock, anomalies = resultat[0], resultat[2]
+            if abs(stock_avant - stock) > TOLERANCE:
+                anomalies.append((mouvement_id, 'stock_avant', stock, stock_avant))
+            attendu = _rejouer(type_mouvement, quantite, stock, stock_apres)
+            if type_mouvement == MouvementStock.TYPE_AJUSTEMENT:
+                if abs(quantite - abs(stock_apres - stock)) > TOLERANCE:
+                    anomalies.append((mouvement_id, 'quantite', abs(stock_apres - stock), quantite))
+            elif abs(stock_apres - attendu) > TOLERANCE:
+                anomalies.append((mouvement_id, 'stock_apres', attendu, stock_apres))
+            resultat[0] = attendu
+            resultat[1] += 1
+
+        # Produits sans nouveau mouvement : leur stock reste celui du point précédent
+        for produit_id, stock in stocks.items():
+            resultats.setdefault(produit_id, [stock, 0, []])
+        return {produit_id: tuple(r) for produit_id, r in resultats.items()}
+    finally:
+        connexion.close()
+
+
+def _tranches(produits, nb_tranches):
+    """Découper une liste triée d'identifiants en intervalles contigus"""
+    taille = max(1, -(-len(produits) // nb_tranches))
+    for lot in _lots(produits, taille):
+        yield lot[0], lot[-1]
+
+
+def verifier_stocks(complet=False, processus=None):
+    """Contrôler les stocks ; renvoie (écarts, anomalies du journal, nombre de produits, borne)
+
+    Écart : (produit_id, stock stocké, stock rejoué). Un produit qui a reçu
+    des mouvements après la borne n'est pas jugé : son stock les inclut déjà,
+    le passage suivant le reprendra.
+    """
+    dernier_id, depuis = (0, None) if complet else _point('stocks')
+    borne = db.session.query(func.max(MouvementStock.id)).scalar() or 0
+
+    if complet:
+        produits = sorted(p for (p,) in db.session.query(MouvementStock.produit_id).distinct())
+        restreint = False
+    else:
+        touches = {p for (p,) in db.session.query(MouvementStock.produit_id).filter(
+            MouvementStock.id > dernier_id, MouvementStock.id <= borne).distinct()}
+        touches.update(_modifies_depuis('produit', depuis))
+        produits = sorted(touches)
+        restreint = True
+    db.session.remove()
+
+    chemin = db.engine.url.database
+    processus = processus or os.cpu_count() or 1
+    tranches = [(chemin, premier, dernier, [p for p in produits if premier <= p <= dernier] if restreint else None,
+                 dernier_id, borne)
+                for premier, dernier in _tranches(produits, processus * TRANCHES_PAR_PROCESSUS)]
+    rejoues = {}
+    if processus > 1 and len(tranches) > 1:
+        with ProcessPoolExecutor(max_workers=processus) as pool:
+            for resultat in pool.map(rejouer_tranche, *zip(*tranches)):
+                rejoues.update(resultat)
+    else:
+        for tranche in tranches:
+            rejoues.update(rejouer_tranche(*tranche))
+
+    anomalies = [(produit_id, *anomalie) for produit_id, (_, _, liste) in sorted(rejoues.items())
+                 for anomalie in liste]
+    ecarts = []
+    ids = sorted(rejoues)
+    for lot in _lots(ids, 500):
+        stockes = dict(db.session.query(Produit.id, Produit.stock_actuel).filter(Produit.id.in_(lot)))
+        ecarts += [(produit_id, stockes[produit_id], rejoues[produit_id][0]) for produit_id in lot
+                   if produit_id in stockes and abs((stockes[produit_id] or 0) - rejoues[produit_id][0]) > TOLERANCE]
+    if ecarts:
+        posterieurs = {p for (p,) in db.session.query(MouvementStock.produit_id).filter(
+            MouvementStock.id > borne, MouvementStock.produit_id.in_([e[0] for e in ecarts])).distinct()}
+        ecarts = [e for e in ecarts if e[0] not in posterieurs]
+    db.session.remove()
+    return ecarts, anomalies, len(produits), borne
+
+
+def reparer_stocks(corrections, borne):
+    """Fixer stock_actuel au stock rejoué, sauf si le produit a bougé depuis la borne"""
+    posterieurs = {p for (p,) in db.session.query(MouvementStock.produit_id).filter(
+        MouvementStock.id > borne, MouvementStock.produit_id.in_(list(corrections))).distinct()}
+    corriges = 0
+    for produit in Produit.query.filter(Produit.id.in_(list(corrections))):
+        if produit.id not in posterieurs:
+            produit.stock_actuel = corrections[produit.id]
+            corriges += 1
+    return corriges
+
+
+# ===== COMMANDE =====
+
+@click.command('verify')
+@click.option('--reparer', is_flag=True, help='Corriger les écarts trouvés')
+@click.option('--complet', is_flag=True, help='Tout contrôler au lieu de repartir du dernier passage')
+@click.option('--processus', type=int, default=None, help='Processus du rejeu des stocks (défaut : nombre de CPU)')
+@click.option('--totaux/--sans-totaux', default=True, help='Contrôle des totaux des factures')
+@click.option('--stocks/--sans-stocks', default=True, help='Contrôle des stocks')
+@with_appcontext
+def verifier_commande(reparer, complet, processus, totaux, stocks):
+    """Contrôler les totaux des factures et les stocks"""
+    non_repares = 0
+
+    if totaux:
+        debut = datetime.utcnow()
+        ecarts, nb, borne = verifier_totaux(complet)
+        click.echo(f'Totaux : {nb} factures contrôlées, {len(ecarts)} écarts')
+        for facture_id, total, lignes in ecarts:
+            click.echo(f'  facture {facture_id} : total {total}, lignes {lignes}')
+        corrigees = 0
+        if reparer and ecarts:
+            for lot in _lots([e[0] for e in ecarts], 500):
+                corrigees += ecrire(reparer_totaux, lot)
+            click.echo(f'  {corrigees} totaux corrigés')
+        non_repares += len(ecarts) - corrigees
+        ecrire(enregistrer_point, 'totaux', borne, debut)
+
+    if stocks:
+        debut = datetime.utcnow()
+        ecarts, anomalies, nb, borne = verifier_stocks(complet, processus)
+        click.echo(f'Stocks : {nb} produits rejoués, {len(ecarts)} écarts, {len(anomalies)} anomalies du journal')
+        for produit_id, mouvement_id, champ, attendu, trouve in anomalies:
+            click.echo(f'  produit {produit_id}, mouvement {mouvement_id} : {champ} {trouve}, attendu {attendu}')
+        for produit_id, stock, rejoue in ecarts:
+            click.echo(f'  produit {produit_id} : stock {stock}, journal {rejoue}')
+        corriges = 0
+        if reparer and ecarts:
+            corriges = ecrire(reparer_stocks, {p: rejoue for p, _, rejoue in ecarts}, borne)
+            click.echo(f'  {corriges} stocks corrigés')
+        # Le journal n'est pas réécrit : ses anomalies restent à examiner
+        non_repares += len(ecarts) - corriges + len(anomalies)
+        ecrire(enregistrer_point, 'stocks', borne, debut)
+
+    if non_repares:
+        raise SystemExit(1)
+
+
+def init_app(app):
+    app.cli.add_command(verifier_commande)